@@ -0,0 +1,375 @@
+# benchmarks/collabBench.py
+#Micro-benchmarks for the CollabServer hot paths (asv style: named benchmarks with parameters,
+#timed with timeit). Each run is saved as benchmarks/results/<commit>.json so runs on the same
+#machine can be compared across commits.
+#
+#   cd backend
+#   python -m benchmarks.collabBench                      # run everything, save under the current commit
+#   python -m benchmarks.collabBench --filter apply_diff --quick
+#   python -m benchmarks.collabBench --compare 8611778    # saved 8611778 vs the current commit
+#   python -m benchmarks.collabBench --compare 8611778 a1b2c3d --fail-above 1.2
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+from typing import Callable, Optional
+
+#The project is imported as the `backend` package, so its parent directory has to be importable
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _REPO_ROOT not in sys.path:
+    sys.path.insert(0, _REPO_ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+BENCH_ROOM = "bench-room"
+
+
+class Benchmark:
+    """`setup(param)` builds the state and returns the zero-argument callable that gets timed."""
+
+    def __init__(self, name: str, params: list, setup: Callable[[object], Callable[[], object]], doc: str = ""):
+        self.name = name
+        self.params = params
+        self.setup = setup
+        self.doc = doc
+
+
+BENCHMARKS: list[Benchmark] = []
+
+
+def benchmark(name: str, params: list):
+    def register(setup):
+        BENCHMARKS.append(Benchmark(name, params, setup, (setup.__doc__ or "").strip()))
+        return setup
+    return register
+
+
+# --- fixtures ---------------------------------------------------------------------------------
+
+def make_element(index: int, rng: random.Random) -> dict:
+    """An element shaped like what Excalidraw sends."""
+    return {
+        "id": f"el{index}", "type": rng.choice(["rectangle", "ellipse", "text", "arrow", "line"]),
+        "x": rng.randint(0, 4000), "y": rng.randint(0, 3000),
+        "width": rng.randint(20, 400), "height": rng.randint(20, 300), "angle": 0,
+        "strokeColor": "#1e1e1e", "backgroundColor": "transparent", "fillStyle": "solid",
+        "strokeWidth": 2, "strokeStyle": "solid", "roughness": 1, "opacity": 100,
+        "groupIds": [], "frameId": None, "roundness": None, "seed": rng.randint(1, 2 ** 31),
+        "version": 1, "versionNonce": rng.randint(1, 2 ** 31), "isDeleted": False,
+        "boundElements": None, "updated": 1700000000000, "link": None, "locked": False,
+    }
+
+
+def make_scene(elements: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    return {"elements": [make_element(i, rng) for i in range(elements)],
+            "appState": {"viewBackgroundColor": "#ffffff", "gridSize": None}}
+
+
+def move_diff(elements: int) -> dict:
+    """The common case: one element dragged, only its changed fields sent."""
+    return {"elements": {str(elements // 2): {"x": 1234, "y": 567, "version": 2, "versionNonce": 42}}}
+
+
+class CountingLayer:
+    """Channel layer stand-in that only counts sends, so fan-out cost excludes queueing."""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, channel, message):
+        self.sent += 1
+
+
+@contextlib.contextmanager
+def counting_layer():
+    from backend.sketch_api import CollabServer as module
+
+    layer = CountingLayer()
+    original = module.get_channel_layer
+    module.get_channel_layer = lambda *args, **kwargs: layer
+    try:
+        yield layer
+    finally:
+        module.get_channel_layer = original
+
+
+#Room flushes and consumer handlers are coroutines; one loop drives them all
+_loop = asyncio.new_event_loop()
+run_coroutine = _loop.run_until_complete
+
+
+def make_room(members: int = 1, pages: int = 1, elements: int = 0, collaborators: int = 0):
+    """A room actor with the given state. Its task is not started: benchmarks call its handlers directly."""
+    from backend.sketch_api.CollabServer import Collaborator, RoomActor, Sketch
+
+    actor = RoomActor(BENCH_ROOM)
+    session = actor.session
+    session.members = [f"bench.member{i}" for i in range(members)]
+    for i in range(collaborators):
+        session.collaborators[f"user{i}"] = Collaborator(f"user{i}", f"User {i}", f"bench.member{i}")
+    session.sketches = [Sketch(f"Page {i}", f"page-{i}", make_scene(elements, seed=i)) for i in range(pages)]
+    return actor
+
+
+class NullServer:
+    """Accepts every CollabServer call so consumer benchmarks time only JSON and dispatch."""
+
+    moved = {}
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+# --- benchmarks -------------------------------------------------------------------------------
+
+@benchmark("apply_diff_move", [100, 1000, 10000])
+def bench_apply_diff_move(elements):
+    """applyDiff of a one-element move into a scene of N elements."""
+    from backend.sketch_api.CollabServer import applyDiff
+
+    scene, diff = make_scene(elements), move_diff(elements)
+    return lambda: applyDiff(scene, diff)
+
+
+@benchmark("apply_diff_full_scene", [100, 1000, 10000])
+def bench_apply_diff_full_scene(elements):
+    """applyDiff of a full N-element scene resent over an existing one (e.g. after an undo)."""
+    from backend.sketch_api.CollabServer import applyDiff
+
+    scene, resent = make_scene(elements), make_scene(elements, seed=1)
+    return lambda: applyDiff(scene, resent)
+
+
+@benchmark("sketch_lookup", [1, 50, 500])
+def bench_sketch_lookup(pages):
+    """onSceneUpdate on the last of N pages with no other members: lookup plus a tiny diff."""
+    room = make_room(members=1, pages=pages)
+    sketch_id, diff = f"page-{pages - 1}", {"appState": {"gridSize": 20}}
+    return lambda: room.onSceneUpdate("bench.member0", sketch_id, diff)
+
+
+@benchmark("scene_update_fanout", [2, 10, 50])
+def bench_scene_update_fanout(members):
+    """onSceneUpdate of a one-element move on a 1000-element page, fanned out to N members."""
+    room = make_room(members=members, pages=1, elements=1000)
+    diff = move_diff(1000)
+
+    def update():
+        room.onSceneUpdate("bench.member0", "page-0", diff)
+        run_coroutine(room.flush())
+    return update
+
+
+@benchmark("pointer_fanout", [2, 10, 50])
+def bench_pointer_fanout(members):
+    """onCollaboratorPointer fanned out to N members."""
+    room = make_room(members=members, collaborators=members)
+    pointer = {"x": 100.5, "y": 200.25}
+
+    def move():
+        room.onCollaboratorPointer("bench.member0", "user0", pointer, "page-0")
+        run_coroutine(room.flush())
+    return move
+
+
+@benchmark("consumer_decode", [1, 100, 1000])
+def bench_consumer_decode(elements):
+    """SketchConsumer.receive of a scene_update frame carrying N elements (JSON decode + dispatch)."""
+    from backend.sketch_api.consumers import SketchConsumer
+
+    consumer = SketchConsumer()
+    consumer.server = NullServer()
+    consumer.channel_name, consumer.collabID = "bench.member0", BENCH_ROOM
+    text = json.dumps({"action": "scene_update", "sketchID": "page-0", "sketchData": make_scene(elements)})
+    return lambda: run_coroutine(consumer.receive(text))
+
+
+@benchmark("consumer_encode", [1, 100, 1000])
+def bench_consumer_encode(elements):
+    """Encoding and sending one outgoing scene_update frame carrying N elements to one member."""
+    room = make_room(members=1)
+    frame = {"action": "scene_update", "sketchID": "page-0", "sketchData": make_scene(elements)}
+
+    def send():
+        room.emit(["bench.member0"], frame)
+        run_coroutine(room.flush())
+    return send
+
+
+@benchmark("new_connection_replay", [1, 10, 50])
+def bench_new_connection_replay(pages):
+    """onNewConnection replaying N pages of 200 elements and 10 collaborators to a joining client."""
+    room = make_room(members=1, pages=pages, elements=200, collaborators=10)
+    members = room.session.members
+
+    def join():
+        room.onNewConnection("bench.joiner")
+        run_coroutine(room.flush())
+        members.pop()
+    return join
+
+
+@benchmark("channel_layer_roundtrip", ["in_memory", "local"])
+def bench_channel_layer_roundtrip(backend):
+    """send + receive of a room's frames message (a 1000-element scene update) through a channel layer."""
+    from channels.layers import InMemoryChannelLayer
+    from backend.sketch_api.services.channelLayer import LocalChannelLayer
+
+    layer = InMemoryChannelLayer() if backend == "in_memory" else LocalChannelLayer()
+    frame = json.dumps({"action": "scene_update", "sketchID": "page-0", "sketchData": make_scene(1000)})
+    message = {"type": "collab.frames", "frames": [("scene_update", frame)]}
+
+    async def roundtrip():
+        await layer.send("bench.member0", message)
+        return await layer.receive("bench.member0")
+    return lambda: run_coroutine(roundtrip())
+
+
+# --- runner -----------------------------------------------------------------------------------
+
+def time_callable(fn: Callable[[], object], repeat: int, min_time: float) -> dict:
+    """Per-call seconds: timeit picks the loop count so one repeat takes at least `min_time`."""
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 10 ** 7:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    samples = [elapsed / number] + [timer.timeit(number) / number for _ in range(repeat - 1)]
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def run(filter_text: Optional[str] = None, repeat: int = 5, min_time: float = 0.2) -> dict:
+    """Run the matching benchmarks; keys are "name[param]"."""
+    import django
+    django.setup()
+
+    results = {}
+    with counting_layer(), open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for bench in BENCHMARKS:
+            for param in bench.params:
+                key = f"{bench.name}[{param}]"
+                if filter_text and filter_text not in key:
+                    continue
+                results[key] = time_callable(bench.setup(param), repeat, min_time)
+    return results
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(["git", *args], cwd=_REPO_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def current_commit() -> str:
+    commit = _git("rev-parse", "--short", "HEAD") or "unknown"
+    #Uncommitted changes get their own file so they never overwrite the commit's baseline
+    return commit + "-dirty" if _git("status", "--porcelain", "--untracked-files=no") else commit
+
+
+def results_path(commit: str) -> str:
+    return os.path.join(RESULTS_DIR, f"{commit}.json")
+
+
+def save(commit: str, results: dict) -> str:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = results_path(commit)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                        "processor": platform.processor() or platform.machine()},
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+    return path
+
+
+def load(commit: str) -> dict:
+    with open(results_path(commit), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(base: dict, head: dict) -> list[dict]:
+    """Rows for every benchmark in both runs; ratio > 1 means head is slower (by min time)."""
+    rows = []
+    for key in sorted(set(base) & set(head)):
+        before, after = base[key]["min"], head[key]["min"]
+        rows.append({"benchmark": key, "base": before, "head": after,
+                     "ratio": after / before if before else float("inf")})
+    return rows
+
+
+def _format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g}{unit}"
+    return f"{seconds / 1e-9:.3g}ns"
+
+
+def print_results(results: dict) -> None:
+    for key, stats in results.items():
+        print(f"  {key:<36} {_format_time(stats['min']):>10}  median {_format_time(stats['median']):>10}  "
+              f"(x{stats['number']})")
+
+
+def print_comparison(rows: list[dict], base: str, head: str, threshold: float) -> None:
+    print(f"  {'benchmark':<36} {base:>12} {head:>12}  ratio")
+    for row in rows:
+        flag = "  slower" if row["ratio"] > threshold else "  faster" if row["ratio"] < 1 / threshold else ""
+        print(f"  {row['benchmark']:<36} {_format_time(row['base']):>12} {_format_time(row['head']):>12}"
+              f"  {row['ratio']:.2f}{flag}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the CollabServer hot paths.")
+    parser.add_argument("--filter", help="only run benchmarks whose name[param] contains this")
+    parser.add_argument("--quick", action="store_true", help="fewer, shorter repeats (noisier)")
+    parser.add_argument("--no-save", action="store_true", help="don't write benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", nargs="+", metavar="COMMIT",
+                        help="compare saved BASE with saved HEAD (default: the current commit)")
+    parser.add_argument("--fail-above", type=float, default=1.10,
+                        help="ratio that counts as a regression (exit 1 when any benchmark exceeds it)")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for bench in BENCHMARKS:
+            print(f"  {bench.name}{bench.params}  {bench.doc}")
+        return 0
+
+    if args.compare:
+        base = args.compare[0]
+        head = args.compare[1] if len(args.compare) > 1 else current_commit()
+        rows = compare(load(base)["results"], load(head)["results"])
+        print_comparison(rows, base, head, args.fail_above)
+        return 1 if any(row["ratio"] > args.fail_above for row in rows) else 0
+
+    results = run(args.filter, repeat=3 if args.quick else 5, min_time=0.05 if args.quick else 0.2)
+    print_results(results)
+    if not args.no_save:
+        commit = current_commit()
+        print(f"saved {os.path.relpath(save(commit, results))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,469 @@
+# benchmarks/collabLoad.py
+#Load generator for the collab websocket. Spins up N simulated CollabClients across M rooms, replays
+#an edit/pointer trace from each of them, and reports throughput, fan-out latency percentiles and
+#server-side CPU/memory per room. By default it drives backend.asgi.application in-process (no
+#server, Redis or network needed); --url points it at a running server instead.
+#
+#   cd backend
+#   python -m benchmarks.collabLoad --clients 40 --rooms 8 --duration 10
+#   python -m benchmarks.collabLoad --trace benchmarks/traces/sample.jsonl --json
+#   python -m benchmarks.collabLoad --url ws://127.0.0.1:8000 --clients 100 --rooms 10
+#
+#Trace format (JSONL): one outgoing CollabClient frame per line plus "t", its offset in seconds.
+#The harness fills in userID / sketchID / pageID for each simulated client:
+#   {"t": 0.05, "action": "collaborator_pointer", "pointer": {"x": 120, "y": 80}}
+#   {"t": 0.50, "action": "scene_update", "sketchData": {"elements": {"0": {"x": 10}}}}
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Optional
+
+#The project is imported as the `backend` package, so its parent directory has to be importable
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if _REPO_ROOT not in sys.path:
+    sys.path.insert(0, _REPO_ROOT)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+
+#Marks a frame with its send time so receivers can measure fan-out latency
+SENT_AT = "_loadSentAt"
+
+
+def synthetic_trace(duration: float = 10.0, pointer_hz: float = 20.0, edit_hz: float = 2.0,
+                    seed: int = 0) -> list[dict]:
+    """A plausible drawing session: steady pointer moves plus element edits shaped like Excalidraw diffs."""
+    rng = random.Random(seed)
+    events = []
+    x, y = 400.0, 300.0
+    for i in range(int(duration * pointer_hz)):
+        x = min(1600.0, max(0.0, x + rng.gauss(0, 25)))
+        y = min(1000.0, max(0.0, y + rng.gauss(0, 25)))
+        events.append({"t": i / pointer_hz, "action": "collaborator_pointer",
+                       "pointer": {"x": round(x, 1), "y": round(y, 1)}})
+
+    elements = 0
+    for i in range(int(duration * edit_hz)):
+        if elements == 0 or rng.random() < 0.3:
+            #New element: the whole element object
+            diff = {str(elements): {
+                "id": f"el{elements}", "type": rng.choice(["rectangle", "ellipse", "text", "arrow"]),
+                "x": rng.randint(0, 1400), "y": rng.randint(0, 900),
+                "width": rng.randint(20, 400), "height": rng.randint(20, 300),
+                "strokeColor": "#1e1e1e", "backgroundColor": "transparent", "strokeWidth": 2,
+                "roughness": 1, "opacity": 100, "seed": rng.randint(1, 2 ** 31), "version": 1,
+                "versionNonce": rng.randint(1, 2 ** 31), "isDeleted": False, "groupIds": [],
+                "boundElements": None, "updated": 0, "link": None, "locked": False,
+            }}
+            elements += 1
+        else:
+            #Move/resize of an existing element: only the changed fields
+            index = rng.randrange(elements)
+            diff = {str(index): {"x": rng.randint(0, 1400), "y": rng.randint(0, 900),
+                                 "version": i + 2, "versionNonce": rng.randint(1, 2 ** 31)}}
+        events.append({"t": i / edit_hz + 0.01, "action": "scene_update", "sketchData": {"elements": diff}})
+
+    events.sort(key=lambda event: event["t"])
+    return events
+
+
+def load_trace(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    return sorted(events, key=lambda event: event.get("t", 0))
+
+
+def percentile(values: list[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class RoomStats:
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.latencies: list[float] = []
+        self.handler_cpu = 0.0
+
+
+class InProcessConnection:
+    """A websocket to backend.asgi.application through channels' test communicator."""
+
+    def __init__(self, application, path: str):
+        from channels.testing import WebsocketCommunicator
+        self.communicator = WebsocketCommunicator(application, path)
+
+    async def connect(self) -> None:
+        connected, _ = await self.communicator.connect(timeout=10)
+        if not connected:
+            raise RuntimeError("websocket connection refused")
+
+    async def send(self, text: str) -> None:
+        await self.communicator.send_to(text_data=text)
+
+    async def receive(self) -> str:
+        message = await self.communicator.receive_output(timeout=None)
+        if message["type"] == "websocket.close":
+            raise ConnectionError("closed by server")
+        return message.get("text", "")
+
+    async def close(self) -> None:
+        await self.communicator.disconnect()
+
+
+class NetworkConnection:
+    """A real websocket to a running server (uses the websockets package)."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.socket = None
+
+    async def connect(self) -> None:
+        from websockets.asyncio.client import connect
+        self.socket = await connect(self.url, max_size=None)
+
+    async def send(self, text: str) -> None:
+        await self.socket.send(text)
+
+    async def receive(self) -> str:
+        return await self.socket.recv()
+
+    async def close(self) -> None:
+        await self.socket.close()
+
+
+class Viewer:
+    """A passive audience member: counts what it is sent and answers heartbeats."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.frames = 0
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        await self.connection.connect()
+        self._reader = asyncio.ensure_future(self._read())
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                message = json.loads(await self.connection.receive())
+            except (ConnectionError, asyncio.CancelledError):
+                return
+            except Exception:
+                return
+            if message.get("action") == "ping":
+                await self.connection.send(json.dumps({"action": "pong"}))
+            else:
+                self.frames += 1
+
+    async def stop(self) -> None:
+        if self._reader:
+            self._reader.cancel()
+        with contextlib.suppress(Exception):
+            await self.connection.close()
+
+
+class SimulatedClient:
+    """Does what CollabClient does: join, then send the trace's frames on its timeline."""
+
+    def __init__(self, connection, room: str, index: int, stats: RoomStats):
+        self.connection = connection
+        self.room = room
+        self.index = index
+        self.stats = stats
+        self.user_id = f"load-{room}-{index}"
+        self.sketch_id = f"{room}-page-1"
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self, create_page: bool) -> None:
+        await self.connection.connect()
+        self._reader = asyncio.ensure_future(self._read())
+        await self.connection.send(json.dumps({
+            "action": "collaborator_join", "userID": self.user_id, "username": f"Load {self.index}",
+        }))
+        if create_page:
+            await self.connection.send(json.dumps({
+                "action": "page_update", "sketchID": self.sketch_id, "pageName": "Page 1",
+            }))
+
+    async def _read(self) -> None:
+        while True:
+            try:
+                message = json.loads(await self.connection.receive())
+            except (ConnectionError, asyncio.CancelledError):
+                return
+            except Exception:
+                return
+            sent_at = None
+            if message.get("action") == "ping":
+                await self.connection.send(json.dumps({"action": "pong"}))
+            elif message.get("action") == "scene_update":
+                sent_at = (message.get("sketchData") or {}).get(SENT_AT)
+            elif message.get("action") == "collaborator_pointer":
+                sent_at = (message.get("pointer") or {}).get(SENT_AT)
+            if sent_at is not None:
+                self.stats.received += 1
+                self.stats.latencies.append(time.perf_counter() - sent_at)
+
+    def _frame(self, event: dict) -> dict:
+        action = event["action"]
+        if action == "collaborator_pointer":
+            pointer = dict(event.get("pointer") or {}, **{SENT_AT: time.perf_counter()})
+            return {"action": action, "userID": self.user_id, "pointer": pointer, "pageID": self.sketch_id}
+        if action == "scene_update":
+            data = dict(event.get("sketchData") or {}, **{SENT_AT: time.perf_counter()})
+            return {"action": action, "sketchID": self.sketch_id, "sketchData": data}
+        frame = {key: value for key, value in event.items() if key != "t"}
+        frame.setdefault("sketchID", self.sketch_id)
+        return frame
+
+    async def replay(self, trace: list[dict], duration: float, speed: float, phase: float) -> None:
+        if not trace:
+            return
+        span = max(event.get("t", 0) for event in trace) or 1.0
+        start = time.perf_counter()
+        loop_offset = 0.0
+        #Loop the trace until the run's duration is used up; `phase` desynchronises clients
+        while True:
+            for event in trace:
+                due = start + (loop_offset + event.get("t", 0) + phase) / speed
+                if due - start >= duration:
+                    return
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self.connection.send(json.dumps(self._frame(event)))
+                self.stats.sent += 1
+            loop_offset += span
+
+    async def stop(self) -> None:
+        if self._reader:
+            self._reader.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reader
+        with contextlib.suppress(Exception):
+            await self.connection.close()
+
+
+def _instrument_server(room_stats: dict[str, RoomStats]):
+    """Attribute the CPU time of each room's batch processing (applying ops, not sending) to its room."""
+    from backend.sketch_api.CollabServer import RoomActor
+
+    original = RoomActor.process
+
+    def timed(self, batch):
+        started = time.thread_time()
+        try:
+            return original(self, batch)
+        finally:
+            stats = room_stats.get(str(self.collabID))
+            if stats is not None:
+                stats.handler_cpu += time.thread_time() - started
+
+    RoomActor.process = timed
+
+    def restore():
+        RoomActor.process = original
+    return restore
+
+
+def _room_state_bytes(room: str) -> int:
+    from backend.sketch_api.CollabServer import CollabServer
+    actor = CollabServer().rooms.get(room)
+    if actor is None:
+        return 0
+    return len(json.dumps([sketch.sceneData for sketch in actor.session.sketches], default=str))
+
+
+async def run_load(clients: int = 20, rooms: int = 4, duration: float = 5.0, trace: Optional[list[dict]] = None,
+                   speed: float = 1.0, url: Optional[str] = None, seed: int = 0, first_room: int = 90000,
+                   trace_memory: bool = False, viewers: int = 0, viewers_as_members: bool = False) -> dict:
+    """
+    Run one load test and return the report as a dict. `trace_memory` adds tracemalloc's
+    per-room memory figures, but slows every allocation enough to distort the latencies.
+    `viewers` passive connections join each room as spectators (or, with `viewers_as_members`,
+    as ordinary members, to compare against); latencies are only measured between editors.
+    """
+    rng = random.Random(seed)
+    trace = trace if trace is not None else synthetic_trace(duration=max(duration, 1.0), seed=seed)
+    room_ids = [str(first_room + i) for i in range(rooms)]
+    room_stats = {room: RoomStats() for room in room_ids}
+
+    application = None
+    restore = None
+    if url is None:
+        import django
+        django.setup()
+        from backend.asgi import application
+        restore = _instrument_server(room_stats)
+
+    if trace_memory:
+        tracemalloc.start()
+    baseline_memory = current_memory = peak_memory = None
+    cpu_start = time.process_time()
+    sim_clients = []
+    audience = []
+    try:
+        for i in range(clients):
+            room = room_ids[i % rooms]
+            path = f"/ws/collab/{room}/"
+            connection = NetworkConnection(url.rstrip("/") + path) if url else InProcessConnection(application, path)
+            client = SimulatedClient(connection, room, i // rooms, room_stats[room])
+            await client.start(create_page=i < rooms)
+            sim_clients.append(client)
+        for room in room_ids:
+            path = f"/ws/collab/{room}/" + ("" if viewers_as_members else "?role=spectator")
+            for _ in range(viewers):
+                connection = NetworkConnection(url.rstrip("/") + path) if url else InProcessConnection(application, path)
+                viewer = Viewer(connection)
+                await viewer.start()
+                audience.append(viewer)
+
+        #Let joins and the initial page creation settle before measuring
+        await asyncio.sleep(0.2)
+        for stats in room_stats.values():
+            stats.received, stats.latencies = 0, []
+        for viewer in audience:
+            viewer.frames = 0
+        if trace_memory:
+            _, baseline_memory = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            client.replay(trace, duration, speed, rng.uniform(0, 0.5)) for client in sim_clients
+        ))
+        #Drain in-flight fan-out
+        await asyncio.sleep(0.5)
+        elapsed = time.perf_counter() - started
+        if trace_memory:
+            current_memory, peak_memory = tracemalloc.get_traced_memory()
+        state_bytes = {room: _room_state_bytes(room) for room in room_ids}
+    finally:
+        for client in sim_clients + audience:
+            await client.stop()
+        if restore:
+            restore()
+        cpu = time.process_time() - cpu_start
+        if trace_memory:
+            tracemalloc.stop()
+
+    latencies = [value for stats in room_stats.values() for value in stats.latencies]
+    sent = sum(stats.sent for stats in room_stats.values())
+    received = sum(stats.received for stats in room_stats.values())
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "mode": "network" if url else "in-process",
+        "clients": clients,
+        "rooms": rooms,
+        "viewers_per_room": viewers,
+        "viewer_role": "member" if viewers_as_members else "spectator",
+        "viewer_frames": sum(viewer.frames for viewer in audience),
+        "duration": round(elapsed, 3),
+        "sent": sent,
+        "delivered": received,
+        "sent_per_sec": round(sent / elapsed, 1),
+        "delivered_per_sec": round(received / elapsed, 1),
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 0.50)),
+            "p90": ms(percentile(latencies, 0.90)),
+            "p99": ms(percentile(latencies, 0.99)),
+            "max": ms(max(latencies) if latencies else None),
+        },
+        #Process CPU includes the simulated clients; handler CPU is the server's share
+        "process_cpu_sec": round(cpu, 3),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "memory_growth_mb_per_room": (round((current_memory - baseline_memory) / rooms / 2 ** 20, 3)
+                                      if trace_memory else None),
+        "peak_memory_mb_per_room": (round((peak_memory - baseline_memory) / rooms / 2 ** 20, 3)
+                                    if trace_memory else None),
+        "per_room": {
+            room: {
+                "sent": stats.sent,
+                "delivered": stats.received,
+                "p99_ms": ms(percentile(stats.latencies, 0.99)),
+                "handler_cpu_ms": round(stats.handler_cpu * 1000, 1) if url is None else None,
+                "state_bytes": state_bytes.get(room) if url is None else None,
+            }
+            for room, stats in room_stats.items()
+        },
+    }
+
+
+def print_report(report: dict) -> None:
+    latency = report["latency_ms"]
+    print(f"{report['mode']}: {report['clients']} clients in {report['rooms']} rooms for {report['duration']}s")
+    if report["viewers_per_room"]:
+        print(f"  viewers    {report['viewers_per_room']:>8} per room as {report['viewer_role']}s, "
+              f"{report['viewer_frames']} frames to them")
+    print(f"  sent       {report['sent']:>8}  ({report['sent_per_sec']}/s)")
+    print(f"  delivered  {report['delivered']:>8}  ({report['delivered_per_sec']}/s)")
+    print(f"  fan-out latency ms  p50={latency['p50']}  p90={latency['p90']}  p99={latency['p99']}  max={latency['max']}")
+    memory = f"  process cpu {report['process_cpu_sec']}s, max rss {report['max_rss_mb']} MB"
+    if report["memory_growth_mb_per_room"] is not None:
+        memory += (f", memory/room growth {report['memory_growth_mb_per_room']} MB"
+                   f" peak {report['peak_memory_mb_per_room']} MB")
+    print(memory)
+    print(f"  {'room':>8} {'sent':>8} {'delivered':>10} {'p99 ms':>9} {'cpu ms':>9} {'state B':>9}")
+    for room, stats in report["per_room"].items():
+        print(f"  {room:>8} {stats['sent']:>8} {stats['delivered']:>10} {str(stats['p99_ms']):>9} "
+              f"{str(stats['handler_cpu_ms']):>9} {str(stats['state_bytes']):>9}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the collab websocket.")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--rooms", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of trace replay")
+    parser.add_argument("--trace", help="JSONL trace to replay (default: synthetic drawing session)")
+    parser.add_argument("--write-trace", help="write the synthetic trace to this file and exit")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--url", help="ws://host:port of a running server (default: in-process)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--max-p99-ms", type=float, help="exit non-zero if fan-out p99 exceeds this")
+    parser.add_argument("--verbose", action="store_true", help="keep the server's per-message prints")
+    parser.add_argument("--viewers", type=int, default=0, help="passive spectators per room")
+    parser.add_argument("--viewers-as-members", action="store_true",
+                        help="connect the viewers as ordinary members instead of spectators")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="report per-room memory via tracemalloc (slows the run; latencies are not comparable)")
+    args = parser.parse_args(argv)
+
+    if args.write_trace:
+        with open(args.write_trace, "w", encoding="utf-8") as f:
+            for event in synthetic_trace(duration=args.duration, seed=args.seed):
+                f.write(json.dumps(event) + "\n")
+        return 0
+
+    trace = load_trace(args.trace) if args.trace else None
+    #CollabServer prints on every message; that console I/O would dominate the measurement
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        report = asyncio.run(run_load(args.clients, args.rooms, args.duration, trace, args.speed, args.url, args.seed,
+                                      trace_memory=args.trace_memory, viewers=args.viewers,
+                                      viewers_as_members=args.viewers_as_members))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    p99 = report["latency_ms"]["p99"]
+    if args.max_p99_ms is not None and (p99 is None or p99 > args.max_p99_ms):
+        print(f"FAIL: p99 fan-out latency {p99} ms exceeds {args.max_p99_ms} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
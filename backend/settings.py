@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management.utils import get_random_secret_key
 import os
 
@@ -22,6 +23,135 @@ CLAUDE_API_KEY = PROJECT_ROOT / "APIkey.txt"
 CLAUDE_VARIATION_KEY = PROJECT_ROOT / "APIkey2.txt"
 CLAUDE_MODEL = "claude-haiku-4-5-20251001"
 
+# Model backend: "anthropic" (real API) or "fake" (in-process, deterministic, for load tests).
+# Setting CLAUDE_BASE_URL points the real SDK at another server, e.g. the local fake:
+#   cd backend && python -m sketch_api.services.fakeClaudeServer --port 8787
+# Fake latency/429/token behaviour is set with FAKE_CLAUDE_* env vars (see services/fakeClaude.py).
+CLAUDE_PROVIDER = os.environ.get("CLAUDE_PROVIDER", "anthropic")
+CLAUDE_BASE_URL = os.environ.get("CLAUDE_BASE_URL") or None
+
+# Outbound Claude admission control (process-wide). 0 disables a rate limit.
+CLAUDE_MAX_CONCURRENCY = int(os.environ.get("CLAUDE_MAX_CONCURRENCY", "8"))
+CLAUDE_REQUESTS_PER_MINUTE = float(os.environ.get("CLAUDE_REQUESTS_PER_MINUTE", "50"))
+CLAUDE_INPUT_TOKENS_PER_MINUTE = float(os.environ.get("CLAUDE_INPUT_TOKENS_PER_MINUTE", "50000"))
+
+# Per-call deadline / retry / hedging policy for Claude calls (seconds)
+CLAUDE_CALL_DEADLINE = float(os.environ.get("CLAUDE_CALL_DEADLINE", "300"))
+CLAUDE_ATTEMPT_TIMEOUT = float(os.environ.get("CLAUDE_ATTEMPT_TIMEOUT", "180"))
+CLAUDE_MAX_RETRIES = int(os.environ.get("CLAUDE_MAX_RETRIES", "3"))
+CLAUDE_RETRY_BASE_DELAY = 1.0
+CLAUDE_RETRY_MAX_DELAY = 30.0
+CLAUDE_HEDGE_ENABLED = os.environ.get("CLAUDE_HEDGE_ENABLED") == "True"
+CLAUDE_HEDGE_PERCENTILE = 0.95
+
+# Batched multi-page generation (generate-multi with batch=1): pages per call and its output budget,
+# PAGE_MAX_TOKENS per page up to MAX_TOKENS (groups shrink so each page still gets its share). The SDK
+# refuses non-streaming calls that could run past 10 minutes, so keep MAX_TOKENS under ~21k. Pages the
+# budget cut off before </html> are generated again on their own.
+CLAUDE_BATCH_MAX_PAGES = int(os.environ.get("CLAUDE_BATCH_MAX_PAGES", "4"))
+CLAUDE_BATCH_PAGE_MAX_TOKENS = 5000
+CLAUDE_BATCH_MAX_TOKENS = 20000
+
+# Complexity-aware routing of page generations (services/claudeRouting.py): each sketch goes to the
+# first tier whose limits it fits (separate shapes, share of the page inked, pixels after trimming),
+# and a page that runs out of output tokens is retried once on the next tier
+CLAUDE_ROUTING_ENABLED = os.environ.get("CLAUDE_ROUTING_ENABLED", "True") == "True"
+CLAUDE_COMPLEX_MODEL = os.environ.get("CLAUDE_COMPLEX_MODEL", CLAUDE_MODEL)
+CLAUDE_ROUTING_TIERS = [
+    {"name": "simple", "model": CLAUDE_MODEL, "max_tokens": 5000, "max_components": 30, "max_ink": 0.10},
+    {"name": "standard", "model": CLAUDE_MODEL, "max_tokens": 10000, "max_components": 90, "max_ink": 0.20},
+    {"name": "complex", "model": CLAUDE_COMPLEX_MODEL, "max_tokens": 15000},
+]
+CLAUDE_PAGE_MAX_TOKENS = 15000      # the one budget used when routing is off
+CLAUDE_VARIATION_MAX_TOKENS = 4000  # variations get less when the element is small
+
+# Generated pages and variations ship an inline stylesheet of just the Tailwind classes they use instead
+# of the Tailwind CDN runtime (pages with classes the compiler doesn't know keep the runtime)
+TAILWIND_COMPILE_ENABLED = os.environ.get("TAILWIND_COMPILE_ENABLED", "True") == "True"
+TAILWIND_MINIFY_HTML = True
+
+# Brotli/gzip for API JSON and NDJSON responses (streams are flushed per page/variation)
+API_COMPRESSION_ENABLED = os.environ.get("API_COMPRESSION_ENABLED", "True") == "True"
+API_COMPRESSION_MIN_BYTES = 1024
+API_COMPRESSION_BROTLI_QUALITY = 5   # 11 compresses ~5% smaller but is far too slow per response
+API_COMPRESSION_GZIP_LEVEL = 6
+
+# Generated pages and variations by content hash (/api/artifacts/<hash>/, revalidated with If-None-Match)
+ARTIFACT_CACHE_MAX_ENTRIES = 1024
+ARTIFACT_CACHE_TTL = 86400      # seconds
+
+# Sketch preprocessing before upload to Claude (trim margins, downscale, re-encode)
+SKETCH_PREPROCESS_ENABLED = os.environ.get("SKETCH_PREPROCESS_ENABLED", "True") == "True"
+SKETCH_MAX_EDGE = 1568          # Claude's effective long-edge resolution
+SKETCH_MAX_PIXELS = 1_150_000   # ~1600 image tokens
+SKETCH_TRIM_MARGIN = 16         # px of blank canvas kept around the drawing
+SKETCH_PREPROCESS_CONCURRENCY = 4   # images decoded at once; bounds peak bitmap memory
+
+# Uploads: hashed and size-checked chunk by chunk, spooled to disk above 512 KB
+SKETCH_UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+FILE_UPLOAD_MAX_MEMORY_SIZE = 512 * 1024
+FILE_UPLOAD_HANDLERS = [
+    "backend.sketch_api.services.uploadStream.HashingUploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
+# Background generation jobs (/api/jobs/)
+JOB_MAX_CONCURRENT_JOBS = int(os.environ.get("JOB_MAX_CONCURRENT_JOBS", "4"))
+JOB_RESULT_TTL = 3600           # seconds a finished job's results stay pollable
+
+# Server-side cache of generated component variations, shared across users
+VARIATION_CACHE_MAX_ENTRIES = 512
+VARIATION_CACHE_TTL = 3600      # seconds
+
+# Near-duplicate cache: sketches whose perceptual hashes differ by at most MAX_DISTANCE bits (out of
+# HASH_SIZE squared) get the page generated for the earlier one instead of a new Claude call, as long
+# as no 8x8 block of their 128px thumbnails differs by more than MAX_BLOCK_DIFFERENCE grey levels on
+# average (the hash alone can't tell two labels apart). Entries are per caller / collab room.
+SKETCH_SIMILARITY_ENABLED = os.environ.get("SKETCH_SIMILARITY_ENABLED", "True") == "True"
+SKETCH_SIMILARITY_HASH_SIZE = 16
+SKETCH_SIMILARITY_MAX_DISTANCE = int(os.environ.get("SKETCH_SIMILARITY_MAX_DISTANCE", "4"))
+SKETCH_SIMILARITY_MAX_BLOCK_DIFFERENCE = 16.0
+SKETCH_SIMILARITY_CACHE_MAX_ENTRIES = 512
+SKETCH_SIMILARITY_CACHE_TTL = 3600      # seconds
+
+# Server-side rendering of collab pages (/api/collab/<id>/generate/), cached per scene version
+SCENE_RASTER_MAX_SCALE = 2.0    # render at up to 2x scene units, still capped by SKETCH_MAX_EDGE/PIXELS
+SCENE_RASTER_CACHE_MAX_ENTRIES = 256
+SCENE_RASTER_CACHE_TTL = 3600   # seconds
+
+# Partial regeneration (/api/generate-partial/)
+PARTIAL_REGEN_MAX_AREA = 0.5    # fraction of the page an edit may cover before a full regeneration is cheaper
+PARTIAL_REGEN_MARGIN = 24       # px of context kept around the changed region
+PARTIAL_REGEN_MAX_TOKENS = 4000
+
+# Collab rooms: operations a room applies before flushing their fan-out in one go
+COLLAB_MAX_BATCH = 256
+
+# Read-only spectators (?role=spectator) get changed pages as whole scenes this often instead of every delta
+COLLAB_SPECTATOR_INTERVAL = 0.5
+
+# Collab heartbeats (seconds): connections are pinged every interval, and members that send nothing,
+# not even a pong, for the timeout are dropped from their room. 0 disables either.
+COLLAB_HEARTBEAT_INTERVAL = float(os.environ.get("COLLAB_HEARTBEAT_INTERVAL", "20"))
+COLLAB_HEARTBEAT_TIMEOUT = float(os.environ.get("COLLAB_HEARTBEAT_TIMEOUT", "60"))
+
+# Room affinity across collab workers (off unless COLLAB_WORKER_URL is set). Each collabID is owned by
+# one worker, chosen by consistent hashing over COLLAB_WORKERS; websockets landing on another worker
+# are proxied to the owner. Change membership at runtime by POSTing {"workers": [...]} to
+# /api/collab/ring/ on every worker; rooms whose owner changed are handed off with their pages.
+COLLAB_WORKER_URL = os.environ.get("COLLAB_WORKER_URL", "")   # this worker, as listed in COLLAB_WORKERS
+COLLAB_WORKERS = [worker for worker in os.environ.get("COLLAB_WORKERS", "").split(",") if worker]
+COLLAB_RING_REPLICAS = 64       # points per worker on the ring
+COLLAB_MAX_HOPS = 2             # proxy hops before a connection is served wherever it landed
+COLLAB_CLUSTER_TOKEN = os.environ.get("COLLAB_CLUSTER_TOKEN", "")   # shared secret on ring/handoff requests
+if COLLAB_WORKER_URL and not COLLAB_CLUSTER_TOKEN:
+    raise ImproperlyConfigured("COLLAB_CLUSTER_TOKEN must be set when COLLAB_WORKER_URL is: without it anyone "
+                               "could POST a new worker ring or a room handoff.")
+
+# Prometheus-format metrics at /metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True") == "True"
+
 PRODUCTION = False
 prod_env = os.environ.get("PROD")
 if prod_env == "True":
@@ -62,6 +192,7 @@ INSTALLED_APPS = [
 # Middleware
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "backend.sketch_api.services.responseCompression.APICompressionMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -111,9 +242,16 @@ STATICFILES_DIRS = [dist_path] if dist_path.exists() else []
 ROOT_URLCONF = "backend.urls"
 ASGI_APPLICATION = "backend.asgi.application"
 
+# Single-process layer: bounded per-channel queues, no message copying (see services/channelLayer.py).
+# overflow is "reject" (raise ChannelFull), "drop_oldest" or "drop_newest".
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+        "BACKEND": "backend.sketch_api.services.channelLayer.LocalChannelLayer",
+        "CONFIG": {
+            "capacity": int(os.environ.get("CHANNEL_LAYER_CAPACITY", "100")),
+            "overflow": os.environ.get("CHANNEL_LAYER_OVERFLOW", "reject"),
+            "expiry": 60,
+        },
     }
 }
 
@@ -1,5 +1,45 @@
+import asyncio
+import concurrent.futures
+import json
+import time
+
+from django.conf import settings
+from channels.exceptions import ChannelFull
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+
+from .services.metrics import callback, counter, histogram
+from .services.roomAffinity import HANDOFFS, get_affinity, send_snapshot
+
+FANOUT_SECONDS = histogram("collab_fanout_seconds",
+                           "Time from an operation reaching its room to its fan-out being handed to the channel layer.",
+                           ("action",))
+MERGE_SECONDS = histogram("collab_merge_seconds", "Time to merge a scene diff into the stored page.")
+BATCH_SIZE = histogram("collab_batch_operations", "Operations a room applied per mailbox batch.",
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+FRAMES_DROPPED = counter("collab_frames_dropped_total", "Outgoing frames dropped because a channel was full.")
+REAPED = counter("collab_reaped_members_total", "Members dropped from their room after missing heartbeats.")
+REAPED_FRAMES = counter("collab_reaped_frames_total",
+                        "Frames sent to reaped members after they last showed signs of life (wasted fan-out).")
+SPECTATOR_SNAPSHOTS = counter("collab_spectator_snapshots_total", "Throttled snapshots sent to rooms' spectators.")
+
+#Operation name -> action label for metrics
+_OP_ACTIONS = {
+    "onNewConnection": "connect",
+    "onCollaboratorJoin": "collaborator_join",
+    "onCollaboratorPointer": "collaborator_pointer",
+    "onSceneUpdate": "scene_update",
+    "onPageUpdate": "page_update",
+    "onJobUpdate": "job_update",
+    "onConnectionEnd": "disconnect",
+    "onHandoff": "handoff",
+    "onRestore": "restore",
+    "onHeartbeat": "heartbeat",
+    "onReap": "reap",
+    "onSpectatorSnapshot": "spectator_snapshot",
+}
+
+#Operations a member's own connection sends; each one shows the member is still there
+_CLIENT_OPS = {"onCollaboratorJoin", "onCollaboratorPointer", "onSceneUpdate", "onPageUpdate", "onHeartbeat"}
 
 
 def applyDiff(base, diff):
@@ -59,9 +99,23 @@ class Collaborator():
 class CollabSession():
     def __init__(self):
         self.members = []  # List of channel names (for backwards compatibility)
+        self.spectators = []  # read-only channels: throttled snapshots, no deltas, pointers or roster
         self.collaborators = {}  # Dict of userID -> Collaborator
         self.sketches = []
 
+    def to_snapshot(self):
+        """What moves with the room to another worker. Collaborators aren't included: each
+        connection announces itself again once it is proxied to the new owner."""
+        return {"sketches": [{"ID": sketch.ID, "name": sketch.name, "sceneData": sketch.sceneData}
+                             for sketch in self.sketches]}
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        session = cls()
+        session.sketches = [Sketch(sketch["name"], sketch["ID"], sketch["sceneData"])
+                            for sketch in snapshot.get("sketches", [])]
+        return session
+
 
 class Sketch():
     def __init__(self, name, ID, sceneData):
@@ -70,82 +124,237 @@ class Sketch():
         self.sceneData = sceneData
 
 
-class CollabServer(metaclass=SingletonMeta):
-    def sendSceneUpdate(self, channelName, sketchID, sceneData):
-        async_to_sync(get_channel_layer().send)(channelName, {
-            "type": "scene.update",
-            "sketchID": sketchID,
-            "sketchData": sceneData
-            })
-
-    def sendPageUpdate(self, channelName, sketchID, pageName):
-        async_to_sync(get_channel_layer().send)(channelName, {
-            "type": "page.update",
-            "sketchID": sketchID,
-            "pageName": pageName
-            })
-
-    def sendCollaboratorJoin(self, channelName, userID, username, pointer=None):
-        async_to_sync(get_channel_layer().send)(channelName, {
-            "type": "collaborator.join",
-            "userID": userID,
-            "username": username,
-            "pointer": pointer
-            })
-
-    def sendCollaboratorLeave(self, channelName, userID):
-        async_to_sync(get_channel_layer().send)(channelName, {
-            "type": "collaborator.leave",
-            "userID": userID
-            })
-
-    def sendCollaboratorPointer(self, channelName, userID, pointer, pageID=None):
-        async_to_sync(get_channel_layer().send)(channelName, {
-            "type": "collaborator.pointer",
-            "userID": userID,
-            "pointer": pointer,
-            "pageID": pageID
-            })
-
-    #handler methods - define in STS-26
-    collabSessions = {}
-
-    def onNewConnection(self, channelName, collabID):
-        print(f"New connection from {channelName} in collab {collabID}")
-
-        if not collabID in self.collabSessions:
-            self.collabSessions[collabID] = CollabSession()
-            print(f"collab session created")
-
-        self.collabSessions[collabID].members.append(channelName)
+def _coalesce_pointers(outbox):
+    """Within one batch only the newest pointer position per (recipient, user) is worth sending."""
+    seen = set()
+    kept = []
+    for channelName, frame in reversed(outbox):
+        if frame["action"] == "collaborator_pointer":
+            key = (channelName, frame["userID"])
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append((channelName, frame))
+    kept.reverse()
+    return kept
+
+
+class RoomActor():
+    """
+    Owns one room's CollabSession. Consumers post operations to its mailbox and a single task
+    applies them in arrival order, so the room's state is only ever touched from that task and
+    needs no locking. Everything a batch of operations sends is coalesced, encoded once per
+    distinct frame, and handed to the channel layer as one message per recipient.
+    """
+
+    def __init__(self, collabID, server=None, session=None):
+        self.collabID = collabID
+        self.server = server
+        self.session = session or CollabSession()
+        self.loop = None
+        self.mailbox = None
+        self.task = None
+        self.movedTo = None  # worker the room is being handed to
+        self.lastSeen = {}       # member channel -> monotonic time of its last operation or pong
+        self.sentSinceSeen = {}  # member channel -> frames sent to it since then
+        self._outbox = []  # (channelName, client frame) produced by the current batch
+        self._reaped = []  # members the current batch reaped; their consumers are told to close
+        self._reaper = None
+        self._dirtyPages = set()   # sketch IDs created, renamed or deleted since the last spectator snapshot
+        self._dirtyScenes = set()  # sketch IDs whose scene changed since then
+        self._snapshotTimer = None
+
+    def start(self, loop):
+        self.loop = loop
+        self.mailbox = asyncio.Queue()
+        self.task = loop.create_task(self._run())
+        self._schedule_reap()
+
+    def _schedule_reap(self):
+        interval = getattr(settings, "COLLAB_HEARTBEAT_INTERVAL", 20)
+        if interval > 0 and getattr(settings, "COLLAB_HEARTBEAT_TIMEOUT", 60) > 0:
+            self._reaper = self.loop.call_later(interval, self._reap_tick)
+
+    def _reap_tick(self):
+        self.post("onReap")
+        self._schedule_reap()
+
+    def post(self, op, *args):
+        """Queue an operation for the room; safe to call from any thread."""
+        item = (op, args, time.perf_counter())
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self.mailbox.put_nowait(item)
+        else:
+            try:
+                self.loop.call_soon_threadsafe(self.mailbox.put_nowait, item)
+            except RuntimeError:
+                print(f"Room {self.collabID} is gone; dropping {op}")
+
+    async def _run(self):
+        try:
+            await self._serve()
+        finally:
+            for timer in (self._reaper, self._snapshotTimer):
+                if timer is not None:
+                    timer.cancel()
+
+    async def _serve(self):
+        max_batch = getattr(settings, "COLLAB_MAX_BATCH", 256)
+        while True:
+            batch = [await self.mailbox.get()]
+            while len(batch) < max_batch and not self.mailbox.empty():
+                batch.append(self.mailbox.get_nowait())
+
+            self.process(batch)
+            await self.flush()
+
+            now = time.perf_counter()
+            BATCH_SIZE.observe(len(batch))
+            for op, _, posted in batch:
+                FANOUT_SECONDS.labels(_OP_ACTIONS.get(op, op)).observe(now - posted)
+
+            if self.movedTo is not None and await self.hand_off():
+                return
+
+            #Nothing can be posted between this check and retiring: both run without yielding
+            if not self.session.members and not self.session.spectators and self.mailbox.empty():
+                if self.server is not None:
+                    self.server.retire(self)
+                return
+
+    def process(self, batch):
+        now = time.monotonic()
+        lastSeen = self.lastSeen
+        for op, args, _ in batch:
+            if op in _CLIENT_OPS and args[0] in lastSeen:
+                lastSeen[args[0]] = now
+                self.sentSinceSeen[args[0]] = 0
+            try:
+                getattr(self, op)(*args)
+            except Exception as e:
+                print(f"Room {self.collabID}: {op} failed: {e!r}")
+
+    def emit(self, channelNames, frame):
+        for channelName in channelNames:
+            self._outbox.append((channelName, frame))
+
+    async def flush(self):
+        """Send everything the last batch produced; returns the number of frames sent."""
+        outbox, self._outbox = _coalesce_pointers(self._outbox), []
+        reaped, self._reaped = self._reaped, []
+        layer = get_channel_layer()
+        for channelName in reaped:
+            try:
+                await layer.send(channelName, {"type": "collab.reaped"})
+            except ChannelFull:
+                pass
+        if not outbox:
+            return 0
+
+        encoded = {}
+        per_channel = {}
+        for channelName, frame in outbox:
+            text = encoded.get(id(frame))
+            if text is None:
+                text = encoded[id(frame)] = json.dumps(frame)
+            per_channel.setdefault(channelName, []).append((frame["action"], text))
+
+        sent = self.sentSinceSeen
+        for channelName, frames in per_channel.items():
+            if channelName in sent:
+                sent[channelName] += len(frames)
+            try:
+                await layer.send(channelName, {"type": "collab.frames", "frames": frames})
+            except ChannelFull:
+                FRAMES_DROPPED.inc(len(frames))
+                print(f"Dropping {len(frames)} frames for full channel {channelName}")
+        return len(outbox)
+
+    async def hand_off(self):
+        """
+        Ship the room to self.movedTo. On success the room is retired here and its connections are
+        told to follow it; on failure it stays here, pinned, until the next rebalance.
+        """
+        owner, done = self.movedTo, None
+        if self.server is not None:
+            owner, done = self.server.moved.get(self.collabID, (owner, None))
+        ok = await send_snapshot(owner, self.collabID, self.session.to_snapshot())
+        if ok:
+            if self.server is not None:
+                self.server.retire(self)
+            layer = get_channel_layer()
+            for channelName in self.connections():
+                try:
+                    await layer.send(channelName, {"type": "collab.moved", "owner": owner})
+                except ChannelFull:
+                    print(f"Could not tell {channelName} that room {self.collabID} moved")
+        else:
+            self.movedTo = None
+            if self.server is not None:
+                self.server.moved.pop(self.collabID, None)
+                self.server.pinned.add(self.collabID)
+        if done is not None:
+            done.set_result(ok)
+        return ok
+
+    def others(self, channelName):
+        return [member for member in self.session.members if member != channelName]
+
+    def connections(self):
+        return self.session.members + self.session.spectators
+
+    def spectatorsMissed(self, sketchID, page=False, scene=False):
+        """Note a change for the next spectator snapshot, scheduling one if none is pending."""
+        if not self.session.spectators:
+            return
+        if page:
+            self._dirtyPages.add(sketchID)
+        if scene:
+            self._dirtyScenes.add(sketchID)
+        if self._snapshotTimer is None and self.loop is not None:
+            interval = getattr(settings, "COLLAB_SPECTATOR_INTERVAL", 0.5)
+            self._snapshotTimer = self.loop.call_later(interval, self.post, "onSpectatorSnapshot")
+
+    #handler methods - run only on the room's task
+
+    def onNewConnection(self, channelName, spectator=False):
+        print(f"New {'spectator' if spectator else 'connection'} from {channelName} in collab {self.collabID}")
+        session = self.session
+        (session.spectators if spectator else session.members).append(channelName)
+        self.lastSeen[channelName] = time.monotonic()
+        self.sentSinceSeen[channelName] = 0
 
         # Send existing sketches to new connection
-        for sketch in self.collabSessions[collabID].sketches:
-            self.sendPageUpdate(channelName, sketch.ID, sketch.name)
-            self.sendSceneUpdate(channelName, sketch.ID, sketch.sceneData)
+        for sketch in session.sketches:
+            self.emit([channelName], {"action": "page_update", "sketchID": sketch.ID, "pageName": sketch.name})
+            self.emit([channelName], {"action": "scene_update", "sketchID": sketch.ID, "sketchData": sketch.sceneData})
 
-        # Send existing collaborators to new connection
-        print(f"Sending {len(self.collabSessions[collabID].collaborators)} existing collaborators to new user")
-        for userID, collaborator in self.collabSessions[collabID].collaborators.items():
-            print(f"  - Sending collaborator: {collaborator.username} ({userID})")
-            self.sendCollaboratorJoin(channelName, userID, collaborator.username, collaborator.pointer)
+        # Spectators see pages only, never who else is in the room
+        if spectator:
+            return
 
-    def onCollaboratorJoin(self, channelName, collabID, userID, username):
-        print(f"Collaborator join: {username} ({userID}) in collab {collabID}")
+        # Send existing collaborators to new connection
+        print(f"Sending {len(session.collaborators)} existing collaborators to new user")
+        for userID, collaborator in session.collaborators.items():
+            self.emit([channelName], {"action": "collaborator_join", "userID": userID,
+                                      "username": collaborator.username, "pointer": collaborator.pointer})
 
-        session = self.collabSessions[collabID]
+    def onCollaboratorJoin(self, channelName, userID, username):
+        print(f"Collaborator join: {username} ({userID}) in collab {self.collabID}")
 
         # Create and store collaborator info
-        collaborator = Collaborator(userID, username, channelName)
-        session.collaborators[userID] = collaborator
+        self.session.collaborators[userID] = Collaborator(userID, username, channelName)
 
         # Broadcast join to all OTHER members
-        for member in session.members:
-            if member != channelName:
-                self.sendCollaboratorJoin(member, userID, username, None)
+        self.emit(self.others(channelName),
+                  {"action": "collaborator_join", "userID": userID, "username": username, "pointer": None})
 
-    def onCollaboratorPointer(self, channelName, collabID, userID, pointer, pageID=None):
-        session = self.collabSessions[collabID]
+    def onCollaboratorPointer(self, channelName, userID, pointer, pageID=None):
+        session = self.session
 
         # Update stored pointer position and current page
         if userID in session.collaborators:
@@ -154,69 +363,287 @@ class CollabServer(metaclass=SingletonMeta):
 
         # Broadcast pointer update to all OTHER members
         # Include the pageID so clients can filter
-        for member in session.members:
-            if member != channelName:
-                self.sendCollaboratorPointer(member, userID, pointer, pageID)
+        self.emit(self.others(channelName),
+                  {"action": "collaborator_pointer", "userID": userID, "pointer": pointer, "pageID": pageID})
 
-    def onSceneUpdate(self, channelName, collabID, sketchID, sceneData):
-        print(f"Scene update from {channelName} in collab {collabID}")
-
-        session = self.collabSessions[collabID]
-
-        match = [x for x in session.sketches if x.ID == sketchID]
+    def onSceneUpdate(self, channelName, sketchID, sceneData):
+        print(f"Scene update from {channelName} in collab {self.collabID}")
 
-        if len(match) == 0:
+        match = next((x for x in self.session.sketches if x.ID == sketchID), None)
+        if match is None:
             print(f"discarding invalid scene update")
             return
-        else: 
-            match = match[0]
 
-        match.sceneData = applyDiff(match.sceneData, sceneData)
+        with MERGE_SECONDS.time():
+            match.sceneData = applyDiff(match.sceneData, sceneData)
 
-        for member in session.members:
-            if member != channelName:
-                self.sendSceneUpdate(member, sketchID, sceneData)
-
-    def onPageUpdate(self, channelName, collabID, sketchID, pageName):
-        print(f"Page update from {channelName} in collab {collabID}")
+        self.emit(self.others(channelName), {"action": "scene_update", "sketchID": sketchID, "sketchData": sceneData})
+        self.spectatorsMissed(sketchID, scene=True)
 
-        session = self.collabSessions[collabID]
+    def onPageUpdate(self, channelName, sketchID, pageName):
+        print(f"Page update from {channelName} in collab {self.collabID}")
+        session = self.session
 
-        match = [x for x in session.sketches if x.ID == sketchID]
-        if len(match) == 0:
+        match = next((x for x in session.sketches if x.ID == sketchID), None)
+        if match is None:
             session.sketches.append(Sketch(pageName, sketchID, {}))
-            match = session.sketches[-1]
+        elif pageName is None:
+            session.sketches.remove(match)
+            print(f"deleting sketch {match}")
         else:
-            match = match[0]
-            if pageName is None:
-                session.sketches.remove(match)
-                print(f"deleting sketch {match}")
-            else:
-                match.name = pageName
-
-        for member in session.members:
-            if member != channelName:
-                self.sendPageUpdate(member, sketchID, pageName)
-
-    def onConnectionEnd(self, channelName, collabID):
+            match.name = pageName
+
+        self.emit(self.others(channelName), {"action": "page_update", "sketchID": sketchID, "pageName": pageName})
+        self.spectatorsMissed(sketchID, page=True)
+
+    def onJobUpdate(self, job):
+        """Push a background generation job's progress to every member of the room."""
+        self.emit(list(self.session.members), {"action": "job_update", "job": job})
+
+    def onHandoff(self, owner):
+        """The ring gave the room to another worker; _run ships it there after this batch."""
+        print(f"Handing room {self.collabID} to {owner}")
+        self.movedTo = owner
+
+    def onRestore(self, snapshot):
+        """A snapshot handed over by the room's previous owner, arriving after the room was
+        already recreated here: add the pages we don't have yet and send them to everyone."""
+        session = self.session
+        known = {sketch.ID for sketch in session.sketches}
+        for sketch in CollabSession.from_snapshot(snapshot).sketches:
+            if sketch.ID in known:
+                continue
+            session.sketches.append(sketch)
+            self.emit(list(session.members), {"action": "page_update", "sketchID": sketch.ID, "pageName": sketch.name})
+            self.emit(list(session.members),
+                      {"action": "scene_update", "sketchID": sketch.ID, "sketchData": sketch.sceneData})
+            self.spectatorsMissed(sketch.ID, page=True, scene=True)
+
+    def onSpectatorSnapshot(self):
+        """
+        Bring spectators up to date: every page changed since the last snapshot is sent once, as
+        its whole current scene, however many deltas editors exchanged in between. One frame per
+        page is shared by all spectators, so this costs the same for 2 viewers or 100.
+        """
+        self._snapshotTimer = None
+        pages, scenes = self._dirtyPages, self._dirtyScenes
+        self._dirtyPages, self._dirtyScenes = set(), set()
+        spectators = list(self.session.spectators)
+        if not spectators:
+            return
+        sketches = {sketch.ID: sketch for sketch in self.session.sketches}
+        for sketchID in pages | scenes:
+            sketch = sketches.get(sketchID)
+            if sketch is None:
+                self.emit(spectators, {"action": "page_update", "sketchID": sketchID, "pageName": None})
+                continue
+            if sketchID in pages:
+                self.emit(spectators, {"action": "page_update", "sketchID": sketchID, "pageName": sketch.name})
+            if sketchID in scenes:
+                self.emit(spectators, {"action": "scene_update", "sketchID": sketchID, "sketchData": sketch.sceneData})
+        SPECTATOR_SNAPSHOTS.inc()
+
+    def onHeartbeat(self, channelName):
+        """A pong; process() has already marked the member as alive."""
+
+    def onReap(self):
+        """Drop members that have sent nothing, not even a pong, for COLLAB_HEARTBEAT_TIMEOUT seconds."""
+        timeout = getattr(settings, "COLLAB_HEARTBEAT_TIMEOUT", 60)
+        now = time.monotonic()
+        for channelName in self.connections():
+            #Members without a record (a room re-homed from a dead loop) get a full timeout from now
+            silent = now - self.lastSeen.setdefault(channelName, now)
+            if silent < timeout:
+                continue
+            frames = self.sentSinceSeen.get(channelName, 0)
+            print(f"Reaping {channelName} from collab {self.collabID}: silent for {silent:.0f}s, "
+                  f"{frames} frames sent to it since")
+            REAPED.inc()
+            REAPED_FRAMES.inc(frames)
+            self.onConnectionEnd(channelName)
+            self._reaped.append(channelName)
+
+    def onConnectionEnd(self, channelName):
         print(f"Disconnection from {channelName}")
-        
-        session = self.collabSessions[collabID]
-        session.members.remove(channelName)
+        session = self.session
+        if channelName in session.members:
+            session.members.remove(channelName)
+        elif channelName in session.spectators:
+            session.spectators.remove(channelName)
+        self.lastSeen.pop(channelName, None)
+        self.sentSinceSeen.pop(channelName, None)
 
         # Find and remove the collaborator associated with this channel
-        userID_to_remove = None
-        for userID, collaborator in session.collaborators.items():
-            if collaborator.channelName == channelName:
-                userID_to_remove = userID
-                break
+        userID_to_remove = next((userID for userID, collaborator in session.collaborators.items()
+                                 if collaborator.channelName == channelName), None)
 
         if userID_to_remove:
             del session.collaborators[userID_to_remove]
             # Broadcast leave to remaining members
-            for member in session.members:
-                self.sendCollaboratorLeave(member, userID_to_remove)
+            self.emit(list(session.members), {"action": "collaborator_leave", "userID": userID_to_remove})
+
 
-        if len(session.members) == 0:
-            self.collabSessions.pop(collabID)
-            print(f"Ended collab {collabID}")
\ No newline at end of file
+class CollabServer(metaclass=SingletonMeta):
+    """
+    Routes each room's operations to its RoomActor. The actors run on the event loop serving the
+    websockets; the on* methods only post to a mailbox and may be called from any thread.
+
+    With room affinity on (services/roomAffinity.py) this worker only holds the rooms the ring
+    gives it; route() tells consumers where to proxy the others.
+    """
+
+    rooms = {}     # collabID -> RoomActor
+    moved = {}     # collabID -> (owner, Future[bool]) for rooms this worker handed off since the last rebalance
+    pinned = set()  # rooms kept here because handing them off failed
+    handoffs = {}  # collabID -> snapshot received from the room's previous owner, used when the room starts
+    loop = None    # loop the rooms run on
+
+    def room(self, collabID):
+        """The room's actor, started on the running loop if the room is new (call from the loop)."""
+        loop = asyncio.get_running_loop()
+        actor = self.rooms.get(collabID)
+        if actor is None or (actor.loop is not loop and (actor.loop.is_closed() or not actor.loop.is_running())):
+            #A room left behind on a stopped loop (e.g. a reloaded server) keeps its state on the new one
+            session = actor.session if actor is not None else None
+            snapshot = self.handoffs.pop(collabID, None)
+            if session is None and snapshot is not None:
+                session = CollabSession.from_snapshot(snapshot)
+            actor = RoomActor(collabID, self, session)
+            self.rooms[collabID] = actor
+            actor.start(loop)
+            CollabServer.loop = loop
+            print(f"collab session created")
+        return actor
+
+    def retire(self, actor):
+        if self.rooms.get(actor.collabID) is actor:
+            del self.rooms[actor.collabID]
+
+    async def route(self, collabID, hops=0):
+        """The worker to proxy a connection for this room to, or None to serve it here. Waits for
+        a handoff in progress, so a connection never reaches the new owner before the room does."""
+        pending = self.moved.get(collabID)
+        if pending is not None:
+            owner, done = pending
+            return owner if await asyncio.wrap_future(done) else None
+        if collabID in self.pinned:
+            return None
+        return get_affinity().route(collabID, hops)
+
+    def rebalance(self, workers):
+        """
+        Install a new worker list and start handing off the rooms it moves elsewhere; returns
+        their ids. Call on the rooms' loop (see on_loop), so no consumer can post to a room
+        between it being marked moved and its handoff being queued.
+        """
+        affinity = get_affinity()
+        affinity.set_workers(workers)
+        for collabID, (_, done) in list(self.moved.items()):
+            if done.done():
+                del self.moved[collabID]
+        self.pinned.clear()
+        moving = []
+        for collabID, actor in list(self.rooms.items()):
+            owner = affinity.owner(collabID)
+            if owner is None or collabID in self.moved:
+                continue
+            self.moved[collabID] = (owner, concurrent.futures.Future())
+            actor.post("onHandoff", owner)
+            moving.append(collabID)
+        return moving
+
+    def install(self, collabID, snapshot):
+        """Take over a room handed off by its previous owner (call on the rooms' loop)."""
+        HANDOFFS.labels("in", "received").inc()
+        actor = self.rooms.get(collabID)
+        if actor is None:
+            self.handoffs[collabID] = snapshot
+        else:
+            actor.post("onRestore", snapshot)
+
+    def pages(self, collabID):
+        """The room's pages as (sketchID, name, sceneData), or None if this worker doesn't hold the
+        room (call on the rooms' loop). Scene dicts are replaced, never mutated, by updates."""
+        actor = self.rooms.get(collabID)
+        if actor is None:
+            return None
+        return [(sketch.ID, sketch.name, sketch.sceneData) for sketch in actor.session.sketches]
+
+    def on_loop(self, fn, *args, timeout=30):
+        """Call fn on the loop the rooms run on and return its result; for sync views' threads."""
+        loop = self.loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is None or loop is running or not loop.is_running():
+            return fn(*args)
+
+        async def call():
+            return fn(*args)
+        return asyncio.run_coroutine_threadsafe(call(), loop).result(timeout)
+
+    def onNewConnection(self, channelName, collabID, spectator=False):
+        self.room(collabID).post("onNewConnection", channelName, spectator)
+
+    def onCollaboratorJoin(self, channelName, collabID, userID, username):
+        self.room(collabID).post("onCollaboratorJoin", channelName, userID, username)
+
+    def onCollaboratorPointer(self, channelName, collabID, userID, pointer, pageID=None):
+        self.room(collabID).post("onCollaboratorPointer", channelName, userID, pointer, pageID)
+
+    def onSceneUpdate(self, channelName, collabID, sketchID, sceneData):
+        self.room(collabID).post("onSceneUpdate", channelName, sketchID, sceneData)
+
+    def onPageUpdate(self, channelName, collabID, sketchID, pageName):
+        self.room(collabID).post("onPageUpdate", channelName, sketchID, pageName)
+
+    def onHeartbeat(self, channelName, collabID):
+        actor = self.rooms.get(collabID)
+        if actor is not None:
+            actor.post("onHeartbeat", channelName)
+
+    def onJobUpdate(self, collabID, job):
+        """Called from job runner threads; rooms that have since emptied are skipped."""
+        actor = self.rooms.get(str(collabID))
+        if actor is not None:
+            actor.post("onJobUpdate", job)
+
+    def onConnectionEnd(self, channelName, collabID):
+        actor = self.rooms.get(collabID)
+        if actor is not None:
+            actor.post("onConnectionEnd", channelName)
+
+
+def _room_totals():
+    sessions = [actor.session for actor in list(CollabServer.rooms.values())]
+    return (len(sessions), sum(len(session.members) for session in sessions),
+            sum(len(session.sketches) for session in sessions))
+
+
+def _mailbox_depths():
+    return [actor.mailbox.qsize() for actor in list(CollabServer.rooms.values()) if actor.mailbox is not None]
+
+
+def _queue_depths():
+    """Per-channel queue depths for the in-process layers (LocalChannelLayer or channels' in-memory one)."""
+    layer = get_channel_layer()
+    if hasattr(layer, "queue_depths"):
+        return layer.queue_depths()
+    queues = getattr(layer, "channels", None)
+    if not isinstance(queues, dict):
+        return None
+    return [queue.qsize() for queue in list(queues.values())]
+
+
+callback("collab_rooms", "Active collab rooms.", "gauge", lambda: _room_totals()[0])
+callback("collab_members", "Websocket connections across all collab rooms.", "gauge", lambda: _room_totals()[1])
+callback("collab_spectators", "Read-only spectator connections across all collab rooms.", "gauge",
+         lambda: sum(len(actor.session.spectators) for actor in list(CollabServer.rooms.values())))
+callback("collab_pages", "Pages held across all collab rooms.", "gauge", lambda: _room_totals()[2])
+callback("collab_mailbox_depth", "Operations waiting in room mailboxes.", "gauge", lambda: sum(_mailbox_depths()))
+callback("collab_max_mailbox_depth", "Deepest room mailbox.", "gauge", lambda: max(_mailbox_depths(), default=0))
+callback("channel_layer_queued_messages", "Messages waiting in channel layer queues.", "gauge",
+         lambda: sum(_queue_depths()))
+callback("channel_layer_max_queue_depth", "Deepest channel layer queue.", "gauge",
+         lambda: max(_queue_depths(), default=0))
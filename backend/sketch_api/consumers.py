@@ -1,26 +1,129 @@
-from channels.generic.websocket import WebsocketConsumer
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from .CollabServer import CollabServer
+from .services.metrics import BYTE_BUCKETS, bounded_label, counter, histogram
+from .services.roomAffinity import FORWARDED, open_upstream, scope_hops
 import channels.layers
+import asyncio
 import json
 import uuid
+from urllib.parse import parse_qs
 
+ACTIONS = {"scene_update", "page_update", "collaborator_join", "collaborator_leave", "collaborator_pointer",
+           "job_update", "ping", "pong"}
 
-class SketchConsumer(WebsocketConsumer):
+PING = json.dumps({"action": "ping"})
+
+MESSAGES = counter("collab_messages_total", "Websocket messages by direction (in, out) and action.",
+                   ("direction", "action"))
+MESSAGE_BYTES = histogram("collab_message_bytes", "Websocket message size by direction and action.",
+                          ("direction", "action"), BYTE_BUCKETS)
+
+
+class SketchConsumer(AsyncWebsocketConsumer):
     server = CollabServer()
+    upstream = None   # websocket to the worker owning the room, when it isn't this one
+    identity = None   # (userID, username) from the client's collaborator_join
+    heartbeat = None
+    spectator = False
 
-    def connect(self):
+    async def connect(self):
         self.collabID = self.scope["url_route"]["kwargs"]["collabID"]
-        self.server.onNewConnection(self.channel_name, self.collabID)
-        self.accept()
+        #Read-only viewers connect with ?role=spectator
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.spectator = query.get("role") == ["spectator"]
+        self.hops = scope_hops(self.scope)
+        owner = await self.server.route(self.collabID, self.hops)
+        await self.accept()
+        if owner is None:
+            self.server.onNewConnection(self.channel_name, self.collabID, self.spectator)
+            self.heartbeat = asyncio.ensure_future(self.send_pings())
+            return
+        try:
+            await self.forward(owner)
+        except Exception as e:
+            print(f"Could not reach {owner} for room {self.collabID}: {e!r}")
+            await self.close(code=1013)
+
+    async def disconnect(self, close_code):
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+        if self.upstream is not None:
+            self.pump.cancel()
+            await self.upstream.close()
+        else:
+            self.server.onConnectionEnd(self.channel_name, self.collabID)
+
+    async def forward(self, owner):
+        """Proxy this connection to the room's owner from now on."""
+        self.upstream = await open_upstream(owner, self.collabID, self.hops + 1, self.spectator)
+        #The owner pings the client through us from now on
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+        self.pump = asyncio.ensure_future(self.pump_upstream())
+        FORWARDED.inc()
+        #A connection moved mid-session announces itself to the new owner as it did to the old one
+        if self.identity is not None:
+            userID, username = self.identity
+            await self.upstream.send(json.dumps({"action": "collaborator_join", "userID": userID, "username": username}))
+
+    async def pump_upstream(self):
+        try:
+            async for text in self.upstream:
+                MESSAGES.labels("out", "forwarded").inc()
+                MESSAGE_BYTES.labels("out", "forwarded").observe(len(text))
+                await self.send(text_data=text)
+        except Exception as e:
+            print(f"Upstream for room {self.collabID} failed: {e!r}")
+        #The owner went away or closed us; a reconnecting client is routed afresh
+        await self.close()
 
-    def disconnect(self, close_code):
-        self.server.onConnectionEnd(self.channel_name, self.collabID)
+    async def send_pings(self):
+        """Ping the client every COLLAB_HEARTBEAT_INTERVAL seconds; its room reaps it if the pongs stop."""
+        interval = getattr(settings, "COLLAB_HEARTBEAT_INTERVAL", 20)
+        if interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            MESSAGES.labels("out", "ping").inc()
+            await self.send(text_data=PING)
 
-    def receive(self, text_data):
+    async def follow(self):
+        """Switch to proxying if this worker handed the room off; False if it is still served here."""
+        owner = await self.server.route(self.collabID, self.hops)
+        if owner is None:
+            return False
+        try:
+            await self.forward(owner)
+        except Exception as e:
+            print(f"Could not follow room {self.collabID} to {owner}: {e!r}")
+            await self.close(code=1013)
+        return True
+
+    async def receive(self, text_data=None, bytes_data=None):
         message = json.loads(text_data)
         action = message["action"]
+        label = bounded_label(action, ACTIONS)
+        MESSAGES.labels("in", label).inc()
+        MESSAGE_BYTES.labels("in", label).observe(len(text_data))
+
+        if self.upstream is None and self.collabID in self.server.moved:
+            if await self.follow() and self.upstream is None:
+                return  # the new owner is unreachable and the connection is closing
+        if action == "collaborator_join":
+            self.identity = (message["userID"], message["username"])
+        if self.upstream is not None:
+            await self.upstream.send(text_data)
+            return
+
+        if action == "pong":
+            self.server.onHeartbeat(self.channel_name, self.collabID)
 
-        if action == "scene_update":
+        # Spectators are read-only
+        elif self.spectator:
+            return
+
+        elif action == "scene_update":
             self.server.onSceneUpdate(self.channel_name, self.collabID, message["sketchID"], message["sketchData"])
 
         elif action == "page_update":
@@ -45,41 +148,18 @@ class SketchConsumer(WebsocketConsumer):
                 message.get("pageID")  # Pass pageID from client
             )
 
-    def scene_update(self, event):
-        self.send(text_data=json.dumps({
-            "action": "scene_update",
-            "sketchID": event["sketchID"],
-            "sketchData": event["sketchData"]
-        }))
-
-    def page_update(self, event):
-        self.send(text_data=json.dumps({
-            "action": "page_update",
-            "sketchID": event["sketchID"],
-            "pageName": event["pageName"]
-        }))
-
-    # Send collaborator join to WebSocket
-    def collaborator_join(self, event):
-        self.send(text_data=json.dumps({
-            "action": "collaborator_join",
-            "userID": event["userID"],
-            "username": event["username"],
-            "pointer": event.get("pointer")
-        }))
-
-    # Send collaborator leave to WebSocket
-    def collaborator_leave(self, event):
-        self.send(text_data=json.dumps({
-            "action": "collaborator_leave",
-            "userID": event["userID"]
-        }))
-
-    # Send collaborator pointer update to WebSocket - now includes pageID
-    def collaborator_pointer(self, event):
-        self.send(text_data=json.dumps({
-            "action": "collaborator_pointer",
-            "userID": event["userID"],
-            "pointer": event["pointer"],
-            "pageID": event.get("pageID")  # Include pageID in response
-        }))
\ No newline at end of file
+    # This worker handed the room to another one (see RoomActor.hand_off)
+    async def collab_moved(self, event):
+        if self.upstream is None:
+            await self.follow()
+
+    # The room gave up on this connection after it missed its heartbeats
+    async def collab_reaped(self, event):
+        await self.close(code=4000)
+
+    # Frames from this connection's room, already JSON-encoded by the room actor
+    async def collab_frames(self, event):
+        for action, text in event["frames"]:
+            MESSAGES.labels("out", action).inc()
+            MESSAGE_BYTES.labels("out", action).observe(len(text))
+            await self.send(text_data=text)
@@ -0,0 +1,274 @@
+# services/channelLayer.py
+#Single-node channel layer for one process, a drop-in replacement for InMemoryChannelLayer:
+#  - each channel is a bounded deque; a full channel rejects or drops by policy, counted in metrics
+#  - messages are passed by reference, never deep-copied (room actors send pre-encoded frames)
+#  - group membership is a dict per group plus a reverse index per channel, O(1) add/discard
+#  - no expiry scans: expired heads are dropped as they are reached, and channels nobody has
+#    received on for `expiry` seconds are reclaimed a few at a time, least recently used first
+#  - senders on other threads/loops (async_to_sync) wake receivers with call_soon_threadsafe
+#
+#   CHANNEL_LAYERS = {"default": {"BACKEND": "backend.sketch_api.services.channelLayer.LocalChannelLayer",
+#                                 "CONFIG": {"capacity": 100, "overflow": "reject"}}}
+import asyncio
+import random
+import string
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from copy import deepcopy
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from .metrics import callback, counter
+
+#What happens to a send when the channel is at capacity
+REJECT = "reject"            # raise ChannelFull, like the stock layers
+DROP_OLDEST = "drop_oldest"  # evict the oldest queued message to make room
+DROP_NEWEST = "drop_newest"  # silently discard the message being sent
+OVERFLOW_POLICIES = (REJECT, DROP_OLDEST, DROP_NEWEST)
+
+#Idle channels examined per send when reclaiming
+SWEEP_BATCH = 4
+
+MESSAGES = counter("channel_layer_messages_total",
+                   "Channel layer sends by outcome (queued, rejected, dropped_oldest, dropped_newest, expired).",
+                   ("outcome",))
+
+_layers = weakref.WeakSet()
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Channel:
+    __slots__ = ("queue", "capacity", "waiters", "groups", "active")
+
+    def __init__(self, capacity: int, now: float):
+        self.queue = deque()
+        self.capacity = capacity
+        self.waiters = deque()  # (loop, future) of blocked receivers
+        self.groups = set()
+        self.active = now       # last receive; channels idle past expiry are reclaimed
+
+
+class LocalChannelLayer(BaseChannelLayer):
+    """See the module comment; accepts the same CONFIG keys as InMemoryChannelLayer plus `overflow`."""
+
+    extensions = ["groups", "flush"]
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 overflow=REJECT, copy_messages=False, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, not {overflow!r}")
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.group_expiry = group_expiry
+        self.overflow = overflow
+        self.copy_messages = copy_messages
+        self._lock = threading.Lock()
+        self._channels: "OrderedDict[str, _Channel]" = OrderedDict()
+        self._groups: dict[str, dict[str, float]] = {}
+        _layers.add(self)
+
+    # ---- bookkeeping (lock held) ----
+
+    def _channel_locked(self, name: str, now: float) -> _Channel:
+        channel = self._channels.get(name)
+        if channel is None:
+            channel = self._channels[name] = _Channel(self.get_capacity(name), now)
+        return channel
+
+    def _drop_expired_locked(self, channel: _Channel, now: float) -> None:
+        queue = channel.queue
+        while queue and queue[0][0] <= now:
+            queue.popleft()
+            MESSAGES.labels("expired").inc()
+
+    def _remove_channel_locked(self, name: str) -> None:
+        channel = self._channels.pop(name, None)
+        if channel is None:
+            return
+        for group in channel.groups:
+            members = self._groups.get(group)
+            if members is not None:
+                members.pop(name, None)
+                if not members:
+                    del self._groups[group]
+
+    def _sweep_locked(self, now: float) -> None:
+        """Reclaim a few channels nobody has received on for `expiry` seconds (LRU order)."""
+        for _ in range(SWEEP_BATCH):
+            if not self._channels:
+                return
+            name, channel = next(iter(self._channels.items()))
+            if channel.waiters:
+                #A blocked receiver is alive; refresh it so the sweep can look further
+                channel.active = now
+                self._channels.move_to_end(name)
+                continue
+            if channel.active > now - self.expiry:
+                return
+            self._remove_channel_locked(name)
+            MESSAGES.labels("expired").inc(len(channel.queue))
+
+    def _enqueue_locked(self, name: str, message: dict, now: float) -> None:
+        channel = self._channel_locked(name, now)
+        queue = channel.queue
+        if len(queue) >= channel.capacity:
+            self._drop_expired_locked(channel, now)
+        if len(queue) >= channel.capacity:
+            if self.overflow == REJECT:
+                MESSAGES.labels("rejected").inc()
+                raise ChannelFull(name)
+            if self.overflow == DROP_NEWEST:
+                MESSAGES.labels("dropped_newest").inc()
+                return
+            queue.popleft()
+            MESSAGES.labels("dropped_oldest").inc()
+        queue.append((now + self.expiry, deepcopy(message) if self.copy_messages else message))
+        MESSAGES.labels("queued").inc()
+
+        if channel.waiters:
+            loop, future = channel.waiters.popleft()
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if loop is running:
+                _wake(future)
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(_wake, future)
+
+    # ---- channel layer API ----
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        assert "__asgi_channel__" not in message
+        now = time.time()
+        with self._lock:
+            self._enqueue_locked(channel, message, now)
+            self._sweep_locked(now)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        loop = asyncio.get_running_loop()
+        while True:
+            now = time.time()
+            with self._lock:
+                state = self._channel_locked(channel, now)
+                state.active = now
+                self._channels.move_to_end(channel)
+                self._drop_expired_locked(state, now)
+                if state.queue:
+                    return state.queue.popleft()[1]
+                future = loop.create_future()
+                waiter = (loop, future)
+                state.waiters.append(waiter)
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._lock:
+                    try:
+                        state.waiters.remove(waiter)
+                    except ValueError:
+                        #Already woken: pass the wakeup on so a queued message isn't stranded
+                        if state.queue and state.waiters:
+                            next_loop, next_future = state.waiters.popleft()
+                            next_loop.call_soon_threadsafe(_wake, next_future)
+                raise
+
+    async def new_channel(self, prefix="specific."):
+        return "%s.local!%s" % (prefix, "".join(random.choice(string.ascii_letters) for _ in range(12)))
+
+    # ---- flush extension ----
+
+    async def flush(self):
+        with self._lock:
+            channels = list(self._channels.values())
+            self._channels.clear()
+            self._groups.clear()
+        #Blocked receivers go back round their loop and wait on a fresh channel
+        for channel in channels:
+            for loop, future in channel.waiters:
+                if not loop.is_closed():
+                    loop.call_soon_threadsafe(_wake, future)
+
+    async def close(self):
+        pass
+
+    # ---- groups extension ----
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        now = time.time()
+        with self._lock:
+            self._groups.setdefault(group, {})[channel] = now
+            self._channel_locked(channel, now).groups.add(group)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        with self._lock:
+            members = self._groups.get(group)
+            if members is not None:
+                members.pop(channel, None)
+                if not members:
+                    del self._groups[group]
+            state = self._channels.get(channel)
+            if state is not None:
+                state.groups.discard(group)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        now = time.time()
+        with self._lock:
+            members = self._groups.get(group)
+            if not members:
+                return
+            stale = now - self.group_expiry
+            for name, joined in list(members.items()):
+                if joined < stale:
+                    members.pop(name, None)
+                    continue
+                try:
+                    self._enqueue_locked(name, message, now)
+                except ChannelFull:
+                    pass
+
+    # ---- introspection for metrics ----
+
+    def queue_depths(self) -> list[int]:
+        with self._lock:
+            return [len(channel.queue) for channel in self._channels.values()]
+
+    def stats(self) -> dict:
+        with self._lock:
+            depths = [len(channel.queue) for channel in self._channels.values()]
+            return {
+                "channels": len(self._channels),
+                "groups": len(self._groups),
+                "group_members": sum(len(members) for members in self._groups.values()),
+                "queued": sum(depths),
+                "max_depth": max(depths, default=0),
+                "capacity": self.capacity,
+                "overflow": self.overflow,
+            }
+
+
+def _stat(name: str):
+    return lambda: sum(layer.stats()[name] for layer in list(_layers)) if _layers else None
+
+
+callback("channel_layer_channels", "Channels with state in the local channel layer.", "gauge", _stat("channels"))
+callback("channel_layer_groups", "Groups in the local channel layer.", "gauge", _stat("groups"))
+callback("channel_layer_group_members", "Channel memberships across local channel layer groups.", "gauge",
+         _stat("group_members"))
+callback("channel_layer_capacity", "Per-channel capacity of the local channel layer, by overflow policy.", "gauge",
+         lambda: [((layer.overflow,), layer.capacity) for layer in list(_layers)] or None, ("overflow",))
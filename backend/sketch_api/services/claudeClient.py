@@ -1,12 +1,23 @@
 # services/claude_client.py
 #This file consists of all the code that is required to interact with the Claude API
+import asyncio
 import base64
+import time
+from functools import partial
 from typing import Optional, Sequence
 
 from django.conf import settings
-from anthropic import AsyncAnthropic
 import json
 import os
+import re
+
+from .claudeProvider import get_client
+from .claudeScheduler import get_scheduler, estimate_image_tokens, estimate_text_tokens
+from .claudeRetry import RetryPolicy, call_with_retry, get_latency_tracker
+from .claudeRouting import (PAGE_STOP_SEQUENCES, ROUTED, TIER_OUTPUT_TOKENS, TIER_SECONDS, batch_budget,
+                            finish_page, measure_complexity, next_tier, route_page, tiers)
+from .claudeUsage import EPHEMERAL_CACHE, rate_limited_input_tokens, usage
+from .tailwindCompile import postprocess_page
 
 def _load_anthropic_key_from_file(key_name: str) -> str:
     """Read API key from plaintext file defined in settings."""
@@ -20,7 +31,7 @@ def _load_anthropic_key_from_file(key_name: str) -> str:
     return key
 
 
-def _client() -> AsyncAnthropic:
+def _api_key() -> str:
     key = ""
     try:
         key = _load_anthropic_key_from_file("CLAUDE_API_KEY")
@@ -29,8 +40,12 @@ def _client() -> AsyncAnthropic:
     
     if not key or key == "":
         raise RuntimeError("Anthropic API key is missing.")
+    return key
+
 
-    return AsyncAnthropic(api_key=key)
+def _client():
+    """AsyncAnthropic, or a fake, depending on CLAUDE_PROVIDER (see claudeProvider)."""
+    return get_client(_api_key)
 
 #This function would help extract text from the response received from Claude API focusing on only the output.
 def _extract_text(resp) -> str:
@@ -42,20 +57,15 @@ def _extract_text(resp) -> str:
     return "".join(parts).strip()
 
 
-async def image_to_html_css(image_bytes: bytes, media_type: str = "image/png", prompt: Optional[str] = None) -> str:
-    """
-    Send one image + optional prompt to Claude and get back HTML/CSS.
-    Returns HTML string (sanitize on the client before injecting into DOM).
-    """
-    b64 = base64.b64encode(image_bytes).decode("utf-8")
+#Static prompt prefix, identical on every call so it can be served from Claude's prompt cache.
+#Keep anything per-request (the image, a custom prompt) out of these strings.
+SYSTEM_PROMPT = (
+    "You are an expert frontend developer specializing in converting UI sketches into "
+    "modern, high-fidelity, pixel-perfect, production-ready HTML with Tailwind CSS. Your code is clean, semantic, "
+    "accessible, and follows modern web development best practices."
+)
 
-    system_msg = (
-        "You are an expert frontend developer specializing in converting UI sketches into "
-        "modern, high-fidelity, pixel-perfect, production-ready HTML with Tailwind CSS. Your code is clean, semantic, "
-        "accessible, and follows modern web development best practices."
-    )
-    user_instruction = prompt or (
-            """Convert the provided UI sketch into complete, functional HTML with Tailwind CSS styling.
+DEFAULT_INSTRUCTIONS = """Convert the provided UI sketch into complete, functional HTML with Tailwind CSS styling.
 
             CRITICAL OUTPUT REQUIREMENTS:
             - Ignore the outer bounding box of sketch as it is for user to assume as a viewport.
@@ -94,35 +104,190 @@ async def image_to_html_css(image_bytes: bytes, media_type: str = "image/png", p
             - Add hover states where interactive elements are present (buttons, links)
             - Use flexbox and grid layouts as needed for complex arrangements
             Begin your response with <!DOCTYPE html> and nothing else."""
-       )
+
+#Sent after the image when the default instructions (already in the cached system prefix) apply
+DEFAULT_USER_TEXT = "Convert this UI sketch following the instructions above."
+
+
+#Appended after DEFAULT_INSTRUCTIONS when several pages go out in one call
+BATCH_INSTRUCTIONS = """These sketches are pages of the same application. Design them as one product:
+
+            - Before writing any page, settle on one shared design system (colour palette, typography scale,
+              spacing, border radius, button/card/input styles, header and navigation) and apply it
+              identically on every page so they look like parts of the same site.
+            - Return one complete HTML document per sketch, in the order the sketches were given.
+            - Put the marker line <!-- PAGE n --> (n = 1, 2, 3, ...) immediately before each page's <!DOCTYPE html>.
+            - Output nothing except the markers and the documents."""
+
+_PAGE_MARKER = re.compile(r"<!--\s*PAGE\s+(\d+)\s*-->", re.IGNORECASE)
+_HTML_CLOSE = re.compile(r"</html\s*>", re.IGNORECASE)
+
+
+def _system_blocks(prompt: Optional[str]) -> list[dict]:
+    """System prompt as content blocks with a cache breakpoint at the end of the static prefix."""
+    if prompt:
+        #A custom prompt replaces the default instructions, so only the persona is shared
+        return [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": EPHEMERAL_CACHE}]
+    return [
+        {"type": "text", "text": SYSTEM_PROMPT},
+        {"type": "text", "text": DEFAULT_INSTRUCTIONS, "cache_control": EPHEMERAL_CACHE},
+    ]
+
+
+async def image_to_html_css(
+    image_bytes: bytes,
+    media_type: str = "image/png",
+    prompt: Optional[str] = None,
+    client_key: str = "anonymous",
+    priority: bool = False,
+) -> str:
+    """
+    Send one image + optional prompt to Claude and get back HTML/CSS.
+    Returns HTML string (sanitize on the client before injecting into DOM).
+    `client_key` (user or collab room) and `priority` feed the shared call scheduler.
+    The model and output budget come from the sketch's complexity (see claudeRouting).
+    """
+    system_blocks = _system_blocks(prompt)
+    user_instruction = prompt or DEFAULT_USER_TEXT
 
     client = _client()
-    model = getattr(settings, "CLAUDE_MODEL", "claude-haiku-4-5-20251001")
+    available = tiers()
+    complexity = await asyncio.to_thread(measure_complexity, image_bytes)
+    tier = route_page(complexity, available)
 
-    resp = await client.messages.create(
-        model=model,
-        max_tokens=15000,
-        system=system_msg,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": media_type,  # e.g., "image/png"
-                            "data": b64,
-                        },
-                    },
-                    {"type": "text", "text": user_instruction},
-                ],
-            }
-        ],
+    estimated_tokens = (
+        estimate_image_tokens(len(image_bytes))
+        + sum(estimate_text_tokens(block["text"]) for block in system_blocks)
+        + estimate_text_tokens(user_instruction)
     )
+
+    async def attempt(ticket):
+        # Encoded only once admitted, so queued calls hold the compact image and not a 4/3-size copy
+        b64 = base64.b64encode(image_bytes).decode("ascii")
+        resp = await tracker.timed(client.messages.create(
+            model=tier.model,
+            max_tokens=tier.max_tokens,
+            stop_sequences=PAGE_STOP_SEQUENCES,
+            system=system_blocks,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": media_type,  # e.g., "image/png"
+                                "data": b64,
+                            },
+                        },
+                        {"type": "text", "text": user_instruction},
+                    ],
+                }
+            ],
+        ))
+        ticket.actual_tokens = rate_limited_input_tokens(getattr(resp, "usage", None))
+        usage.record("image_to_html_css", getattr(resp, "usage", None), pages=1)
+        return resp
+
+    policy = RetryPolicy.from_settings()
+    tracker = get_latency_tracker("image_to_html_css")
+    slot = partial(get_scheduler().slot, client_key, estimated_tokens, priority)
+    escalated = False
+    while True:
+        started = time.monotonic()
+        resp = await call_with_retry(attempt, policy, tracker, slot)
+        TIER_SECONDS.labels(tier.name).observe(time.monotonic() - started)
+        TIER_OUTPUT_TOKENS.labels(tier.name).observe(getattr(getattr(resp, "usage", None), "output_tokens", 0) or 0)
+        if getattr(resp, "stop_reason", None) != "max_tokens":
+            ROUTED.labels(tier.name, "complete").inc()
+            break
+        # Ran out of budget mid-page: a cut-off document is worse than a slower one, but one retry
+        # on the next tier up is the most a page gets
+        bigger = None if escalated else next_tier(tier, available)
+        if bigger is None:
+            ROUTED.labels(tier.name, "truncated").inc()
+            break
+        ROUTED.labels(tier.name, "escalated").inc()
+        tier = bigger
+        escalated = True
+
     html = _extract_text(resp)
     if not html:
         raise RuntimeError("Claude returned no text content.")
-    return html
+    return postprocess_page(finish_page(html, resp))
+
+
+def split_batch_response(text: str, count: int) -> list[Optional[str]]:
+    """Split a batched response on its <!-- PAGE n --> markers; pages the model skipped are None."""
+    pages: list[Optional[str]] = [None] * count
+    markers = list(_PAGE_MARKER.finditer(text))
+    for i, marker in enumerate(markers):
+        number = int(marker.group(1))
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        html = text[marker.end():end].strip()
+        if 1 <= number <= count and html and pages[number - 1] is None:
+            pages[number - 1] = html
+    return pages
+
 
+def _batch_content(images: Sequence[tuple[bytes, str]], instruction: str) -> list[dict]:
+    content: list[dict] = []
+    for number, (image_bytes, media_type) in enumerate(images, start=1):
+        content.append({"type": "text", "text": f"Sketch {number}:"})
+        content.append({
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": media_type,
+                "data": base64.b64encode(image_bytes).decode("ascii"),
+            },
+        })
+    content.append({"type": "text", "text": instruction})
+    return content
 
+
+async def images_to_html_batch(
+    images: Sequence[tuple[bytes, str]],
+    client_key: str = "anonymous",
+    priority: bool = False,
+) -> list[Optional[str]]:
+    """
+    Generate several pages in one call: the instructions are sent once and the model designs
+    the pages against a shared design system. `images` is (bytes, media type) per page;
+    returns HTML per page in the same order, None for any page missing from the response or cut off
+    before its </html> (the last one, when the call ran out of tokens), so the caller regenerates it alone.
+    """
+    system_blocks = _system_blocks(None)
+    instruction = BATCH_INSTRUCTIONS.replace("These sketches", f"These {len(images)} sketches", 1)
+
+    client = _client()
+    model = getattr(settings, "CLAUDE_MODEL", "claude-haiku-4-5-20251001")
+    estimated_tokens = (
+        sum(estimate_image_tokens(len(image_bytes)) for image_bytes, _ in images)
+        + sum(estimate_text_tokens(block["text"]) for block in system_blocks)
+        + estimate_text_tokens(instruction)
+    )
+    tracker = get_latency_tracker("image_to_html_batch")
+
+    async def attempt(ticket):
+        resp = await tracker.timed(client.messages.create(
+            model=model,
+            max_tokens=batch_budget(len(images)),
+            system=system_blocks,
+            messages=[{"role": "user", "content": _batch_content(images, instruction)}],
+        ))
+        ticket.actual_tokens = rate_limited_input_tokens(getattr(resp, "usage", None))
+        usage.record("image_to_html_batch", getattr(resp, "usage", None), pages=len(images))
+        return resp
+
+    slot = partial(get_scheduler().slot, client_key, estimated_tokens, priority)
+    resp = await call_with_retry(attempt, RetryPolicy.from_settings(), tracker, slot)
+    text = _extract_text(resp)
+    if not text:
+        raise RuntimeError("Claude returned no text content.")
+    pages = split_batch_response(text, len(images))
+    for i, page in enumerate(pages):
+        if page is not None and not _HTML_CLOSE.search(page):
+            pages[i] = None
+    return [page and postprocess_page(page) for page in pages]
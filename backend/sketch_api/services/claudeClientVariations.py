@@ -1,13 +1,31 @@
+import asyncio
 import base64
+from functools import partial
 from typing import Optional, Sequence
 
 from django.conf import settings
-from anthropic import AsyncAnthropic
 import json
 import os
-import json
+import re
+
+from .claudeProvider import get_client
+from .claudeScheduler import get_scheduler, estimate_text_tokens
+from .claudeRetry import (CALL_SECONDS, CALLS, RETRIES, RetryPolicy, backoff_delay, call_with_retry,
+                          get_latency_tracker, is_retryable)
+from .claudeRouting import variation_budget
+from .claudeUsage import EPHEMERAL_CACHE, rate_limited_input_tokens, usage
+from .resultCache import LRUTTLCache, stable_hash
+from .jsonStream import JSONArrayStreamParser, parse_json_array_leniently
+from .metrics import callback
+from .tailwindCompile import postprocess_fragment, strip_compiled
 
 VARIATION_COUNT = 3  # default number of variations to generate
+#Call-type label for the streaming path, which can't go through call_with_retry: it retries on its own,
+#and only until the first variation has been yielded
+STREAM_CALL = "stream_component_variations"
+
+_ELEMENT_ID_ATTR = re.compile(r"""\s*data-element-id\s*=\s*("[^"]*"|'[^']*'|[^\s>]+)""", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
 
 def _load_anthropic_key_from_file(key_name: str) -> str:
     """Read API key from plaintext file defined in settings."""
@@ -29,9 +47,9 @@ def _extract_text(resp) -> str:
             parts.append(getattr(block, "text", "") or "")
     return "".join(parts).strip()
 
-def _variations_client() -> AsyncAnthropic:
+def _variations_api_key() -> str:
     """
-    Separate client for variations using second API key.
+    Separate API key for variations.
     Falls back to main key if variations key not configured.
     """
     try:
@@ -48,40 +66,23 @@ def _variations_client() -> AsyncAnthropic:
     
     if not key or key == "":
         raise RuntimeError("Anthropic API key for variations is missing.")
-    
-    return AsyncAnthropic(api_key=key)
+    return key
 
-async def generate_component_variations(
-    element_html: str,
-    element_type: str,
-    custom_prompt: Optional[str] = None,
-    count: int = VARIATION_COUNT
-) -> list[str]:
-    """
-    Generate design variations for a component using Claude.
-    
-    Args:
-        element_html: HTML of the selected element
-        element_type: Type like 'button', 'card', 'form', etc.
-        custom_prompt: Optional user prompt for specific requirements
-        count: Number of variations to generate (default: VARIATION_COUNT)
-    
-    Returns:
-        List of HTML strings representing variations
-    """
-    system_msg = (
-        "You are an expert UI/UX designer specializing in creating modern, "
-        "visually distinct design variations. You generate clean, accessible HTML "
-        "with Tailwind CSS that maintains functionality while exploring different visual styles."
-    )
 
-    if custom_prompt:
-        # Custom prompt mode
-        user_instruction = f"""Generate {count} design variations for this {element_type} based on the user's request:
-            Component:
-            {element_html}
+def _variations_client():
+    """Client for variations (AsyncAnthropic or a fake, depending on CLAUDE_PROVIDER)."""
+    return get_client(_variations_api_key)
 
-            User request: "{custom_prompt}"
+
+#Static prompt prefix shared by every variations call so it can be served from the prompt cache.
+#Per-request values (count, element type, component HTML, user request) go in the user message.
+SYSTEM_PROMPT = (
+    "You are an expert UI/UX designer specializing in creating modern, "
+    "visually distinct design variations. You generate clean, accessible HTML "
+    "with Tailwind CSS that maintains functionality while exploring different visual styles."
+)
+
+CUSTOM_GUIDELINES = """When the user gives a design request:
 
             Requirements:
             - Keep the same semantic HTML structure and tag names
@@ -92,15 +93,11 @@ async def generate_component_variations(
             - Make each variation visually distinct from others
             -Do not include any markdown fences
 
-            Return ONLY a JSON array of {count} HTML strings, nothing else. No markdown, no explanation.
+            Return ONLY a JSON array of HTML strings, nothing else. No markdown, no explanation.
             Example format: ["<button class='...'>...</button>", "<button class='...'>...</button>", "<button class='...'>...</button>"]
             """
-    else:
-        #Auto Generation Mode
-        user_instruction = f"""Generate {count} modern, visually distinct design variations for this {element_type}:
 
-            Component:
-            {element_html}
+AUTO_GUIDELINES = """When asked for design variations of a component:
 
             Focus on varying:
             - Color schemes (while maintaining good contrast and accessibility)
@@ -119,25 +116,129 @@ async def generate_component_variations(
             - Ensure accessibility (WCAG AA contrast ratios minimum)
             - Modern, professional appearance
 
-            Return ONLY a JSON array of {count} HTML strings, nothing else. No markdown, no explanation.
+            Return ONLY a JSON array of HTML strings, nothing else. No markdown, no explanation.
             Example format: ["<button class='...'>...</button>", "<button class='...'>...</button>", "<button class='...'>...</button>"]
             """
 
-    client = _variations_client()
+
+def _system_blocks(custom_prompt: Optional[str]) -> list[dict]:
+    """Persona + mode guidelines, with a cache breakpoint after the static text."""
+    guidelines = CUSTOM_GUIDELINES if custom_prompt else AUTO_GUIDELINES
+    return [
+        {"type": "text", "text": SYSTEM_PROMPT},
+        {"type": "text", "text": guidelines, "cache_control": EPHEMERAL_CACHE},
+    ]
+
+
+def _build_prompt(element_html: str, element_type: str, custom_prompt: Optional[str],
+                  count: int) -> tuple[list[dict], str]:
+    """Cached system blocks plus the per-request user message."""
+    if custom_prompt:
+        # Custom prompt mode
+        user_instruction = f"""Generate {count} design variations for this {element_type} based on the user's request:
+            Component:
+            {element_html}
+
+            User request: "{custom_prompt}"
+
+            Return ONLY a JSON array of {count} HTML strings."""
+    else:
+        #Auto Generation Mode
+        user_instruction = f"""Generate {count} modern, visually distinct design variations for this {element_type}:
+
+            Component:
+            {element_html}
+
+            Return ONLY a JSON array of {count} HTML strings."""
+    return _system_blocks(custom_prompt), user_instruction
+
+
+def _normalize_element_html(element_html: str) -> str:
+    """Drop per-page element ids and collapse whitespace so the same component hashes the same."""
+    html = _ELEMENT_ID_ATTR.sub("", element_html)
+    return _WHITESPACE.sub(" ", html).replace(" >", ">").strip()
+
+
+def variation_cache_key(element_html: str, element_type: str, custom_prompt: Optional[str], count: int,
+                        model: str) -> str:
+    return stable_hash(
+        _normalize_element_html(element_html),
+        element_type,
+        (custom_prompt or "").strip(),
+        count,
+        model,
+    )
+
+
+_variation_cache = LRUTTLCache(
+    max_entries=getattr(settings, "VARIATION_CACHE_MAX_ENTRIES", 512),
+    ttl=getattr(settings, "VARIATION_CACHE_TTL", 3600),
+)
+
+callback("variation_cache_lookups_total", "Variation result cache lookups by result.", "counter",
+         lambda: [(("hit",), _variation_cache.hits), (("miss",), _variation_cache.misses)], ("result",))
+callback("variation_cache_entries", "Entries in the variation result cache.", "gauge", lambda: len(_variation_cache))
+
+
+async def generate_component_variations(
+    element_html: str,
+    element_type: str,
+    custom_prompt: Optional[str] = None,
+    count: int = VARIATION_COUNT,
+    client_key: str = "anonymous",
+) -> list[str]:
+    """
+    Generate design variations for a component using Claude.
+    
+    Args:
+        element_html: HTML of the selected element
+        element_type: Type like 'button', 'card', 'form', etc.
+        custom_prompt: Optional user prompt for specific requirements
+        count: Number of variations to generate (default: VARIATION_COUNT)
+        client_key: User or collab room the call is queued under in the shared scheduler
+    
+    Returns:
+        List of HTML strings representing variations
+    """
     model = getattr(settings, "CLAUDE_MODEL", "claude-sonnet-4-20250514")
+    # A component picked from a compiled page or an applied variation carries a stylesheet the model doesn't need
+    element_html = strip_compiled(element_html)
+
+    # Teammates asking for variations of the same component share one Claude call
+    cache_key = variation_cache_key(element_html, element_type, custom_prompt, count, model)
+    cached = _variation_cache.get(cache_key)
+    if cached is not None:
+        return list(cached)
+
+    system_blocks, user_instruction = _build_prompt(element_html, element_type, custom_prompt, count)
+
+    client = _variations_client()
     try:
-        resp = await client.messages.create(
-            model=model,
-            max_tokens=4000,
-            system=system_msg,
-            messages=[
-                {
-                    "role": "user",
-                    "content": user_instruction,
-                }
-            ],
+        estimated_tokens = (
+            sum(estimate_text_tokens(block["text"]) for block in system_blocks)
+            + estimate_text_tokens(user_instruction)
         )
-        
+        tracker = get_latency_tracker("generate_component_variations")
+
+        async def attempt(ticket):
+            resp = await tracker.timed(client.messages.create(
+                model=model,
+                max_tokens=variation_budget(element_html, count),
+                system=system_blocks,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": user_instruction,
+                    }
+                ],
+            ))
+            ticket.actual_tokens = rate_limited_input_tokens(getattr(resp, "usage", None))
+            usage.record("generate_component_variations", getattr(resp, "usage", None))
+            return resp
+
+        slot = partial(get_scheduler().slot, client_key, estimated_tokens)
+        resp = await call_with_retry(attempt, RetryPolicy.from_settings(), tracker, slot)
+
         text = _extract_text(resp)
         if not text:
             raise RuntimeError("Claude returned no text content for variations.")
@@ -154,11 +255,21 @@ async def generate_component_variations(
             text = text[:-3]
         text = text.strip()
 
-        # Parse JSON array
-        variations = json.loads(text)
-        
+        # Parse JSON array; keep the well-formed variations if the array itself is damaged
+        try:
+            variations = json.loads(text)
+            damaged = False
+        except json.JSONDecodeError:
+            variations = [v for v in parse_json_array_leniently(text) if isinstance(v, str)]
+            if not variations:
+                raise
+            damaged = True
+
         if not isinstance(variations, list):
             raise RuntimeError("Claude did not return a JSON array.")
+
+        # Only a clean, full set is worth sharing; a padded or salvaged one is regenerated next time
+        complete = not damaged and len(variations) >= count
         
         # Ensure we have the right count
         if len(variations) < count:
@@ -167,7 +278,10 @@ async def generate_component_variations(
                 variations.append(variations[0] if variations else element_html)
         elif len(variations) > count:
             variations = variations[:count]
-        
+
+        variations = [postprocess_fragment(variation) for variation in variations]
+        if complete:
+            _variation_cache.set(cache_key, tuple(variations))
         return variations
     
     except json.JSONDecodeError as e:
@@ -175,4 +289,111 @@ async def generate_component_variations(
     except Exception as e:
         raise RuntimeError(f"Error generating variations: {e}")
 
-    
\ No newline at end of file
+    
+
+
+async def stream_component_variations(
+    element_html: str,
+    element_type: str,
+    custom_prompt: Optional[str] = None,
+    count: int = VARIATION_COUNT,
+    client_key: str = "anonymous",
+):
+    """
+    Async generator version of generate_component_variations.
+
+    Streams the model's output and yields each variation's HTML as soon as its array
+    element is complete, instead of waiting for (and json-parsing) the whole response.
+    Always yields exactly `count` strings, padding like the non-streaming version.
+    Each attempt runs under the RetryPolicy's attempt timeout and the call under its deadline;
+    transient errors are retried only while nothing has been yielded yet.
+    """
+    model = getattr(settings, "CLAUDE_MODEL", "claude-sonnet-4-20250514")
+    element_html = strip_compiled(element_html)
+
+    cache_key = variation_cache_key(element_html, element_type, custom_prompt, count, model)
+    cached = _variation_cache.get(cache_key)
+    if cached is not None:
+        for variation in cached:
+            yield variation
+        return
+
+    system_blocks, user_instruction = _build_prompt(element_html, element_type, custom_prompt, count)
+    estimated_tokens = (
+        sum(estimate_text_tokens(block["text"]) for block in system_blocks)
+        + estimate_text_tokens(user_instruction)
+    )
+    client = _variations_client()
+    variations: list[str] = []
+
+    scheduler = get_scheduler()
+    policy = RetryPolicy.from_settings()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + policy.deadline
+    attempt = 0
+    outcome = "error"
+    try:
+        while True:
+            parser = JSONArrayStreamParser()
+            try:
+                #Waiting for a slot counts against the deadline, not the attempt timeout
+                async with asyncio.timeout_at(deadline):
+                    ticket = await scheduler.acquire(client_key, estimated_tokens)
+                try:
+                    async with asyncio.timeout_at(min(deadline, loop.time() + policy.attempt_timeout)) as timer:
+                        async with client.messages.stream(
+                            model=model,
+                            max_tokens=variation_budget(element_html, count),
+                            system=system_blocks,
+                            messages=[{"role": "user", "content": user_instruction}],
+                        ) as stream:
+                            async for text in stream.text_stream:
+                                for item in parser.feed(text):
+                                    if isinstance(item, str) and len(variations) < count:
+                                        item = postprocess_fragment(item)
+                                        variations.append(item)
+                                        #The timeout may only fire in this generator, not in the reader's code
+                                        expires = timer.when()
+                                        timer.reschedule(None)
+                                        yield item
+                                        timer.reschedule(expires)
+                            final = await stream.get_final_message()
+                    ticket.actual_tokens = rate_limited_input_tokens(getattr(final, "usage", None))
+                    usage.record("generate_component_variations", getattr(final, "usage", None))
+                finally:
+                    scheduler.release(ticket)
+                outcome = "ok"
+                break
+            except Exception as exc:
+                if isinstance(exc, TimeoutError) and loop.time() >= deadline:
+                    outcome = "deadline"
+                #Once a variation is out the call can't be transparently replayed
+                if variations or not is_retryable(exc) or attempt >= policy.max_retries:
+                    raise
+                delay = backoff_delay(attempt, policy, exc)
+                if loop.time() + delay >= deadline:
+                    raise
+                attempt += 1
+                RETRIES.labels(STREAM_CALL).inc()
+                await asyncio.sleep(delay)
+    finally:
+        CALL_SECONDS.labels(STREAM_CALL).observe(loop.time() - started)
+        CALLS.labels(STREAM_CALL, outcome).inc()
+
+    for item in parser.close():
+        if isinstance(item, str) and len(variations) < count:
+            item = postprocess_fragment(item)
+            variations.append(item)
+            yield item
+
+    if not variations:
+        raise RuntimeError("Claude returned no parseable variations.")
+
+    complete = len(variations) >= count and parser.errors == 0
+    while len(variations) < count:
+        variations.append(variations[0])
+        yield variations[0]
+
+    if complete:
+        _variation_cache.set(cache_key, tuple(variations))
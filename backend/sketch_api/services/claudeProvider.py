@@ -0,0 +1,54 @@
+# services/claudeProvider.py
+#Chooses what the Claude service modules talk to. Everything downstream only uses
+#client.messages.create(...) / client.messages.stream(...), so any object with that shape works.
+#  CLAUDE_PROVIDER=anthropic  real API (or the local fake server when CLAUDE_BASE_URL is set)
+#  CLAUDE_PROVIDER=fake       in-process deterministic fake, no network at all
+import threading
+from typing import Callable, Optional
+
+from django.conf import settings
+from anthropic import AsyncAnthropic
+
+from .fakeClaude import FakeAsyncClient, FakeModel, FakeModelConfig
+
+ANTHROPIC = "anthropic"
+FAKE = "fake"
+
+#Any non-empty key is accepted by the local fake server
+LOCAL_SERVER_KEY = "local-fake-key"
+
+_fake_model: Optional[FakeModel] = None
+_fake_lock = threading.Lock()
+
+
+def _fake_client() -> FakeAsyncClient:
+    """One shared FakeModel per process, so prompt-cache accounting behaves like the real thing."""
+    global _fake_model
+    with _fake_lock:
+        if _fake_model is None:
+            _fake_model = FakeModel(FakeModelConfig.from_env())
+    return FakeAsyncClient(_fake_model)
+
+
+def get_client(load_key: Callable[[], str]):
+    """
+    Client for the configured provider. `load_key` returns the API key or raises RuntimeError;
+    it is only called for the real API, and a missing key is fine when CLAUDE_BASE_URL points
+    at the local fake server.
+    """
+    provider = getattr(settings, "CLAUDE_PROVIDER", ANTHROPIC)
+    if provider == FAKE:
+        return _fake_client()
+    if provider != ANTHROPIC:
+        raise RuntimeError(f"Unknown CLAUDE_PROVIDER '{provider}'.")
+
+    base_url = getattr(settings, "CLAUDE_BASE_URL", None) or None
+    try:
+        key = load_key()
+    except RuntimeError:
+        if not base_url:
+            raise
+        key = LOCAL_SERVER_KEY
+
+    #Retries are handled by claudeRetry so each attempt is re-admitted by the scheduler
+    return AsyncAnthropic(api_key=key, base_url=base_url, max_retries=0)
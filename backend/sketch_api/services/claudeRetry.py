@@ -0,0 +1,238 @@
+# services/claudeRetry.py
+#Deadlines, retries and hedged requests around a single logical Claude call.
+#The SDK's own retries are disabled (max_retries=0) so every attempt also goes back through the
+#shared scheduler instead of hammering the API from inside a held slot.
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from contextlib import AsyncExitStack
+from functools import partial
+from typing import AsyncContextManager, Awaitable, Callable, Optional, TypeVar
+
+from django.conf import settings
+from anthropic import APIConnectionError, APIStatusError, InternalServerError, RateLimitError
+
+from .metrics import SLOW_BUCKETS, counter, histogram
+
+T = TypeVar("T")
+
+#529 "overloaded" is a 5xx and also surfaces as InternalServerError in the SDK
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class DeadlineExceeded(RuntimeError):
+    """The call's overall deadline passed before any attempt succeeded."""
+
+
+CALL_SECONDS = histogram("claude_call_seconds", "Claude call latency including retries, by call type.",
+                         ("call",), SLOW_BUCKETS)
+CALLS = counter("claude_calls_total", "Claude calls by call type and outcome (ok, error, deadline).",
+                ("call", "outcome"))
+RETRIES = counter("claude_retries_total", "Claude attempts retried after a transient error.", ("call",))
+
+
+class RetryPolicy:
+    """Per-call deadline, retry and hedging configuration."""
+
+    def __init__(
+        self,
+        deadline: float = 300.0,
+        attempt_timeout: float = 180.0,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        hedge: bool = False,
+        hedge_percentile: float = 0.95,
+        hedge_min_samples: int = 20,
+    ):
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+    @classmethod
+    def from_settings(cls) -> "RetryPolicy":
+        return cls(
+            deadline=getattr(settings, "CLAUDE_CALL_DEADLINE", 300.0),
+            attempt_timeout=getattr(settings, "CLAUDE_ATTEMPT_TIMEOUT", 180.0),
+            max_retries=getattr(settings, "CLAUDE_MAX_RETRIES", 3),
+            base_delay=getattr(settings, "CLAUDE_RETRY_BASE_DELAY", 1.0),
+            max_delay=getattr(settings, "CLAUDE_RETRY_MAX_DELAY", 30.0),
+            hedge=getattr(settings, "CLAUDE_HEDGE_ENABLED", False),
+            hedge_percentile=getattr(settings, "CLAUDE_HEDGE_PERCENTILE", 0.95),
+        )
+
+
+class LatencyTracker:
+    """Sliding window of successful call latencies, used to pick the hedging threshold."""
+
+    def __init__(self, window: int = 200, name: str = "unknown"):
+        self.name = name
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(p * len(ordered)))
+        return ordered[index]
+
+    async def timed(self, awaitable: Awaitable[T]) -> T:
+        started = time.monotonic()
+        result = await awaitable
+        self.record(time.monotonic() - started)
+        return result
+
+
+_trackers: dict[str, LatencyTracker] = {}
+
+
+def get_latency_tracker(name: str) -> LatencyTracker:
+    """One tracker per call type: page generation and variations have very different latencies."""
+    tracker = _trackers.get(name)
+    if tracker is None:
+        tracker = _trackers.setdefault(name, LatencyTracker(name=name))
+    return tracker
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (RateLimitError, InternalServerError, APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code in RETRYABLE_STATUS
+    return False
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Server-requested wait in seconds, from retry-after-ms or retry-after headers."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def backoff_delay(attempt: int, policy: RetryPolicy, exc: Optional[BaseException] = None,
+                  rng: random.Random = random) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's retry-after."""
+    ceiling = min(policy.max_delay, policy.base_delay * (2 ** attempt))
+    delay = rng.uniform(0, ceiling)
+    requested = retry_after(exc) if exc is not None else None
+    if requested is not None:
+        #Small jitter on top so a burst of 429s doesn't come back in lockstep
+        delay = max(delay, requested + rng.uniform(0, policy.base_delay / 2))
+    return delay
+
+
+async def _first_success(tasks: set[asyncio.Task]):
+    """Return the first successful result; raise the last error if every task fails."""
+    error: Optional[BaseException] = None
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                return task.result()
+            error = task.exception()
+    raise error
+
+
+async def _attempt(make_call: Callable[..., Awaitable[T]], deadline: float, policy: RetryPolicy,
+                   tracker: Optional[LatencyTracker], slot: Optional[Callable[..., AsyncContextManager]]) -> T:
+    hedge_after = None
+    if policy.hedge and tracker is not None:
+        hedge_after = tracker.percentile(policy.hedge_percentile, policy.hedge_min_samples)
+
+    async with AsyncExitStack() as held:
+        if slot is None:
+            start = make_call
+        else:
+            #Queueing for the slot is bounded by the deadline only; the attempt timeout and the hedge
+            #threshold (measured on the API call alone) start once the call can actually go out
+            async with asyncio.timeout_at(deadline):
+                ticket = await held.enter_async_context(slot())
+            start = partial(make_call, ticket)
+        loop = asyncio.get_running_loop()
+        timeout = min(policy.attempt_timeout, deadline - loop.time())
+        tasks = {asyncio.ensure_future(start())}
+        try:
+            async with asyncio.timeout(timeout):
+                if hedge_after is not None and hedge_after < timeout:
+                    done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                    if not done:
+                        #Slower than p95: race a duplicate and keep whichever answers first, but only
+                        #if it doesn't have to queue behind other callers for a slot
+                        if slot is None:
+                            tasks.add(asyncio.ensure_future(make_call()))
+                        else:
+                            ticket = await held.enter_async_context(slot(wait=False))
+                            if ticket is not None:
+                                tasks.add(asyncio.ensure_future(make_call(ticket)))
+                return await _first_success(tasks)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            #Retrieve exceptions from losers so asyncio doesn't log them as unhandled
+            for task in tasks:
+                if task.done() and not task.cancelled():
+                    task.exception()
+
+
+async def call_with_retry(make_call: Callable[..., Awaitable[T]], policy: Optional[RetryPolicy] = None,
+                          tracker: Optional[LatencyTracker] = None,
+                          slot: Optional[Callable[..., AsyncContextManager]] = None) -> T:
+    """
+    Run `make_call` (a fresh coroutine per attempt) under the policy's deadline, retrying
+    transient errors (429/5xx/529, connection errors, timeouts) with jittered backoff.
+    With `slot` (e.g. a bound ClaudeScheduler.slot), each attempt first waits for a slot and
+    `make_call` gets its ticket; only the call itself counts against the attempt timeout.
+    """
+    policy = policy or RetryPolicy.from_settings()
+    call = tracker.name if tracker is not None else "unknown"
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + policy.deadline
+    attempt = 0
+    outcome = "error"
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                outcome = "deadline"
+                raise DeadlineExceeded(f"Claude call exceeded its {policy.deadline:.0f}s deadline.")
+            try:
+                result = await _attempt(make_call, deadline, policy, tracker, slot)
+                outcome = "ok"
+                return result
+            except Exception as exc:
+                if not is_retryable(exc) or attempt >= policy.max_retries:
+                    raise
+                delay = backoff_delay(attempt, policy, exc)
+                if loop.time() + delay >= deadline:
+                    raise
+                attempt += 1
+                RETRIES.labels(call).inc()
+                await asyncio.sleep(delay)
+    finally:
+        CALL_SECONDS.labels(call).observe(loop.time() - started)
+        CALLS.labels(call, outcome).inc()
@@ -0,0 +1,174 @@
+# services/claudeRouting.py
+#Picks the model tier and output-token budget for a page from how much is drawn on its sketch.
+#A login form and a dense dashboard used to get the same model and the same 15000-token budget;
+#now a sketch is measured (ink density, separate shapes, size) and sent to the cheapest tier whose
+#limits it fits. A page that runs out of budget is retried once on the next tier up.
+import io
+from typing import Optional, Sequence
+
+import numpy as np
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+
+from .claudeScheduler import estimate_text_tokens
+from .metrics import SLOW_BUCKETS, counter, histogram
+
+#Generation ends at the close of the document instead of whenever the model stops talking.
+#The API leaves the matched sequence out of the text, so it is put back afterwards.
+PAGE_STOP_SEQUENCES = ["</html>"]
+
+#Sketches are measured on a thumbnail this size; shapes much smaller than a cell merge or vanish
+MEASURE_EDGE = 256
+#Thumbnail cells darker than this hold some ink
+INK_LEVEL = 250
+
+#Output budget for design variations: room for each variation at twice the element's size, plus JSON
+VARIATION_TOKENS_PER_VARIATION = 200
+VARIATION_MIN_TOKENS = 1000
+
+#Outcomes: complete, truncated (hit max_tokens on the top tier) or escalated (retried a tier up)
+ROUTED = counter("claude_routed_pages_total", "Page generations by routing tier and outcome.", ("tier", "outcome"))
+TIER_SECONDS = histogram("claude_tier_seconds", "Page generation latency by routing tier, retries included.",
+                         ("tier",), SLOW_BUCKETS)
+TIER_OUTPUT_TOKENS = histogram("claude_tier_output_tokens", "Output tokens per page by routing tier.", ("tier",),
+                               (250, 500, 1000, 2000, 4000, 8000, 12000, 16000))
+
+
+class SketchComplexity:
+    """How busy a sketch is: share of the page with ink, separate shapes, and size in pixels."""
+
+    def __init__(self, ink: float, components: int, pixels: int):
+        self.ink = ink
+        self.components = components
+        self.pixels = pixels
+
+    def to_dict(self) -> dict:
+        return {"ink": round(self.ink, 4), "components": self.components, "pixels": self.pixels}
+
+
+class Tier:
+    """A model and output budget, for sketches within all of the tier's limits (None = no limit)."""
+
+    def __init__(self, name: str, model: str, max_tokens: int, max_components: Optional[int] = None,
+                 max_ink: Optional[float] = None, max_pixels: Optional[int] = None):
+        self.name = name
+        self.model = model
+        self.max_tokens = max_tokens
+        self.max_components = max_components
+        self.max_ink = max_ink
+        self.max_pixels = max_pixels
+
+    def fits(self, complexity: SketchComplexity) -> bool:
+        return ((self.max_components is None or complexity.components <= self.max_components)
+                and (self.max_ink is None or complexity.ink <= self.max_ink)
+                and (self.max_pixels is None or complexity.pixels <= self.max_pixels))
+
+
+def count_components(mask: np.ndarray) -> int:
+    """8-connected regions of True in a 2D mask, labelled run by run with a union-find."""
+    parent: list[int] = []
+
+    def find(label: int) -> int:
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    previous: list[tuple[int, int, int]] = []
+    for row in mask:
+        edges = np.diff(np.concatenate(([0], row.astype(np.int8), [0])))
+        runs = []
+        j = 0
+        for start, end in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+            #Runs on the previous row touch this one if they overlap it or meet it diagonally
+            while j < len(previous) and previous[j][1] < start:
+                j += 1
+            label = None
+            k = j
+            while k < len(previous) and previous[k][0] <= end:
+                other = find(previous[k][2])
+                if label is None:
+                    label = other
+                elif other != label:
+                    parent[other] = label
+                k += 1
+            if label is None:
+                label = len(parent)
+                parent.append(label)
+            runs.append((start, end, label))
+        previous = runs
+    return sum(1 for label in range(len(parent)) if parent[label] == label)
+
+
+def measure_complexity(image_bytes: bytes) -> Optional[SketchComplexity]:
+    """None for anything Pillow can't read."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as opened:
+            opened.draft("L", (MEASURE_EDGE, MEASURE_EDGE))
+            img = opened.convert("L")
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError):
+        return None
+    pixels = img.width * img.height
+    scale = min(1.0, MEASURE_EDGE / max(img.width, img.height))
+    #BOX keeps any cell a thin line passes through dark, so outlines stay connected
+    thumb = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.Resampling.BOX)
+    mask = np.asarray(thumb) < INK_LEVEL
+    return SketchComplexity(float(mask.mean()), count_components(mask), pixels)
+
+
+def tiers() -> list[Tier]:
+    """CLAUDE_ROUTING_TIERS, cheapest first; a single tier on the default model when routing is off."""
+    model = getattr(settings, "CLAUDE_MODEL", "claude-haiku-4-5-20251001")
+    if not getattr(settings, "CLAUDE_ROUTING_ENABLED", True):
+        return [Tier("default", model, getattr(settings, "CLAUDE_PAGE_MAX_TOKENS", 15000))]
+    configured = getattr(settings, "CLAUDE_ROUTING_TIERS", None) or [{"name": "default", "max_tokens": 15000}]
+    return [Tier(**dict({"model": model}, **tier)) for tier in configured]
+
+
+def route_page(complexity: Optional[SketchComplexity], available: Optional[Sequence[Tier]] = None) -> Tier:
+    """Cheapest tier the sketch fits; the top tier for sketches that couldn't be measured."""
+    available = list(available or tiers())
+    if complexity is not None:
+        for tier in available:
+            if tier.fits(complexity):
+                return tier
+    return available[-1]
+
+
+def next_tier(tier: Tier, available: Optional[Sequence[Tier]] = None) -> Optional[Tier]:
+    """The tier above, if it gives more room; None on the top tier."""
+    available = list(available or tiers())
+    names = [candidate.name for candidate in available]
+    if tier.name not in names:
+        return None
+    for candidate in available[names.index(tier.name) + 1:]:
+        if candidate.max_tokens > tier.max_tokens or candidate.model != tier.model:
+            return candidate
+    return None
+
+
+def finish_page(text: str, resp) -> str:
+    """Close the document again when generation ended on the stop sequence."""
+    if getattr(resp, "stop_reason", None) == "stop_sequence":
+        return text + (getattr(resp, "stop_sequence", None) or PAGE_STOP_SEQUENCES[0])
+    return text
+
+
+def batch_budget(pages: int) -> int:
+    """Output tokens for a batched call: CLAUDE_BATCH_PAGE_MAX_TOKENS per page, capped at CLAUDE_BATCH_MAX_TOKENS."""
+    per_page = getattr(settings, "CLAUDE_BATCH_PAGE_MAX_TOKENS", 5000)
+    return min(getattr(settings, "CLAUDE_BATCH_MAX_TOKENS", 20000), per_page * max(1, pages))
+
+
+def batch_size() -> int:
+    """Pages per batched call: CLAUDE_BATCH_MAX_PAGES, fewer if the cap can't give each its per-page budget."""
+    per_page = max(1, getattr(settings, "CLAUDE_BATCH_PAGE_MAX_TOKENS", 5000))
+    fits = getattr(settings, "CLAUDE_BATCH_MAX_TOKENS", 20000) // per_page
+    return max(1, min(getattr(settings, "CLAUDE_BATCH_MAX_PAGES", 4), fits))
+
+
+def variation_budget(element_html: str, count: int) -> int:
+    """Output tokens for `count` variations of an element, capped at CLAUDE_VARIATION_MAX_TOKENS."""
+    needed = count * (2 * estimate_text_tokens(element_html) + VARIATION_TOKENS_PER_VARIATION)
+    cap = getattr(settings, "CLAUDE_VARIATION_MAX_TOKENS", 4000)
+    return min(cap, max(VARIATION_MIN_TOKENS, needed))
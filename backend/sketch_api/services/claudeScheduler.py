@@ -0,0 +1,274 @@
+# services/claudeScheduler.py
+#Process-wide admission control for every outbound Claude call.
+#Views run each request on its own event loop (see views.run_async), so the scheduler state is
+#guarded by a thread lock and waiters are woken on their own loop with call_soon_threadsafe.
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+from django.conf import settings
+
+from .metrics import callback
+
+#Anthropic downsizes images to ~1.15 megapixels, which costs roughly 1600 input tokens at most
+MAX_IMAGE_TOKENS = 1600
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Rough input-token estimate for prompt text (~4 characters per token)."""
+    return max(1, len(text or "") // 4)
+
+
+def estimate_image_tokens(num_bytes: int) -> int:
+    """Upper-bound token estimate for an image; the model resizes large images anyway."""
+    return min(MAX_IMAGE_TOKENS, max(85, num_bytes // 100))
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        self._refill(now)
+        #A single request larger than the bucket would otherwise never be admitted
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> float:
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        return amount
+
+    def adjust(self, delta: float) -> None:
+        """Credit (positive) or debit (negative) tokens once the real usage is known."""
+        self.tokens = min(self.capacity, self.tokens + delta)
+
+
+class _Waiter:
+    __slots__ = ("key", "tokens", "priority", "loop", "future", "granted", "charged", "actual_tokens")
+
+    def __init__(self, key: str, tokens: int, priority: bool, loop: asyncio.AbstractEventLoop):
+        self.key = key
+        self.tokens = tokens
+        self.priority = priority
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+        self.charged = 0.0
+        #Callers may set this after the call returns so the token bucket reflects real usage
+        self.actual_tokens: Optional[int] = None
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class ClaudeScheduler:
+    """
+    Bounded-concurrency scheduler with request and token rate limits.
+
+    - At most `max_concurrency` calls are in flight across the whole process.
+    - `requests_per_minute` / `tokens_per_minute` are enforced with token buckets (0 disables).
+    - Waiters are served round-robin per key (user or collab room) so one large batch
+      cannot starve everybody else; priority waiters (single-page requests) go first.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._clock = clock
+        now = clock()
+        self._requests = TokenBucket(requests_per_minute, requests_per_minute / 60.0, now) if requests_per_minute > 0 else None
+        self._tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0, now) if tokens_per_minute > 0 else None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._priority: deque[_Waiter] = deque()
+        self._queues: "OrderedDict[str, deque[_Waiter]]" = OrderedDict()
+        self._blocked_until: Optional[float] = None
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queued(self) -> int:
+        with self._lock:
+            return len(self._priority) + sum(len(q) for q in self._queues.values())
+
+    # ---- queue bookkeeping (lock held) ----
+
+    def _enqueue_locked(self, waiter: _Waiter) -> None:
+        if waiter.priority:
+            self._priority.append(waiter)
+        else:
+            self._queues.setdefault(waiter.key, deque()).append(waiter)
+
+    def _peek_locked(self) -> Optional[_Waiter]:
+        if self._priority:
+            return self._priority[0]
+        for queue in self._queues.values():
+            return queue[0]
+        return None
+
+    def _pop_locked(self, waiter: _Waiter) -> None:
+        if self._priority and self._priority[0] is waiter:
+            self._priority.popleft()
+            return
+        queue = self._queues.pop(waiter.key)
+        queue.popleft()
+        if queue:
+            #Rotate the key to the back so the next key gets the next slot
+            self._queues[waiter.key] = queue
+
+    def _remove_locked(self, waiter: _Waiter) -> None:
+        if waiter.priority:
+            if waiter in self._priority:
+                self._priority.remove(waiter)
+            return
+        queue = self._queues.get(waiter.key)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.key]
+
+    def _bucket_wait_locked(self, waiter: _Waiter, now: float) -> float:
+        wait = 0.0
+        if self._requests is not None:
+            wait = max(wait, self._requests.wait_time(1, now))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.wait_time(waiter.tokens, now))
+        return wait
+
+    def _dispatch_locked(self) -> None:
+        self._blocked_until = None
+        now = self._clock()
+        while self._in_flight < self.max_concurrency:
+            waiter = self._peek_locked()
+            if waiter is None:
+                return
+            wait = self._bucket_wait_locked(waiter, now)
+            if wait > 0:
+                self._blocked_until = now + wait
+                return
+            self._pop_locked(waiter)
+            self._grant_locked(waiter)
+            waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+
+    def _grant_locked(self, waiter: _Waiter) -> None:
+        if self._requests is not None:
+            self._requests.take(1)
+        if self._tokens is not None:
+            waiter.charged = self._tokens.take(waiter.tokens)
+        self._in_flight += 1
+        waiter.granted = True
+
+    def _release_locked(self, waiter: _Waiter) -> None:
+        self._in_flight -= 1
+        if self._tokens is not None and waiter.actual_tokens is not None:
+            self._tokens.adjust(waiter.charged - waiter.actual_tokens)
+        self._dispatch_locked()
+
+    # ---- public API ----
+
+    async def acquire(self, key: str = "anonymous", estimated_tokens: int = 0, priority: bool = False) -> _Waiter:
+        """Wait for a slot; the returned ticket must be passed to release()."""
+        waiter = _Waiter(key or "anonymous", max(0, int(estimated_tokens)), priority, asyncio.get_running_loop())
+        with self._lock:
+            self._enqueue_locked(waiter)
+            self._dispatch_locked()
+        try:
+            while not waiter.future.done():
+                with self._lock:
+                    delay = None
+                    if self._blocked_until is not None and not waiter.granted:
+                        delay = max(0.001, self._blocked_until - self._clock())
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), delay)
+                except asyncio.TimeoutError:
+                    #Rate-limit window refilled; whoever wakes first re-runs dispatch for everyone
+                    with self._lock:
+                        self._dispatch_locked()
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self._release_locked(waiter)
+                else:
+                    self._remove_locked(waiter)
+            raise
+        return waiter
+
+    def try_acquire(self, key: str = "anonymous", estimated_tokens: int = 0, priority: bool = False) -> Optional[_Waiter]:
+        """A slot only if one is free right now and nobody is queued for it; never waits."""
+        waiter = _Waiter(key or "anonymous", max(0, int(estimated_tokens)), priority, asyncio.get_running_loop())
+        with self._lock:
+            if (self._in_flight >= self.max_concurrency or self._peek_locked() is not None
+                    or self._bucket_wait_locked(waiter, self._clock()) > 0):
+                return None
+            self._grant_locked(waiter)
+        return waiter
+
+    def release(self, ticket: _Waiter) -> None:
+        with self._lock:
+            self._release_locked(ticket)
+
+    @asynccontextmanager
+    async def slot(self, key: str = "anonymous", estimated_tokens: int = 0, priority: bool = False,
+                   wait: bool = True):
+        """Hold a slot for the block; with wait=False the ticket is None when no slot is free right now."""
+        if wait:
+            ticket = await self.acquire(key, estimated_tokens, priority)
+        else:
+            ticket = self.try_acquire(key, estimated_tokens, priority)
+            if ticket is None:
+                yield None
+                return
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+
+_scheduler: Optional[ClaudeScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> ClaudeScheduler:
+    """Process-wide scheduler configured from CLAUDE_MAX_CONCURRENCY / CLAUDE_*_PER_MINUTE settings."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ClaudeScheduler(
+                    max_concurrency=getattr(settings, "CLAUDE_MAX_CONCURRENCY", 8),
+                    requests_per_minute=getattr(settings, "CLAUDE_REQUESTS_PER_MINUTE", 0),
+                    tokens_per_minute=getattr(settings, "CLAUDE_INPUT_TOKENS_PER_MINUTE", 0),
+                )
+    return _scheduler
+
+
+callback("claude_in_flight", "Claude calls currently holding a scheduler slot.", "gauge",
+         lambda: _scheduler.in_flight if _scheduler is not None else 0)
+callback("claude_queued", "Claude calls waiting for a scheduler slot.", "gauge",
+         lambda: _scheduler.queued if _scheduler is not None else 0)
@@ -0,0 +1,102 @@
+# services/claudeUsage.py
+#Token accounting for Claude calls, including prompt-cache hits and what they saved.
+import threading
+
+from .metrics import callback
+
+#Cache reads are billed at 10% of the normal input price, cache writes at 125%
+CACHE_READ_COST = 0.1
+CACHE_WRITE_COST = 1.25
+
+#Marks the end of a cacheable prompt prefix (tools -> system -> messages order)
+EPHEMERAL_CACHE = {"type": "ephemeral"}
+
+
+def rate_limited_input_tokens(usage):
+    """Input tokens that count against the per-minute limit; cache reads don't."""
+    if usage is None:
+        return None
+    return (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+
+
+class _CallUsage:
+    __slots__ = ("calls", "pages", "input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens",
+                 "cache_hits", "cache_misses")
+
+    def __init__(self):
+        self.calls = 0
+        self.pages = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def to_dict(self) -> dict:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        #Input-token equivalents saved by reading the prefix from cache instead of resending it
+        data["input_tokens_saved"] = int(self.cache_read_tokens * (1 - CACHE_READ_COST)
+                                         - self.cache_write_tokens * (CACHE_WRITE_COST - 1))
+        #Lets batched and per-page generation be compared on equal terms
+        if self.pages:
+            data["input_tokens_per_page"] = (self.input_tokens + self.cache_read_tokens
+                                             + self.cache_write_tokens) / self.pages
+            data["output_tokens_per_page"] = self.output_tokens / self.pages
+        return data
+
+
+class UsageRecorder:
+    """Per-call-type running totals of the `usage` block Claude returns."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_call: dict[str, _CallUsage] = {}
+
+    def record(self, call: str, usage, pages: int = 0) -> None:
+        """`pages` is how many generated pages the call produced, for per-page comparisons."""
+        if usage is None:
+            return
+        cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+        with self._lock:
+            totals = self._by_call.setdefault(call, _CallUsage())
+            totals.calls += 1
+            totals.pages += pages
+            totals.input_tokens += getattr(usage, "input_tokens", 0) or 0
+            totals.output_tokens += getattr(usage, "output_tokens", 0) or 0
+            totals.cache_read_tokens += cache_read
+            totals.cache_write_tokens += cache_write
+            if cache_read:
+                totals.cache_hits += 1
+            else:
+                totals.cache_misses += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {call: totals.to_dict() for call, totals in self._by_call.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._by_call.clear()
+
+
+usage = UsageRecorder()
+
+
+def _token_series():
+    for call, totals in usage.snapshot().items():
+        for kind in ("input", "output", "cache_read", "cache_write"):
+            yield (call, kind), totals[f"{kind}_tokens"]
+
+
+def _prompt_cache_series():
+    for call, totals in usage.snapshot().items():
+        yield (call, "hit"), totals["cache_hits"]
+        yield (call, "miss"), totals["cache_misses"]
+
+
+callback("claude_tokens_total", "Tokens reported by Claude, by call type and kind.", "counter",
+         lambda: list(_token_series()), ("call", "kind"))
+callback("claude_prompt_cache_total", "Claude calls that did (hit) or did not (miss) read the prompt cache.",
+         "counter", lambda: list(_prompt_cache_series()), ("call", "result"))
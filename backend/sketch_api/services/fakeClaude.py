@@ -0,0 +1,274 @@
+# services/fakeClaude.py
+#Deterministic stand-in for the Claude Messages API, for load and capacity testing without spending
+#money or needing the network. The same FakeModel backs an in-process client (CLAUDE_PROVIDER=fake)
+#and the local HTTP server in fakeClaudeServer.py (real SDK + CLAUDE_BASE_URL).
+#No Django imports here so the server can run on its own.
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import uuid
+from types import SimpleNamespace
+from typing import Optional
+
+#Rough image cost (Anthropic caps images at ~1600 tokens after resizing)
+IMAGE_TOKENS = 1600
+CHARS_PER_TOKEN = 4
+
+_COUNT = re.compile(r"JSON array of (\d+)")
+_SKETCH_COUNT = re.compile(r"These (\d+) sketches")
+
+
+class FakeModelConfig:
+    """
+    Latency is lognormal: the median time to first token is `latency_ms`, with `latency_sigma`
+    controlling the tail (0 = constant). Output then streams at `tokens_per_second`.
+    """
+
+    def __init__(self, latency_ms: float = 800.0, latency_sigma: float = 0.5, tokens_per_second: float = 400.0,
+                 rate_limit_probability: float = 0.0, retry_after: float = 1.0, output_tokens: int = 1200,
+                 seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.output_tokens = output_tokens
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls) -> "FakeModelConfig":
+        seed = os.environ.get("FAKE_CLAUDE_SEED")
+        return cls(
+            latency_ms=float(os.environ.get("FAKE_CLAUDE_LATENCY_MS", "800")),
+            latency_sigma=float(os.environ.get("FAKE_CLAUDE_LATENCY_SIGMA", "0.5")),
+            tokens_per_second=float(os.environ.get("FAKE_CLAUDE_TOKENS_PER_SECOND", "400")),
+            rate_limit_probability=float(os.environ.get("FAKE_CLAUDE_RATE_LIMIT", "0")),
+            retry_after=float(os.environ.get("FAKE_CLAUDE_RETRY_AFTER", "1")),
+            output_tokens=int(os.environ.get("FAKE_CLAUDE_OUTPUT_TOKENS", "1200")),
+            seed=int(seed) if seed else None,
+        )
+
+
+def _blocks(content) -> list[dict]:
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return list(content or [])
+
+
+def _text_of(blocks: list[dict]) -> str:
+    return "\n".join(block.get("text", "") for block in blocks if block.get("type") == "text")
+
+
+class FakeModel:
+    """
+    Produces plausible, deterministic output for each kind of request the app makes: page HTML,
+    batched pages, variation arrays and patch operations. The same request always yields the same
+    text; latency and 429s come from a (seedable) random generator.
+    """
+
+    def __init__(self, config: Optional[FakeModelConfig] = None):
+        self.config = config or FakeModelConfig()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._cached_prefixes: set[str] = set()
+
+    # --- timing -----------------------------------------------------------------------------
+
+    def first_token_delay(self) -> float:
+        with self._lock:
+            jitter = self._rng.gauss(0, self.config.latency_sigma) if self.config.latency_sigma else 0.0
+        return self.config.latency_ms / 1000.0 * math.exp(jitter)
+
+    def token_delay(self, tokens: int) -> float:
+        return tokens / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0.0
+
+    def should_rate_limit(self) -> bool:
+        if self.config.rate_limit_probability <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < self.config.rate_limit_probability
+
+    # --- content ------------------------------------------------------------------------------
+
+    @staticmethod
+    def _digest(request: dict) -> str:
+        encoded = json.dumps([request.get("system"), request.get("messages")], sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:12]
+
+    def _page(self, digest: str, number: int = 1) -> str:
+        sections = max(1, self.config.output_tokens // 60)
+        body = "".join(
+            f'<section class="p-6 border-b"><h2 class="text-xl font-semibold">Section {i + 1}</h2>'
+            f'<p class="text-gray-600">Generated from sketch {digest} page {number}.</p></section>'
+            for i in range(sections)
+        )
+        return ('<!DOCTYPE html><html><head><script src="https://cdn.tailwindcss.com"></script></head>'
+                f'<body class="h-screen w-screen"><header class="p-4 bg-indigo-600 text-white">Page {number}</header>'
+                f"<main>{body}</main></body></html>")
+
+    def respond_text(self, request: dict) -> str:
+        system = _text_of(_blocks(request.get("system")))
+        blocks = [block for message in request.get("messages", []) for block in _blocks(message.get("content"))]
+        user = _text_of(blocks)
+        images = sum(1 for block in blocks if block.get("type") == "image")
+        digest = self._digest(request)
+
+        if "patch operations" in system:
+            return "[]"
+        batch = _SKETCH_COUNT.search(user)
+        if batch and images > 1:
+            return "\n".join(f"<!-- PAGE {n} -->\n{self._page(digest, n)}" for n in range(1, images + 1))
+        if images:
+            return self._page(digest)
+        count = _COUNT.search(user)
+        if count:
+            colors = ["indigo", "emerald", "rose", "amber", "sky", "violet", "slate", "teal", "orange", "pink"]
+            return json.dumps([
+                f'<button class="px-4 py-2 rounded-lg bg-{colors[i % len(colors)]}-600 text-white">Variation {i + 1}</button>'
+                for i in range(int(count.group(1)))
+            ])
+        return f"Fake response {digest}."
+
+    def usage(self, request: dict, text: str) -> dict:
+        """Token usage in the API's shape, including prompt-cache reads/writes for marked prefixes."""
+        system_blocks = _blocks(request.get("system"))
+        blocks = [block for message in request.get("messages", []) for block in _blocks(message.get("content"))]
+
+        prefix_chars, cached_prefix = 0, None
+        for i, block in enumerate(system_blocks):
+            prefix_chars += len(block.get("text", ""))
+            if block.get("cache_control"):
+                cached_prefix = json.dumps(system_blocks[:i + 1], sort_keys=True)
+        prefix_tokens = prefix_chars // CHARS_PER_TOKEN
+        other_tokens = (len(_text_of(blocks)) // CHARS_PER_TOKEN
+                        + IMAGE_TOKENS * sum(1 for block in blocks if block.get("type") == "image"))
+
+        cache_read = cache_write = 0
+        if cached_prefix is None:
+            other_tokens += prefix_tokens
+        else:
+            with self._lock:
+                hit = cached_prefix in self._cached_prefixes
+                self._cached_prefixes.add(cached_prefix)
+            if hit:
+                cache_read = prefix_tokens
+            else:
+                cache_write = prefix_tokens
+
+        return {
+            "input_tokens": max(1, other_tokens),
+            "output_tokens": max(1, len(text) // CHARS_PER_TOKEN),
+            "cache_read_input_tokens": cache_read,
+            "cache_creation_input_tokens": cache_write,
+        }
+
+    @staticmethod
+    def stop(request: dict, text: str) -> tuple[str, str, Optional[str]]:
+        """Apply the request's stop_sequences and max_tokens like the API: (text, stop_reason, sequence)."""
+        found = [(text.find(sequence), sequence) for sequence in request.get("stop_sequences") or ()]
+        found = [(index, sequence) for index, sequence in found if index >= 0]
+        reason, sequence = "end_turn", None
+        if found:
+            index, sequence = min(found)
+            text, reason = text[:index], "stop_sequence"
+        max_chars = int(request.get("max_tokens") or 0) * CHARS_PER_TOKEN
+        if max_chars and len(text) > max_chars:
+            text, reason, sequence = text[:max_chars], "max_tokens", None
+        return text, reason, sequence
+
+    def message(self, request: dict) -> dict:
+        """A complete Messages API response body."""
+        text, stop_reason, stop_sequence = self.stop(request, self.respond_text(request))
+        return {
+            "id": f"msg_fake_{uuid.uuid4().hex[:16]}",
+            "type": "message",
+            "role": "assistant",
+            "model": request.get("model", "fake"),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": stop_reason,
+            "stop_sequence": stop_sequence,
+            "usage": self.usage(request, text),
+        }
+
+
+def chunk_text(text: str, chunk_chars: int = 16) -> list[str]:
+    return [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+
+
+def _namespace(message: dict) -> SimpleNamespace:
+    return SimpleNamespace(
+        id=message["id"],
+        model=message["model"],
+        stop_reason=message["stop_reason"],
+        stop_sequence=message["stop_sequence"],
+        content=[SimpleNamespace(**block) for block in message["content"]],
+        usage=SimpleNamespace(**message["usage"]),
+    )
+
+
+def _rate_limit_error(retry_after: float):
+    import httpx
+    from anthropic import RateLimitError
+
+    body = {"type": "error", "error": {"type": "rate_limit_error", "message": "Fake rate limit"}}
+    response = httpx.Response(
+        429, headers={"retry-after": str(retry_after)}, json=body,
+        request=httpx.Request("POST", "http://fake-claude/v1/messages"),
+    )
+    return RateLimitError("Fake rate limit", response=response, body=body)
+
+
+class _FakeStream:
+    """Async context manager with the parts of the SDK's MessageStream the app uses."""
+
+    def __init__(self, model: FakeModel, request: dict):
+        self._model = model
+        self._request = request
+        self._message: Optional[dict] = None
+
+    async def __aenter__(self):
+        if self._model.should_rate_limit():
+            raise _rate_limit_error(self._model.config.retry_after)
+        await asyncio.sleep(self._model.first_token_delay())
+        self._message = self._model.message(self._request)
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    async def text_stream(self):
+        for chunk in chunk_text(self._message["content"][0]["text"]):
+            await asyncio.sleep(self._model.token_delay(max(1, len(chunk) // CHARS_PER_TOKEN)))
+            yield chunk
+
+    async def get_final_message(self):
+        return _namespace(self._message)
+
+
+class _FakeMessages:
+    def __init__(self, model: FakeModel):
+        self._model = model
+
+    async def create(self, **request):
+        if self._model.should_rate_limit():
+            raise _rate_limit_error(self._model.config.retry_after)
+        message = self._model.message(request)
+        await asyncio.sleep(self._model.first_token_delay()
+                            + self._model.token_delay(message["usage"]["output_tokens"]))
+        return _namespace(message)
+
+    def stream(self, **request):
+        return _FakeStream(self._model, request)
+
+
+class FakeAsyncClient:
+    """In-process replacement for AsyncAnthropic (messages.create / messages.stream)."""
+
+    def __init__(self, model: Optional[FakeModel] = None):
+        self.messages = _FakeMessages(model or FakeModel())
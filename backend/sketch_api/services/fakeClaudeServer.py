@@ -0,0 +1,135 @@
+# services/fakeClaudeServer.py
+#Local HTTP server speaking enough of the Anthropic Messages API (JSON and SSE streaming, 429s with
+#retry-after, usage blocks) for the real SDK to talk to it. Point the app at it with
+#CLAUDE_BASE_URL=http://127.0.0.1:8787 to load-test the full generation path offline.
+#
+#   cd backend && python -m sketch_api.services.fakeClaudeServer --port 8787 --latency-ms 1500 --rate-limit 0.05
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .fakeClaude import CHARS_PER_TOKEN, FakeModel, FakeModelConfig, chunk_text
+
+
+class FakeClaudeHandler(BaseHTTPRequestHandler):
+    model: FakeModel = FakeModel()
+    quiet = False
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, body: dict, headers: dict = None) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_event(self, event: str, data: dict) -> None:
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def do_POST(self):
+        if self.path.split("?")[0] != "/v1/messages":
+            self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except json.JSONDecodeError as e:
+            self._send_json(400, {"type": "error", "error": {"type": "invalid_request_error", "message": str(e)}})
+            return
+
+        model = self.model
+        if model.should_rate_limit():
+            self._send_json(
+                429,
+                {"type": "error", "error": {"type": "rate_limit_error", "message": "Fake rate limit"}},
+                {"retry-after": str(model.config.retry_after)},
+            )
+            return
+
+        time.sleep(model.first_token_delay())
+        message = model.message(request)
+        if not request.get("stream"):
+            time.sleep(model.token_delay(message["usage"]["output_tokens"]))
+            self._send_json(200, message)
+            return
+
+        #Streaming: the standard message_start / content_block_delta / message_stop event sequence
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        usage = message["usage"]
+        start = dict(message, content=[], stop_reason=None, usage=dict(usage, output_tokens=1))
+        self._send_event("message_start", {"type": "message_start", "message": start})
+        self._send_event("content_block_start",
+                         {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        for chunk in chunk_text(message["content"][0]["text"]):
+            time.sleep(model.token_delay(max(1, len(chunk) // CHARS_PER_TOKEN)))
+            self._send_event("content_block_delta",
+                             {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": chunk}})
+        self._send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self._send_event("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": message["stop_reason"], "stop_sequence": message["stop_sequence"]},
+            "usage": {"output_tokens": usage["output_tokens"]},
+        })
+        self._send_event("message_stop", {"type": "message_stop"})
+        self.close_connection = True
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8787, config: FakeModelConfig = None,
+                quiet: bool = False) -> ThreadingHTTPServer:
+    handler = type("ConfiguredFakeClaudeHandler", (FakeClaudeHandler,), {
+        "model": FakeModel(config or FakeModelConfig.from_env()),
+        "quiet": quiet,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    defaults = FakeModelConfig.from_env()
+    parser = argparse.ArgumentParser(description="Local fake of the Anthropic Messages API for load testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms,
+                        help="median time to first token")
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma,
+                        help="lognormal spread of the latency (0 = constant)")
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--rate-limit", type=float, default=defaults.rate_limit_probability,
+                        help="probability of answering 429")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+    parser.add_argument("--output-tokens", type=int, default=defaults.output_tokens,
+                        help="approximate size of generated pages")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    config = FakeModelConfig(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, tokens_per_second=args.tokens_per_second,
+        rate_limit_probability=args.rate_limit, retry_after=args.retry_after, output_tokens=args.output_tokens,
+        seed=args.seed,
+    )
+    server = make_server(args.host, args.port, config, args.quiet)
+    print(f"Fake Claude API listening on http://{args.host}:{args.port} (set CLAUDE_BASE_URL to use it)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
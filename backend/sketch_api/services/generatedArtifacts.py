@@ -0,0 +1,57 @@
+# services/generatedArtifacts.py
+#Generated HTML addressed by its content hash. Generation responses carry each page's hash next to
+#its HTML; GET /api/artifacts/<hash>/ serves the page again with that hash as its ETag, so a client
+#that already holds a page revalidates it with If-None-Match and gets a 304 instead of the HTML.
+import hashlib
+import re
+import threading
+from typing import Optional
+
+from django.conf import settings
+
+from .metrics import callback
+from .resultCache import LRUTTLCache
+
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def content_hash(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+def etag_for(digest: str) -> str:
+    return f'"{digest}"'
+
+
+_artifacts: Optional[LRUTTLCache] = None
+_artifacts_lock = threading.Lock()
+
+
+def get_artifact_cache() -> LRUTTLCache:
+    """Process-wide store sized by ARTIFACT_CACHE_MAX_ENTRIES / ARTIFACT_CACHE_TTL."""
+    global _artifacts
+    if _artifacts is None:
+        with _artifacts_lock:
+            if _artifacts is None:
+                _artifacts = LRUTTLCache(
+                    max_entries=getattr(settings, "ARTIFACT_CACHE_MAX_ENTRIES", 1024),
+                    ttl=getattr(settings, "ARTIFACT_CACHE_TTL", 86400),
+                )
+    return _artifacts
+
+
+def remember(html: str) -> str:
+    """Keep `html` addressable by its content hash and return the hash."""
+    digest = content_hash(html)
+    get_artifact_cache().set(digest, html)
+    return digest
+
+
+def recall(digest: str) -> Optional[str]:
+    if not DIGEST_PATTERN.match(digest):
+        return None
+    return get_artifact_cache().get(digest)
+
+
+callback("generated_artifacts_entries", "Generated pages and variations addressable by content hash.", "gauge",
+         lambda: len(_artifacts) if _artifacts is not None else 0)
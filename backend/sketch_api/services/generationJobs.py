@@ -0,0 +1,188 @@
+# services/generationJobs.py
+#Background generation jobs: the HTTP request only enqueues pages and returns a job id, a worker
+#loop runs the Claude calls, and results land in a store that can be polled or pushed over the
+#collab websocket. Generation throughput is then independent of request/proxy timeouts.
+#API-only for now: the editor streams /api/generate-multi/ instead, and only ignores job_update pushes,
+#so /api/jobs/ and /api/collab/<id>/generate/ are for scripts and other clients that poll or listen.
+import asyncio
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+from django.conf import settings
+
+from .claudeClient import image_to_html_css
+from .imagePreprocess import preprocess_sketch
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class PageInput:
+    """One uploaded page, read out of the request before the request goes away."""
+
+    def __init__(self, index: int, page_id: str, name: str, data: bytes, media_type: str):
+        self.index = index
+        self.page_id = page_id
+        self.name = name
+        self.data = data
+        self.media_type = media_type
+
+
+class Job:
+    def __init__(self, total: int, client_key: str = "anonymous", collab_id: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.total = total
+        self.client_key = client_key
+        self.collab_id = collab_id
+        self.results: list[dict] = []
+        self.created = time.time()
+        self.finished: Optional[float] = None
+
+    def to_dict(self, include_results: bool = True) -> dict:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "completed": len(self.results),
+        }
+        if include_results:
+            data["results"] = sorted(self.results, key=lambda r: r.get("index", 0))
+        return data
+
+
+class JobStore:
+    """In-process result store; finished jobs are kept for JOB_RESULT_TTL seconds."""
+
+    def __init__(self, ttl: float = 3600.0):
+        self.ttl = ttl
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def put(self, job: Job) -> None:
+        with self._lock:
+            self._prune_locked()
+            self._jobs[job.id] = job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._prune_locked()
+            return self._jobs.get(job_id)
+
+    def add_result(self, job: Job, result: dict) -> None:
+        with self._lock:
+            job.results.append(result)
+
+    def _prune_locked(self) -> None:
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+async def generate_page(page: PageInput, client_key: str = "anonymous", priority: bool = False) -> dict:
+    """Preprocess and generate one page, returning the same result shape as generate-multi."""
+    try:
+        sketch = await asyncio.to_thread(preprocess_sketch, page.data, page.media_type)
+        html = await image_to_html_css(
+            sketch.data, media_type=sketch.media_type, prompt=None,
+            client_key=client_key, priority=priority,
+        )
+        return {"id": page.page_id, "index": page.index, "html": html, "preprocess": sketch.stats()}
+    except Exception as e:
+        return {
+            "id": page.page_id,
+            "index": page.index,
+            "html": f"<p>Error generating mockup for {page.name}: {str(e)}</p>",
+            "error": "Generation failed.",
+        }
+
+
+class JobRunner:
+    """
+    Runs jobs as asyncio tasks on a dedicated background event loop thread.
+    At most JOB_MAX_CONCURRENT_JOBS run at once; the Claude scheduler caps the calls underneath.
+    """
+
+    def __init__(self, store: JobStore, max_concurrent_jobs: int = 4,
+                 notify: Optional[Callable[[Job], None]] = None):
+        self.store = store
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.notify = notify
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._started = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._started:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._slots = asyncio.Semaphore(self.max_concurrent_jobs)
+                threading.Thread(target=loop.run_forever, name="generation-jobs", daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def submit(self, job: Job, pages: list[PageInput]):
+        """Store the job and schedule it; returns a concurrent.futures.Future for the run."""
+        self.store.put(job)
+        return asyncio.run_coroutine_threadsafe(self.run(job, pages), self._ensure_loop())
+
+    async def run(self, job: Job, pages: list[PageInput]) -> Job:
+        async with self._slots:
+            job.status = RUNNING
+            await self._notify(job)
+
+            async def one(page: PageInput):
+                result = await generate_page(page, job.client_key, priority=job.total == 1)
+                self.store.add_result(job, result)
+                await self._notify(job)
+
+            await asyncio.gather(*(one(page) for page in pages))
+            job.status = FAILED if job.results and all("error" in r for r in job.results) else DONE
+            job.finished = time.time()
+            await self._notify(job)
+        return job
+
+    async def _notify(self, job: Job) -> None:
+        if self.notify is None:
+            return
+        try:
+            #notify is a plain callable that may block, so keep it off this loop
+            await asyncio.to_thread(self.notify, job)
+        except Exception as e:
+            print(f"Job {job.id} notification failed: {e}")
+
+
+def _notify_collab(job: Job) -> None:
+    """Push job progress to everyone in the job's collab room, if it has one."""
+    if not job.collab_id:
+        return
+    from ..CollabServer import CollabServer
+    CollabServer().onJobUpdate(job.collab_id, job.to_dict(include_results=False))
+
+
+_store = JobStore()
+_runner: Optional[JobRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    _store.ttl = getattr(settings, "JOB_RESULT_TTL", _store.ttl)
+    return _store
+
+
+def get_job_runner() -> JobRunner:
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = JobRunner(
+                    get_job_store(),
+                    max_concurrent_jobs=getattr(settings, "JOB_MAX_CONCURRENT_JOBS", 4),
+                    notify=_notify_collab,
+                )
+    return _runner
@@ -0,0 +1,210 @@
+# services/imagePreprocess.py
+#Shrinks uploaded sketches before they are sent to Claude: trim empty canvas, downscale to the
+#resolution the model actually looks at, and re-encode as a compact grayscale/palette image.
+import io
+import threading
+from typing import BinaryIO, Optional, Union
+
+from django.conf import settings
+from PIL import Image, ImageChops, ImageOps, UnidentifiedImageError, features
+
+from .metrics import callback
+from .sketchSimilarity import get_similarity_cache
+
+#Claude resizes anything larger than this before the model sees it, so extra pixels are wasted upload
+MODEL_MAX_EDGE = 1568
+MODEL_MAX_PIXELS = 1_150_000
+#Anthropic's published image cost: tokens ~= width * height / 750
+PIXELS_PER_TOKEN = 750
+
+#Pixels closer than this to the background count as empty canvas when trimming
+INK_THRESHOLD = 16
+#Saturation (0-255) below which the sketch is treated as black-and-white
+COLOR_SATURATION_THRESHOLD = 24
+PALETTE_COLORS = 64
+
+
+def estimate_tokens_for_size(width: int, height: int) -> int:
+    """Input tokens Claude charges for an image of this size, after its own downscaling."""
+    width, height = _fit(width, height, MODEL_MAX_EDGE, MODEL_MAX_PIXELS)
+    return max(1, (width * height) // PIXELS_PER_TOKEN)
+
+
+def _fit(width: int, height: int, max_edge: int, max_pixels: int) -> tuple[int, int]:
+    scale = min(1.0, max_edge / max(width, height), (max_pixels / float(width * height)) ** 0.5)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+class PreprocessResult:
+    """The bytes to upload plus what preprocessing saved."""
+
+    def __init__(self, data: bytes, media_type: str, original_bytes: int, original_size: Optional[tuple[int, int]],
+                 size: Optional[tuple[int, int]], fingerprint: Optional[tuple] = None):
+        self.data = data
+        self.media_type = media_type
+        self.original_bytes = original_bytes
+        self.original_size = original_size
+        self.size = size
+        #Perceptual hash of the preprocessed sketch, for the near-duplicate result cache
+        self.fingerprint = fingerprint
+
+    def stats(self) -> dict:
+        original_tokens = estimate_tokens_for_size(*self.original_size) if self.original_size else None
+        tokens = estimate_tokens_for_size(*self.size) if self.size else original_tokens
+        return {
+            "original_bytes": self.original_bytes,
+            "bytes": len(self.data),
+            "bytes_saved": self.original_bytes - len(self.data),
+            "original_size": list(self.original_size) if self.original_size else None,
+            "size": list(self.size) if self.size else None,
+            "original_tokens": original_tokens,
+            "tokens": tokens,
+            "tokens_saved": (original_tokens - tokens) if original_tokens is not None else 0,
+            "media_type": self.media_type,
+        }
+
+
+class _SavingsTotals:
+    """Running totals of what preprocessing has saved since the process started."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.bytes_saved = 0
+        self.tokens_saved = 0
+
+    def add(self, stats: dict) -> None:
+        with self._lock:
+            self.images += 1
+            self.bytes_saved += stats["bytes_saved"]
+            self.tokens_saved += stats["tokens_saved"]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"images": self.images, "bytes_saved": self.bytes_saved, "tokens_saved": self.tokens_saved}
+
+
+savings = _SavingsTotals()
+
+callback("sketch_preprocess_images_total", "Sketches run through preprocessing.", "counter",
+         lambda: savings.snapshot()["images"])
+callback("sketch_preprocess_bytes_saved_total", "Upload bytes removed by preprocessing.", "counter",
+         lambda: savings.snapshot()["bytes_saved"])
+callback("sketch_preprocess_tokens_saved_total", "Estimated image tokens saved by preprocessing.", "counter",
+         lambda: savings.snapshot()["tokens_saved"])
+
+#Each decode holds the full bitmap (~6 bytes/pixel while converting), so cap how many run at once
+_decode_slots = threading.BoundedSemaphore(getattr(settings, "SKETCH_PREPROCESS_CONCURRENCY", 4))
+
+
+def _read_all(source: Union[bytes, BinaryIO]) -> bytes:
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    source.seek(0)
+    return source.read()
+
+
+def _size_of(source: Union[bytes, BinaryIO]) -> int:
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    size = getattr(source, "size", None)
+    if size is None:
+        size = source.seek(0, io.SEEK_END)
+    return size
+
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """Composite transparency onto white (exported Excalidraw PNGs may be transparent)."""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+        return Image.alpha_composite(background, rgba).convert("RGB")
+    return img.convert("RGB")
+
+
+def _trim(img: Image.Image, margin: int) -> Image.Image:
+    """Crop to the bounding box of everything that differs from the corner background colour."""
+    background = Image.new("RGB", img.size, img.getpixel((0, 0)))
+    diff = ImageChops.difference(img, background).convert("L")
+    bbox = diff.point(lambda v: 255 if v > INK_THRESHOLD else 0).getbbox()
+    if not bbox:
+        return img
+    left, top, right, bottom = bbox
+    return img.crop((
+        max(0, left - margin),
+        max(0, top - margin),
+        min(img.width, right + margin),
+        min(img.height, bottom + margin),
+    ))
+
+
+def _is_colorful(img: Image.Image) -> bool:
+    saturation = img.convert("HSV").getchannel("S")
+    return saturation.getextrema()[1] > COLOR_SATURATION_THRESHOLD
+
+
+def _encode(img: Image.Image) -> tuple[bytes, str]:
+    """Smallest of optimized PNG and lossless WebP (when Pillow was built with WebP)."""
+    candidates = []
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    candidates.append((buf.getvalue(), "image/png"))
+    if features.check("webp"):
+        buf = io.BytesIO()
+        img.save(buf, format="WEBP", lossless=True, method=4)
+        candidates.append((buf.getvalue(), "image/webp"))
+    return min(candidates, key=lambda c: len(c[0]))
+
+
+def preprocess_sketch(image: Union[bytes, BinaryIO], media_type: str = "image/png") -> PreprocessResult:
+    """
+    Trim, downscale and re-encode a sketch for upload to Claude.
+    `image` may be bytes or a seekable file (e.g. an UploadedFile spooled to disk), which Pillow
+    decodes straight from the file so the raw upload is never copied into memory.
+    Anything Pillow can't read, or that would come out larger, is passed through untouched.
+    """
+    original_bytes = _size_of(image)
+    if not getattr(settings, "SKETCH_PREPROCESS_ENABLED", True):
+        return PreprocessResult(_read_all(image), media_type, original_bytes, None, None)
+
+    source = io.BytesIO(image) if isinstance(image, (bytes, bytearray)) else image
+    with _decode_slots:
+        try:
+            source.seek(0)
+            with Image.open(source) as opened:
+                opened.load()
+                original_size = opened.size
+                img = _flatten(ImageOps.exif_transpose(opened))
+        except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError):
+            return PreprocessResult(_read_all(image), media_type, original_bytes, None, None)
+
+        img = _trim(img, getattr(settings, "SKETCH_TRIM_MARGIN", 16))
+
+        width, height = _fit(
+            img.width, img.height,
+            getattr(settings, "SKETCH_MAX_EDGE", MODEL_MAX_EDGE),
+            getattr(settings, "SKETCH_MAX_PIXELS", MODEL_MAX_PIXELS),
+        )
+        if (width, height) != img.size:
+            img = img.resize((width, height), Image.Resampling.LANCZOS)
+
+        #Hashed after trimming and scaling, so the same drawing on a different canvas hashes the same
+        similarity = get_similarity_cache()
+        fingerprint = similarity.fingerprint(img) if similarity is not None else None
+
+        if _is_colorful(img):
+            img = img.quantize(colors=PALETTE_COLORS, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+        else:
+            img = img.convert("L")
+
+        data, out_type = _encode(img)
+        size = img.size
+
+    if len(data) >= original_bytes and size == original_size:
+        #Nothing to gain: same pixels for the model and no smaller on the wire
+        return PreprocessResult(_read_all(image), media_type, original_bytes, original_size, original_size,
+                                fingerprint)
+
+    result = PreprocessResult(data, out_type, original_bytes, original_size, size, fingerprint)
+    savings.add(result.stats())
+    return result
@@ -0,0 +1,95 @@
+# services/jsonStream.py
+#Incremental parser for a top-level JSON array arriving in arbitrary text chunks (e.g. a model's
+#token stream). Each element is emitted as soon as its closing delimiter arrives, and a malformed
+#element only loses that element instead of the whole batch.
+import json
+from typing import Any
+
+
+class JSONArrayStreamParser:
+    """
+    Feed text with feed(); get back the array elements completed by that chunk.
+
+    Anything before the first '[' (a ```json fence, stray prose) is ignored, as is anything
+    after the matching ']'. Elements that fail json.loads are counted in `errors` and skipped.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self.errors = 0
+        self._element: list[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def _flush(self, out: list[Any]) -> None:
+        raw = "".join(self._element).strip()
+        self._element = []
+        if not raw:
+            return
+        try:
+            out.append(json.loads(raw))
+        except json.JSONDecodeError:
+            self.errors += 1
+
+    def feed(self, chunk: str) -> list[Any]:
+        out: list[Any] = []
+        if self.finished or not chunk:
+            return out
+
+        start = 0
+        if not self.started:
+            bracket = chunk.find("[")
+            if bracket < 0:
+                return out
+            self.started = True
+            start = bracket + 1
+
+        #Index of the first character of the current element within this chunk
+        segment = start
+        for i in range(start, len(chunk)):
+            ch = chunk[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0 and ch == "]":
+                    self._element.append(chunk[segment:i])
+                    self._flush(out)
+                    self.finished = True
+                    return out
+                self._depth -= 1
+            elif ch == "," and self._depth == 0:
+                self._element.append(chunk[segment:i])
+                self._flush(out)
+                segment = i + 1
+
+        self._element.append(chunk[segment:])
+        return out
+
+    def close(self) -> list[Any]:
+        """End of input: salvage a final element if the closing ']' never arrived."""
+        out: list[Any] = []
+        if self.started and not self.finished:
+            self._flush(out)
+            self.finished = True
+        return out
+
+
+def parse_json_array_leniently(text: str) -> list[Any]:
+    """Parse a JSON array, keeping every well-formed element even if the array itself is broken."""
+    parser = JSONArrayStreamParser()
+    items = parser.feed(text)
+    items.extend(parser.close())
+    return items
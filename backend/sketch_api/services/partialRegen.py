@@ -0,0 +1,347 @@
+# services/partialRegen.py
+#Partial regeneration: when a sketch changes a little, find the changed region of the image, show
+#Claude only that region plus the previous HTML (with every element tagged by a data-rid id), and
+#apply the patch operations it returns instead of regenerating the whole page.
+import base64
+import io
+import json
+import re
+from functools import partial
+from typing import Optional
+
+from django.conf import settings
+from PIL import Image, ImageChops, ImageOps, UnidentifiedImageError
+
+from .claudeClient import SYSTEM_PROMPT, _client, _extract_text, image_to_html_css
+from .claudeRetry import RetryPolicy, call_with_retry, get_latency_tracker
+from .claudeScheduler import estimate_image_tokens, estimate_text_tokens, get_scheduler
+from .claudeUsage import EPHEMERAL_CACHE, rate_limited_input_tokens, usage
+from .imagePreprocess import INK_THRESHOLD, _flatten
+from .jsonStream import parse_json_array_leniently
+from .tailwindCompile import postprocess_page, strip_compiled
+
+RID_ATTR = "data-rid"
+
+UNCHANGED = "unchanged"
+PATCH = "patch"
+FULL = "full"
+
+#Any tag, with quoted attribute values allowed to contain '>'
+_TAG = re.compile(r"""<(/?)([a-zA-Z][\w:-]*)((?:[^>"']|"[^"]*"|'[^']*')*)>""")
+_RID = re.compile(r'\s+data-rid="[^"]*"')
+_BODY_OPEN = re.compile(r"<body\b(?:[^>\"']|\"[^\"]*\"|'[^']*')*>", re.IGNORECASE)
+
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source",
+                 "track", "wbr"}
+#Content of these is raw text, not markup
+RAW_TEXT_ELEMENTS = {"script", "style", "textarea"}
+
+#Small overview of the whole new sketch so the model knows where the changed region sits
+THUMBNAIL_EDGE = 512
+
+PATCH_INSTRUCTIONS = """You are updating an existing HTML page after the user edited part of their UI sketch.
+
+            You are given:
+            - The current page HTML. Every element in <body> has a data-rid attribute identifying it.
+            - A small overview of the whole edited sketch.
+            - The changed region of the sketch before and after the edit, and where it sits on the page.
+
+            Change only what the edit requires. Return ONLY a JSON array of patch operations, no markdown
+            fences and no explanations. Each operation is an object with:
+            - "op": one of "replace", "remove", "insert_before", "insert_after", "append"
+            - "rid": the data-rid of the element the operation targets
+            - "html": the new markup (not used by "remove")
+
+            "replace" swaps the whole element (including its children) for "html", "append" adds "html" as
+            the element's last child. New markup should use Tailwind classes consistent with the page and
+            must not contain data-rid attributes. If nothing needs to change, return []."""
+
+
+def strip_annotations(html: str) -> str:
+    return _RID.sub("", html)
+
+
+def _raw_text_end(html: str, name: str, pos: int) -> int:
+    """Index just past the closing tag of a raw-text element whose opening tag ends at `pos`."""
+    close = re.compile(rf"</{name}\s*>", re.IGNORECASE).search(html, pos)
+    return close.end() if close else len(html)
+
+
+def annotate_html(html: str) -> tuple[str, int]:
+    """Tag every element inside <body> with a sequential data-rid; returns (html, element count)."""
+    html = strip_annotations(html)
+    body = _BODY_OPEN.search(html)
+    pos = body.end() if body else 0
+
+    pieces = [html[:pos]]
+    count = 0
+    while True:
+        tag = _TAG.search(html, pos)
+        if tag is None:
+            break
+        closing, name = tag.group(1), tag.group(2).lower()
+        pieces.append(html[pos:tag.start()])
+        if closing:
+            pieces.append(tag.group(0))
+            pos = tag.end()
+            continue
+
+        pieces.append(f'<{tag.group(2)} {RID_ATTR}="{count}"{tag.group(3)}>')
+        count += 1
+        pos = tag.end()
+        if name in RAW_TEXT_ELEMENTS:
+            end = _raw_text_end(html, name, pos)
+            pieces.append(html[pos:end])
+            pos = end
+
+    pieces.append(html[pos:])
+    return "".join(pieces), count
+
+
+def _element_span(html: str, rid: str) -> Optional[tuple[int, int, int]]:
+    """(start, end of opening tag, end) of the element with this data-rid, or None."""
+    marker = re.compile(rf'<([a-zA-Z][\w:-]*)\s+{RID_ATTR}="{re.escape(str(rid))}"')
+    found = marker.search(html)
+    if found is None:
+        return None
+    opening = _TAG.match(html, found.start())
+    if opening is None:
+        return None
+
+    name = opening.group(2).lower()
+    if name in VOID_ELEMENTS or opening.group(3).rstrip().endswith("/"):
+        return found.start(), opening.end(), opening.end()
+    if name in RAW_TEXT_ELEMENTS:
+        return found.start(), opening.end(), _raw_text_end(html, name, opening.end())
+
+    depth = 1
+    pos = opening.end()
+    while depth:
+        tag = _TAG.search(html, pos)
+        if tag is None:
+            return found.start(), opening.end(), len(html)
+        tag_name = tag.group(2).lower()
+        pos = tag.end()
+        if tag.group(1):
+            depth -= 1
+            if depth == 0:
+                return found.start(), opening.end(), pos
+        elif tag_name in RAW_TEXT_ELEMENTS:
+            pos = _raw_text_end(html, tag_name, pos)
+        elif tag_name not in VOID_ELEMENTS and not tag.group(3).rstrip().endswith("/"):
+            depth += 1
+    return found.start(), opening.end(), pos
+
+
+def apply_patch_ops(html: str, ops: list) -> tuple[str, int]:
+    """Apply patch operations to annotated HTML; returns (html, operations applied)."""
+    applied = 0
+    for op in ops:
+        if not isinstance(op, dict):
+            continue
+        kind = op.get("op")
+        new_html = strip_annotations(str(op.get("html") or ""))
+        span = _element_span(html, op.get("rid", ""))
+        if span is None:
+            continue
+        start, open_end, end = span
+
+        if kind == "replace":
+            html = html[:start] + new_html + html[end:]
+        elif kind == "remove":
+            html = html[:start] + html[end:]
+        elif kind == "insert_before":
+            html = html[:start] + new_html + html[start:]
+        elif kind == "insert_after":
+            html = html[:end] + new_html + html[end:]
+        elif kind == "append":
+            #Before the element's closing tag; void elements can't have children
+            if end == open_end:
+                continue
+            close_start = html.rfind("</", open_end, end)
+            html = html[:close_start] + new_html + html[close_start:]
+        else:
+            continue
+        applied += 1
+    return html, applied
+
+
+def _load(image) -> Image.Image:
+    """Decode bytes or a seekable uploaded file into a flattened RGB image."""
+    source = io.BytesIO(image) if isinstance(image, (bytes, bytearray)) else image
+    source.seek(0)
+    with Image.open(source) as opened:
+        opened.load()
+        return _flatten(ImageOps.exif_transpose(opened))
+
+
+def _ink_bbox(a: Image.Image, b: Image.Image) -> Optional[tuple[int, int, int, int]]:
+    diff = ImageChops.difference(a, b).convert("L")
+    return diff.point(lambda v: 255 if v > INK_THRESHOLD else 0).getbbox()
+
+
+def align_previous(previous: Image.Image, current: Image.Image) -> Image.Image:
+    """
+    The previous sketch on a canvas the size of the current one. Exports are cropped to the
+    drawing's bounds, so when the size changed each corner anchor is tried and the one leaving
+    the smallest difference wins.
+    """
+    if previous.size == current.size:
+        return previous
+
+    dx, dy = current.width - previous.width, current.height - previous.height
+    best = None
+    for ox in {0, dx}:
+        for oy in {0, dy}:
+            canvas = Image.new("RGB", current.size, (255, 255, 255))
+            canvas.paste(previous, (ox, oy))
+            bbox = _ink_bbox(canvas, current)
+            area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) if bbox else 0
+            if best is None or area < best[0]:
+                best = (area, canvas)
+    return best[1]
+
+
+def changed_region(previous: Image.Image, current: Image.Image) -> Optional[tuple[int, int, int, int]]:
+    """Bounding box (in `current` coordinates) of what changed between two sketches, or None."""
+    return _ink_bbox(align_previous(previous, current), current)
+
+
+def _png(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def _image_block(data: bytes) -> dict:
+    return {
+        "type": "image",
+        "source": {"type": "base64", "media_type": "image/png", "data": base64.b64encode(data).decode("utf-8")},
+    }
+
+
+class PartialResult:
+    """Regenerated HTML and how it was produced (unchanged, patched, or a full regeneration)."""
+
+    def __init__(self, html: str, mode: str, region: Optional[tuple[int, int, int, int]] = None,
+                 ops_applied: int = 0, reason: Optional[str] = None):
+        self.html = html
+        self.mode = mode
+        self.region = region
+        self.ops_applied = ops_applied
+        self.reason = reason
+
+    def to_dict(self) -> dict:
+        return {
+            "html": self.html,
+            "mode": self.mode,
+            "region": list(self.region) if self.region else None,
+            "ops_applied": self.ops_applied,
+            "reason": self.reason,
+        }
+
+
+async def request_patch_ops(annotated_html: str, previous: Image.Image, current: Image.Image,
+                            region: tuple[int, int, int, int], client_key: str = "anonymous",
+                            priority: bool = False) -> list:
+    """Ask Claude for patch operations covering the changed region."""
+    margin = getattr(settings, "PARTIAL_REGEN_MARGIN", 24)
+    left, top, right, bottom = region
+    box = (max(0, left - margin), max(0, top - margin),
+           min(current.width, right + margin), min(current.height, bottom + margin))
+
+    after_crop = _png(current.crop(box))
+    before_crop = _png(align_previous(previous, current).crop(box))
+    overview = current.copy()
+    overview.thumbnail((THUMBNAIL_EDGE, THUMBNAIL_EDGE))
+    overview_png = _png(overview.convert("L"))
+
+    location = (
+        f"The changed region spans {100 * box[0] // current.width}%-{100 * box[2] // current.width}% "
+        f"of the page width and {100 * box[1] // current.height}%-{100 * box[3] // current.height}% of its height."
+    )
+    content = [
+        {"type": "text", "text": "Current page HTML:\n" + annotated_html},
+        {"type": "text", "text": "Overview of the edited sketch:"},
+        _image_block(overview_png),
+        {"type": "text", "text": "Changed region before the edit:"},
+        _image_block(before_crop),
+        {"type": "text", "text": "Changed region after the edit:"},
+        _image_block(after_crop),
+        {"type": "text", "text": location + " Return the JSON array of patch operations."},
+    ]
+    system_blocks = [
+        {"type": "text", "text": SYSTEM_PROMPT},
+        {"type": "text", "text": PATCH_INSTRUCTIONS, "cache_control": EPHEMERAL_CACHE},
+    ]
+
+    client = _client()
+    model = getattr(settings, "CLAUDE_MODEL", "claude-haiku-4-5-20251001")
+    estimated_tokens = (
+        sum(estimate_image_tokens(len(data)) for data in (overview_png, before_crop, after_crop))
+        + sum(estimate_text_tokens(block["text"]) for block in system_blocks)
+        + estimate_text_tokens(annotated_html)
+    )
+    tracker = get_latency_tracker("partial_regeneration")
+
+    async def attempt(ticket):
+        resp = await tracker.timed(client.messages.create(
+            model=model,
+            max_tokens=getattr(settings, "PARTIAL_REGEN_MAX_TOKENS", 4000),
+            system=system_blocks,
+            messages=[{"role": "user", "content": content}],
+        ))
+        ticket.actual_tokens = rate_limited_input_tokens(getattr(resp, "usage", None))
+        usage.record("partial_regeneration", getattr(resp, "usage", None), pages=1)
+        return resp
+
+    slot = partial(get_scheduler().slot, client_key, estimated_tokens, priority)
+    resp = await call_with_retry(attempt, RetryPolicy.from_settings(), tracker, slot)
+    text = _extract_text(resp)
+    try:
+        ops = json.loads(text)
+    except json.JSONDecodeError:
+        ops = parse_json_array_leniently(text)
+    if not isinstance(ops, list):
+        raise RuntimeError("Claude did not return a JSON array of patch operations.")
+    return ops
+
+
+async def regenerate_changed_regions(previous_html: str, previous_image, image,
+                                     media_type: str = "image/png", client_key: str = "anonymous",
+                                     priority: bool = False) -> PartialResult:
+    """
+    Update `previous_html` for the edit between two sketch exports (bytes or uploaded files).
+    Falls back to a full image_to_html_css when the images can't be compared, the edit covers
+    too much of the page, or the model's patch doesn't apply.
+    """
+    async def full(reason: str, region=None) -> PartialResult:
+        from .imagePreprocess import preprocess_sketch
+        sketch = preprocess_sketch(image, media_type)
+        html = await image_to_html_css(sketch.data, media_type=sketch.media_type, prompt=None,
+                                       client_key=client_key, priority=priority)
+        return PartialResult(html, FULL, region, reason=reason)
+
+    try:
+        previous, current = _load(previous_image), _load(image)
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError):
+        return await full("unreadable image")
+
+    region = changed_region(previous, current)
+    if region is None:
+        return PartialResult(previous_html, UNCHANGED)
+
+    area = (region[2] - region[0]) * (region[3] - region[1])
+    if area > getattr(settings, "PARTIAL_REGEN_MAX_AREA", 0.5) * current.width * current.height:
+        return await full("edit covers too much of the page", region)
+
+    # The compiled stylesheet is rebuilt for the patched page, so the model never needs to see it
+    annotated, elements = annotate_html(strip_compiled(previous_html))
+    if not elements:
+        return await full("previous HTML has no body elements", region)
+
+    ops = await request_patch_ops(annotated, previous, current, region, client_key, priority)
+    patched, applied = apply_patch_ops(annotated, ops)
+    if ops and not applied:
+        return await full("patch did not apply", region)
+    return PartialResult(postprocess_page(strip_annotations(patched)), PATCH, region, ops_applied=applied)
@@ -0,0 +1,147 @@
+# services/responseCompression.py
+#Compresses API JSON and NDJSON responses: generated HTML is large, repetitive text (the same
+#utility classes on every element) and shrinks several times over. Brotli when the client accepts
+#it and the package is installed, gzip otherwise. Streamed responses are flushed chunk by chunk so
+#pages and variations still reach the client as soon as each one is written.
+import gzip
+import zlib
+from typing import Optional
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from .metrics import counter
+
+try:
+    import brotli
+except ImportError:  # optional: gzip alone still covers every browser
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson")
+
+COMPRESSED = counter("api_compressed_responses_total", "API responses compressed, by encoding.", ("encoding",))
+SAVED_BYTES = counter("api_compression_saved_bytes_total",
+                      "Bytes saved by compressing API responses (buffered responses only).", ("encoding",))
+
+
+def accepted_encodings(header: str) -> set[str]:
+    """Codings an Accept-Encoding header allows (anything with q=0 is refused)."""
+    accepted = set()
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def choose_encoding(header: str) -> Optional[str]:
+    accepted = accepted_encodings(header)
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+class StreamCompressor:
+    """One compressed stream for a whole response; `compress` returns what can be sent so far."""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=getattr(settings, "API_COMPRESSION_BROTLI_QUALITY", 5))
+        else:
+            self._zlib = zlib.compressobj(getattr(settings, "API_COMPRESSION_GZIP_LEVEL", 6), zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk: bytes) -> bytes:
+        """`chunk` compressed and flushed, so the client can decode everything sent so far."""
+        if self.encoding == "br":
+            return self._brotli.process(chunk) + self._brotli.flush()
+        return self._zlib.compress(chunk) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush(zlib.Z_FINISH)
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=getattr(settings, "API_COMPRESSION_BROTLI_QUALITY", 5))
+    return gzip.compress(data, compresslevel=getattr(settings, "API_COMPRESSION_GZIP_LEVEL", 6), mtime=0)
+
+
+def _as_bytes(chunk) -> bytes:
+    return chunk.encode("utf-8") if isinstance(chunk, str) else bytes(chunk)
+
+
+def compress_stream(chunks, encoding: str):
+    compressor = StreamCompressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(_as_bytes(chunk))
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def acompress_stream(chunks, encoding: str):
+    compressor = StreamCompressor(encoding)
+    async for chunk in chunks:
+        data = compressor.compress(_as_bytes(chunk))
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class APICompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses JSON/NDJSON responses of at least API_COMPRESSION_MIN_BYTES (streams always).
+    Everything else (HTML shell, static files, PNGs, metrics) passes through untouched.
+    """
+
+    def process_response(self, request, response):
+        if not getattr(settings, "API_COMPRESSION_ENABLED", True):
+            return response
+        content_type = response.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type not in COMPRESSIBLE_TYPES or response.has_header("Content-Encoding"):
+            return response
+        if not response.streaming and len(response.content) < getattr(settings, "API_COMPRESSION_MIN_BYTES", 1024):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = choose_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            original = response.streaming_content
+            if response.is_async:
+                response.streaming_content = acompress_stream(original, encoding)
+            else:
+                response.streaming_content = compress_stream(original, encoding)
+            del response.headers["Content-Length"]
+        else:
+            compressed = compress_bytes(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            SAVED_BYTES.labels(encoding).inc(len(response.content) - len(compressed))
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(compressed))
+
+        # The body is no longer the bytes a strong ETag promised; a weak one still matches If-None-Match
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+        COMPRESSED.labels(encoding).inc()
+        return response
@@ -0,0 +1,161 @@
+# services/roomAffinity.py
+#Room affinity for running several collab workers without sharing room state between them.
+#Every collabID is owned by one worker, picked by consistent hashing over COLLAB_WORKERS, and only
+#the owner keeps the room in memory. A websocket that lands on another worker is proxied to the
+#owner over one extra websocket hop. When the worker list changes (POST /api/collab/ring/), only
+#the rooms whose owner changed move: the old owner posts the room's snapshot to the new owner and
+#its connections switch to proxying there. Off unless COLLAB_WORKER_URL is set, and then only with a
+#COLLAB_CLUSTER_TOKEN, which every ring change and handoff must carry.
+import bisect
+import hashlib
+import hmac
+import threading
+from typing import Optional, Sequence
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .metrics import counter
+
+#Headers on worker-to-worker requests
+HOPS_HEADER = "x-collab-hops"      # proxy hops a websocket has already taken
+TOKEN_HEADER = "x-collab-token"    # COLLAB_CLUSTER_TOKEN
+
+FORWARDED = counter("collab_forwarded_connections_total", "Websockets proxied to the worker owning their room.")
+HANDOFFS = counter("collab_handoffs_total", "Room snapshots moved between workers, by direction and outcome.",
+                   ("direction", "outcome"))
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring; each worker gets `replicas` points so rooms spread evenly between them."""
+
+    def __init__(self, workers: Sequence[str] = (), replicas: int = 64):
+        self.workers = tuple(dict.fromkeys(worker.rstrip("/") for worker in workers if worker))
+        self.replicas = replicas
+        points = sorted((_hash(f"{worker}#{i}"), worker) for worker in self.workers for i in range(replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [worker for _, worker in points]
+
+    def owner(self, key) -> Optional[str]:
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._owners[index]
+
+
+class Affinity:
+    """
+    This worker's view of the ring. `worker` is this worker's own entry in the worker list; with one
+    set, `token` is required, since anyone who can reach the worker could otherwise rewrite its ring.
+    """
+
+    def __init__(self, worker: str = "", workers: Sequence[str] = (), replicas: int = 64, max_hops: int = 2,
+                 token: str = ""):
+        if worker and not token:
+            raise ImproperlyConfigured("COLLAB_CLUSTER_TOKEN must be set when COLLAB_WORKER_URL is.")
+        self.worker = worker.rstrip("/")
+        self.replicas = replicas
+        self.max_hops = max_hops
+        self.token = token
+        self.ring = HashRing(workers, replicas)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.worker)
+
+    def set_workers(self, workers: Sequence[str]) -> None:
+        #Swapped in one assignment, so readers on other threads see the old ring or the new one
+        self.ring = HashRing(workers, self.replicas)
+
+    def owner(self, collabID) -> Optional[str]:
+        """The worker owning the room, or None if it is this one (or affinity is off)."""
+        if not self.enabled:
+            return None
+        owner = self.ring.owner(collabID)
+        return None if owner in (None, self.worker) else owner
+
+    def route(self, collabID, hops: int = 0) -> Optional[str]:
+        """Where to proxy a new connection to, or None to serve it here.
+        Past COLLAB_MAX_HOPS a connection is served where it is, so workers whose rings disagree
+        during a membership change can't bounce it around forever."""
+        if hops >= self.max_hops:
+            return None
+        return self.owner(collabID)
+
+    def headers(self, hops: int = 0) -> dict:
+        headers = {HOPS_HEADER: str(hops)}
+        if self.token:
+            headers[TOKEN_HEADER] = self.token
+        return headers
+
+    def allows(self, token: Optional[str]) -> bool:
+        """Whether a cluster request (ring change, handoff) carrying `token` may proceed."""
+        return self.enabled and bool(token) and hmac.compare_digest(token.encode(), self.token.encode())
+
+
+def ws_url(worker: str, path: str) -> str:
+    if worker.startswith("https://"):
+        return "wss://" + worker[len("https://"):] + path
+    if worker.startswith("http://"):
+        return "ws://" + worker[len("http://"):] + path
+    return worker + path
+
+
+def scope_hops(scope) -> int:
+    for name, value in scope.get("headers", ()):
+        if name == HOPS_HEADER.encode():
+            try:
+                return int(value)
+            except ValueError:
+                return 0
+    return 0
+
+
+async def open_upstream(worker: str, collabID, hops: int, spectator: bool = False):
+    """Websocket to the room's owner, carrying our hop count so the owner doesn't forward it again."""
+    from websockets.asyncio.client import connect
+
+    path = f"/ws/collab/{collabID}/" + ("?role=spectator" if spectator else "")
+    return await connect(ws_url(worker, path), additional_headers=get_affinity().headers(hops),
+                         max_size=None, open_timeout=10)
+
+
+async def send_snapshot(worker: str, collabID, snapshot: dict) -> bool:
+    """POST a room's snapshot to its new owner; False if it didn't take it."""
+    import httpx
+
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.post(f"{worker}/api/collab/{collabID}/handoff/", json=snapshot,
+                                         headers=get_affinity().headers())
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        print(f"Handing room {collabID} to {worker} failed: {e!r}")
+        HANDOFFS.labels("out", "failed").inc()
+        return False
+    HANDOFFS.labels("out", "sent").inc()
+    return True
+
+
+_affinity: Optional[Affinity] = None
+_affinity_lock = threading.Lock()
+
+
+def get_affinity() -> Affinity:
+    """Process-wide ring configured from the COLLAB_WORKER_URL / COLLAB_WORKERS settings."""
+    global _affinity
+    if _affinity is None:
+        with _affinity_lock:
+            if _affinity is None:
+                _affinity = Affinity(
+                    worker=getattr(settings, "COLLAB_WORKER_URL", ""),
+                    workers=getattr(settings, "COLLAB_WORKERS", ()),
+                    replicas=getattr(settings, "COLLAB_RING_REPLICAS", 64),
+                    max_hops=getattr(settings, "COLLAB_MAX_HOPS", 2),
+                    token=getattr(settings, "COLLAB_CLUSTER_TOKEN", ""),
+                )
+    return _affinity
@@ -0,0 +1,363 @@
+# services/sceneRaster.py
+#Renders an Excalidraw scene (a collab page's sceneData) to PNG on the server, so pages can be
+#generated straight from a room's state instead of the browser exporting and uploading each one.
+#Covers the element types our sketches use: rectangle, ellipse, diamond, line, arrow, freedraw and
+#text. It is not a pixel match for Excalidraw (no rough.js wobble, hachure fills become a light
+#solid fill, curved lines are drawn straight), which doesn't matter for what the model reads off it.
+#Renders are cached per scene version, so regenerating an unchanged page costs nothing.
+import io
+import math
+import threading
+from typing import Optional, Sequence
+
+from django.conf import settings
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from .imagePreprocess import MODEL_MAX_EDGE, MODEL_MAX_PIXELS
+from .metrics import callback, histogram
+from .resultCache import LRUTTLCache, stable_hash
+
+SUPPORTED_TYPES = {"rectangle", "ellipse", "diamond", "line", "arrow", "freedraw", "text"}
+
+#Drawn this many times larger, then box-filtered down: cheap antialiasing for ImageDraw's shapes
+SUPERSAMPLE = 2
+#Blank canvas kept around the drawing, in scene units (Excalidraw's own export default)
+PADDING = 10
+#Excalidraw's adaptive corner radius for rounded rectangles and diamonds
+ROUNDNESS_MAX_RADIUS = 32
+ROUNDNESS_PROPORTION = 0.25
+ELLIPSE_SEGMENTS = 72
+
+RENDER_SECONDS = histogram("scene_raster_seconds", "Time to rasterize one scene (cache misses only).")
+
+
+def _color(value, opacity: float, default="#1e1e1e") -> Optional[tuple]:
+    """RGBA for an Excalidraw color string; None for transparent."""
+    if not value or value == "transparent":
+        return None
+    try:
+        rgb = ImageColor.getrgb(value)
+    except ValueError:
+        rgb = ImageColor.getrgb(default)
+    alpha = rgb[3] if len(rgb) == 4 else 255
+    return rgb[:3] + (int(alpha * opacity),)
+
+
+def _rotate(points, center, angle: float):
+    if not angle:
+        return list(points)
+    cx, cy = center
+    cos, sin = math.cos(angle), math.sin(angle)
+    return [(cx + (x - cx) * cos - (y - cy) * sin, cy + (x - cx) * sin + (y - cy) * cos) for x, y in points]
+
+
+def _linear_points(element) -> list[tuple[float, float]]:
+    x, y = element.get("x", 0), element.get("y", 0)
+    return [(x + px, y + py) for px, py in (element.get("points") or [])]
+
+
+def _corner_radius(width: float, height: float) -> float:
+    size = min(width, height)
+    return size * ROUNDNESS_PROPORTION if size <= ROUNDNESS_MAX_RADIUS / ROUNDNESS_PROPORTION else ROUNDNESS_MAX_RADIUS
+
+
+def _outline(element) -> list[tuple[float, float]]:
+    """Closed outline of a rectangle, diamond or ellipse in scene coordinates, before rotation."""
+    x, y = element.get("x", 0), element.get("y", 0)
+    width, height = element.get("width", 0), element.get("height", 0)
+    kind = element["type"]
+    if kind == "ellipse":
+        cx, cy, rx, ry = x + width / 2, y + height / 2, width / 2, height / 2
+        return [(cx + rx * math.cos(2 * math.pi * i / ELLIPSE_SEGMENTS),
+                 cy + ry * math.sin(2 * math.pi * i / ELLIPSE_SEGMENTS)) for i in range(ELLIPSE_SEGMENTS)]
+    if kind == "diamond":
+        return [(x + width / 2, y), (x + width, y + height / 2), (x + width / 2, y + height), (x, y + height / 2)]
+    radius = _corner_radius(width, height) if element.get("roundness") else 0
+    if radius <= 0:
+        return [(x, y), (x + width, y), (x + width, y + height), (x, y + height)]
+    points = []
+    for cx, cy, start in ((x + width - radius, y + radius, -90), (x + width - radius, y + height - radius, 0),
+                          (x + radius, y + height - radius, 90), (x + radius, y + radius, 180)):
+        for step in range(7):
+            theta = math.radians(start + step * 15)
+            points.append((cx + radius * math.cos(theta), cy + radius * math.sin(theta)))
+    return points
+
+
+def _center(element) -> tuple[float, float]:
+    """Excalidraw rotates every element about the middle of its own bounding box."""
+    if element["type"] in ("line", "arrow", "freedraw") and element.get("points"):
+        xs, ys = zip(*_linear_points(element))
+        return (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2
+    return element.get("x", 0) + element.get("width", 0) / 2, element.get("y", 0) + element.get("height", 0) / 2
+
+
+def element_points(element) -> list[tuple[float, float]]:
+    """The element's geometry in scene coordinates, rotated."""
+    kind = element["type"]
+    if kind in ("line", "arrow", "freedraw"):
+        points = _linear_points(element)
+    elif kind == "text":
+        x, y = element.get("x", 0), element.get("y", 0)
+        width, height = element.get("width", 0), element.get("height", 0)
+        points = [(x, y), (x + width, y), (x + width, y + height), (x, y + height)]
+    else:
+        points = _outline(element)
+    return _rotate(points, _center(element), element.get("angle") or 0)
+
+
+def visible_elements(scene) -> list[dict]:
+    elements = (scene or {}).get("elements") or []
+    if isinstance(elements, dict):
+        #applyDiff keeps lists that arrived as index-keyed diffs as dicts
+        elements = [elements[key] for key in sorted(elements, key=lambda key: int(key) if str(key).isdigit() else 0)]
+    return [element for element in elements
+            if isinstance(element, dict) and element.get("type") in SUPPORTED_TYPES and not element.get("isDeleted")]
+
+
+def scene_bounds(elements: Sequence[dict]) -> Optional[tuple[float, float, float, float]]:
+    points = [point for element in elements for point in element_points(element)]
+    if not points:
+        return None
+    xs, ys = zip(*points)
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def scene_version(scene) -> str:
+    """
+    Identifies a scene's content. Excalidraw bumps an element's version/versionNonce on every
+    edit, so those are enough when present; otherwise the elements themselves are hashed.
+    """
+    elements = visible_elements(scene)
+    if elements and all("version" in element for element in elements):
+        return stable_hash([(element.get("id"), element.get("version"), element.get("versionNonce"))
+                            for element in elements])
+    return stable_hash(elements)
+
+
+class _Canvas:
+    """Maps scene coordinates onto a supersampled RGB image."""
+
+    def __init__(self, bounds, scale: float, background):
+        min_x, min_y, max_x, max_y = bounds
+        self.origin = (min_x - PADDING, min_y - PADDING)
+        self.scale = scale * SUPERSAMPLE
+        self.size = (max(1, math.ceil((max_x - min_x + 2 * PADDING) * scale)),
+                     max(1, math.ceil((max_y - min_y + 2 * PADDING) * scale)))
+        self.image = Image.new("RGB", (self.size[0] * SUPERSAMPLE, self.size[1] * SUPERSAMPLE), background)
+        self.draw = ImageDraw.Draw(self.image, "RGBA")
+
+    def xy(self, points):
+        ox, oy, scale = self.origin[0], self.origin[1], self.scale
+        return [((x - ox) * scale, (y - oy) * scale) for x, y in points]
+
+    def width(self, element) -> int:
+        return max(1, round((element.get("strokeWidth") or 1) * self.scale))
+
+    def finish(self) -> Image.Image:
+        return self.image.reduce(SUPERSAMPLE) if SUPERSAMPLE > 1 else self.image
+
+
+def _dashes(points, on: float, off: float):
+    """Split a polyline into dash segments of `on` length separated by `off` gaps."""
+    segments, current, drawing, left = [], [points[0]], True, on
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        length = math.hypot(x1 - x0, y1 - y0)
+        position = 0.0
+        while length - position > left:
+            position += left
+            point = (x0 + (x1 - x0) * position / length, y0 + (y1 - y0) * position / length)
+            if drawing:
+                segments.append(current + [point])
+            current = [point]
+            drawing, left = not drawing, (on if not drawing else off)
+        left -= length - position
+        current.append((x1, y1))
+    if drawing and len(current) > 1:
+        segments.append(current)
+    return segments
+
+
+def _stroke(canvas: _Canvas, points, element, color, closed=False):
+    if color is None or len(points) < 2:
+        return
+    width = canvas.width(element)
+    points = points + [points[0]] if closed else points
+    style = element.get("strokeStyle")
+    if style in ("dashed", "dotted"):
+        on, off = (width * 4, width * 3) if style == "dashed" else (width, width * 2)
+        for segment in _dashes(points, on, off):
+            canvas.draw.line(segment, fill=color, width=width, joint="curve")
+    else:
+        canvas.draw.line(points, fill=color, width=width, joint="curve")
+
+
+def _arrowhead(canvas: _Canvas, tip, previous, kind, element, color):
+    if not kind or color is None:
+        return
+    width = canvas.width(element)
+    dx, dy = tip[0] - previous[0], tip[1] - previous[1]
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return
+    ux, uy = dx / length, dy / length
+    size = min(30 * canvas.scale, length * 0.5) + width
+    if kind in ("dot", "circle", "circle_outline"):
+        radius = size / 3
+        box = [tip[0] - radius, tip[1] - radius, tip[0] + radius, tip[1] + radius]
+        canvas.draw.ellipse(box, fill=color if kind != "circle_outline" else None, outline=color, width=width)
+        return
+    if kind == "bar":
+        half = size / 2
+        canvas.draw.line([(tip[0] - uy * half, tip[1] + ux * half), (tip[0] + uy * half, tip[1] - ux * half)],
+                         fill=color, width=width)
+        return
+    wings = []
+    for side in (-1, 1):
+        theta = math.radians(25) * side
+        bx = -ux * math.cos(theta) + uy * math.sin(theta)
+        by = -uy * math.cos(theta) - ux * math.sin(theta)
+        wings.append((tip[0] + bx * size, tip[1] + by * size))
+    if kind.startswith("triangle"):
+        canvas.draw.polygon([tip] + wings, fill=color if kind == "triangle" else None, outline=color, width=width)
+    else:
+        canvas.draw.line([wings[0], tip, wings[1]], fill=color, width=width, joint="curve")
+
+
+def _text(canvas: _Canvas, element, color):
+    text = element.get("text") or ""
+    if color is None or not text.strip():
+        return
+    font_size = (element.get("fontSize") or 20) * canvas.scale
+    font = ImageFont.load_default(size=max(1, round(font_size)))
+    line_height = font_size * (element.get("lineHeight") or 1.25)
+    lines = text.split("\n")
+    box_width = max(1, math.ceil((element.get("width") or 0) * canvas.scale))
+    line_widths = [font.getlength(line) for line in lines]
+    box_width = max(box_width, math.ceil(max(line_widths)))
+    box_height = max(1, math.ceil(max((element.get("height") or 0) * canvas.scale, line_height * len(lines))))
+
+    mask = Image.new("L", (box_width, box_height), 0)
+    draw = ImageDraw.Draw(mask)
+    align = element.get("textAlign") or "left"
+    for index, (line, line_width) in enumerate(zip(lines, line_widths)):
+        left = {"center": (box_width - line_width) / 2, "right": box_width - line_width}.get(align, 0)
+        top = index * line_height + (line_height - font_size) / 2
+        draw.text((left, top), line, fill=color[3], font=font)
+
+    angle = element.get("angle") or 0
+    center = canvas.xy([_center(element)])[0]
+    if angle:
+        mask = mask.rotate(-math.degrees(angle), expand=True, resample=Image.Resampling.BILINEAR)
+    position = (round(center[0] - mask.width / 2), round(center[1] - mask.height / 2))
+    canvas.image.paste(color[:3], (*position, position[0] + mask.width, position[1] + mask.height), mask)
+
+
+def _draw(canvas: _Canvas, element):
+    kind = element["type"]
+    opacity = max(0, min(100, element.get("opacity", 100))) / 100
+    stroke = _color(element.get("strokeColor"), opacity)
+    if kind == "text":
+        _text(canvas, element, stroke)
+        return
+
+    points = canvas.xy(element_points(element))
+    if kind in ("rectangle", "ellipse", "diamond"):
+        fill = _color(element.get("backgroundColor"), opacity)
+        if fill is not None:
+            if element.get("fillStyle", "solid") != "solid":
+                fill = fill[:3] + (fill[3] // 2,)
+            canvas.draw.polygon(points, fill=fill)
+        _stroke(canvas, points, element, stroke, closed=True)
+        return
+
+    if kind == "freedraw":
+        if len(points) == 1:
+            radius = canvas.width(element) / 2
+            canvas.draw.ellipse([points[0][0] - radius, points[0][1] - radius,
+                                 points[0][0] + radius, points[0][1] + radius], fill=stroke)
+        else:
+            canvas.draw.line(points, fill=stroke, width=canvas.width(element), joint="curve")
+        return
+
+    fill = _color(element.get("backgroundColor"), opacity)
+    closed = len(points) > 2 and points[0] == points[-1]
+    if kind == "line" and closed and fill is not None:
+        canvas.draw.polygon(points, fill=fill)
+    _stroke(canvas, points, element, stroke)
+    if kind == "arrow" and len(points) > 1:
+        _arrowhead(canvas, points[-1], points[-2], element.get("endArrowhead", "arrow"), element, stroke)
+        _arrowhead(canvas, points[0], points[1], element.get("startArrowhead"), element, stroke)
+
+
+def _scale_for(bounds, max_scale: float, max_edge: int, max_pixels: int) -> float:
+    width = bounds[2] - bounds[0] + 2 * PADDING
+    height = bounds[3] - bounds[1] + 2 * PADDING
+    return min(max_scale, max_edge / max(width, height), math.sqrt(max_pixels / (width * height)))
+
+
+def render_scene(scene, max_scale: float = 2.0, max_edge: int = MODEL_MAX_EDGE, max_pixels: int = MODEL_MAX_PIXELS,
+                 background: str = "#ffffff") -> Optional[bytes]:
+    """PNG of the scene's visible elements, sized for Claude; None if there is nothing to draw."""
+    elements = visible_elements(scene)
+    bounds = scene_bounds(elements)
+    if bounds is None:
+        return None
+    with RENDER_SECONDS.time():
+        canvas = _Canvas(bounds, _scale_for(bounds, max_scale, max_edge, max_pixels), background)
+        for element in elements:
+            try:
+                _draw(canvas, element)
+            except (KeyError, TypeError, ValueError) as e:
+                #One malformed element shouldn't cost the whole page
+                print(f"Skipping element {element.get('id')} ({element.get('type')}): {e!r}")
+        out = io.BytesIO()
+        canvas.finish().save(out, format="PNG", optimize=False)
+    return out.getvalue()
+
+
+class SceneRasterizer:
+    """render_scene behind a cache keyed by scene version and render options."""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600.0, max_scale: float = 2.0):
+        self.cache = LRUTTLCache(max_entries=max_entries, ttl=ttl)
+        self.max_scale = max_scale
+
+    def render(self, scene) -> Optional[bytes]:
+        max_edge = getattr(settings, "SKETCH_MAX_EDGE", MODEL_MAX_EDGE)
+        max_pixels = getattr(settings, "SKETCH_MAX_PIXELS", MODEL_MAX_PIXELS)
+        key = (scene_version(scene), self.max_scale, max_edge, max_pixels)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached or None
+        png = render_scene(scene, self.max_scale, max_edge, max_pixels)
+        #Empty scenes are cached too, as b""
+        self.cache.set(key, png or b"")
+        return png
+
+
+_rasterizer: Optional[SceneRasterizer] = None
+_rasterizer_lock = threading.Lock()
+
+
+def get_rasterizer() -> SceneRasterizer:
+    """Process-wide rasterizer configured from the SCENE_RASTER_* settings."""
+    global _rasterizer
+    if _rasterizer is None:
+        with _rasterizer_lock:
+            if _rasterizer is None:
+                _rasterizer = SceneRasterizer(
+                    max_entries=getattr(settings, "SCENE_RASTER_CACHE_MAX_ENTRIES", 256),
+                    ttl=getattr(settings, "SCENE_RASTER_CACHE_TTL", 3600),
+                    max_scale=getattr(settings, "SCENE_RASTER_MAX_SCALE", 2.0),
+                )
+    return _rasterizer
+
+
+def _cache_stat(name: str):
+    return lambda: _rasterizer.cache.stats()[name] if _rasterizer is not None else None
+
+
+callback("scene_raster_cache_hits_total", "Scene renders served from the raster cache.", "counter", _cache_stat("hits"))
+callback("scene_raster_cache_misses_total", "Scene renders that had to be drawn.", "counter", _cache_stat("misses"))
+callback("scene_raster_cache_entries", "Renders held in the raster cache.", "gauge", _cache_stat("entries"))
@@ -0,0 +1,237 @@
+# services/sketchSimilarity.py
+#Near-duplicate cache for generated pages. Re-exporting the same sketch rarely gives the same bytes
+#(anti-aliasing, canvas bounds), so results are looked up by a perceptual hash of the preprocessed
+#image instead: a difference hash compared by Hamming distance against every cached sketch at once.
+#A 16x16 hash can't see labels, so a hit is only reused after its stored thumbnail also matches
+#region by region, and entries are scoped to the user or collab room that generated them.
+import hashlib
+import math
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import numpy as np
+from django.conf import settings
+from PIL import Image, ImageFilter
+
+from .metrics import callback, histogram
+
+#Brightness steps a neighbouring pixel must drop by to count as an edge, so near-white noise from
+#anti-aliasing doesn't flip bits in the empty parts of a sketch
+GRADIENT_TOLERANCE = 4
+#Aspect ratios are bucketed by quarter powers of two; a hash never matches across buckets
+ASPECT_BUCKETS_PER_OCTAVE = 4
+#Hits are verified on a blurred grayscale thumbnail this size, in blocks of BLOCK x BLOCK pixels.
+#The blur absorbs re-export anti-aliasing and a pixel of drift; different text in any one block
+#(a label, a button caption) moves that block's mean difference well past the threshold.
+VERIFY_EDGE = 128
+VERIFY_BLOCK = 8
+VERIFY_BLUR = 1.0
+
+REJECTED = histogram("sketch_similarity_rejected_block_difference",
+                     "Worst block difference of hash matches rejected on thumbnail comparison.",
+                     buckets=(8, 16, 24, 32, 48, 64, 96, 128))
+MATCH_DISTANCE = histogram("sketch_similarity_match_distance", "Hamming distance of near-duplicate cache hits (bits).",
+                           buckets=(0, 1, 2, 4, 6, 8, 12, 16, 24, 32))
+
+
+def difference_hash(img: Image.Image, size: int = 16) -> bytes:
+    """
+    `size` x `size` bit difference hash: whether brightness falls from each pixel to its right-hand
+    neighbour on a (size + 1) x size grayscale thumbnail. Packed into bytes, row by row.
+    """
+    thumb = img.convert("L").resize((size + 1, size), Image.Resampling.BOX)
+    pixels = np.asarray(thumb, dtype=np.int16)
+    edges = (pixels[:, :-1] - pixels[:, 1:]) > GRADIENT_TOLERANCE
+    return np.packbits(edges).tobytes()
+
+
+def verification_thumbnail(img: Image.Image) -> np.ndarray:
+    thumb = img.convert("L").resize((VERIFY_EDGE, VERIFY_EDGE), Image.Resampling.BOX)
+    return np.asarray(thumb.filter(ImageFilter.GaussianBlur(VERIFY_BLUR)), dtype=np.uint8)
+
+
+def block_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """Largest mean absolute difference over any VERIFY_BLOCK x VERIFY_BLOCK block of two thumbnails."""
+    diff = np.abs(a.astype(np.int16) - b.astype(np.int16))
+    rows, cols = diff.shape[0] // VERIFY_BLOCK, diff.shape[1] // VERIFY_BLOCK
+    blocks = diff[:rows * VERIFY_BLOCK, :cols * VERIFY_BLOCK].reshape(rows, VERIFY_BLOCK, cols, VERIFY_BLOCK)
+    return float(blocks.mean(axis=(1, 3)).max())
+
+
+def aspect_bucket(width: int, height: int) -> int:
+    return round(math.log2(max(1, width) / max(1, height)) * ASPECT_BUCKETS_PER_OCTAVE)
+
+
+def hamming(a: bytes, b: bytes) -> int:
+    return int(np.bitwise_count(np.bitwise_xor(_words(a), _words(b))).sum())
+
+
+def _words(digest: bytes) -> np.ndarray:
+    padded = digest + bytes(-len(digest) % 8)
+    return np.frombuffer(padded, dtype=np.uint64)
+
+
+def _group(parts) -> int:
+    """Signed 64-bit id for the context a result is only valid in (prompt, model, aspect ratio)."""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class HammingIndex:
+    """
+    Fixed-capacity table of hashes held as one uint64 matrix, so a lookup is a single vectorized
+    XOR + popcount over every entry. Entries expire after `ttl` seconds; when the table is full the
+    least recently used entry is overwritten.
+    """
+
+    def __init__(self, bits: int = 256, max_entries: int = 512, ttl: float = 3600.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.bits = bits
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        words = -(-bits // 64)
+        self._hashes = np.zeros((max_entries, words), dtype=np.uint64)
+        self._groups = np.zeros(max_entries, dtype=np.int64)
+        #Empty slots are simply expired ones
+        self._expires = np.full(max_entries, -np.inf)
+        self._used = np.full(max_entries, -np.inf)
+        self._values: list[Any] = [None] * max_entries
+        self._lock = threading.Lock()
+
+    def _distances(self, words: np.ndarray, group: int, now: float) -> np.ndarray:
+        distances = np.bitwise_count(np.bitwise_xor(self._hashes, words)).sum(axis=1, dtype=np.int64)
+        distances[(self._expires <= now) | (self._groups != group)] = self.bits + 1
+        return distances
+
+    def nearest(self, digest: bytes, group: int, max_distance: int) -> Optional[tuple[Any, int]]:
+        """(value, distance) of the closest live entry within `max_distance` bits, else None."""
+        words = _words(digest)
+        with self._lock:
+            now = self._clock()
+            distances = self._distances(words, group, now)
+            slot = int(np.argmin(distances))
+            distance = int(distances[slot])
+            if distance > max_distance:
+                return None
+            self._used[slot] = now
+            return self._values[slot], distance
+
+    def add(self, digest: bytes, group: int, value: Any) -> None:
+        words = _words(digest)
+        with self._lock:
+            now = self._clock()
+            distances = self._distances(words, group, now)
+            slot = int(np.argmin(distances))
+            if distances[slot] != 0:
+                #No identical hash to refresh: take an expired slot, else the least recently used one
+                expired = np.flatnonzero(self._expires <= now)
+                slot = int(expired[0]) if expired.size else int(np.argmin(self._used))
+            self._hashes[slot] = words
+            self._groups[slot] = group
+            self._expires[slot] = now + self.ttl
+            self._used[slot] = now
+            self._values[slot] = value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._expires[:] = -np.inf
+            self._used[:] = -np.inf
+            self._values = [None] * self.max_entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(np.count_nonzero(self._expires > self._clock()))
+
+
+class SimilarityCache:
+    """
+    Generated HTML keyed by how a sketch looks. Hits are sketches within `max_distance` bits whose
+    verification thumbnails also differ by at most `max_block_difference` in every block.
+    """
+
+    def __init__(self, hash_size: int = 16, max_distance: int = 4, max_entries: int = 512, ttl: float = 3600.0,
+                 max_block_difference: float = 16.0):
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+        self.max_block_difference = max_block_difference
+        self.index = HammingIndex(hash_size * hash_size, max_entries, ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, img: Image.Image) -> tuple[bytes, int, np.ndarray]:
+        """What preprocessing records for a sketch: its hash, aspect-ratio bucket and verification thumbnail."""
+        return (difference_hash(img, self.hash_size), aspect_bucket(img.width, img.height),
+                verification_thumbnail(img))
+
+    def get(self, fingerprint: Optional[tuple[bytes, int, np.ndarray]], *context) -> Optional[Any]:
+        """`context` is everything else the result depends on, including who it belongs to."""
+        if fingerprint is None:
+            return None
+        digest, aspect, thumbnail = fingerprint
+        found = self.index.nearest(digest, _group((aspect, context)), self.max_distance)
+        if found is not None:
+            (stored, value), distance = found
+            difference = block_difference(thumbnail, stored)
+            if difference > self.max_block_difference:
+                REJECTED.observe(difference)
+                found = None
+        with self._lock:
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        MATCH_DISTANCE.observe(distance)
+        return value
+
+    def set(self, fingerprint: Optional[tuple[bytes, int, np.ndarray]], value: Any, *context) -> None:
+        if fingerprint is None:
+            return
+        digest, aspect, thumbnail = fingerprint
+        self.index.add(digest, _group((aspect, context)), (thumbnail, value))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.index),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+_similarity_cache: Optional[SimilarityCache] = None
+_similarity_cache_lock = threading.Lock()
+
+
+def get_similarity_cache() -> Optional[SimilarityCache]:
+    """Process-wide cache configured from the SKETCH_SIMILARITY_* settings; None when disabled."""
+    global _similarity_cache
+    if not getattr(settings, "SKETCH_SIMILARITY_ENABLED", True):
+        return None
+    if _similarity_cache is None:
+        with _similarity_cache_lock:
+            if _similarity_cache is None:
+                _similarity_cache = SimilarityCache(
+                    hash_size=getattr(settings, "SKETCH_SIMILARITY_HASH_SIZE", 16),
+                    max_distance=getattr(settings, "SKETCH_SIMILARITY_MAX_DISTANCE", 4),
+                    max_entries=getattr(settings, "SKETCH_SIMILARITY_CACHE_MAX_ENTRIES", 512),
+                    ttl=getattr(settings, "SKETCH_SIMILARITY_CACHE_TTL", 3600),
+                    max_block_difference=getattr(settings, "SKETCH_SIMILARITY_MAX_BLOCK_DIFFERENCE", 16.0),
+                )
+    return _similarity_cache
+
+
+def _stats() -> dict:
+    return _similarity_cache.stats() if _similarity_cache is not None else {"entries": 0, "hits": 0, "misses": 0}
+
+
+callback("sketch_similarity_cache_lookups_total", "Near-duplicate sketch cache lookups by result.", "counter",
+         lambda: [(("hit",), _stats()["hits"]), (("miss",), _stats()["misses"])], ("result",))
+callback("sketch_similarity_cache_hit_ratio", "Share of near-duplicate cache lookups that were hits.", "gauge",
+         lambda: _stats().get("hit_rate", 0.0))
+callback("sketch_similarity_cache_entries", "Sketches in the near-duplicate cache.", "gauge",
+         lambda: _stats()["entries"])
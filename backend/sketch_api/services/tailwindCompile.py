@@ -0,0 +1,1209 @@
+# services/tailwindCompile.py
+#Compiles the Tailwind classes a generated page actually uses into one small inline stylesheet, so
+#mockup and variation iframes no longer each boot the Tailwind CDN runtime to scan their DOM and
+#build CSS in the browser. Covers the Tailwind v3 default theme and the utilities the generation
+#prompt produces; a page using anything else keeps the CDN runtime, exactly as before.
+#Everything here is v3 on purpose: the model writes v3 pages (it loads cdn.tailwindcss.com itself), and
+#the v3 runtime is the fallback both here and in the editor (frontend utils/tailwindRuntime.ts), so a
+#page looks the same compiled or not. Pages that load the v4 browser build are left alone.
+import re
+from html.parser import HTMLParser
+from typing import Callable, Optional
+
+from django.conf import settings
+
+from .metrics import counter
+
+#Marks the stylesheet this module wrote, so recompiling a page (e.g. after a partial patch) replaces it
+COMPILED_ATTR = "data-tailwind-compiled"
+#Marks a variation's copy of the preflight: needed to preview it alone, left out when it lands in a page
+PREFLIGHT_ATTR = "data-tailwind-preflight"
+CDN_SCRIPT = '<script src="https://cdn.tailwindcss.com"></script>'
+
+COMPILED = counter("tailwind_compile_pages_total",
+                   "Generated pages and variations by CSS outcome (compiled, fallback to the CDN runtime, skipped).",
+                   ("kind", "outcome"))
+UNKNOWN = counter("tailwind_compile_unknown_classes_total", "Classes that sent a page back to the CDN runtime.")
+
+_RUNTIME = re.compile(
+    r"<script\b[^>]*\bsrc=[\"'][^\"']*cdn\.tailwindcss\.com[^\"']*[\"'][^>]*>\s*</script>\s*"
+    r"|<link\b[^>]*\bhref=[\"'][^\"']*tailwind[^\"']*\.css[^\"']*[\"'][^>]*>\s*",
+    re.IGNORECASE,
+)
+_V4_RUNTIME = re.compile(r"<script\b[^>]*\bsrc=[\"'][^\"']*@tailwindcss/browser", re.IGNORECASE)
+_CONFIG = re.compile(r"<script\b[^>]*>[^<]*\btailwind\.config\b", re.IGNORECASE)
+_COMPILED_STYLE = re.compile(r"<style\b[^>]*\b" + COMPILED_ATTR + r"\b[^>]*>.*?</style>", re.IGNORECASE | re.DOTALL)
+_STYLE_BLOCK = re.compile(r"<style\b[^>]*>(.*?)</style>", re.IGNORECASE | re.DOTALL)
+_BODY_OPEN = re.compile(r"<body\b[^>]*>", re.IGNORECASE)
+_HEAD_CLOSE = re.compile(r"</head\s*>", re.IGNORECASE)
+
+#Class names that mean something to Tailwind without producing CSS of their own
+MARKER_CLASSES = {"group", "peer", "dark"}
+
+# --- theme (Tailwind v3 defaults) -------------------------------------------------------------
+
+_SHADES = ("50", "100", "200", "300", "400", "500", "600", "700", "800", "900", "950")
+_PALETTE = {
+    "slate": "f8fafc f1f5f9 e2e8f0 cbd5e1 94a3b8 64748b 475569 334155 1e293b 0f172a 020617",
+    "gray": "f9fafb f3f4f6 e5e7eb d1d5db 9ca3af 6b7280 4b5563 374151 1f2937 111827 030712",
+    "zinc": "fafafa f4f4f5 e4e4e7 d4d4d8 a1a1aa 71717a 52525b 3f3f46 27272a 18181b 09090b",
+    "neutral": "fafafa f5f5f5 e5e5e5 d4d4d4 a3a3a3 737373 525252 404040 262626 171717 0a0a0a",
+    "stone": "fafaf9 f5f5f4 e7e5e4 d6d3d1 a8a29e 78716c 57534e 44403c 292524 1c1917 0c0a09",
+    "red": "fef2f2 fee2e2 fecaca fca5a5 f87171 ef4444 dc2626 b91c1c 991b1b 7f1d1d 450a0a",
+    "orange": "fff7ed ffedd5 fed7aa fdba74 fb923c f97316 ea580c c2410c 9a3412 7c2d12 431407",
+    "amber": "fffbeb fef3c7 fde68a fcd34d fbbf24 f59e0b d97706 b45309 92400e 78350f 451a03",
+    "yellow": "fefce8 fef9c3 fef08a fde047 facc15 eab308 ca8a04 a16207 854d0e 713f12 422006",
+    "lime": "f7fee7 ecfccb d9f99d bef264 a3e635 84cc16 65a30d 4d7c0f 3f6212 365314 1a2e05",
+    "green": "f0fdf4 dcfce7 bbf7d0 86efac 4ade80 22c55e 16a34a 15803d 166534 14532d 052e16",
+    "emerald": "ecfdf5 d1fae5 a7f3d0 6ee7b7 34d399 10b981 059669 047857 065f46 064e3b 022c22",
+    "teal": "f0fdfa ccfbf1 99f6e4 5eead4 2dd4bf 14b8a6 0d9488 0f766e 115e59 134e4a 042f2e",
+    "cyan": "ecfeff cffafe a5f3fc 67e8f9 22d3ee 06b6d4 0891b2 0e7490 155e75 164e63 083344",
+    "sky": "f0f9ff e0f2fe bae6fd 7dd3fc 38bdf8 0ea5e9 0284c7 0369a1 075985 0c4a6e 082f49",
+    "blue": "eff6ff dbeafe bfdbfe 93c5fd 60a5fa 3b82f6 2563eb 1d4ed8 1e40af 1e3a8a 172554",
+    "indigo": "eef2ff e0e7ff c7d2fe a5b4fc 818cf8 6366f1 4f46e5 4338ca 3730a3 312e81 1e1b4b",
+    "violet": "f5f3ff ede9fe ddd6fe c4b5fd a78bfa 8b5cf6 7c3aed 6d28d9 5b21b6 4c1d95 2e1065",
+    "purple": "faf5ff f3e8ff e9d5ff d8b4fe c084fc a855f7 9333ea 7e22ce 6b21a8 581c87 3b0764",
+    "fuchsia": "fdf4ff fae8ff f5d0fe f0abfc e879f9 d946ef c026d3 a21caf 86198f 701a75 4a044e",
+    "pink": "fdf2f8 fce7f3 fbcfe8 f9a8d4 f472b6 ec4899 db2777 be185d 9d174d 831843 500724",
+    "rose": "fff1f2 ffe4e6 fecdd3 fda4af fb7185 f43f5e e11d48 be123c 9f1239 881337 4c0519",
+}
+COLORS = {f"{name}-{shade}": "#" + value
+          for name, values in _PALETTE.items() for shade, value in zip(_SHADES, values.split())}
+COLORS.update({"black": "#000000", "white": "#ffffff"})
+SPECIAL_COLORS = {"transparent": "transparent", "current": "currentColor", "inherit": "inherit"}
+
+SCREENS = {"sm": 640, "md": 768, "lg": 1024, "xl": 1280, "2xl": 1536}
+PSEUDO_CLASSES = {
+    "hover": ":hover", "focus": ":focus", "active": ":active", "visited": ":visited", "disabled": ":disabled",
+    "focus-within": ":focus-within", "focus-visible": ":focus-visible", "checked": ":checked",
+    "first": ":first-child", "last": ":last-child", "odd": ":nth-child(odd)", "even": ":nth-child(even)",
+    "placeholder": "::placeholder", "before": "::before", "after": "::after",
+}
+GROUP_STATES = {"group-hover": ":hover", "group-focus": ":focus", "peer-checked": ":checked",
+                "peer-focus": ":focus", "peer-hover": ":hover"}
+
+FONT_SIZES = {"xs": ("0.75rem", "1rem"), "sm": ("0.875rem", "1.25rem"), "base": ("1rem", "1.5rem"),
+              "lg": ("1.125rem", "1.75rem"), "xl": ("1.25rem", "1.75rem"), "2xl": ("1.5rem", "2rem"),
+              "3xl": ("1.875rem", "2.25rem"), "4xl": ("2.25rem", "2.5rem"), "5xl": ("3rem", "1"),
+              "6xl": ("3.75rem", "1"), "7xl": ("4.5rem", "1"), "8xl": ("6rem", "1"), "9xl": ("8rem", "1")}
+FONT_WEIGHTS = {"thin": "100", "extralight": "200", "light": "300", "normal": "400", "medium": "500",
+                "semibold": "600", "bold": "700", "extrabold": "800", "black": "900"}
+FONT_FAMILIES = {
+    "sans": 'ui-sans-serif, system-ui, sans-serif, "Apple Color Emoji", "Segoe UI Emoji", "Segoe UI Symbol", '
+            '"Noto Color Emoji"',
+    "serif": 'ui-serif, Georgia, Cambria, "Times New Roman", Times, serif',
+    "mono": 'ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, "Liberation Mono", "Courier New", monospace',
+}
+LEADING = {"none": "1", "tight": "1.25", "snug": "1.375", "normal": "1.5", "relaxed": "1.625", "loose": "2"}
+TRACKING = {"tighter": "-0.05em", "tight": "-0.025em", "normal": "0em", "wide": "0.025em", "wider": "0.05em",
+            "widest": "0.1em"}
+RADII = {"none": "0px", "sm": "0.125rem", "": "0.25rem", "md": "0.375rem", "lg": "0.5rem", "xl": "0.75rem",
+         "2xl": "1rem", "3xl": "1.5rem", "full": "9999px"}
+SHADOWS = {
+    "sm": "0 1px 2px 0 rgb(0 0 0 / 0.05)",
+    "": "0 1px 3px 0 rgb(0 0 0 / 0.1), 0 1px 2px -1px rgb(0 0 0 / 0.1)",
+    "md": "0 4px 6px -1px rgb(0 0 0 / 0.1), 0 2px 4px -2px rgb(0 0 0 / 0.1)",
+    "lg": "0 10px 15px -3px rgb(0 0 0 / 0.1), 0 4px 6px -4px rgb(0 0 0 / 0.1)",
+    "xl": "0 20px 25px -5px rgb(0 0 0 / 0.1), 0 8px 10px -6px rgb(0 0 0 / 0.1)",
+    "2xl": "0 25px 50px -12px rgb(0 0 0 / 0.25)",
+    "inner": "inset 0 2px 4px 0 rgb(0 0 0 / 0.05)",
+    "none": "0 0 #0000",
+}
+MAX_WIDTHS = {"none": "none", "xs": "20rem", "sm": "24rem", "md": "28rem", "lg": "32rem", "xl": "36rem",
+              "2xl": "42rem", "3xl": "48rem", "4xl": "56rem", "5xl": "64rem", "6xl": "72rem", "7xl": "80rem",
+              "prose": "65ch", **{f"screen-{name}": f"{width}px" for name, width in SCREENS.items()}}
+BLURS = {"none": "0", "sm": "4px", "": "8px", "md": "12px", "lg": "16px", "xl": "24px", "2xl": "40px", "3xl": "64px"}
+EASINGS = {"linear": "linear", "in": "cubic-bezier(0.4, 0, 1, 1)", "out": "cubic-bezier(0, 0, 0.2, 1)",
+           "in-out": "cubic-bezier(0.4, 0, 0.2, 1)"}
+TRANSITIONS = {
+    "": "color, background-color, border-color, text-decoration-color, fill, stroke, opacity, box-shadow, "
+        "transform, filter, backdrop-filter",
+    "all": "all", "colors": "color, background-color, border-color, text-decoration-color, fill, stroke",
+    "opacity": "opacity", "shadow": "box-shadow", "transform": "transform",
+}
+GRADIENT_DIRECTIONS = {"t": "top", "tr": "top right", "r": "right", "br": "bottom right", "b": "bottom",
+                       "bl": "bottom left", "l": "left", "tl": "top left"}
+
+TRANSFORM = ("translate(var(--tw-translate-x), var(--tw-translate-y)) rotate(var(--tw-rotate)) "
+             "skewX(var(--tw-skew-x)) skewY(var(--tw-skew-y)) scaleX(var(--tw-scale-x)) scaleY(var(--tw-scale-y))")
+BOX_SHADOW = "var(--tw-ring-offset-shadow), var(--tw-ring-shadow), var(--tw-shadow)"
+
+#Tailwind's base reset (preflight), which the CDN runtime injects too; the utilities assume it
+PREFLIGHT = (
+    "*,::before,::after{box-sizing:border-box;border-width:0;border-style:solid;border-color:#e5e7eb;"
+    "--tw-translate-x:0;--tw-translate-y:0;--tw-rotate:0;--tw-skew-x:0;--tw-skew-y:0;--tw-scale-x:1;--tw-scale-y:1;"
+    "--tw-ring-offset-width:0px;--tw-ring-offset-color:#fff;--tw-ring-color:rgb(59 130 246 / 0.5);"
+    "--tw-ring-offset-shadow:0 0 #0000;--tw-ring-shadow:0 0 #0000;--tw-shadow:0 0 #0000}"
+    "::before,::after{--tw-content:''}"
+    "html,:host{line-height:1.5;-webkit-text-size-adjust:100%;tab-size:4;font-family:" + FONT_FAMILIES["sans"] + ";"
+    "font-feature-settings:normal;-webkit-tap-highlight-color:transparent}"
+    "body{margin:0;line-height:inherit}"
+    "hr{height:0;color:inherit;border-top-width:1px}"
+    "abbr:where([title]){text-decoration:underline dotted}"
+    "h1,h2,h3,h4,h5,h6{font-size:inherit;font-weight:inherit}"
+    "a{color:inherit;text-decoration:inherit}"
+    "b,strong{font-weight:bolder}"
+    "code,kbd,samp,pre{font-family:" + FONT_FAMILIES["mono"] + ";font-size:1em}"
+    "small{font-size:80%}"
+    "sub,sup{font-size:75%;line-height:0;position:relative;vertical-align:baseline}sub{bottom:-0.25em}sup{top:-0.5em}"
+    "table{text-indent:0;border-color:inherit;border-collapse:collapse}"
+    "button,input,optgroup,select,textarea{font-family:inherit;font-feature-settings:inherit;"
+    "font-variation-settings:inherit;font-size:100%;font-weight:inherit;line-height:inherit;letter-spacing:inherit;"
+    "color:inherit;margin:0;padding:0}"
+    "button,select{text-transform:none}"
+    "button,input:where([type='button']),input:where([type='reset']),input:where([type='submit'])"
+    "{-webkit-appearance:button;background-color:transparent;background-image:none}"
+    ":-moz-focusring{outline:auto}:-moz-ui-invalid{box-shadow:none}progress{vertical-align:baseline}"
+    "::-webkit-inner-spin-button,::-webkit-outer-spin-button{height:auto}"
+    "[type='search']{-webkit-appearance:textfield;outline-offset:-2px}"
+    "::-webkit-search-decoration{-webkit-appearance:none}"
+    "::-webkit-file-upload-button{-webkit-appearance:button;font:inherit}"
+    "summary{display:list-item}"
+    "blockquote,dl,dd,h1,h2,h3,h4,h5,h6,hr,figure,p,pre{margin:0}"
+    "fieldset{margin:0;padding:0}legend{padding:0}"
+    "ol,ul,menu{list-style:none;margin:0;padding:0}"
+    "dialog{padding:0}textarea{resize:vertical}"
+    "input::placeholder,textarea::placeholder{opacity:1;color:#9ca3af}"
+    "button,[role='button']{cursor:pointer}:disabled{cursor:default}"
+    "img,svg,video,canvas,audio,iframe,embed,object{display:block;vertical-align:middle}"
+    "img,video{max-width:100%;height:auto}"
+    "[hidden]:where(:not([hidden='until-found'])){display:none}"
+)
+
+#Utilities with no value part
+STATIC = {
+    "block": "display:block", "inline-block": "display:inline-block", "inline": "display:inline",
+    "flex": "display:flex", "inline-flex": "display:inline-flex", "grid": "display:grid",
+    "inline-grid": "display:inline-grid", "table": "display:table", "table-row": "display:table-row",
+    "table-cell": "display:table-cell", "contents": "display:contents", "list-item": "display:list-item",
+    "hidden": "display:none", "flow-root": "display:flow-root",
+    "static": "position:static", "fixed": "position:fixed", "absolute": "position:absolute",
+    "relative": "position:relative", "sticky": "position:sticky",
+    "visible": "visibility:visible", "invisible": "visibility:hidden", "collapse": "visibility:collapse",
+    "isolate": "isolation:isolate",
+    "flex-row": "flex-direction:row", "flex-row-reverse": "flex-direction:row-reverse",
+    "flex-col": "flex-direction:column", "flex-col-reverse": "flex-direction:column-reverse",
+    "flex-wrap": "flex-wrap:wrap", "flex-wrap-reverse": "flex-wrap:wrap-reverse", "flex-nowrap": "flex-wrap:nowrap",
+    "flex-1": "flex:1 1 0%", "flex-auto": "flex:1 1 auto", "flex-initial": "flex:0 1 auto", "flex-none": "flex:none",
+    "grow": "flex-grow:1", "grow-0": "flex-grow:0", "flex-grow": "flex-grow:1", "flex-grow-0": "flex-grow:0",
+    "shrink": "flex-shrink:1", "shrink-0": "flex-shrink:0", "flex-shrink": "flex-shrink:1",
+    "flex-shrink-0": "flex-shrink:0",
+    "items-start": "align-items:flex-start", "items-end": "align-items:flex-end", "items-center": "align-items:center",
+    "items-baseline": "align-items:baseline", "items-stretch": "align-items:stretch",
+    "justify-start": "justify-content:flex-start", "justify-end": "justify-content:flex-end",
+    "justify-center": "justify-content:center", "justify-between": "justify-content:space-between",
+    "justify-around": "justify-content:space-around", "justify-evenly": "justify-content:space-evenly",
+    "justify-items-start": "justify-items:start", "justify-items-end": "justify-items:end",
+    "justify-items-center": "justify-items:center", "justify-items-stretch": "justify-items:stretch",
+    "justify-self-auto": "justify-self:auto", "justify-self-start": "justify-self:start",
+    "justify-self-end": "justify-self:end", "justify-self-center": "justify-self:center",
+    "content-center": "align-content:center", "content-start": "align-content:flex-start",
+    "content-end": "align-content:flex-end", "content-between": "align-content:space-between",
+    "content-around": "align-content:space-around", "content-evenly": "align-content:space-evenly",
+    "self-auto": "align-self:auto", "self-start": "align-self:flex-start", "self-end": "align-self:flex-end",
+    "self-center": "align-self:center", "self-stretch": "align-self:stretch", "self-baseline": "align-self:baseline",
+    "place-items-center": "place-items:center", "place-content-center": "place-content:center",
+    "place-self-center": "place-self:center",
+    "grid-flow-row": "grid-auto-flow:row", "grid-flow-col": "grid-auto-flow:column",
+    "grid-flow-dense": "grid-auto-flow:dense", "grid-cols-none": "grid-template-columns:none",
+    "grid-rows-none": "grid-template-rows:none", "col-auto": "grid-column:auto", "row-auto": "grid-row:auto",
+    "col-span-full": "grid-column:1 / -1", "row-span-full": "grid-row:1 / -1",
+    "order-first": "order:-9999", "order-last": "order:9999", "order-none": "order:0",
+    "overflow-auto": "overflow:auto", "overflow-hidden": "overflow:hidden", "overflow-clip": "overflow:clip",
+    "overflow-visible": "overflow:visible", "overflow-scroll": "overflow:scroll",
+    "overflow-x-auto": "overflow-x:auto", "overflow-y-auto": "overflow-y:auto",
+    "overflow-x-hidden": "overflow-x:hidden", "overflow-y-hidden": "overflow-y:hidden",
+    "overflow-x-scroll": "overflow-x:scroll", "overflow-y-scroll": "overflow-y:scroll",
+    "overflow-x-visible": "overflow-x:visible", "overflow-y-visible": "overflow-y:visible",
+    "text-left": "text-align:left", "text-center": "text-align:center", "text-right": "text-align:right",
+    "text-justify": "text-align:justify", "text-start": "text-align:start", "text-end": "text-align:end",
+    "uppercase": "text-transform:uppercase", "lowercase": "text-transform:lowercase",
+    "capitalize": "text-transform:capitalize", "normal-case": "text-transform:none",
+    "italic": "font-style:italic", "not-italic": "font-style:normal",
+    "underline": "text-decoration-line:underline", "overline": "text-decoration-line:overline",
+    "line-through": "text-decoration-line:line-through", "no-underline": "text-decoration-line:none",
+    "antialiased": "-webkit-font-smoothing:antialiased;-moz-osx-font-smoothing:grayscale",
+    "subpixel-antialiased": "-webkit-font-smoothing:auto;-moz-osx-font-smoothing:auto",
+    "truncate": "overflow:hidden;text-overflow:ellipsis;white-space:nowrap",
+    "text-ellipsis": "text-overflow:ellipsis", "text-clip": "text-overflow:clip",
+    "whitespace-normal": "white-space:normal", "whitespace-nowrap": "white-space:nowrap",
+    "whitespace-pre": "white-space:pre", "whitespace-pre-line": "white-space:pre-line",
+    "whitespace-pre-wrap": "white-space:pre-wrap", "break-normal": "overflow-wrap:normal;word-break:normal",
+    "break-words": "overflow-wrap:break-word", "break-all": "word-break:break-all",
+    "align-top": "vertical-align:top", "align-middle": "vertical-align:middle", "align-bottom": "vertical-align:bottom",
+    "align-baseline": "vertical-align:baseline", "align-text-top": "vertical-align:text-top",
+    "list-none": "list-style-type:none", "list-disc": "list-style-type:disc", "list-decimal": "list-style-type:decimal",
+    "list-inside": "list-style-position:inside", "list-outside": "list-style-position:outside",
+    "border-solid": "border-style:solid", "border-dashed": "border-style:dashed", "border-dotted": "border-style:dotted",
+    "border-double": "border-style:double", "border-none": "border-style:none", "border-hidden": "border-style:hidden",
+    "border-collapse": "border-collapse:collapse", "border-separate": "border-collapse:separate",
+    "table-auto": "table-layout:auto", "table-fixed": "table-layout:fixed",
+    "outline-none": "outline:2px solid transparent;outline-offset:2px", "outline": "outline-style:solid",
+    "ring-inset": "--tw-ring-inset:inset",
+    "bg-cover": "background-size:cover", "bg-contain": "background-size:contain", "bg-auto": "background-size:auto",
+    "bg-center": "background-position:center", "bg-top": "background-position:top",
+    "bg-bottom": "background-position:bottom", "bg-left": "background-position:left",
+    "bg-right": "background-position:right", "bg-no-repeat": "background-repeat:no-repeat",
+    "bg-repeat": "background-repeat:repeat", "bg-fixed": "background-attachment:fixed",
+    "bg-none": "background-image:none", "bg-clip-text": "-webkit-background-clip:text;background-clip:text",
+    "object-cover": "object-fit:cover", "object-contain": "object-fit:contain", "object-fill": "object-fit:fill",
+    "object-none": "object-fit:none", "object-center": "object-position:center", "object-top": "object-position:top",
+    "aspect-auto": "aspect-ratio:auto", "aspect-square": "aspect-ratio:1 / 1", "aspect-video": "aspect-ratio:16 / 9",
+    "cursor-pointer": "cursor:pointer", "cursor-default": "cursor:default", "cursor-not-allowed": "cursor:not-allowed",
+    "cursor-wait": "cursor:wait", "cursor-text": "cursor:text", "cursor-move": "cursor:move",
+    "cursor-help": "cursor:help", "cursor-grab": "cursor:grab", "cursor-auto": "cursor:auto",
+    "pointer-events-none": "pointer-events:none", "pointer-events-auto": "pointer-events:auto",
+    "select-none": "user-select:none", "select-text": "user-select:text", "select-all": "user-select:all",
+    "resize": "resize:both", "resize-none": "resize:none", "resize-y": "resize:vertical", "resize-x": "resize:horizontal",
+    "appearance-none": "appearance:none", "box-border": "box-sizing:border-box", "box-content": "box-sizing:content-box",
+    "float-left": "float:left", "float-right": "float:right", "float-none": "float:none", "clear-both": "clear:both",
+    "scroll-smooth": "scroll-behavior:smooth", "snap-x": "scroll-snap-type:x mandatory",
+    "snap-start": "scroll-snap-align:start", "snap-center": "scroll-snap-align:center",
+    "transform": "transform:" + TRANSFORM, "transform-none": "transform:none",
+    "transition-none": "transition-property:none", "shadow-none": "--tw-shadow:0 0 #0000;box-shadow:" + BOX_SHADOW,
+    "sr-only": "position:absolute;width:1px;height:1px;padding:0;margin:-1px;overflow:hidden;"
+               "clip:rect(0, 0, 0, 0);white-space:nowrap;border-width:0",
+    "not-sr-only": "position:static;width:auto;height:auto;padding:0;margin:0;overflow:visible;clip:auto;"
+                   "white-space:normal",
+    "mix-blend-multiply": "mix-blend-mode:multiply", "filter": "filter:var(--tw-filter, none)",
+}
+
+SPACING_PROPS = {
+    "p": ("padding",), "px": ("padding-left", "padding-right"), "py": ("padding-top", "padding-bottom"),
+    "pt": ("padding-top",), "pr": ("padding-right",), "pb": ("padding-bottom",), "pl": ("padding-left",),
+    "ps": ("padding-inline-start",), "pe": ("padding-inline-end",),
+    "m": ("margin",), "mx": ("margin-left", "margin-right"), "my": ("margin-top", "margin-bottom"),
+    "mt": ("margin-top",), "mr": ("margin-right",), "mb": ("margin-bottom",), "ml": ("margin-left",),
+    "ms": ("margin-inline-start",), "me": ("margin-inline-end",),
+    "gap": ("gap",), "gap-x": ("column-gap",), "gap-y": ("row-gap",),
+    "inset": ("inset",), "inset-x": ("left", "right"), "inset-y": ("top", "bottom"),
+    "top": ("top",), "right": ("right",), "bottom": ("bottom",), "left": ("left",),
+    "start": ("inset-inline-start",), "end": ("inset-inline-end",),
+    "scroll-mt": ("scroll-margin-top",), "scroll-pt": ("scroll-padding-top",),
+}
+SIZE_PROPS = {"w": ("width",), "h": ("height",), "size": ("width", "height"), "min-w": ("min-width",),
+              "min-h": ("min-height",), "max-h": ("max-height",), "basis": ("flex-basis",)}
+#Prefixes that take a leading "-" for negative values
+NEGATABLE = set(SPACING_PROPS) - {"p", "px", "py", "pt", "pr", "pb", "pl", "ps", "pe", "gap", "gap-x", "gap-y"} | {
+    "space-x", "space-y", "translate-x", "translate-y", "rotate", "z", "order", "tracking", "skew-x", "skew-y"}
+
+#Colour utilities: prefix -> (property, opacity variable or None)
+COLOR_PROPS = {
+    "bg": ("background-color", "--tw-bg-opacity"), "text": ("color", "--tw-text-opacity"),
+    "border": ("border-color", "--tw-border-opacity"), "border-x": ("border-left-color border-right-color", None),
+    "border-y": ("border-top-color border-bottom-color", None), "border-t": ("border-top-color", None),
+    "border-r": ("border-right-color", None), "border-b": ("border-bottom-color", None),
+    "border-l": ("border-left-color", None), "outline": ("outline-color", None),
+    "decoration": ("text-decoration-color", None), "accent": ("accent-color", None), "caret": ("caret-color", None),
+    "fill": ("fill", None), "stroke": ("stroke", None), "placeholder": ("color", "--tw-placeholder-opacity"),
+    "divide": ("border-color", "--tw-divide-opacity"), "ring": ("--tw-ring-color", "--tw-ring-opacity"),
+    "ring-offset": ("--tw-ring-offset-color", None),
+}
+BORDER_SIDES = {"": ("border-width",), "x": ("border-left-width", "border-right-width"),
+                "y": ("border-top-width", "border-bottom-width"), "t": ("border-top-width",),
+                "r": ("border-right-width",), "b": ("border-bottom-width",), "l": ("border-left-width",)}
+RADIUS_SIDES = {"": ("border-radius",), "t": ("border-top-left-radius", "border-top-right-radius"),
+                "r": ("border-top-right-radius", "border-bottom-right-radius"),
+                "b": ("border-bottom-right-radius", "border-bottom-left-radius"),
+                "l": ("border-top-left-radius", "border-bottom-left-radius"),
+                "tl": ("border-top-left-radius",), "tr": ("border-top-right-radius",),
+                "br": ("border-bottom-right-radius",), "bl": ("border-bottom-left-radius",)}
+
+#Selectors for utilities that style an element's children rather than the element
+CHILDREN = " > :not([hidden]) ~ :not([hidden])"
+
+_NUMBER = re.compile(r"^\d+(\.\d+)?$")
+_FRACTION = re.compile(r"^(\d+)/(\d+)$")
+
+
+# --- values -----------------------------------------------------------------------------------
+
+def _arbitrary(value: str) -> Optional[str]:
+    """`[12px]` -> `12px` (underscores are spaces, as in Tailwind); None if not bracketed."""
+    if len(value) > 2 and value[0] == "[" and value[-1] == "]":
+        inner = value[1:-1].replace("_", " ")
+        if ";" in inner or "{" in inner or "}" in inner:
+            return None
+        return inner
+    return None
+
+
+def _spacing(value: str) -> Optional[str]:
+    arbitrary = _arbitrary(value)
+    if arbitrary is not None:
+        return arbitrary
+    if value == "px":
+        return "1px"
+    if value == "0":
+        return "0px"
+    if _NUMBER.match(value) and float(value) <= 96 and (float(value) * 2).is_integer():
+        return f"{float(value) / 4:g}rem"
+    return None
+
+
+def _fraction(value: str) -> Optional[str]:
+    match = _FRACTION.match(value)
+    if match and 0 < int(match.group(1)) <= int(match.group(2)) <= 12:
+        return f"{int(match.group(1)) / int(match.group(2)) * 100:g}%"
+    return None
+
+
+def _size(prefix: str, value: str) -> Optional[str]:
+    keyword = {"auto": "auto", "full": "100%", "min": "min-content", "max": "max-content", "fit": "fit-content"}
+    if value in keyword:
+        return keyword[value]
+    if value == "screen":
+        return "100vw" if prefix in ("w", "min-w") else "100vh"
+    if value in ("svh", "dvh", "lvh", "svw", "dvw", "lvw"):
+        return f"100{value}"
+    return _spacing(value) or _fraction(value)
+
+
+def _hex_rgb(color: str) -> Optional[tuple[int, int, int]]:
+    if re.fullmatch(r"#[0-9a-fA-F]{6}", color):
+        return int(color[1:3], 16), int(color[3:5], 16), int(color[5:7], 16)
+    if re.fullmatch(r"#[0-9a-fA-F]{3}", color):
+        return tuple(int(c * 2, 16) for c in color[1:])
+    return None
+
+
+def _color(value: str) -> Optional[tuple[str, Optional[str]]]:
+    """(colour, explicit alpha or None) for `blue-500`, `blue-500/50`, `white`, `[#123456]`."""
+    alpha = None
+    if "/" in value and not value.startswith("["):
+        value, alpha_part = value.rsplit("/", 1)
+        arbitrary = _arbitrary(alpha_part)
+        if arbitrary is not None:
+            alpha = arbitrary
+        elif _NUMBER.match(alpha_part) and float(alpha_part) <= 100:
+            alpha = f"{float(alpha_part) / 100:g}"
+        else:
+            return None
+    if value in COLORS:
+        return COLORS[value], alpha
+    if value in SPECIAL_COLORS:
+        return SPECIAL_COLORS[value], None
+    arbitrary = _arbitrary(value)
+    if arbitrary is not None and re.match(r"^(#[0-9a-fA-F]{3,8}|rgba?\(|hsla?\()", arbitrary):
+        return arbitrary, alpha
+    return None
+
+
+def _color_decls(properties: str, opacity_var: Optional[str], value: str) -> Optional[list[str]]:
+    found = _color(value)
+    if found is None:
+        return None
+    color, alpha = found
+    rgb = _hex_rgb(color)
+    decls = []
+    if rgb and (alpha is not None or opacity_var):
+        r, g, b = rgb
+        if alpha is not None:
+            rendered = f"rgb({r} {g} {b} / {alpha})"
+        else:
+            decls.append(f"{opacity_var}:1")
+            rendered = f"rgb({r} {g} {b} / var({opacity_var}))"
+    else:
+        rendered = color
+    decls += [f"{prop}:{rendered}" for prop in properties.split()]
+    return decls
+
+
+def _negate(value: str) -> str:
+    if value in ("0px", "0", "auto"):
+        return value
+    if value.startswith("-"):
+        return value[1:]
+    if re.fullmatch(r"[\d.]+[a-z%]*", value):
+        return "-" + value
+    return f"calc({value} * -1)"
+
+
+# --- utilities --------------------------------------------------------------------------------
+
+#Each handler: (prefix, fn(value, negative) -> declarations or (declarations, selector suffix) or None).
+#Handlers are tried longest prefix first; their position in this list is their order in the stylesheet,
+#so general utilities (p-*) come before the specific ones that override them (px-*, pt-*).
+Handler = Callable[[str, bool], Optional[object]]
+_HANDLERS: list[tuple[str, Handler]] = []
+
+
+def _handler(prefix: str):
+    def register(fn: Handler) -> Handler:
+        _HANDLERS.append((prefix, fn))
+        return fn
+    return register
+
+
+def _spacing_handler(prefix: str, properties: tuple[str, ...]):
+    #Positions take fractions and `full` as well; padding and gaps never take `auto`
+    positional = prefix.startswith(("inset", "top", "right", "bottom", "left", "start", "end"))
+    def handle(value, negative):
+        if value == "auto" and not prefix.startswith(("p", "gap", "scroll")):
+            resolved = "auto"
+        else:
+            resolved = _spacing(value)
+        if resolved is None and positional:
+            resolved = "100%" if value == "full" else _fraction(value)
+        if resolved is None:
+            return None
+        if negative:
+            resolved = _negate(resolved)
+        return [f"{prop}:{resolved}" for prop in properties]
+    return handle
+
+
+for _prefix, _props in SPACING_PROPS.items():
+    _handler(_prefix)(_spacing_handler(_prefix, _props))
+
+
+def _size_handler(prefix: str, properties: tuple[str, ...]):
+    def handle(value, negative):
+        resolved = _size(prefix, value)
+        if prefix == "min-w" and value == "0":
+            resolved = "0px"
+        return None if resolved is None or negative else [f"{prop}:{resolved}" for prop in properties]
+    return handle
+
+
+for _prefix, _props in SIZE_PROPS.items():
+    _handler(_prefix)(_size_handler(_prefix, _props))
+
+
+@_handler("max-w")
+def _max_width(value, negative):
+    resolved = MAX_WIDTHS.get(value) or _size("max-w", value)
+    return None if resolved is None or negative else [f"max-width:{resolved}"]
+
+
+def _space_handler(axis: str):
+    def handle(value, negative):
+        resolved = _spacing(value)
+        if resolved is None:
+            return None
+        if negative:
+            resolved = _negate(resolved)
+        prop = "margin-left" if axis == "x" else "margin-top"
+        return [f"{prop}:{resolved}"], CHILDREN
+    return handle
+
+
+_handler("space-x")(_space_handler("x"))
+_handler("space-y")(_space_handler("y"))
+
+
+@_handler("text")
+def _text(value, negative):
+    if negative:
+        return None
+    if value in FONT_SIZES:
+        size, line_height = FONT_SIZES[value]
+        return [f"font-size:{size}", f"line-height:{line_height}"]
+    color = _color_decls("color", "--tw-text-opacity", value)
+    if color is not None:
+        return color
+    arbitrary = _arbitrary(value)
+    if arbitrary is not None and re.match(r"^[\d.]+(px|rem|em|%|vw|vh)$|^clamp\(", arbitrary):
+        return [f"font-size:{arbitrary}"]
+    return None
+
+
+@_handler("font")
+def _font(value, negative):
+    if value in FONT_WEIGHTS:
+        return [f"font-weight:{FONT_WEIGHTS[value]}"]
+    if value in FONT_FAMILIES:
+        return [f"font-family:{FONT_FAMILIES[value]}"]
+    arbitrary = _arbitrary(value)
+    if arbitrary is not None and arbitrary.isdigit():
+        return [f"font-weight:{arbitrary}"]
+    return None
+
+
+@_handler("leading")
+def _leading(value, negative):
+    resolved = LEADING.get(value) or (_spacing(value) if value.isdigit() and 3 <= int(value) <= 10 else None) \
+        or _arbitrary(value)
+    return [f"line-height:{resolved}"] if resolved else None
+
+
+@_handler("tracking")
+def _tracking(value, negative):
+    resolved = TRACKING.get(value) or _arbitrary(value)
+    if resolved is None:
+        return None
+    return [f"letter-spacing:{_negate(resolved) if negative else resolved}"]
+
+
+@_handler("bg-gradient-to")
+def _gradient(value, negative):
+    direction = GRADIENT_DIRECTIONS.get(value)
+    return [f"background-image:linear-gradient(to {direction}, var(--tw-gradient-stops))"] if direction else None
+
+
+@_handler("bg")
+def _background(value, negative):
+    color = _color_decls("background-color", "--tw-bg-opacity", value)
+    if color is not None:
+        return color
+    arbitrary = _arbitrary(value)
+    if arbitrary is not None and arbitrary.startswith(("url(", "linear-gradient(", "radial-gradient(")):
+        return [f"background-image:{arbitrary}"]
+    return None
+
+
+def _stop_color(value: str) -> Optional[tuple[str, str]]:
+    """(colour, the same colour fully transparent) for gradient stops."""
+    found = _color(value)
+    if found is None:
+        return None
+    color, alpha = found
+    rgb = _hex_rgb(color)
+    if rgb is None:
+        return color, "rgb(255 255 255 / 0)" if color == "transparent" else color
+    r, g, b = rgb
+    return (f"rgb({r} {g} {b} / {alpha})" if alpha is not None else color), f"rgb({r} {g} {b} / 0)"
+
+
+@_handler("from")
+def _from(value, negative):
+    found = _stop_color(value)
+    if found is None:
+        return None
+    color, clear = found
+    return [f"--tw-gradient-from:{color} var(--tw-gradient-from-position, )",
+            f"--tw-gradient-to:{clear} var(--tw-gradient-to-position, )",
+            "--tw-gradient-stops:var(--tw-gradient-from), var(--tw-gradient-to)"]
+
+
+@_handler("via")
+def _via(value, negative):
+    found = _stop_color(value)
+    if found is None:
+        return None
+    color, clear = found
+    return [f"--tw-gradient-to:{clear} var(--tw-gradient-to-position, )",
+            f"--tw-gradient-stops:var(--tw-gradient-from), {color} var(--tw-gradient-via-position, ), "
+            "var(--tw-gradient-to)"]
+
+
+@_handler("to")
+def _to(value, negative):
+    found = _stop_color(value)
+    return [f"--tw-gradient-to:{found[0]} var(--tw-gradient-to-position, )"] if found else None
+
+
+def _border_width(value: str) -> Optional[str]:
+    if value == "":
+        return "1px"
+    if value in ("0", "2", "4", "8"):
+        return f"{value}px"
+    return _arbitrary(value)
+
+
+def _border_handler(side: str):
+    def handle(value, negative):
+        if negative:
+            return None
+        width = _border_width(value)
+        if width is not None:
+            return [f"{prop}:{width}" for prop in BORDER_SIDES[side]]
+        color_prefix = f"border-{side}" if side else "border"
+        properties, opacity_var = COLOR_PROPS[color_prefix]
+        return _color_decls(properties, opacity_var, value)
+    return handle
+
+
+for _side in BORDER_SIDES:
+    _handler(f"border-{_side}" if _side else "border")(_border_handler(_side))
+
+
+def _divide_handler(axis: str):
+    def handle(value, negative):
+        width = _border_width(value)
+        if width is None:
+            return None
+        if axis == "x":
+            return ["border-right-width:0", f"border-left-width:{width}"], CHILDREN
+        return ["border-bottom-width:0", f"border-top-width:{width}"], CHILDREN
+    return handle
+
+
+_handler("divide-x")(_divide_handler("x"))
+_handler("divide-y")(_divide_handler("y"))
+
+
+@_handler("divide")
+def _divide_color(value, negative):
+    decls = _color_decls("border-color", "--tw-divide-opacity", value)
+    return (decls, CHILDREN) if decls else None
+
+
+def _radius_handler(side: str):
+    def handle(value, negative):
+        resolved = RADII.get(value) or _arbitrary(value)
+        return None if resolved is None else [f"{prop}:{resolved}" for prop in RADIUS_SIDES[side]]
+    return handle
+
+
+for _side in RADIUS_SIDES:
+    _handler(f"rounded-{_side}" if _side else "rounded")(_radius_handler(_side))
+
+
+@_handler("shadow")
+def _shadow(value, negative):
+    shadow = SHADOWS.get(value)
+    if shadow is None:
+        return None
+    return [f"--tw-shadow:{shadow}", "box-shadow:" + BOX_SHADOW]
+
+
+@_handler("ring-offset")
+def _ring_offset(value, negative):
+    if value.isdigit():
+        return [f"--tw-ring-offset-width:{value}px"]
+    return _color_decls("--tw-ring-offset-color", None, value)
+
+
+@_handler("ring")
+def _ring(value, negative):
+    width = {"": "3px", "0": "0px", "1": "1px", "2": "2px", "4": "4px", "8": "8px"}.get(value)
+    if width is not None:
+        return [
+            "--tw-ring-offset-shadow:var(--tw-ring-inset, ) 0 0 0 var(--tw-ring-offset-width) "
+            "var(--tw-ring-offset-color)",
+            f"--tw-ring-shadow:var(--tw-ring-inset, ) 0 0 0 calc({width} + var(--tw-ring-offset-width)) "
+            "var(--tw-ring-color)",
+            "box-shadow:var(--tw-ring-offset-shadow), var(--tw-ring-shadow), var(--tw-shadow, 0 0 #0000)",
+        ]
+    return _color_decls("--tw-ring-color", "--tw-ring-opacity", value)
+
+
+@_handler("outline")
+def _outline(value, negative):
+    if value in ("0", "1", "2", "4", "8"):
+        return [f"outline-width:{value}px"]
+    if value in ("dashed", "dotted", "double"):
+        return [f"outline-style:{value}"]
+    return _color_decls("outline-color", None, value)
+
+
+@_handler("outline-offset")
+def _outline_offset(value, negative):
+    return [f"outline-offset:{value}px"] if value in ("0", "1", "2", "4", "8") else None
+
+
+def _simple_color_handler(prefix: str):
+    def handle(value, negative):
+        properties, opacity_var = COLOR_PROPS[prefix]
+        return _color_decls(properties, opacity_var, value)
+    return handle
+
+
+for _prefix in ("decoration", "accent", "caret", "fill", "stroke"):
+    _handler(_prefix)(_simple_color_handler(_prefix))
+
+
+@_handler("placeholder")
+def _placeholder(value, negative):
+    decls = _color_decls("color", "--tw-placeholder-opacity", value)
+    return (decls, "::placeholder") if decls else None
+
+
+def _opacity_value(value: str) -> Optional[str]:
+    if value.isdigit() and int(value) <= 100:
+        return f"{int(value) / 100:g}"
+    return _arbitrary(value)
+
+
+@_handler("opacity")
+def _opacity(value, negative):
+    resolved = _opacity_value(value)
+    return [f"opacity:{resolved}"] if resolved is not None else None
+
+
+for _prefix, _var in (("bg-opacity", "--tw-bg-opacity"), ("text-opacity", "--tw-text-opacity"),
+                      ("border-opacity", "--tw-border-opacity"), ("ring-opacity", "--tw-ring-opacity"),
+                      ("placeholder-opacity", "--tw-placeholder-opacity"), ("divide-opacity", "--tw-divide-opacity")):
+    def _opacity_var_handler(value, negative, _var=_var):
+        resolved = _opacity_value(value)
+        return [f"{_var}:{resolved}"] if resolved is not None else None
+    _handler(_prefix)(_opacity_var_handler)
+
+
+@_handler("z")
+def _z(value, negative):
+    if value == "auto":
+        return ["z-index:auto"]
+    if value.isdigit():
+        return [f"z-index:{'-' if negative else ''}{value}"]
+    arbitrary = _arbitrary(value)
+    return [f"z-index:{arbitrary}"] if arbitrary else None
+
+
+@_handler("order")
+def _order(value, negative):
+    return [f"order:{'-' if negative else ''}{value}"] if value.isdigit() else None
+
+
+def _grid_template(prop: str):
+    def handle(value, negative):
+        if value.isdigit() and 0 < int(value) <= 12:
+            return [f"{prop}:repeat({value}, minmax(0, 1fr))"]
+        arbitrary = _arbitrary(value)
+        return [f"{prop}:{arbitrary}"] if arbitrary else None
+    return handle
+
+
+_handler("grid-cols")(_grid_template("grid-template-columns"))
+_handler("grid-rows")(_grid_template("grid-template-rows"))
+
+
+def _grid_placement(prop: str, kind: str):
+    def handle(value, negative):
+        if not value.isdigit():
+            return None
+        if kind == "span":
+            return [f"{prop}:span {value} / span {value}"]
+        return [f"{prop}-{kind}:{value}"]
+    return handle
+
+
+for _prefix, _prop, _kind in (("col-span", "grid-column", "span"), ("row-span", "grid-row", "span"),
+                              ("col-start", "grid-column", "start"), ("col-end", "grid-column", "end"),
+                              ("row-start", "grid-row", "start"), ("row-end", "grid-row", "end")):
+    _handler(_prefix)(_grid_placement(_prop, _kind))
+
+
+@_handler("line-clamp")
+def _line_clamp(value, negative):
+    if not value.isdigit():
+        return None
+    return ["overflow:hidden", "display:-webkit-box", "-webkit-box-orient:vertical", f"-webkit-line-clamp:{value}"]
+
+
+@_handler("transition")
+def _transition(value, negative):
+    properties = TRANSITIONS.get(value)
+    if properties is None:
+        return None
+    return [f"transition-property:{properties}", "transition-timing-function:cubic-bezier(0.4, 0, 0.2, 1)",
+            "transition-duration:150ms"]
+
+
+@_handler("duration")
+def _duration(value, negative):
+    return [f"transition-duration:{value}ms"] if value.isdigit() else None
+
+
+@_handler("delay")
+def _delay(value, negative):
+    return [f"transition-delay:{value}ms"] if value.isdigit() else None
+
+
+@_handler("ease")
+def _ease(value, negative):
+    return [f"transition-timing-function:{EASINGS[value]}"] if value in EASINGS else None
+
+
+def _transform_handler(variables: tuple[str, ...], kind: str):
+    def handle(value, negative):
+        if kind == "scale":
+            resolved = f"{int(value) / 100:g}" if value.isdigit() else _arbitrary(value)
+        elif kind in ("rotate", "skew"):
+            resolved = f"{value}deg" if value.isdigit() else _arbitrary(value)
+        else:
+            resolved = "100%" if value == "full" else _spacing(value) or _fraction(value)
+        if resolved is None:
+            return None
+        if negative:
+            resolved = _negate(resolved) if kind == "translate" else "-" + resolved
+        return [f"{variable}:{resolved}" for variable in variables] + ["transform:" + TRANSFORM]
+    return handle
+
+
+for _prefix, _vars, _kind in (("scale", ("--tw-scale-x", "--tw-scale-y"), "scale"),
+                              ("scale-x", ("--tw-scale-x",), "scale"), ("scale-y", ("--tw-scale-y",), "scale"),
+                              ("rotate", ("--tw-rotate",), "rotate"),
+                              ("translate-x", ("--tw-translate-x",), "translate"),
+                              ("translate-y", ("--tw-translate-y",), "translate"),
+                              ("skew-x", ("--tw-skew-x",), "skew"), ("skew-y", ("--tw-skew-y",), "skew")):
+    _handler(_prefix)(_transform_handler(_vars, _kind))
+
+
+def _blur_handler(prop: str):
+    def handle(value, negative):
+        resolved = BLURS.get(value) or _arbitrary(value)
+        return [f"{prop}:blur({resolved})"] if resolved is not None else None
+    return handle
+
+
+_handler("blur")(_blur_handler("filter"))
+_handler("backdrop-blur")(_blur_handler("backdrop-filter"))
+
+
+@_handler("aspect")
+def _aspect(value, negative):
+    arbitrary = _arbitrary(value)
+    return [f"aspect-ratio:{arbitrary.replace('/', ' / ')}"] if arbitrary else None
+
+
+@_handler("columns")
+def _columns(value, negative):
+    return [f"columns:{value}"] if value.isdigit() else None
+
+
+#Longest prefix first, so `border-t-2` isn't read as `border` with value `t-2`
+_BY_PREFIX = sorted(((prefix, index, fn) for index, (prefix, fn) in enumerate(_HANDLERS)),
+                    key=lambda item: -len(item[0]))
+_STATIC_ORDER = {name: index for index, name in enumerate(STATIC)}
+
+
+def _utility(name: str) -> Optional[tuple[int, list[str], str]]:
+    """(stylesheet order, declarations, selector suffix) for a bare utility like `-mt-4`, or None."""
+    negative = name.startswith("-")
+    base = name[1:] if negative else name
+    if base in STATIC and not negative:
+        return _STATIC_ORDER[base], STATIC[base].split(";"), ""
+    for prefix, index, fn in _BY_PREFIX:
+        if base == prefix:
+            value = ""
+        elif base.startswith(prefix + "-"):
+            value = base[len(prefix) + 1:]
+        else:
+            continue
+        if negative and prefix not in NEGATABLE:
+            continue
+        result = fn(value, negative)
+        if result is None:
+            continue
+        decls, suffix = result if isinstance(result, tuple) else (result, "")
+        return len(STATIC) + index, decls, suffix
+    return None
+
+
+# --- variants and rules -----------------------------------------------------------------------
+
+def _split_variants(name: str) -> list[str]:
+    """`md:hover:bg-[#fff]` -> ['md', 'hover', 'bg-[#fff]'], leaving colons inside brackets alone."""
+    parts, depth, current = [], 0, ""
+    for char in name:
+        if char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+        if char == ":" and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+
+def escape_class(name: str) -> str:
+    """A class name as a CSS selector (without the leading dot)."""
+    escaped = "".join(char if char.isalnum() or char in "-_" else "\\" + char for char in name)
+    if escaped[:1].isdigit():
+        escaped = f"\\3{escaped[0]} " + escaped[1:]
+    return escaped
+
+
+class _Rule:
+    __slots__ = ("media", "variant_rank", "order", "selector", "body")
+
+    def __init__(self, media, variant_rank, order, selector, body):
+        self.media = media
+        self.variant_rank = variant_rank
+        self.order = order
+        self.selector = selector
+        self.body = body
+
+
+def compile_class(name: str) -> Optional[_Rule]:
+    """The CSS rule for one class as written in the markup, or None if it isn't a known utility."""
+    parts = _split_variants(name)
+    utility = parts[-1]
+    important = utility.startswith("!")
+    if important:
+        utility = utility[1:]
+    found = _utility(utility)
+    if found is None:
+        return None
+    order, decls, suffix = found
+
+    selector = "." + escape_class(name)
+    prefix, pseudo, media, dark = "", "", 0, False
+    for variant in parts[:-1]:
+        if variant in SCREENS:
+            media = max(media, SCREENS[variant])
+        elif variant in PSEUDO_CLASSES:
+            pseudo += PSEUDO_CLASSES[variant]
+        elif variant in GROUP_STATES:
+            kind = "group" if variant.startswith("group") else "peer"
+            prefix += f".{kind}{GROUP_STATES[variant]}" + (" " if kind == "group" else " ~ ")
+        elif variant == "dark":
+            dark = True
+        else:
+            return None
+    #State pseudo-classes before the utility's own suffix: `.focus\:placeholder-x:focus::placeholder`
+    selector = f"{prefix}{selector}{pseudo}{suffix}"
+    body = ";".join(decl + ("!important" if important else "") for decl in decls if decl)
+    variant_rank = 1 if pseudo or prefix else 0
+    return _Rule((dark, media), variant_rank, order, selector, body)
+
+
+def render_rules(rules: list[_Rule]) -> str:
+    """Tailwind's cascade: base utilities, then state variants, then each breakpoint from small to large."""
+    out = []
+    groups: dict[tuple, list[_Rule]] = {}
+    for rule in rules:
+        groups.setdefault(rule.media, []).append(rule)
+    for media in sorted(groups):
+        dark, width = media
+        body = "".join(f"{rule.selector}{{{rule.body}}}" for rule in
+                       sorted(groups[media], key=lambda rule: (rule.variant_rank, rule.order, rule.selector)))
+        if width:
+            body = f"@media (min-width:{width}px){{{body}}}"
+        if dark:
+            body = f"@media (prefers-color-scheme:dark){{{body}}}"
+        out.append(body)
+    return "".join(out)
+
+
+def container_rules() -> str:
+    return ".container{width:100%}" + "".join(
+        f"@media (min-width:{width}px){{.container{{max-width:{width}px}}}}" for width in SCREENS.values())
+
+
+# --- documents ---------------------------------------------------------------------------------
+
+class _ClassCollector(HTMLParser):
+    """Static class attributes, plus the code of inline scripts and on* handlers."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.classes: dict[str, None] = {}
+        self.scripts: list[str] = []
+        self._in_script = False
+
+    def handle_starttag(self, tag, attrs):
+        for name, value in attrs:
+            if name == "class" and value:
+                for cls in value.split():
+                    self.classes[cls] = None
+            elif name.startswith("on") and value:
+                self.scripts.append(value)
+        self._in_script = tag == "script"
+
+    def handle_endtag(self, tag):
+        if tag == "script":
+            self._in_script = False
+
+    def handle_data(self, data):
+        if self._in_script:
+            self.scripts.append(data)
+
+
+def _collect(markup: str) -> _ClassCollector:
+    collector = _ClassCollector()
+    collector.feed(markup)
+    collector.close()
+    return collector
+
+
+def used_classes(markup: str) -> list[str]:
+    return list(_collect(markup).classes)
+
+
+#Where scripts put class names: classList.add/remove/toggle/replace(...), className = ..., setAttribute("class", ...)
+_CLASS_CALL = re.compile(r"\.classList\s*\.\s*(add|remove|toggle|replace)\s*\(([^()]*)\)")
+_CLASS_ASSIGN = re.compile(r"\.className\s*\+?=\s*([^;\n]*)")
+_CLASS_ATTRIBUTE = re.compile(r"\.setAttribute\s*\(\s*[\"']class[\"']\s*,([^()]*)\)")
+_STRING = re.compile(r"'([^'\\]*)'|\"([^\"\\]*)\"|`([^`\\$]*)`")
+#String building: concatenation next to a literal, or template interpolation
+_BUILT = re.compile(r"['\"`]\s*\+|\+\s*['\"`]|\$\{")
+
+
+def scripted_classes(markup: str) -> Optional[list[str]]:
+    """
+    Classes the page's scripts and handlers switch on and off (menus, modals, tabs), which no class
+    attribute mentions until the script runs. None when a script passes classes the compiler can't
+    read (a variable, a built string): only the runtime can style those.
+    """
+    classes: dict[str, None] = {}
+    for code in _collect(markup).scripts:
+        regions = _CLASS_CALL.findall(code)
+        regions += [("assign", value) for value in _CLASS_ASSIGN.findall(code) + _CLASS_ATTRIBUTE.findall(code)]
+        for kind, region in regions:
+            if kind == "toggle":
+                region = region.split(",")[0]    # the second argument is the force flag
+            literals = ["".join(match) for match in _STRING.findall(region)]
+            if _BUILT.search(region) or not literals:
+                return None
+            #Method arguments must all be literals; an assignment may pick between them (a ? "x" : "y")
+            if kind != "assign" and _STRING.sub("", region).strip(" ,"):
+                return None
+            for literal in literals:
+                for cls in literal.split():
+                    classes[cls] = None
+    return list(classes)
+
+
+def _page_defined_classes(markup: str) -> set[str]:
+    """Class selectors the page's own <style> blocks define; they aren't Tailwind's to compile."""
+    defined = set()
+    for block in _STYLE_BLOCK.findall(markup):
+        defined.update(re.findall(r"\.(-?[_a-zA-Z][\w-]*)", block))
+    return defined
+
+
+def stylesheet(classes, defined: set[str] = frozenset(), preflight: bool = True) -> tuple[Optional[str], list[str]]:
+    """(CSS for `classes`, the classes it couldn't compile)."""
+    rules, unknown = [], []
+    container = False
+    for cls in classes:
+        if cls in MARKER_CLASSES or cls in defined:
+            continue
+        if cls == "container":
+            container = True
+            continue
+        rule = compile_class(cls)
+        if rule is None:
+            unknown.append(cls)
+        else:
+            rules.append(rule)
+    css = (PREFLIGHT if preflight else "") + (container_rules() if container else "") + render_rules(rules)
+    return css, unknown
+
+
+def _style_tag(css: str, preflight: bool = False) -> str:
+    if preflight:
+        return f"<style {COMPILED_ATTR} {PREFLIGHT_ATTR}>{css}</style>"
+    return f"<style {COMPILED_ATTR}>{css}</style>"
+
+
+def strip_compiled(markup: str) -> str:
+    """`markup` without the stylesheets this module added, e.g. before it goes back to the model."""
+    return _COMPILED_STYLE.sub("", markup)
+
+
+def compile_page(markup: str) -> tuple[str, str]:
+    """
+    (page, outcome). The page's Tailwind runtime is swapped for its compiled stylesheet when every
+    class compiles, counting those its scripts add by name ("compiled"); otherwise, or when a script
+    builds class names at run time, the runtime stays (or comes back, for a page compiled
+    before and since patched) and any old compiled stylesheet is dropped ("fallback"). Pages that
+    configure Tailwind themselves, load Tailwind v4 or don't use it at all are left alone ("skipped").
+    The stylesheet goes first in <body>, so it survives the editor keeping only the body's markup.
+    """
+    had_runtime = bool(_RUNTIME.search(markup))
+    if _CONFIG.search(markup) or _V4_RUNTIME.search(markup) or not (had_runtime or _COMPILED_STYLE.search(markup)):
+        return markup, "skipped"
+    markup = strip_compiled(markup)
+    scripted = scripted_classes(markup)
+    classes = list(dict.fromkeys(used_classes(markup) + (scripted or [])))
+    css, unknown = stylesheet(classes, _page_defined_classes(markup))
+    if unknown or scripted is None:
+        UNKNOWN.inc(len(unknown))
+        if had_runtime:
+            return markup, "fallback"
+        head_close = _HEAD_CLOSE.search(markup)
+        if head_close:
+            return markup[:head_close.start()] + CDN_SCRIPT + markup[head_close.start():], "fallback"
+        return CDN_SCRIPT + markup, "fallback"
+    markup = _RUNTIME.sub("", markup)
+    body = _BODY_OPEN.search(markup)
+    if body:
+        return markup[:body.end()] + _style_tag(css) + markup[body.end():], "compiled"
+    return _style_tag(css) + markup, "compiled"
+
+
+def compile_fragment(markup: str) -> tuple[str, str]:
+    """
+    A component snippet (a design variation) followed by its stylesheets: the preflight, for previewing
+    it on its own, then its utilities. They go after the markup so the component stays the snippet's
+    first element; the editor moves the utilities into the page's <head> and drops the preflight,
+    which the page already has and which would otherwise override the page's own element styles.
+    """
+    markup = strip_compiled(markup)
+    scripted = scripted_classes(markup)
+    classes = list(dict.fromkeys(used_classes(markup) + (scripted or [])))
+    if not classes and scripted is not None:
+        return markup, "skipped"
+    css, unknown = stylesheet(classes, _page_defined_classes(markup), preflight=False)
+    if unknown or scripted is None:
+        UNKNOWN.inc(len(unknown))
+        return markup, "fallback"
+    return markup + _style_tag(PREFLIGHT, preflight=True) + _style_tag(css), "compiled"
+
+
+# --- minification ------------------------------------------------------------------------------
+
+#Whitespace between two of these tags never renders
+_BLOCK_TAGS = {
+    "html", "head", "body", "meta", "link", "title", "style", "script", "div", "section", "header", "footer",
+    "main", "nav", "aside", "article", "ul", "ol", "li", "table", "thead", "tbody", "tfoot", "tr", "td", "th",
+    "form", "fieldset", "h1", "h2", "h3", "h4", "h5", "h6", "p", "figure", "figcaption", "hr", "br", "!doctype",
+    "dl", "dt", "dd", "details", "summary", "dialog", "blockquote", "option", "select", "colgroup", "col",
+}
+_RAW_TAGS = ("pre", "textarea", "script", "style")
+_TOKEN = re.compile(r"<!--.*?-->|<(pre|textarea|script|style)\b.*?</\1\s*>|<[^>]*>|[^<]+|<",
+                    re.IGNORECASE | re.DOTALL)
+_TAG_NAME = re.compile(r"^</?\s*([!\w-]+)")
+
+
+def _tag_name(token: str) -> Optional[str]:
+    match = _TAG_NAME.match(token)
+    return match.group(1).lower() if match else None
+
+
+def minify_html(markup: str) -> str:
+    """
+    Drops comments (keeping conditional ones), collapses whitespace runs in text to one space, and
+    removes whitespace between block-level tags. Contents of pre, textarea, script and style are kept.
+    """
+    tokens = []
+    for match in _TOKEN.finditer(markup):
+        token = match.group(0)
+        if token.startswith("<!--"):
+            if token.startswith("<!--[if"):
+                tokens.append(token)
+            continue
+        if not token.startswith("<"):
+            if tokens and not tokens[-1].startswith("<"):
+                #Text on both sides of a dropped comment
+                token = tokens.pop() + token
+            token = re.sub(r"\s+", " ", token)
+        tokens.append(token)
+
+    out = []
+    for i, token in enumerate(tokens):
+        if token == " ":
+            before = _tag_name(tokens[i - 1]) if i > 0 else "html"
+            after = _tag_name(tokens[i + 1]) if i + 1 < len(tokens) else "html"
+            if before in _BLOCK_TAGS and after in _BLOCK_TAGS:
+                continue
+        out.append(token)
+    return "".join(out).strip()
+
+
+def postprocess_page(markup: str) -> str:
+    """What every generated page goes through before it is returned (TAILWIND_COMPILE_ENABLED)."""
+    if not getattr(settings, "TAILWIND_COMPILE_ENABLED", True):
+        return markup
+    markup, outcome = compile_page(markup)
+    COMPILED.labels("page", outcome).inc()
+    if outcome == "skipped" or not getattr(settings, "TAILWIND_MINIFY_HTML", True):
+        return markup
+    return minify_html(markup)
+
+
+def postprocess_fragment(markup: str) -> str:
+    if not getattr(settings, "TAILWIND_COMPILE_ENABLED", True):
+        return markup
+    markup, outcome = compile_fragment(markup)
+    COMPILED.labels("variation", outcome).inc()
+    if outcome == "skipped" or not getattr(settings, "TAILWIND_MINIFY_HTML", True):
+        return markup
+    return minify_html(markup)
@@ -0,0 +1,63 @@
+# services/uploadStream.py
+#Upload handler that sees every multipart chunk on its way to Django's memory/temp-file handlers:
+#it hashes uploads incrementally and stops reading an oversized file at the limit instead of
+#buffering it first, so a request never holds more than one chunk of a rejected file.
+import hashlib
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Runs first in FILE_UPLOAD_HANDLERS and passes chunks through unchanged.
+    Sets on the request:
+      upload_digests   - {field name: sha256 hex} for every file received
+      oversized_uploads - field names skipped for exceeding SKETCH_UPLOAD_MAX_BYTES
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_bytes = getattr(settings, "SKETCH_UPLOAD_MAX_BYTES", DEFAULT_MAX_BYTES)
+        self._hasher = None
+        self._size = 0
+        if request is not None:
+            request.upload_digests = {}
+            request.oversized_uploads = set()
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self._hasher = hashlib.sha256()
+        self._size = 0
+        #Browsers rarely send a per-part length, but when they do an oversized file is refused up front
+        if content_length is not None and content_length > self.max_bytes:
+            self._skip()
+
+    def _skip(self):
+        if self.request is not None:
+            self.request.oversized_uploads.add(self.field_name)
+        raise SkipFile()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._size += len(raw_data)
+        if self._size > self.max_bytes:
+            self._skip()
+        self._hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.request is not None and self._hasher is not None:
+            self.request.upload_digests[self.field_name] = self._hasher.hexdigest()
+        #Let the memory/temp-file handler after us build the UploadedFile
+        return None
+
+
+def upload_digest(request, field_name: str):
+    """sha256 of an uploaded file as computed while it streamed in, if the handler ran."""
+    return getattr(request, "upload_digests", {}).get(field_name)
+
+
+def upload_too_large(request, field_name: str) -> bool:
+    return field_name in getattr(request, "oversized_uploads", ())
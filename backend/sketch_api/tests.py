@@ -7,7 +7,7 @@ import json
 from django.shortcuts import render
 from channels.routing import URLRouter
 
-from .views import api_test, generate_mockup, frontend, GenerateView
+from .views import api_test, generate_mockup, frontend, GenerateView, GenerateMultiView, GenerateVariationsView, GenerateJobView, JobStatusView
 from .consumers import SketchConsumer
 from .urls import urlpatterns
 
@@ -256,6 +256,2103 @@ class TestGenerateView:
 
         assert response.status_code == 200
 
+class TestGenerateMultiView:
+    """Tests for the GenerateMultiView APIView class"""
+    @pytest.fixture
+    def factory(self):
+        return APIRequestFactory()
+
+    @pytest.fixture
+    def two_pages(self):
+        return {
+            "count": "2",
+            "file_0": SimpleUploadedFile("slow.png", b"slow", content_type="image/png"),
+            "id_0": "slow-page",
+            "file_1": SimpleUploadedFile("fast.png", b"fast", content_type="image/png"),
+            "id_1": "fast-page",
+        }
+
+    @pytest.fixture
+    def fake_generator(self, mocker):
+        """Slow page takes longer than the fast one so completion order differs from upload order"""
+        import asyncio
+
+        async def fake(image_bytes, media_type="image/png", prompt=None, **kwargs):
+            await asyncio.sleep(0.05 if image_bytes == b"slow" else 0)
+            return f"<html>{image_bytes.decode()}</html>"
+
+        return mocker.patch('backend.sketch_api.views.image_to_html_css', side_effect=fake)
+
+    def test_generate_multi_returns_all_results(self, factory, two_pages, fake_generator):
+        request = factory.post('/api/generate-multi/', two_pages, format='multipart')
+        response = GenerateMultiView.as_view()(request)
+
+        assert response.status_code == 200
+        assert [r["id"] for r in response.data["results"]] == ["slow-page", "fast-page"]
+
+    def test_generate_multi_streams_pages_as_they_finish(self, factory, two_pages, fake_generator):
+        two_pages["stream"] = "ndjson"
+        request = factory.post('/api/generate-multi/', two_pages, format='multipart')
+        response = GenerateMultiView.as_view()(request)
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in b"".join(response).decode().splitlines()]
+        assert [line["id"] for line in lines] == ["fast-page", "slow-page"]
+        assert lines[0]["html"] == "<html>fast</html>"
+        assert lines[0]["index"] == 1
+
+    def test_generate_multi_missing_file_reports_error(self, factory, fake_generator):
+        request = factory.post('/api/generate-multi/', {"count": "1", "id_0": "p1"}, format='multipart')
+        response = GenerateMultiView.as_view()(request)
+
+        assert response.status_code == 200
+        assert response.data["results"][0]["error"] == "Missing file."
+
+    def test_uploads_are_hashed_and_oversized_files_dropped_while_streaming(self, factory, two_pages, fake_generator, settings):
+        import hashlib
+        settings.SKETCH_UPLOAD_MAX_BYTES = 4
+        two_pages["file_0"] = SimpleUploadedFile("big.png", b"x" * 5000, content_type="image/png")
+
+        request = factory.post('/api/generate-multi/', two_pages, format='multipart')
+        response = GenerateMultiView.as_view()(request)
+
+        big, fast = response.data["results"]
+        assert big["error"] == "File too large."
+        assert fast["sha256"] == hashlib.sha256(b"fast").hexdigest()
+
+    def test_generate_multi_batch_mode_uses_one_call_per_group(self, factory, two_pages, fake_generator, mocker):
+        two_pages["batch"] = "1"
+        # The model left out the second page, so it is generated on its own
+        batch = mocker.patch('backend.sketch_api.views.images_to_html_batch', return_value=["<html>both-1</html>", None])
+
+        request = factory.post('/api/generate-multi/', two_pages, format='multipart')
+        response = GenerateMultiView.as_view()(request)
+
+        assert response.status_code == 200
+        assert batch.call_count == 1
+        assert [image for image, _ in batch.call_args.args[0]] == [b"slow", b"fast"]
+        assert [r["html"] for r in response.data["results"]] == ["<html>both-1</html>", "<html>fast</html>"]
+        assert fake_generator.call_count == 1
+
+class TestClaudeScheduler:
+    """Tests for the process-wide Claude call scheduler"""
+
+    def test_concurrency_is_capped(self):
+        import asyncio
+        from .services.claudeScheduler import ClaudeScheduler
+
+        scheduler = ClaudeScheduler(max_concurrency=2)
+        peak = 0
+
+        async def call():
+            nonlocal peak
+            async with scheduler.slot("user"):
+                peak = max(peak, scheduler.in_flight)
+                await asyncio.sleep(0.01)
+
+        async def main():
+            await asyncio.gather(*(call() for _ in range(6)))
+
+        asyncio.run(main())
+        assert peak == 2
+        assert scheduler.in_flight == 0
+
+    def test_keys_are_served_round_robin_with_priority_first(self):
+        import asyncio
+        from .services.claudeScheduler import ClaudeScheduler
+
+        scheduler = ClaudeScheduler(max_concurrency=1)
+        order = []
+
+        async def call(key, priority=False):
+            async with scheduler.slot(key, priority=priority):
+                order.append(key)
+                await asyncio.sleep(0)
+
+        async def main():
+            blocker = await scheduler.acquire("blocker")
+            tasks = [asyncio.create_task(call("batch")) for _ in range(3)]
+            tasks.append(asyncio.create_task(call("other")))
+            tasks.append(asyncio.create_task(call("single", priority=True)))
+            await asyncio.sleep(0.01)
+            scheduler.release(blocker)
+            await asyncio.gather(*tasks)
+
+        asyncio.run(main())
+        assert order == ["single", "batch", "other", "batch", "batch"]
+
+    def test_request_rate_limit_delays_calls(self):
+        import asyncio
+        import time
+        from .services.claudeScheduler import ClaudeScheduler
+
+        # 600/min = a 600 request burst, then one every 0.1s
+        scheduler = ClaudeScheduler(max_concurrency=1000, requests_per_minute=600)
+
+        async def main():
+            for _ in range(600):
+                scheduler.release(await scheduler.acquire("a"))
+            started = time.monotonic()
+            scheduler.release(await scheduler.acquire("a"))
+            return time.monotonic() - started
+
+        assert asyncio.run(main()) >= 0.05
+
+    def test_cancelled_waiter_leaves_queue(self):
+        import asyncio
+        from .services.claudeScheduler import ClaudeScheduler
+
+        scheduler = ClaudeScheduler(max_concurrency=1)
+
+        async def main():
+            held = await scheduler.acquire("a")
+            waiting = asyncio.create_task(scheduler.acquire("b"))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await asyncio.gather(waiting, return_exceptions=True)
+            assert scheduler.queued == 0
+            scheduler.release(held)
+
+        asyncio.run(main())
+        assert scheduler.in_flight == 0
+
+class TestClaudeRetry:
+    """Tests for deadlines, retries and hedging around Claude calls"""
+
+    @pytest.fixture
+    def fast_policy(self):
+        from .services.claudeRetry import RetryPolicy
+        return RetryPolicy(deadline=2.0, attempt_timeout=1.0, max_retries=2, base_delay=0.01, max_delay=0.02)
+
+    @staticmethod
+    def rate_limit_error(headers=None):
+        import httpx
+        from anthropic import RateLimitError
+        request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+        response = httpx.Response(429, request=request, headers=headers or {})
+        return RateLimitError("rate limited", response=response, body=None)
+
+    def test_retries_transient_errors_then_succeeds(self, fast_policy):
+        import asyncio
+        from .services.claudeRetry import call_with_retry
+
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise self.rate_limit_error()
+            return "ok"
+
+        assert asyncio.run(call_with_retry(flaky, fast_policy)) == "ok"
+        assert len(calls) == 3
+
+    def test_non_retryable_errors_are_raised_immediately(self, fast_policy):
+        import asyncio
+        from .services.claudeRetry import call_with_retry
+
+        calls = []
+
+        async def broken():
+            calls.append(1)
+            raise ValueError("bad request")
+
+        with pytest.raises(ValueError):
+            asyncio.run(call_with_retry(broken, fast_policy))
+        assert len(calls) == 1
+
+    def test_backoff_respects_retry_after(self, fast_policy):
+        from .services.claudeRetry import backoff_delay
+
+        exc = self.rate_limit_error({"retry-after": "3"})
+        assert backoff_delay(0, fast_policy, exc) >= 3
+
+    def test_hung_call_hits_deadline(self):
+        import asyncio
+        from .services.claudeRetry import RetryPolicy, call_with_retry, DeadlineExceeded
+
+        policy = RetryPolicy(deadline=0.1, attempt_timeout=0.05, max_retries=5, base_delay=0.01, max_delay=0.01)
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        with pytest.raises((DeadlineExceeded, TimeoutError)):
+            asyncio.run(call_with_retry(hang, policy))
+
+    def test_slow_call_is_hedged(self):
+        import asyncio
+        from .services.claudeRetry import RetryPolicy, LatencyTracker, call_with_retry
+
+        tracker = LatencyTracker()
+        for _ in range(20):
+            tracker.record(0.01)
+        policy = RetryPolicy(deadline=2.0, attempt_timeout=1.0, hedge=True, hedge_min_samples=20)
+        calls = []
+
+        async def first_hangs():
+            calls.append(1)
+            if len(calls) == 1:
+                await asyncio.sleep(10)
+            return "hedged"
+
+        assert asyncio.run(call_with_retry(first_hangs, policy, tracker)) == "hedged"
+        assert len(calls) == 2
+
+    def test_queueing_for_a_slot_is_not_timed(self):
+        import asyncio
+        from functools import partial
+        from .services.claudeRetry import RetryPolicy, LatencyTracker, call_with_retry
+        from .services.claudeScheduler import ClaudeScheduler
+
+        scheduler = ClaudeScheduler(max_concurrency=1)
+        tracker = LatencyTracker()
+        for _ in range(20):
+            tracker.record(0.01)
+        policy = RetryPolicy(deadline=2.0, attempt_timeout=0.1, max_retries=0, hedge=True, hedge_min_samples=20)
+        calls = []
+
+        async def call(ticket):
+            calls.append(ticket)
+            await asyncio.sleep(0.05)
+            return "ok"
+
+        async def main():
+            held = await scheduler.acquire("other")
+            asyncio.get_running_loop().call_later(0.2, scheduler.release, held)
+            return await call_with_retry(call, policy, tracker, partial(scheduler.slot, "user"))
+
+        # Queued longer than the attempt timeout and slower than p95, yet neither retried nor hedged:
+        # the only slot is taken, so the hedge has nowhere to go
+        assert asyncio.run(main()) == "ok"
+        assert len(calls) == 1
+        assert scheduler.in_flight == 0
+
+class TestImagePreprocess:
+    """Tests for sketch preprocessing before upload to Claude"""
+
+    @staticmethod
+    def png_bytes(img):
+        import io
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        return buf.getvalue()
+
+    @pytest.fixture
+    def sketch_png(self):
+        """Large mostly-empty canvas with a black box drawn near the middle"""
+        from PIL import Image, ImageDraw
+        img = Image.new("RGBA", (3000, 2000), (255, 255, 255, 255))
+        ImageDraw.Draw(img).rectangle((1000, 800, 1600, 1200), outline=(0, 0, 0, 255), width=4)
+        return self.png_bytes(img)
+
+    def test_trims_margins_and_reports_savings(self, sketch_png):
+        from PIL import Image
+        import io
+        from .services.imagePreprocess import preprocess_sketch
+
+        result = preprocess_sketch(sketch_png, "image/png")
+        stats = result.stats()
+
+        width, height = Image.open(io.BytesIO(result.data)).size
+        assert width <= 600 + 2 * 16 + 4
+        assert height <= 400 + 2 * 16 + 4
+        assert stats["bytes_saved"] > 0
+        assert stats["tokens_saved"] > 0
+        assert result.media_type in ("image/png", "image/webp")
+
+    def test_colored_sketch_keeps_its_colors(self):
+        from PIL import Image, ImageDraw
+        import io
+        from .services.imagePreprocess import preprocess_sketch
+
+        img = Image.new("RGB", (800, 600), "white")
+        ImageDraw.Draw(img).rectangle((100, 100, 500, 400), fill=(220, 30, 30), outline="black", width=3)
+        result = preprocess_sketch(self.png_bytes(img), "image/png")
+
+        colors = Image.open(io.BytesIO(result.data)).convert("RGB").getcolors(1 << 16)
+        assert any(r > 180 and g < 80 and b < 80 for _, (r, g, b) in colors)
+
+    def test_downscales_to_model_resolution(self):
+        from PIL import Image, ImageDraw
+        import io
+        from .services.imagePreprocess import preprocess_sketch, MODEL_MAX_EDGE
+
+        img = Image.new("RGB", (4000, 1000), "white")
+        ImageDraw.Draw(img).line((0, 500, 3999, 500), fill="red", width=10)
+        ImageDraw.Draw(img).rectangle((0, 0, 3999, 999), outline="black", width=6)
+        result = preprocess_sketch(self.png_bytes(img), "image/png")
+
+        assert max(Image.open(io.BytesIO(result.data)).size) <= MODEL_MAX_EDGE
+
+    def test_unreadable_images_pass_through(self):
+        from .services.imagePreprocess import preprocess_sketch
+
+        result = preprocess_sketch(b"not really an image", "image/png")
+        assert result.data == b"not really an image"
+        assert result.media_type == "image/png"
+        assert result.stats()["bytes_saved"] == 0
+
+    def test_reads_from_spooled_upload_without_copying(self, sketch_png):
+        import tempfile
+        from .services.imagePreprocess import preprocess_sketch
+
+        with tempfile.TemporaryFile() as upload:
+            upload.write(sketch_png)
+            from_file = preprocess_sketch(upload, "image/png")
+
+        assert from_file.data == preprocess_sketch(sketch_png, "image/png").data
+        assert from_file.original_bytes == len(sketch_png)
+
+class TestGenerationJobs:
+    """Tests for background generation jobs"""
+    @pytest.fixture
+    def factory(self):
+        return APIRequestFactory()
+
+    @pytest.fixture
+    def fake_generator(self, mocker):
+        async def fake(image_bytes, media_type="image/png", prompt=None, **kwargs):
+            return "<html>job</html>"
+
+        return mocker.patch('backend.sketch_api.services.generationJobs.image_to_html_css', side_effect=fake)
+
+    def test_job_runs_in_background_and_can_be_polled(self, factory, fake_generator, mocker):
+        from .services import generationJobs
+
+        submitted = []
+        original_submit = generationJobs.JobRunner.submit
+
+        def capture(runner, job, pages):
+            future = original_submit(runner, job, pages)
+            submitted.append(future)
+            return future
+
+        mocker.patch.object(generationJobs.JobRunner, 'submit', capture)
+
+        request = factory.post('/api/jobs/', {
+            "count": "1",
+            "file_0": SimpleUploadedFile("a.png", b"fake", content_type="image/png"),
+            "id_0": "page-a",
+        }, format='multipart')
+        response = GenerateJobView.as_view()(request)
+
+        assert response.status_code == 202
+        job_id = response.data["job_id"]
+        assert response.data["status_url"] == f"/api/jobs/{job_id}/"
+
+        submitted[0].result(timeout=5)
+        poll = JobStatusView.as_view()(factory.get(f'/api/jobs/{job_id}/'), job_id=job_id)
+
+        assert poll.status_code == 200
+        assert poll.data["status"] == "done"
+        assert poll.data["results"][0]["id"] == "page-a"
+        assert poll.data["results"][0]["html"] == "<html>job</html>"
+
+    def test_unknown_job_returns_404(self, factory):
+        response = JobStatusView.as_view()(factory.get('/api/jobs/nope/'), job_id="nope")
+        assert response.status_code == 404
+
+    def test_job_rejects_missing_files(self, factory):
+        request = factory.post('/api/jobs/', {"count": "2"}, format='multipart')
+        response = GenerateJobView.as_view()(request)
+        assert response.status_code == 400
+
+    def test_runner_reports_progress(self, fake_generator):
+        from .services.generationJobs import Job, JobRunner, JobStore, PageInput
+
+        updates = []
+        runner = JobRunner(JobStore(), notify=lambda job: updates.append((job.status, len(job.results))))
+        job = Job(2, collab_id="42")
+        pages = [PageInput(i, f"p{i}", f"Page {i}", b"fake", "image/png") for i in range(2)]
+        runner.submit(job, pages).result(timeout=5)
+
+        assert updates[0] == ("running", 0)
+        assert updates[-1] == ("done", 2)
+
+class FakeMessages:
+    """Stands in for AsyncAnthropic().messages, recording each create() call"""
+    def __init__(self, text, usage=None):
+        from types import SimpleNamespace
+        self.calls = []
+        # Per stream() call: stop sending (until cancelled) after this many characters; None streams everything
+        self.stalls = []
+        self.response = SimpleNamespace(
+            content=[SimpleNamespace(type="text", text=text)],
+            usage=usage or SimpleNamespace(input_tokens=100, output_tokens=50,
+                                           cache_read_input_tokens=900, cache_creation_input_tokens=0),
+        )
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.response
+
+    def stream(self, **kwargs):
+        """Mimics messages.stream(): the response text arrives in small chunks"""
+        self.calls.append(kwargs)
+        messages = self
+        stall = self.stalls.pop(0) if self.stalls else None
+
+        class _Stream:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            @property
+            async def text_stream(self):
+                import asyncio
+
+                text = messages.response.content[0].text
+                for i in range(0, len(text), 7):
+                    if stall is not None and i >= stall:
+                        break
+                    yield text[i:i + 7]
+                if stall is not None:
+                    await asyncio.sleep(60)
+
+            async def get_final_message(self):
+                return messages.response
+
+        return _Stream()
+
+
+class TestPromptCaching:
+    """Tests for cacheable prompt prefixes and cache usage accounting"""
+
+    @pytest.fixture(autouse=True)
+    def reset_usage(self):
+        from .services.claudeUsage import usage
+        from .services.claudeClientVariations import _variation_cache
+        usage.reset()
+        _variation_cache.clear()
+        yield
+        usage.reset()
+
+    def test_page_prompt_puts_static_instructions_in_cached_system_prefix(self, mocker):
+        import asyncio
+        from types import SimpleNamespace
+        from .services import claudeClient
+        from .services.claudeUsage import usage
+
+        messages = FakeMessages("<!DOCTYPE html><html></html>")
+        mocker.patch.object(claudeClient, '_client', return_value=SimpleNamespace(messages=messages))
+
+        asyncio.run(claudeClient.image_to_html_css(b"img"))
+
+        system = messages.calls[0]["system"]
+        assert system[-1]["cache_control"] == {"type": "ephemeral"}
+        assert system[-1]["text"] == claudeClient.DEFAULT_INSTRUCTIONS
+        user_content = messages.calls[0]["messages"][0]["content"]
+        assert user_content[0]["type"] == "image"
+        assert claudeClient.DEFAULT_INSTRUCTIONS not in user_content[1]["text"]
+
+        stats = usage.snapshot()["image_to_html_css"]
+        assert stats["cache_hits"] == 1
+        assert stats["input_tokens_saved"] == 810
+
+    def test_custom_prompt_keeps_persona_cached(self, mocker):
+        import asyncio
+        from types import SimpleNamespace
+        from .services import claudeClient
+
+        messages = FakeMessages("<html></html>")
+        mocker.patch.object(claudeClient, '_client', return_value=SimpleNamespace(messages=messages))
+
+        asyncio.run(claudeClient.image_to_html_css(b"img", prompt="Make it blue"))
+
+        call = messages.calls[0]
+        assert call["system"] == [{"type": "text", "text": claudeClient.SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+        assert call["messages"][0]["content"][1]["text"] == "Make it blue"
+
+    def test_batch_prompt_shares_instructions_and_splits_pages(self, mocker):
+        import asyncio
+        from types import SimpleNamespace
+        from .services import claudeClient
+        from .services.claudeUsage import usage
+
+        text = "<!-- PAGE 1 -->\n<!DOCTYPE html><html>one</html>\n<!-- PAGE 2 -->\n<!DOCTYPE html><html>two</html>"
+        messages = FakeMessages(text)
+        mocker.patch.object(claudeClient, '_client', return_value=SimpleNamespace(messages=messages))
+
+        pages = asyncio.run(claudeClient.images_to_html_batch([(b"a", "image/png"), (b"b", "image/png"), (b"c", "image/png")]))
+
+        assert pages == ["<!DOCTYPE html><html>one</html>", "<!DOCTYPE html><html>two</html>", None]
+        call = messages.calls[0]
+        assert call["system"][-1]["text"] == claudeClient.DEFAULT_INSTRUCTIONS
+        assert [block["type"] for block in call["messages"][0]["content"]].count("image") == 3
+        stats = usage.snapshot()["image_to_html_batch"]
+        assert stats["pages"] == 3
+        assert stats["input_tokens_per_page"] == (100 + 900) / 3
+
+    def test_batch_cut_off_by_max_tokens_leaves_last_page_to_regenerate(self, mocker, settings):
+        import asyncio
+        from types import SimpleNamespace
+        from .services import claudeClient
+        from .services.claudeRouting import batch_size
+
+        settings.CLAUDE_BATCH_PAGE_MAX_TOKENS = 6000
+        text = "<!-- PAGE 1 -->\n<!DOCTYPE html><html>one</html>\n<!-- PAGE 2 -->\n<!DOCTYPE html><html><body><div>tw"
+        messages = FakeMessages(text)
+        messages.response.stop_reason = "max_tokens"
+        mocker.patch.object(claudeClient, '_client', return_value=SimpleNamespace(messages=messages))
+
+        pages = asyncio.run(claudeClient.images_to_html_batch([(b"a", "image/png"), (b"b", "image/png")]))
+
+        assert pages == ["<!DOCTYPE html><html>one</html>", None]
+        assert messages.calls[0]["max_tokens"] == 12000
+        # 20000 tokens only give three pages 6000 each
+        assert batch_size() == 3
+
+    def test_variation_prompt_is_split_into_static_and_dynamic_parts(self, mocker):
+        import asyncio
+        from types import SimpleNamespace
+        from .services import claudeClientVariations
+        from .services.claudeUsage import usage
+
+        messages = FakeMessages('["<button>a</button>", "<button>b</button>"]', SimpleNamespace(
+            input_tokens=80, output_tokens=40, cache_read_input_tokens=0, cache_creation_input_tokens=600))
+        mocker.patch.object(claudeClientVariations, '_variations_client', return_value=SimpleNamespace(messages=messages))
+
+        result = asyncio.run(claudeClientVariations.generate_component_variations("<button>x</button>", "button", count=2))
+
+        assert result == ["<button>a</button>", "<button>b</button>"]
+        system = messages.calls[0]["system"]
+        assert system[-1]["text"] == claudeClientVariations.AUTO_GUIDELINES
+        assert "<button>x</button>" not in "".join(block["text"] for block in system)
+        assert "<button>x</button>" in messages.calls[0]["messages"][0]["content"]
+        assert usage.snapshot()["generate_component_variations"]["cache_misses"] == 1
+
+class TestVariationCache:
+    """Tests for the shared server-side variation cache"""
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        from .services.claudeClientVariations import _variation_cache
+        _variation_cache.clear()
+        yield
+        _variation_cache.clear()
+
+    def test_key_ignores_element_ids_and_whitespace(self):
+        from .services.claudeClientVariations import variation_cache_key
+
+        first = variation_cache_key('<button data-element-id="el-1" class="a">\n  Go </button>', "button", None, 3, "m")
+        second = variation_cache_key("<button class=\"a\" data-element-id='el-99'> Go </button>", "button", None, 3, "m")
+        other_prompt = variation_cache_key('<button class="a"> Go </button>', "button", "make it red", 3, "m")
+
+        assert first == variation_cache_key('<button class="a"> Go </button>', "button", None, 3, "m")
+        assert first != other_prompt
+        assert len(first) == 64
+        assert second == first
+
+    def test_repeat_request_is_served_from_cache(self, mocker):
+        import asyncio
+        from types import SimpleNamespace
+        from .services import claudeClientVariations
+
+        messages = FakeMessages('["<a>1</a>", "<a>2</a>"]')
+        mocker.patch.object(claudeClientVariations, '_variations_client', return_value=SimpleNamespace(messages=messages))
+
+        first = asyncio.run(claudeClientVariations.generate_component_variations('<a data-element-id="x">hi</a>', "link", count=2))
+        second = asyncio.run(claudeClientVariations.generate_component_variations('<a data-element-id="y">hi</a>', "link", count=2))
+
+        assert first == second == ["<a>1</a>", "<a>2</a>"]
+        assert len(messages.calls) == 1
+
+    @pytest.mark.parametrize("text", ['["<a>1</a>"]', '["<a>1</a>", "<a>2</a>", "<a>3</a>", "<a>4'])
+    def test_padded_or_salvaged_results_are_not_cached(self, mocker, text):
+        import asyncio
+        from types import SimpleNamespace
+        from .services import claudeClientVariations
+
+        messages = FakeMessages(text)
+        mocker.patch.object(claudeClientVariations, '_variations_client', return_value=SimpleNamespace(messages=messages))
+
+        for _ in range(2):
+            variations = asyncio.run(claudeClientVariations.generate_component_variations("<a>hi</a>", "link", count=3))
+            assert len(variations) == 3
+        assert len(messages.calls) == 2
+
+    def test_lru_eviction_and_ttl(self):
+        from .services.resultCache import LRUTTLCache
+
+        clock = {"now": 0.0}
+        cache = LRUTTLCache(max_entries=2, ttl=10, clock=lambda: clock["now"])
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1       # a is now most recently used
+        cache.set("c", 3)                # evicts b
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+
+        clock["now"] = 11
+        assert cache.get("a") is None
+        assert cache.stats()["hits"] == 2
+
+class TestVariationStreaming:
+    """Tests for the incremental JSON parser and streamed variation results"""
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        from .services.claudeClientVariations import _variation_cache
+        _variation_cache.clear()
+        yield
+        _variation_cache.clear()
+
+    def test_parser_emits_elements_across_chunk_boundaries(self):
+        from .services.jsonStream import JSONArrayStreamParser
+
+        text = '```json\n["<a href=\\"x\\">[1]</a>", "<b>, {2}</b>",\n "<i>3</i>"]\n```'
+        parser = JSONArrayStreamParser()
+        seen = []
+        for i in range(0, len(text), 3):
+            seen.extend(parser.feed(text[i:i + 3]))
+
+        assert seen == ['<a href="x">[1]</a>', "<b>, {2}</b>", "<i>3</i>"]
+        assert parser.finished and parser.errors == 0
+        assert parser.close() == []
+
+    def test_malformed_element_is_skipped(self):
+        from .services.jsonStream import parse_json_array_leniently
+
+        assert parse_json_array_leniently('["<a>1</a>", <b>oops</b>, "<i>3</i>"]') == ["<a>1</a>", "<i>3</i>"]
+        #Truncated response: the last complete element is still recovered
+        assert parse_json_array_leniently('["<a>1</a>", "<b>2</b>"') == ["<a>1</a>", "<b>2</b>"]
+
+    def test_stream_yields_each_variation_and_fills_cache(self, mocker):
+        import asyncio
+        from types import SimpleNamespace
+        from .services import claudeClientVariations
+
+        messages = FakeMessages('["<a>1</a>", "<a>2</a>"]')
+        mocker.patch.object(claudeClientVariations, '_variations_client', return_value=SimpleNamespace(messages=messages))
+
+        async def collect():
+            return [v async for v in claudeClientVariations.stream_component_variations("<a>hi</a>", "link", count=3)]
+
+        assert asyncio.run(collect()) == ["<a>1</a>", "<a>2</a>", "<a>1</a>"]
+        #A padded (short) response isn't cached
+        asyncio.run(collect())
+        assert len(messages.calls) == 2
+
+    def test_stream_retries_stalled_attempt_until_first_variation(self, mocker, settings):
+        import asyncio
+        from types import SimpleNamespace
+        from .services import claudeClientVariations
+
+        settings.CLAUDE_ATTEMPT_TIMEOUT = 0.05
+        settings.CLAUDE_RETRY_BASE_DELAY = 0
+        messages = FakeMessages('["<a>1</a>", "<a>2</a>"]')
+        messages.stalls = [0]
+        mocker.patch.object(claudeClientVariations, '_variations_client', return_value=SimpleNamespace(messages=messages))
+
+        async def collect():
+            return [v async for v in claudeClientVariations.stream_component_variations("<a>hi</a>", "link", count=2)]
+
+        assert asyncio.run(collect()) == ["<a>1</a>", "<a>2</a>"]
+        assert len(messages.calls) == 2
+
+    def test_stream_failing_after_a_variation_is_not_replayed(self, mocker, settings):
+        import asyncio
+        from types import SimpleNamespace
+        from .services import claudeClientVariations
+
+        settings.CLAUDE_ATTEMPT_TIMEOUT = 0.05
+        settings.CLAUDE_RETRY_BASE_DELAY = 0
+        # The first variation arrives, then the model stalls mid-array
+        messages = FakeMessages('["<a>1</a>", "<a>2</a>"]')
+        messages.stalls = [14]
+        mocker.patch.object(claudeClientVariations, '_variations_client', return_value=SimpleNamespace(messages=messages))
+        seen = []
+
+        async def collect():
+            async for variation in claudeClientVariations.stream_component_variations("<a>hi</a>", "link", count=2):
+                seen.append(variation)
+
+        with pytest.raises(TimeoutError):
+            asyncio.run(collect())
+        assert seen == ["<a>1</a>"] and len(messages.calls) == 1
+
+    def test_view_streams_ndjson(self, mocker):
+        from types import SimpleNamespace
+        from .services import claudeClientVariations
+        from .services.generatedArtifacts import content_hash
+
+        messages = FakeMessages('["<a>1</a>", "<a>2</a>"]')
+        mocker.patch.object(claudeClientVariations, '_variations_client', return_value=SimpleNamespace(messages=messages))
+
+        request = APIRequestFactory().post('/api/generate-variations/',
+                                           {"element_html": "<a>hi</a>", "count": 2, "stream": True}, format='json')
+        response = GenerateVariationsView.as_view()(request)
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in b"".join(response).decode().splitlines()]
+        assert lines == [{"index": 0, "html": "<a>1</a>", "artifact": content_hash("<a>1</a>")},
+                         {"index": 1, "html": "<a>2</a>", "artifact": content_hash("<a>2</a>")}]
+
+
+class TestPartialRegeneration:
+    """Tests for regenerating only the changed region of a page"""
+
+    PAGE = ('<!DOCTYPE html><html><head><style>a>b{}</style></head><body class="h-screen">'
+            '<header><h1>Hi</h1><img src="a.png"></header><main><p>One</p><ul><li>a</li></ul></main></body></html>')
+
+    @staticmethod
+    def sketch(*boxes, size=(800, 600)):
+        import io
+        from PIL import Image, ImageDraw
+        img = Image.new("RGB", size, (255, 255, 255))
+        for box in boxes:
+            ImageDraw.Draw(img).rectangle(box, outline=(0, 0, 0), width=4)
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        return buf.getvalue()
+
+    def test_annotate_and_apply_patch_ops(self):
+        from .services.partialRegen import annotate_html, apply_patch_ops, strip_annotations
+
+        annotated, count = annotate_html(self.PAGE)
+        assert count == 7
+        assert '<style>a>b{}</style>' in annotated
+        assert '<img data-rid="2" src="a.png">' in annotated
+
+        patched, applied = apply_patch_ops(annotated, [
+            {"op": "replace", "rid": "1", "html": "<h1>Bye</h1>"},
+            {"op": "append", "rid": "5", "html": "<li>b</li>"},
+            {"op": "remove", "rid": "2"},
+            {"op": "replace", "rid": "99", "html": "<p>missing</p>"},
+        ])
+
+        assert applied == 3
+        assert strip_annotations(patched) == (
+            '<!DOCTYPE html><html><head><style>a>b{}</style></head><body class="h-screen">'
+            '<header><h1>Bye</h1></header><main><p>One</p><ul><li>a</li><li>b</li></ul></main></body></html>')
+
+    def test_changed_region_tracks_shifted_export(self):
+        import io
+        from PIL import Image
+        from .services.partialRegen import changed_region
+
+        load = lambda data: Image.open(io.BytesIO(data)).convert("RGB")
+        before = self.sketch((100, 100, 300, 200), size=(800, 600))
+        assert changed_region(load(before), load(before)) is None
+
+        #Drawing grew on the left, so the old drawing now sits at the right edge of the export
+        after = self.sketch((300, 100, 500, 200), (10, 400, 60, 450), size=(1000, 600))
+        left, top, right, bottom = changed_region(load(before), load(after))
+        assert left < 60 and right < 200 and top >= 380
+
+    def test_small_edit_is_patched(self, mocker):
+        import asyncio
+        import json
+        from types import SimpleNamespace
+        from .services import partialRegen
+
+        ops = [{"op": "replace", "rid": "3", "html": "<p>Two</p>"}]
+        messages = FakeMessages(json.dumps(ops))
+        mocker.patch.object(partialRegen, '_client', return_value=SimpleNamespace(messages=messages))
+        full = mocker.patch.object(partialRegen, 'image_to_html_css')
+
+        result = asyncio.run(partialRegen.regenerate_changed_regions(
+            self.PAGE, self.sketch((100, 100, 300, 200)), self.sketch((100, 100, 300, 200), (500, 400, 560, 440))))
+
+        assert result.mode == partialRegen.PATCH
+        assert result.ops_applied == 1
+        assert "<p>Two</p>" in result.html and "data-rid" not in result.html
+        assert messages.calls[0]["max_tokens"] == 4000
+        full.assert_not_called()
+
+    def test_unchanged_and_large_edits_skip_patching(self, mocker):
+        import asyncio
+        from .services import partialRegen
+
+        full = mocker.patch.object(partialRegen, 'image_to_html_css', return_value="<html>new</html>")
+        request_ops = mocker.patch.object(partialRegen, 'request_patch_ops')
+        sketch = self.sketch((100, 100, 300, 200))
+
+        unchanged = asyncio.run(partialRegen.regenerate_changed_regions(self.PAGE, sketch, sketch))
+        redrawn = asyncio.run(partialRegen.regenerate_changed_regions(
+            self.PAGE, sketch, self.sketch((10, 10, 790, 590))))
+
+        assert unchanged.mode == partialRegen.UNCHANGED and unchanged.html == self.PAGE
+        assert redrawn.mode == partialRegen.FULL and redrawn.html == "<html>new</html>"
+        request_ops.assert_not_called()
+        assert full.call_count == 1
+
+
+class TestFakeProvider:
+    """Tests for the pluggable provider and the local fake Claude API"""
+
+    @pytest.fixture
+    def instant(self):
+        from .services.fakeClaude import FakeModelConfig
+        return FakeModelConfig(latency_ms=0, latency_sigma=0, tokens_per_second=0, seed=7)
+
+    def test_fake_provider_serves_every_call_type(self, settings, mocker, instant):
+        import asyncio
+        from .services import claudeProvider
+        from .services.claudeClient import image_to_html_css
+        from .services.claudeClientVariations import generate_component_variations, _variation_cache
+        from .services.fakeClaude import FakeModel
+
+        settings.CLAUDE_PROVIDER = "fake"
+        mocker.patch.object(claudeProvider, '_fake_model', FakeModel(instant))
+        _variation_cache.clear()
+
+        html = asyncio.run(image_to_html_css(b"sketch"))
+        variations = asyncio.run(generate_component_variations("<button>Go</button>", "button", count=4))
+        _variation_cache.clear()
+
+        assert html.startswith("<!DOCTYPE html>")
+        assert html == asyncio.run(image_to_html_css(b"sketch"))
+        assert len(variations) == 4 and len(set(variations)) == 4
+
+    def test_usage_reports_prompt_cache_reads_after_first_call(self, instant):
+        from .services.fakeClaude import FakeModel
+
+        model = FakeModel(instant)
+        request = {
+            "system": [{"type": "text", "text": "x" * 4000, "cache_control": {"type": "ephemeral"}}],
+            "messages": [{"role": "user", "content": "Return ONLY a JSON array of 2 HTML strings."}],
+        }
+        first, second = model.message(request)["usage"], model.message(request)["usage"]
+
+        assert first["cache_creation_input_tokens"] == 1000 and first["cache_read_input_tokens"] == 0
+        assert second["cache_read_input_tokens"] == 1000 and second["cache_creation_input_tokens"] == 0
+
+    def test_sdk_talks_to_local_server_with_streaming_and_429s(self, instant):
+        import asyncio
+        import threading
+        from anthropic import AsyncAnthropic, RateLimitError
+        from .services.fakeClaudeServer import make_server
+
+        server = make_server(port=0, config=instant, quiet=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = AsyncAnthropic(api_key="k", base_url=f"http://127.0.0.1:{server.server_port}", max_retries=0)
+        request = dict(model="fake", max_tokens=100,
+                       messages=[{"role": "user", "content": "Return ONLY a JSON array of 3 HTML strings."}])
+
+        async def run():
+            resp = await client.messages.create(**request)
+            async with client.messages.stream(**request) as stream:
+                streamed = "".join([text async for text in stream.text_stream])
+                final = await stream.get_final_message()
+            server.RequestHandlerClass.model.config.rate_limit_probability = 1.0
+            with pytest.raises(RateLimitError) as limited:
+                await client.messages.create(**request)
+            return resp, streamed, final, limited.value
+
+        try:
+            resp, streamed, final, limited = asyncio.run(run())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert len(json.loads(resp.content[0].text)) == 3
+        assert streamed == resp.content[0].text
+        assert final.usage.output_tokens == resp.usage.output_tokens
+        assert limited.response.headers["retry-after"] == "1.0"
+
+
+class TestMetrics:
+    """Tests for the metrics registry and the /metrics endpoint"""
+
+    def test_counter_and_histogram_render_prometheus_text(self):
+        from .services.metrics import Counter, Histogram, Registry
+
+        registry = Registry()
+        messages = registry.register(Counter("t_messages_total", "Messages.", ("action",)))
+        latency = registry.register(Histogram("t_latency_seconds", "Latency.", buckets=(0.1, 1.0)))
+        messages.labels("scene_update").inc()
+        messages.labels("scene_update").inc(2)
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+
+        lines = registry.render().splitlines()
+
+        assert "# TYPE t_messages_total counter" in lines
+        assert 't_messages_total{action="scene_update"} 3' in lines
+        assert 't_latency_seconds_bucket{le="0.1"} 1' in lines
+        assert 't_latency_seconds_bucket{le="1"} 2' in lines
+        assert 't_latency_seconds_bucket{le="+Inf"} 3' in lines
+        assert "t_latency_seconds_count 3" in lines
+
+    def test_failing_callback_is_left_out_of_the_scrape(self):
+        from .services.metrics import CallbackMetric, Registry
+
+        registry = Registry()
+        registry.register(CallbackMetric("t_ok", "Fine.", "gauge", lambda: 4))
+        registry.register(CallbackMetric("t_broken", "Broken.", "gauge", lambda: 1 / 0))
+
+        text = registry.render()
+        assert "t_ok 4" in text and "t_broken" not in text
+
+    def test_retries_are_counted_per_call_type(self):
+        import asyncio
+        from .services.claudeRetry import CALLS, RETRIES, RetryPolicy, LatencyTracker, call_with_retry
+
+        policy = RetryPolicy(deadline=2.0, attempt_timeout=1.0, max_retries=2, base_delay=0.01, max_delay=0.02)
+        tracker = LatencyTracker(name="metrics_test")
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            if len(calls) < 2:
+                raise TestClaudeRetry.rate_limit_error()
+            return "ok"
+
+        before_retries, before_ok = RETRIES.value("metrics_test"), CALLS.value("metrics_test", "ok")
+        asyncio.run(call_with_retry(flaky, policy, tracker))
+
+        assert RETRIES.value("metrics_test") == before_retries + 1
+        assert CALLS.value("metrics_test", "ok") == before_ok + 1
+
+    def test_consumer_counts_messages_in_and_out(self, mocker):
+        import asyncio
+        from .consumers import MESSAGES
+
+        consumer = SketchConsumer()
+        consumer.server = mocker.Mock(moved={})
+        consumer.channel_name, consumer.collabID = "test.channel", "1"
+        consumer.send = mocker.AsyncMock()
+        before_in, before_out = MESSAGES.value("in", "collaborator_pointer"), MESSAGES.value("out", "page_update")
+        frame = json.dumps({"action": "page_update", "sketchID": "s", "pageName": "Home"})
+
+        async def run():
+            await consumer.receive(json.dumps({"action": "collaborator_pointer", "userID": "u", "pointer": {"x": 1}}))
+            await consumer.collab_frames({"frames": [("page_update", frame)]})
+        asyncio.run(run())
+
+        assert MESSAGES.value("in", "collaborator_pointer") == before_in + 1
+        assert MESSAGES.value("out", "page_update") == before_out + 1
+        consumer.send.assert_awaited_once_with(text_data=frame)
+
+    def test_metrics_endpoint_exposes_collab_and_claude_series(self, client):
+        from .services.claudeUsage import usage
+        from types import SimpleNamespace
+
+        usage.record("metrics_endpoint_test", SimpleNamespace(input_tokens=10, output_tokens=5,
+                                                             cache_read_input_tokens=0,
+                                                             cache_creation_input_tokens=0))
+        response = client.get("/metrics")
+        text = response.content.decode()
+
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+        for name in ("collab_rooms", "collab_members", "collab_pages", "claude_in_flight",
+                     "sketch_preprocess_bytes_saved_total", "variation_cache_entries"):
+            assert f"# TYPE {name} " in text
+        assert 'claude_tokens_total{call="metrics_endpoint_test",kind="input"} 10' in text
+
+    def test_metrics_endpoint_can_be_disabled(self, client, settings):
+        settings.METRICS_ENABLED = False
+        assert client.get("/metrics").status_code == 404
+
+
+class TestRoomActor:
+    """Tests for the per-room actors that own collab state"""
+
+    class RecordingLayer:
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, channel, message):
+            self.sent.append((channel, message))
+
+        def frames(self, channel):
+            return [json.loads(text) for to, message in self.sent if to == channel for _, text in message["frames"]]
+
+    @pytest.fixture
+    def layer(self, mocker):
+        from . import CollabServer as collab_module
+        layer = self.RecordingLayer()
+        mocker.patch.object(collab_module, "get_channel_layer", return_value=layer)
+        return layer
+
+    def test_concurrent_updates_from_threads_are_all_applied(self, layer):
+        import asyncio
+        import threading
+        from .CollabServer import CollabServer
+
+        server = CollabServer()
+
+        async def run():
+            server.onNewConnection("a", "93001")
+            server.onPageUpdate("a", "93001", "page", "Page")
+
+            def writer(n):
+                for i in range(50):
+                    server.rooms["93001"].post("onSceneUpdate", "a", "page", {f"k{n}-{i}": i})
+
+            threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            await asyncio.sleep(0.05)
+            data = server.rooms["93001"].session.sketches[0].sceneData
+            server.onConnectionEnd("a", "93001")
+            await asyncio.sleep(0.01)
+            return data
+
+        data = asyncio.run(run())
+        assert len(data) == 200
+        assert "93001" not in server.rooms
+
+    def test_batch_coalesces_pointers_and_sends_one_message_per_member(self, layer):
+        import asyncio
+        from .CollabServer import RoomActor
+
+        room = RoomActor("93002")
+        room.session.members = ["a", "b", "c"]
+        room.process([
+            ("onCollaboratorPointer", ("a", "ua", {"x": 1}, "p"), 0),
+            ("onCollaboratorPointer", ("a", "ua", {"x": 2}, "p"), 0),
+            ("onPageUpdate", ("a", "p", "Page"), 0),
+            ("onCollaboratorPointer", ("a", "ua", {"x": 3}, "p"), 0),
+        ])
+        sent = asyncio.run(room.flush())
+
+        assert sent == 4
+        assert [channel for channel, _ in layer.sent] == ["b", "c"]
+        assert [frame["action"] for frame in layer.frames("b")] == ["page_update", "collaborator_pointer"]
+        assert layer.frames("b")[1]["pointer"] == {"x": 3}
+        # One encoded string shared by every recipient of the same frame
+        assert layer.sent[0][1]["frames"][0][1] is layer.sent[1][1]["frames"][0][1]
+
+    def test_failed_operation_does_not_stop_the_room(self, layer):
+        import asyncio
+        from .CollabServer import RoomActor
+
+        room = RoomActor("93003")
+        room.session.members = ["a", "b"]
+        room.process([
+            ("onCollaboratorJoin", ("a",), 0),
+            ("onPageUpdate", ("a", "p", "Page"), 0),
+            ("onConnectionEnd", ("missing",), 0),
+        ])
+        asyncio.run(room.flush())
+
+        assert [sketch.ID for sketch in room.session.sketches] == ["p"]
+        assert layer.frames("b")[0]["action"] == "page_update"
+
+    def test_job_updates_from_worker_threads_reach_members(self, layer):
+        import asyncio
+        from .CollabServer import CollabServer
+
+        server = CollabServer()
+
+        async def run():
+            server.onNewConnection("a", "93004")
+            await asyncio.to_thread(server.onJobUpdate, 93004, {"id": "job", "status": "running"})
+            await asyncio.sleep(0.02)
+            server.onConnectionEnd("a", "93004")
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        assert {"action": "job_update", "job": {"id": "job", "status": "running"}} in layer.frames("a")
+
+
+class TestClaudeRouting:
+    """Tests for complexity-aware model routing and output budgets"""
+
+    @staticmethod
+    def png(boxes, size=(800, 600)):
+        import io
+        from PIL import Image, ImageDraw
+
+        img = Image.new("L", size, 255)
+        draw = ImageDraw.Draw(img)
+        for box in boxes:
+            draw.rectangle(box, outline=0, width=3)
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        return buf.getvalue()
+
+    def test_components_are_eight_connected(self):
+        import numpy as np
+        from .services.claudeRouting import count_components
+
+        mask = np.array([
+            [1, 0, 0, 0, 1],
+            [0, 1, 0, 0, 1],
+            [0, 0, 0, 0, 1],
+            [1, 1, 0, 1, 1],
+        ], dtype=bool)
+        assert count_components(mask) == 3
+        assert count_components(np.array([[1, 0, 1], [1, 1, 1]], dtype=bool)) == 1
+        assert count_components(np.zeros((3, 3), dtype=bool)) == 0
+
+    def test_sketches_route_by_complexity(self, settings):
+        from .services.claudeRouting import measure_complexity, route_page
+
+        simple = measure_complexity(self.png([(300, 200, 500, 260)]))
+        busy = measure_complexity(self.png([(x, y, x + 30, y + 20) for x in range(10, 780, 60)
+                                            for y in range(10, 580, 50)]))
+        assert simple.components == 1 and busy.components > 90
+        assert route_page(simple).name == "simple"
+        assert route_page(busy).name == "complex"
+        assert route_page(None).name == "complex"
+        settings.CLAUDE_ROUTING_ENABLED = False
+        assert route_page(simple).max_tokens == 15000
+
+    def test_page_stops_at_html_close_and_escalates_when_cut_off(self, mocker):
+        import asyncio
+        from types import SimpleNamespace
+        from .services import claudeClient
+
+        usage = SimpleNamespace(input_tokens=10, output_tokens=5000)
+        responses = [
+            SimpleNamespace(content=[SimpleNamespace(type="text", text="<!DOCTYPE html><html><body>")],
+                            stop_reason="max_tokens", stop_sequence=None, usage=usage),
+            SimpleNamespace(content=[SimpleNamespace(type="text", text="<!DOCTYPE html><html><body></body>")],
+                            stop_reason="stop_sequence", stop_sequence="</html>", usage=usage),
+        ]
+        calls = []
+
+        async def create(**kwargs):
+            calls.append(kwargs)
+            return responses[len(calls) - 1]
+
+        mocker.patch.object(claudeClient, '_client',
+                            return_value=SimpleNamespace(messages=SimpleNamespace(create=create)))
+
+        html = asyncio.run(claudeClient.image_to_html_css(self.png([(300, 200, 500, 260)])))
+
+        assert html == "<!DOCTYPE html><html><body></body></html>"
+        assert [call["max_tokens"] for call in calls] == [5000, 10000]
+        assert all(call["stop_sequences"] == ["</html>"] for call in calls)
+
+        # Cut off again on the bigger tier: kept as it is rather than climbing to the last tier
+        calls.clear()
+        responses[1] = responses[0]
+        html = asyncio.run(claudeClient.image_to_html_css(self.png([(300, 200, 500, 260)])))
+        assert [call["max_tokens"] for call in calls] == [5000, 10000]
+        assert html.startswith("<!DOCTYPE html><html><body>")
+
+    def test_variation_budget_scales_with_element(self):
+        from .services.claudeRouting import variation_budget
+
+        assert variation_budget("<button>Go</button>", 4) == 1000
+        assert 1000 < variation_budget("<div>" + "x" * 2000 + "</div>", 4) <= 4000
+        assert variation_budget("<div>" + "x" * 40000 + "</div>", 4) == 4000
+
+    def test_fake_model_honours_stop_sequences_and_budget(self):
+        from .services.fakeClaude import FakeModel
+
+        text = "<html><body>page</body></html> trailing chatter"
+        assert FakeModel.stop({"stop_sequences": ["</html>"]}, text) == (
+            "<html><body>page</body>", "stop_sequence", "</html>")
+        assert FakeModel.stop({"max_tokens": 2}, text) == ("<html><b", "max_tokens", None)
+
+
+class TestTailwindCompile:
+    """Tests for compiling generated pages' Tailwind classes into an inline stylesheet"""
+
+    PAGE = ('<!DOCTYPE html>\n<html>\n<head>\n  <!-- styles -->\n  <script src="https://cdn.tailwindcss.com"></script>\n'
+            '</head>\n<body class="bg-gray-100">\n  <div class="p-4 md:px-8 hover:bg-blue-500/50 w-1/2">\n'
+            '    <pre>  a   b  </pre>\n  </div>\n</body>\n</html>')
+
+    def test_utilities_compile_with_variants_and_escaping(self):
+        from .services.tailwindCompile import compile_class, render_rules
+
+        css = render_rules([compile_class(name) for name in
+                            ("md:px-8", "p-4", "hover:bg-blue-500/50", "-mt-2", "2xl:w-1/2", "space-y-4")])
+        assert ".p-4{padding:1rem}" in css
+        assert ".-mt-2{margin-top:-0.5rem}" in css
+        assert ".hover\\:bg-blue-500\\/50:hover{background-color:rgb(59 130 246 / 0.5)}" in css
+        assert ".space-y-4 > :not([hidden]) ~ :not([hidden]){margin-top:1rem}" in css
+        assert "@media (min-width:768px){.md\\:px-8{padding-left:2rem;padding-right:2rem}}" in css
+        assert "\\32 xl\\:w-1\\/2" in css
+        # Breakpoints come after the base utilities they override, smallest first
+        assert css.index(".p-4") < css.index("min-width:768px") < css.index("min-width:1536px")
+        assert compile_class("text-brand-600") is None
+        assert compile_class("wobble:p-4") is None
+
+    def test_page_swaps_runtime_for_stylesheet(self):
+        from .services.tailwindCompile import COMPILED_ATTR, compile_page, postprocess_page
+
+        compiled, outcome = compile_page(self.PAGE)
+        assert outcome == "compiled"
+        assert "cdn.tailwindcss.com" not in compiled
+        # First thing in the body, so the editor's body.innerHTML keeps it
+        assert compiled.index("<body") < compiled.index(COMPILED_ATTR) < compiled.index('<div class="p-4')
+        assert compile_page(compiled) == (compiled, "compiled")
+
+        page = postprocess_page(self.PAGE)
+        assert "<!--" not in page
+        assert "<pre>  a   b  </pre>" in page
+        assert "</head><body" in page
+
+    def test_unknown_classes_keep_or_restore_the_runtime(self):
+        from .services.tailwindCompile import COMPILED_ATTR, compile_page
+
+        custom = self.PAGE.replace("</head>", "<style>.brand { color: red }</style></head>").replace("p-4", "p-4 brand")
+        assert compile_page(custom)[1] == "compiled"
+
+        unknown = self.PAGE.replace("p-4", "p-4 text-brand-600")
+        assert compile_page(unknown) == (unknown, "fallback")
+
+        # A compiled page patched with a class the compiler doesn't know gets the runtime back
+        patched = compile_page(self.PAGE)[0].replace("p-4", "p-4 text-brand-600")
+        restored, outcome = compile_page(patched)
+        assert outcome == "fallback"
+        assert COMPILED_ATTR not in restored
+        assert restored.count("cdn.tailwindcss.com") == 1
+
+        configured = self.PAGE.replace("</head>", "<script>tailwind.config = {}</script></head>")
+        assert compile_page(configured) == (configured, "skipped")
+        # The compiler is v3; a page written against v4 keeps its own runtime
+        v4 = self.PAGE.replace("https://cdn.tailwindcss.com", "https://cdn.jsdelivr.net/npm/@tailwindcss/browser@4")
+        assert compile_page(v4) == (v4, "skipped")
+
+    def test_toggled_classes_compile_or_keep_the_runtime(self):
+        from .services.tailwindCompile import compile_page
+
+        menu = self.PAGE.replace("<pre>", '<nav id="menu" class="hidden"></nav><pre>').replace("</body>", (
+            '<button onclick="menu.classList.toggle(\'hidden\'); menu.classList.toggle(\'flex\', true)">Menu</button>'
+            '<script>menu.classList.add("bg-red-500", "md:block")</script></body>'))
+        compiled, outcome = compile_page(menu)
+        assert outcome == "compiled"
+        assert ".flex{display:flex}" in compiled
+        assert ".bg-red-500{" in compiled
+        assert "md\\:block{display:block}" in compiled
+
+        # Class names only known at run time need the runtime
+        dynamic = menu.replace('add("bg-red-500", "md:block")', "add(active)")
+        assert compile_page(dynamic) == (dynamic, "fallback")
+        built = menu.replace('add("bg-red-500", "md:block")', "add('bg-' + tone + '-500')")
+        assert compile_page(built) == (built, "fallback")
+
+    def test_variations_carry_their_own_stylesheet(self, mocker):
+        import asyncio
+        from types import SimpleNamespace
+        from .services import claudeClientVariations
+        from .services.tailwindCompile import COMPILED_ATTR
+
+        claudeClientVariations._variation_cache.clear()
+        messages = FakeMessages('["<button class=\\"px-4 py-2 rounded-lg\\">Go</button>", "<a>plain</a>"]')
+        mocker.patch.object(claudeClientVariations, '_variations_client', return_value=SimpleNamespace(messages=messages))
+
+        element = f'<style {COMPILED_ATTR}>.p-4{{padding:1rem}}</style><button class="p-4">Go</button>'
+        styled, plain = asyncio.run(claudeClientVariations.generate_component_variations(element, "button", count=2))
+        claudeClientVariations._variation_cache.clear()
+
+        assert styled.startswith('<button class="px-4 py-2 rounded-lg">') and ".rounded-lg{" in styled
+        assert plain == "<a>plain</a>"
+        # The stylesheet of the element picked from a compiled page isn't sent to the model
+        assert COMPILED_ATTR not in messages.calls[0]["messages"][0]["content"]
+
+    def test_applied_variation_keeps_its_component(self):
+        from html.parser import HTMLParser
+        from .services.tailwindCompile import PREFLIGHT_ATTR, compile_fragment
+
+        class TopLevel(HTMLParser):
+            """The children of the editor's temp <div> after `temp.innerHTML = newHtml`."""
+
+            def __init__(self):
+                super().__init__()
+                self.depth, self.children, self.text = 0, [], {}
+
+            def handle_starttag(self, tag, attrs):
+                if self.depth == 0:
+                    self.children.append((tag, dict(attrs)))
+                self.depth += 1
+
+            def handle_endtag(self, tag):
+                self.depth -= 1
+
+            def handle_data(self, data):
+                if self.depth == 1 and self.children[-1][0] == "style":
+                    self.text[len(self.children) - 1] = data
+
+        fragment, outcome = compile_fragment('<button class="px-4 py-2 bg-blue-500 rounded-lg">Go</button>')
+        parser = TopLevel()
+        parser.feed(fragment)
+        assert outcome == "compiled"
+        # APPLY_VARIATION swaps in the first element that isn't a <style>, and older editors take
+        # firstElementChild: both are the button
+        assert parser.children[0] == ("button", {"class": "px-4 py-2 bg-blue-500 rounded-lg"})
+        hoisted = [i for i, (tag, attrs) in enumerate(parser.children) if tag == "style" and PREFLIGHT_ATTR not in attrs]
+        assert len(hoisted) == 1 and ".bg-blue-500{" in parser.text[hoisted[0]]
+        # What moves into the page's <head> leaves the page's element styles alone
+        assert "box-sizing" not in parser.text[hoisted[0]] and "button" not in parser.text[hoisted[0]]
+
+
+class TestResponseCompression:
+    """Tests for API response compression and content-addressed generated pages"""
+
+    BODY = {"html": "<div class=\"p-4 text-gray-700\">" * 200}
+
+    @staticmethod
+    def middleware(response):
+        from .services.responseCompression import APICompressionMiddleware
+        return APICompressionMiddleware(lambda request: response)
+
+    def test_encoding_negotiation(self):
+        from .services.responseCompression import choose_encoding
+
+        assert choose_encoding("gzip, deflate, br") == "br"
+        assert choose_encoding("gzip, br;q=0") == "gzip"
+        assert choose_encoding("identity") is None
+        assert choose_encoding("") is None
+
+    def test_large_json_is_compressed_small_and_html_are_not(self):
+        import gzip
+
+        request = RequestFactory().get('/api/jobs/x/', HTTP_ACCEPT_ENCODING="gzip")
+        response = self.middleware(JsonResponse(self.BODY))(request)
+        assert response["Content-Encoding"] == "gzip"
+        assert response["Vary"] == "Accept-Encoding"
+        assert json.loads(gzip.decompress(response.content)) == self.BODY
+        assert int(response["Content-Length"]) == len(response.content) < len(json.dumps(self.BODY)) // 10
+
+        assert not self.middleware(JsonResponse({"ok": True}))(request).has_header("Content-Encoding")
+        page = HttpResponse(self.BODY["html"], content_type="text/html")
+        assert not self.middleware(page)(request).has_header("Content-Encoding")
+
+    def test_streams_are_flushed_line_by_line(self):
+        import asyncio
+        import brotli
+        from django.http import StreamingHttpResponse
+
+        async def lines():
+            for i in range(3):
+                yield json.dumps({"index": i, **self.BODY}) + "\n"
+
+        request = RequestFactory().post('/api/generate-multi/', HTTP_ACCEPT_ENCODING="br, gzip")
+        response = self.middleware(StreamingHttpResponse(lines(), content_type="application/x-ndjson"))(request)
+        assert response["Content-Encoding"] == "br"
+
+        async def read():
+            decompressor, decoded = brotli.Decompressor(), []
+            async for chunk in response.streaming_content:
+                decoded.append(decompressor.process(chunk).decode())
+            return decoded
+
+        decoded = asyncio.run(read())
+        # Each page's line is decodable as soon as its chunk arrives
+        assert [json.loads(line)["index"] for line in decoded[:3]] == [0, 1, 2]
+        assert "".join(decoded).count("\n") == 3
+
+    def test_artifacts_revalidate_with_etags(self):
+        from .views import ArtifactView
+        from .services.generatedArtifacts import get_artifact_cache, remember
+
+        digest = remember("<html>page</html>")
+        view = ArtifactView.as_view()
+        factory = APIRequestFactory()
+
+        response = view(factory.get(f'/api/artifacts/{digest}/'), digest=digest)
+        assert response.status_code == 200
+        assert response.data == {"artifact": digest, "html": "<html>page</html>"}
+        assert response["ETag"] == f'"{digest}"'
+
+        # Weak form too: that's what a client sees after the response was compressed
+        for held in (f'"{digest}"', f'W/"{digest}"', f'"other", W/"{digest}"', '*'):
+            response = view(factory.get(f'/api/artifacts/{digest}/', HTTP_IF_NONE_MATCH=held), digest=digest)
+            assert response.status_code == 304
+            assert response.content == b""
+
+        get_artifact_cache().clear()
+        assert view(factory.get(f'/api/artifacts/{digest}/', HTTP_IF_NONE_MATCH=f'"{digest}"'),
+                    digest=digest).status_code == 304
+        assert view(factory.get(f'/api/artifacts/{digest}/'), digest=digest).status_code == 404
+        assert view(factory.get(f'/api/artifacts/{digest}/', HTTP_IF_NONE_MATCH='*'), digest=digest).status_code == 404
+        assert view(factory.get('/api/artifacts/nope/'), digest="nope").status_code == 404
+
+
+class TestSketchSimilarity:
+    """Tests for the perceptual-hash near-duplicate result cache"""
+
+    @staticmethod
+    def wireframe(canvas=(1200, 900), offset=(100, 80), blur=0, extra=False):
+        from PIL import Image, ImageDraw, ImageFilter
+
+        img = Image.new("RGB", canvas, "white")
+        draw = ImageDraw.Draw(img)
+        x, y = offset
+        boxes = [(0, 0, 800, 80), (0, 120, 250, 600), (290, 120, 800, 350), (290, 390, 520, 600), (560, 390, 800, 600)]
+        if extra:
+            boxes.append((320, 160, 760, 300))
+        for left, top, right, bottom in boxes:
+            draw.rectangle([x + left, y + top, x + right, y + bottom], outline="black", width=3)
+        return img.filter(ImageFilter.GaussianBlur(blur)) if blur else img
+
+    @staticmethod
+    def png(img):
+        import io
+
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        return buf.getvalue()
+
+    def test_reexported_sketches_hash_close_and_edits_do_not(self):
+        from .services.imagePreprocess import preprocess_sketch
+        from .services.sketchSimilarity import hamming
+
+        original = preprocess_sketch(self.png(self.wireframe())).fingerprint
+        moved = preprocess_sketch(self.png(self.wireframe((1400, 1000), (250, 130), blur=1))).fingerprint
+        edited = preprocess_sketch(self.png(self.wireframe(extra=True))).fingerprint
+        assert original[1] == moved[1]
+        assert hamming(original[0], moved[0]) <= 2
+        assert hamming(original[0], edited[0]) > 10
+
+    def test_cache_matches_within_threshold_and_context(self):
+        import numpy as np
+        from .services.sketchSimilarity import SimilarityCache
+
+        thumb = np.full((128, 128), 255, dtype=np.uint8)
+        cache = SimilarityCache(max_distance=1)
+        cache.set((bytes(32), 0, thumb), "<html>", "alice", None, "model")
+        assert cache.get((bytes([0b11]) + bytes(31), 0, thumb), "alice", None, "model") is None
+        assert cache.get((bytes([0b1]) + bytes(31), 0, thumb), "alice", None, "model") == "<html>"
+        assert cache.get((bytes(32), 0, thumb), "alice", "Make it dark", "model") is None
+        assert cache.get((bytes(32), 0, thumb), "bob", None, "model") is None
+        assert cache.get((bytes(32), 1, thumb), "alice", None, "model") is None
+        assert cache.get(None, "alice", None, "model") is None
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 4
+
+    def test_sketches_differing_only_in_text_miss(self):
+        from PIL import ImageDraw, ImageFont
+        from .services.imagePreprocess import preprocess_sketch
+        from .services.sketchSimilarity import SimilarityCache
+
+        def login(label):
+            img = self.wireframe()
+            ImageDraw.Draw(img).text((420, 250), label, fill="black", font=ImageFont.load_default(size=48))
+            return preprocess_sketch(self.png(img)).fingerprint
+
+        cache = SimilarityCache()
+        cache.set(login("Sign in"), "<html>sign in</html>", "alice")
+        assert cache.get(login("Sign in"), "alice") == "<html>sign in</html>"
+        assert cache.get(login("Register"), "alice") is None
+
+    def test_index_expires_and_evicts_least_recently_used(self):
+        from .services.sketchSimilarity import HammingIndex
+
+        now = [0.0]
+        index = HammingIndex(bits=64, max_entries=2, ttl=10, clock=lambda: now[0])
+        a, b, c = bytes([1]) + bytes(7), bytes([2]) + bytes(7), bytes([4]) + bytes(7)
+        index.add(a, 0, "a")
+        now[0] = 1
+        index.add(b, 0, "b")
+        now[0] = 2
+        assert index.nearest(a, 0, 0) == ("a", 0)
+        index.add(c, 0, "c")
+        assert index.nearest(b, 0, 0) is None
+        assert index.nearest(a, 0, 0) == ("a", 0) and len(index) == 2
+        now[0] = 20
+        assert index.nearest(a, 0, 0) is None and len(index) == 0
+
+    def test_generate_reuses_page_for_reexported_sketch(self, mocker):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from . import views
+        from .services import imagePreprocess
+        from .services.sketchSimilarity import SimilarityCache
+
+        cache = SimilarityCache()
+        mocker.patch.object(views, "get_similarity_cache", return_value=cache)
+        mocker.patch.object(imagePreprocess, "get_similarity_cache", return_value=cache)
+        convertor = mocker.patch.object(views, "image_to_html_css", return_value="<html>first</html>")
+
+        responses = []
+        for img in (self.wireframe(), self.wireframe((1400, 1000), (250, 130), blur=1)):
+            upload = SimpleUploadedFile("sketch.png", self.png(img), content_type="image/png")
+            request = APIRequestFactory().post("/api/generate/", {"file": upload}, format="multipart")
+            responses.append(views.GenerateView.as_view()(request))
+
+        assert [r.data["html"] for r in responses] == ["<html>first</html>"] * 2
+        assert [r.data["cached"] for r in responses] == [False, True]
+        assert convertor.call_count == 1
+
+
+class TestSceneRaster:
+    """Tests for rendering collab pages server-side and generating from room state"""
+
+    @staticmethod
+    def element(id, type="rectangle", version=1, **extra):
+        element = {"id": id, "type": type, "x": 0, "y": 0, "width": 200, "height": 100, "angle": 0,
+                   "strokeColor": "#1e1e1e", "backgroundColor": "transparent", "fillStyle": "solid",
+                   "strokeWidth": 2, "strokeStyle": "solid", "opacity": 100, "version": version,
+                   "versionNonce": version, "isDeleted": False}
+        element.update(extra)
+        return element
+
+    def test_render_draws_scene_at_its_bounds(self):
+        import io
+        from PIL import Image
+        from .services.sceneRaster import PADDING, render_scene
+
+        scene = {"elements": [self.element("r"), self.element("t", "text", x=20, y=20, width=80, height=25,
+                                                               text="Hello", fontSize=20)]}
+        image = Image.open(io.BytesIO(render_scene(scene, max_scale=1)))
+        assert image.format == "PNG"
+        assert image.size == (200 + 2 * PADDING, 100 + 2 * PADDING)
+        assert image.convert("L").getextrema()[0] < 100
+
+    def test_deleted_and_unsupported_elements_are_skipped(self):
+        from .services.sceneRaster import render_scene, visible_elements
+
+        scene = {"elements": [self.element("gone", isDeleted=True), self.element("pic", "image")]}
+        assert visible_elements(scene) == []
+        assert render_scene(scene) is None
+        assert render_scene({}) is None
+
+    def test_renders_are_cached_per_scene_version(self, mocker):
+        from .services import sceneRaster
+        from .services.sceneRaster import SceneRasterizer
+
+        draw = mocker.spy(sceneRaster, "render_scene")
+        rasterizer = SceneRasterizer(max_scale=1)
+        png = rasterizer.render({"elements": [self.element("r")]})
+        assert rasterizer.render({"elements": [self.element("r")]}) == png
+        assert draw.call_count == 1
+        rasterizer.render({"elements": [self.element("r", version=2, width=50)]})
+        assert draw.call_count == 2
+        assert rasterizer.render({"elements": []}) is None
+        assert rasterizer.render({"elements": []}) is None
+        assert draw.call_count == 3
+
+    def test_generate_queues_a_job_from_room_pages(self, mocker):
+        from . import views
+        from .CollabServer import CollabServer
+        from .services.sceneRaster import SceneRasterizer
+        from .views import CollabGenerateView
+
+        pages = [("98001-a", "Home", {"elements": [self.element("r")]}),
+                 ("98001-b", "Blank", {"elements": []}),
+                 ("98001-c", "About", {"elements": [self.element("e", "ellipse")]})]
+        mocker.patch.object(CollabServer, "pages", return_value=pages)
+        mocker.patch.object(views, "get_rasterizer", return_value=SceneRasterizer(max_scale=1))
+        runner = mocker.Mock()
+        mocker.patch.object(views, "get_job_runner", return_value=runner)
+
+        request = APIRequestFactory().post("/api/collab/98001/generate/", {"pages": ["98001-a", "98001-b"]},
+                                           format="json")
+        response = CollabGenerateView.as_view()(request, collab_id="98001")
+
+        assert response.status_code == 202
+        assert response.data["skipped"] == ["98001-b"]
+        job, inputs = runner.submit.call_args.args
+        assert job.collab_id == "98001"
+        assert [(page.page_id, page.name, page.media_type) for page in inputs] == [("98001-a", "Home", "image/png")]
+        assert inputs[0].data.startswith(b"\x89PNG")
+
+    def test_too_many_pages_are_refused_before_rendering(self, mocker):
+        from . import views
+        from .CollabServer import CollabServer
+        from .views import CollabGenerateView
+
+        pages = [(f"98003-{i}", f"Page {i}", {"elements": [self.element("r")]}) for i in range(21)]
+        mocker.patch.object(CollabServer, "pages", return_value=pages)
+        rasterizer = mocker.patch.object(views, "get_rasterizer")
+
+        factory = APIRequestFactory()
+        response = CollabGenerateView.as_view()(factory.post("/api/collab/98003/generate/", {}, format="json"),
+                                                collab_id="98003")
+        assert response.status_code == 400
+        assert not rasterizer.called
+
+    def test_unknown_room_is_not_found(self, mocker):
+        from .views import CollabGenerateView, CollabPageImageView
+
+        factory = APIRequestFactory()
+        response = CollabGenerateView.as_view()(factory.post("/api/collab/98002/generate/", {}, format="json"),
+                                                collab_id="98002")
+        assert response.status_code == 404
+        response = CollabPageImageView.as_view()(factory.get("/api/collab/98002/pages/x.png"),
+                                                 collab_id="98002", sketch_id="x")
+        assert response.status_code == 404
+
+
+class TestSpectators:
+    """Tests for read-only spectators that get throttled snapshots"""
+
+    class RecordingLayer:
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, channel, message):
+            self.sent.append((channel, message))
+
+        def frames(self, channel):
+            return [json.loads(text) for to, message in self.sent if to == channel and "frames" in message
+                    for _, text in message["frames"]]
+
+    def test_spectators_get_coalesced_snapshots_and_no_roster(self, settings, mocker):
+        import asyncio
+        from . import CollabServer as collab_module
+        from .CollabServer import CollabServer
+
+        settings.COLLAB_SPECTATOR_INTERVAL = 0.05
+        layer = self.RecordingLayer()
+        mocker.patch.object(collab_module, "get_channel_layer", return_value=layer)
+        server = CollabServer()
+
+        async def run():
+            server.onNewConnection("editor-a", "97001")
+            server.onNewConnection("editor-b", "97001")
+            server.onNewConnection("viewer", "97001", True)
+            server.onCollaboratorJoin("editor-a", "97001", "ua", "Ann")
+            server.onPageUpdate("editor-a", "97001", "97001-p", "Page")
+            for i in range(10):
+                server.onSceneUpdate("editor-a", "97001", "97001-p", {f"k{i}": i})
+                server.onCollaboratorPointer("editor-a", "97001", "ua", {"x": i}, "97001-p")
+            await asyncio.sleep(0.15)
+            spectators = list(server.rooms["97001"].session.spectators)
+            for channel in ("editor-a", "editor-b", "viewer"):
+                server.onConnectionEnd(channel, "97001")
+            await asyncio.sleep(0.01)
+            return spectators
+
+        assert asyncio.run(run()) == ["viewer"]
+        viewer = layer.frames("viewer")
+        assert [frame["action"] for frame in viewer] == ["page_update", "scene_update"]
+        assert viewer[1]["sketchData"] == {f"k{i}": i for i in range(10)}
+        editor = [frame["action"] for frame in layer.frames("editor-b")]
+        assert editor.count("scene_update") == 10 and "collaborator_join" in editor
+        assert "97001" not in server.rooms
+
+    @pytest.mark.asyncio
+    async def test_spectator_connections_are_read_only(self):
+        application = URLRouter(urlpatterns)
+        editor = WebsocketCommunicator(application, "/ws/collab/97002/")
+        viewer = WebsocketCommunicator(application, "/ws/collab/97002/?role=spectator")
+        await editor.connect()
+        await viewer.connect()
+        await viewer.send_json_to({"action": "page_update", "sketchID": "97002-p", "pageName": "Vandalised"})
+        await viewer.send_json_to({"action": "collaborator_join", "userID": "v", "username": "Viewer"})
+        assert await editor.receive_nothing(timeout=0.2)
+        await editor.send_json_to({"action": "collaborator_join", "userID": "e", "username": "Editor"})
+        assert await viewer.receive_nothing(timeout=0.2)
+        await editor.disconnect()
+        await viewer.disconnect()
+
+
+class TestHeartbeats:
+    """Tests for heartbeat pings and reaping members that stopped answering"""
+
+    class RecordingLayer:
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, channel, message):
+            self.sent.append((channel, message))
+
+        def frames(self, channel):
+            return [json.loads(text) for to, message in self.sent if to == channel and "frames" in message
+                    for _, text in message["frames"]]
+
+    def test_silent_member_is_reaped_and_its_wasted_frames_counted(self, settings, mocker):
+        import asyncio
+        from . import CollabServer as collab_module
+        from .CollabServer import REAPED, REAPED_FRAMES, CollabServer
+
+        settings.COLLAB_HEARTBEAT_INTERVAL = 0.02
+        settings.COLLAB_HEARTBEAT_TIMEOUT = 0.1
+        layer = self.RecordingLayer()
+        mocker.patch.object(collab_module, "get_channel_layer", return_value=layer)
+        server = CollabServer()
+        reaped_before, frames_before = REAPED.value(), REAPED_FRAMES.value()
+
+        async def run():
+            for channel in ("alive", "gone"):
+                server.onNewConnection(channel, "96001")
+            server.onCollaboratorJoin("gone", "96001", "u-gone", "Gone")
+            server.onPageUpdate("alive", "96001", "96001-p", "Page")
+            for _ in range(8):
+                await asyncio.sleep(0.02)
+                server.onHeartbeat("alive", "96001")
+            members = list(server.rooms["96001"].session.members)
+            server.onConnectionEnd("alive", "96001")
+            await asyncio.sleep(0.01)
+            return members
+
+        assert asyncio.run(run()) == ["alive"]
+        assert REAPED.value() == reaped_before + 1
+        assert REAPED_FRAMES.value() == frames_before + 1  # the page_update sent after its last sign of life
+        assert ("gone", {"type": "collab.reaped"}) in layer.sent
+        assert {"action": "collaborator_leave", "userID": "u-gone"} in layer.frames("alive")
+
+    @pytest.mark.asyncio
+    async def test_consumer_pings_and_pongs_keep_the_member(self, settings, mocker):
+        from .CollabServer import CollabServer
+
+        settings.COLLAB_HEARTBEAT_INTERVAL = 0.02
+        heartbeat = mocker.spy(CollabServer, "onHeartbeat")
+        communicator = WebsocketCommunicator(URLRouter(urlpatterns), "/ws/collab/96002/")
+        await communicator.connect()
+        assert await communicator.receive_json_from(timeout=1) == {"action": "ping"}
+        await communicator.send_json_to({"action": "pong"})
+        assert await communicator.receive_json_from(timeout=1) == {"action": "ping"}
+        await communicator.disconnect()
+
+        assert heartbeat.call_args.args[2] == "96002"
+
+    @pytest.mark.asyncio
+    async def test_reaped_consumer_closes_its_socket(self):
+        communicator = WebsocketCommunicator(URLRouter(urlpatterns), "/ws/collab/96003/")
+        await communicator.connect()
+        await communicator.send_input({"type": "collab.reaped"})
+        closed = await communicator.receive_output(timeout=1)
+        assert (closed["type"], closed["code"]) == ("websocket.close", 4000)
+        await communicator.disconnect()
+
+
+class TestRoomAffinity:
+    """Tests for pinning rooms to workers (services/roomAffinity.py) and handing them off"""
+
+    class RecordingLayer:
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, channel, message):
+            self.sent.append((channel, message))
+
+    class FakeUpstream:
+        def __init__(self):
+            import asyncio
+            self.sent = []
+            self.incoming = asyncio.Queue()
+            self.closed = False
+
+        async def send(self, text):
+            self.sent.append(json.loads(text))
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            text = await self.incoming.get()
+            if text is None:
+                raise StopAsyncIteration
+            return text
+
+        async def close(self):
+            self.closed = True
+
+    @pytest.fixture
+    def affinity(self, mocker):
+        from .services import roomAffinity
+        affinity = roomAffinity.Affinity("http://a", ["http://a"], token="s")
+        mocker.patch.object(roomAffinity, "_affinity", affinity)
+        return affinity
+
+    @pytest.fixture
+    def layer(self, mocker):
+        from . import CollabServer as collab_module
+        layer = self.RecordingLayer()
+        mocker.patch.object(collab_module, "get_channel_layer", return_value=layer)
+        return layer
+
+    def test_adding_a_worker_only_moves_rooms_to_it(self):
+        from .services.roomAffinity import HashRing
+
+        before = HashRing(["http://a", "http://b", "http://c"])
+        after = HashRing(["http://a", "http://b", "http://c", "http://d"])
+        moved = [key for key in range(2000) if before.owner(key) != after.owner(key)]
+
+        assert all(after.owner(key) == "http://d" for key in moved)
+        assert 0.15 < len(moved) / 2000 < 0.35
+        assert HashRing(["http://c", "http://a", "http://b"]).owner(1234) == before.owner(1234)
+
+    def test_route(self):
+        from .services.roomAffinity import Affinity
+
+        assert Affinity().route("95000") is None
+        affinity = Affinity("http://a", ["http://a", "http://b"], max_hops=2, token="s")
+        elsewhere = next(str(key) for key in range(1000) if affinity.ring.owner(key) == "http://b")
+        here = next(str(key) for key in range(1000) if affinity.ring.owner(key) == "http://a")
+        assert affinity.route(elsewhere) == "http://b"
+        assert affinity.route(here) is None
+        assert affinity.route(elsewhere, hops=2) is None
+        assert affinity.allows("s") and not affinity.allows("wrong") and not affinity.allows(None)
+        assert affinity.headers(1) == {"x-collab-hops": "1", "x-collab-token": "s"}
+
+    def test_worker_without_cluster_token_refuses_to_start(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from .services.roomAffinity import Affinity
+
+        with pytest.raises(ImproperlyConfigured):
+            Affinity("http://a", ["http://a", "http://b"])
+        assert not Affinity(token="s").allows("s")
+
+    def test_rebalance_hands_the_room_off_and_members_follow(self, affinity, layer, mocker):
+        import asyncio
+        from . import CollabServer as collab_module
+        from .CollabServer import CollabServer
+
+        send_snapshot = mocker.patch.object(collab_module, "send_snapshot", mocker.AsyncMock(return_value=True))
+        server = CollabServer()
+
+        async def run():
+            server.onNewConnection("m1", "95001")
+            server.onPageUpdate("m1", "95001", "95001-p", "Page")
+            await asyncio.sleep(0.01)
+            moving = server.rebalance(["http://b"])
+            owner = await server.route("95001")
+            await asyncio.sleep(0.01)
+            return moving, owner
+
+        moving, owner = asyncio.run(run())
+        assert "95001" in moving and owner == "http://b"
+        assert "95001" not in server.rooms
+        send_snapshot.assert_awaited_once_with(
+            "http://b", "95001", {"sketches": [{"ID": "95001-p", "name": "Page", "sceneData": {}}]})
+        assert ("m1", {"type": "collab.moved", "owner": "http://b"}) in layer.sent
+        server.rebalance(["http://a"])
+        assert "95001" not in server.moved
+
+    def test_failed_handoff_keeps_the_room_here(self, affinity, layer, mocker):
+        import asyncio
+        from . import CollabServer as collab_module
+        from .CollabServer import CollabServer
+
+        mocker.patch.object(collab_module, "send_snapshot", mocker.AsyncMock(return_value=False))
+        server = CollabServer()
+
+        async def run():
+            server.onNewConnection("m1", "95002")
+            await asyncio.sleep(0.01)
+            server.rebalance(["http://b"])
+            owner = await server.route("95002")
+            server.onConnectionEnd("m1", "95002")
+            await asyncio.sleep(0.01)
+            return owner
+
+        assert asyncio.run(run()) is None
+        assert "95002" in server.pinned
+        server.rebalance(["http://a"])
+        assert not server.pinned
+
+    def test_installed_snapshot_seeds_the_room(self, layer):
+        import asyncio
+        from .CollabServer import CollabServer
+
+        server = CollabServer()
+        snapshot = {"sketches": [{"ID": "95003-p", "name": "Page", "sceneData": {"elements": []}}]}
+
+        async def run():
+            server.install("95003", snapshot)
+            server.onNewConnection("m1", "95003")
+            await asyncio.sleep(0.01)
+            #A second copy arriving once the room exists only adds pages it doesn't have
+            server.install("95003", {"sketches": snapshot["sketches"] + [{"ID": "95003-q", "name": "Q", "sceneData": {}}]})
+            await asyncio.sleep(0.01)
+            names = [sketch.name for sketch in server.rooms["95003"].session.sketches]
+            server.onConnectionEnd("m1", "95003")
+            await asyncio.sleep(0.01)
+            return names
+
+        assert asyncio.run(run()) == ["Page", "Q"]
+        actions = [json.loads(text)["action"] for channel, message in layer.sent for _, text in message["frames"]]
+        assert actions == ["page_update", "scene_update", "page_update", "scene_update"]
+
+    @pytest.mark.asyncio
+    async def test_connection_for_a_room_owned_elsewhere_is_proxied(self, mocker):
+        from . import consumers
+        from .services import roomAffinity
+
+        affinity = roomAffinity.Affinity("http://a", ["http://b"], token="s")
+        mocker.patch.object(roomAffinity, "_affinity", affinity)
+        upstream = self.FakeUpstream()
+        open_upstream = mocker.patch.object(consumers, "open_upstream", mocker.AsyncMock(return_value=upstream))
+
+        communicator = WebsocketCommunicator(URLRouter(urlpatterns), "/ws/collab/95004/")
+        connected, _ = await communicator.connect()
+        assert connected
+        await communicator.send_json_to({"action": "collaborator_join", "userID": "u1", "username": "Ann"})
+        await upstream.incoming.put(json.dumps({"action": "page_update", "sketchID": "95004-p", "pageName": "P"}))
+        assert (await communicator.receive_json_from())["pageName"] == "P"
+        await communicator.disconnect()
+
+        open_upstream.assert_awaited_once_with("http://b", "95004", 1, False)
+        assert upstream.sent == [{"action": "collaborator_join", "userID": "u1", "username": "Ann"}]
+        assert upstream.closed
+        assert "95004" not in consumers.CollabServer.rooms
+
+
+class TestLocalChannelLayer:
+    """Tests for the single-process channel layer in services/channelLayer.py"""
+
+    def test_is_the_configured_layer_and_passes_messages_by_reference(self):
+        import asyncio
+        from channels.layers import get_channel_layer
+        from .services.channelLayer import LocalChannelLayer
+
+        layer = get_channel_layer()
+        message = {"type": "collab.frames", "frames": [("page_update", "{}")]}
+
+        async def run():
+            channel = await layer.new_channel()
+            await layer.send(channel, message)
+            await layer.send(channel, {"type": "second"})
+            return await layer.receive(channel), await layer.receive(channel)
+
+        first, second = asyncio.run(run())
+        assert isinstance(layer, LocalChannelLayer)
+        assert first is message and second["type"] == "second"
+
+    @pytest.mark.parametrize("overflow, kept, outcome", [
+        ("drop_oldest", [1, 2], "dropped_oldest"),
+        ("drop_newest", [0, 1], "dropped_newest"),
+    ])
+    def test_overflow_policies_drop_and_count(self, overflow, kept, outcome):
+        import asyncio
+        from .services.channelLayer import MESSAGES, LocalChannelLayer
+
+        layer = LocalChannelLayer(capacity=2, overflow=overflow)
+        before = MESSAGES.value(outcome)
+
+        async def run():
+            for n in range(3):
+                await layer.send("full", {"type": "t", "n": n})
+            return [(await layer.receive("full"))["n"] for _ in range(2)]
+
+        assert asyncio.run(run()) == kept
+        assert MESSAGES.value(outcome) == before + 1
+
+    def test_reject_policy_raises_channel_full(self):
+        import asyncio
+        from channels.exceptions import ChannelFull
+        from .services.channelLayer import LocalChannelLayer
+
+        layer = LocalChannelLayer(capacity=1)
+
+        async def run():
+            await layer.send("full", {"type": "t"})
+            await layer.send("full", {"type": "t"})
+
+        with pytest.raises(ChannelFull):
+            asyncio.run(run())
+
+    def test_groups(self):
+        import asyncio
+        from .services.channelLayer import LocalChannelLayer
+
+        layer = LocalChannelLayer(capacity=1)
+
+        async def run():
+            for name in ("a", "b", "c"):
+                await layer.group_add("room", name)
+            await layer.group_discard("room", "c")
+            await layer.send("b", {"type": "fills b"})
+            # b is full: group_send skips it instead of failing the whole send
+            await layer.group_send("room", {"type": "hello"})
+            return (await layer.receive("a"))["type"], (await layer.receive("b"))["type"], layer.stats()
+
+        a, b, stats = asyncio.run(run())
+        assert (a, b) == ("hello", "fills b")
+        assert stats["groups"] == 1 and stats["group_members"] == 2
+
+    def test_send_from_another_thread_wakes_the_receiver(self):
+        import asyncio
+        import threading
+        from .services.channelLayer import LocalChannelLayer
+
+        layer = LocalChannelLayer()
+
+        async def run():
+            receiving = asyncio.ensure_future(layer.receive("waiting"))
+            await asyncio.sleep(0.01)
+            sender = threading.Thread(target=asyncio.run, args=(layer.send("waiting", {"type": "from thread"}),))
+            sender.start()
+            message = await asyncio.wait_for(receiving, 1)
+            sender.join()
+            return message
+
+        assert asyncio.run(run())["type"] == "from thread"
+
+    def test_idle_channels_are_reclaimed_with_their_groups(self):
+        import asyncio
+        import time
+        from .services.channelLayer import LocalChannelLayer
+
+        layer = LocalChannelLayer(expiry=0.01)
+
+        async def run():
+            await layer.group_add("room", "gone")
+            await layer.send("gone", {"type": "never read"})
+            time.sleep(0.02)
+            await layer.send("other", {"type": "t"})
+            return layer.stats()
+
+        stats = asyncio.run(run())
+        assert stats["channels"] == 1 and stats["groups"] == 0
+
+
+class TestCollabLoad:
+    """Smoke tests for the websocket load harness in benchmarks/collabLoad.py"""
+
+    def test_synthetic_trace_is_ordered_and_mixes_pointers_and_edits(self):
+        from benchmarks.collabLoad import synthetic_trace
+
+        trace = synthetic_trace(duration=2, seed=1)
+        actions = {event["action"] for event in trace}
+
+        assert actions == {"collaborator_pointer", "scene_update"}
+        assert [event["t"] for event in trace] == sorted(event["t"] for event in trace)
+        assert synthetic_trace(duration=2, seed=1) == trace
+
+    def test_percentile(self):
+        from benchmarks.collabLoad import percentile
+
+        assert percentile([], 0.5) is None
+        assert percentile([3, 1, 2, 4], 0.5) == 3
+        assert percentile(list(range(100)), 0.99) == 99
+
+    def test_in_process_run_reports_fan_out_per_room(self):
+        import asyncio
+        from benchmarks.collabLoad import run_load
+
+        trace = [
+            {"t": 0.0, "action": "collaborator_pointer", "pointer": {"x": 1, "y": 2}},
+            {"t": 0.1, "action": "scene_update", "sketchData": {"elements": {"0": {"id": "a", "x": 1}}}},
+        ]
+        report = asyncio.run(run_load(clients=4, rooms=2, duration=0.3, trace=trace, first_room=91000))
+
+        assert report["mode"] == "in-process"
+        assert set(report["per_room"]) == {"91000", "91001"}
+        assert report["sent"] > 0 and report["delivered"] > 0
+        assert report["latency_ms"]["p50"] is not None
+        assert all(room["handler_cpu_ms"] is not None for room in report["per_room"].values())
+
+    def test_viewers_join_as_spectators(self, settings):
+        import asyncio
+        from benchmarks.collabLoad import run_load
+
+        settings.COLLAB_SPECTATOR_INTERVAL = 0.05
+        trace = [{"t": 0.0, "action": "scene_update", "sketchData": {"elements": {"0": {"id": "a", "x": 1}}}}]
+        report = asyncio.run(run_load(clients=2, rooms=1, duration=0.6, trace=trace, first_room=91010, viewers=2))
+
+        assert report["viewer_role"] == "spectator"
+        assert report["viewer_frames"] > 0
+
+
+class TestCollabBench:
+    """Smoke tests for the micro-benchmark runner in benchmarks/collabBench.py"""
+
+    def test_every_benchmark_runs(self):
+        from benchmarks.collabBench import run
+
+        results = run(filter_text="[1", repeat=1, min_time=0)
+
+        assert "apply_diff_move[100]" in results and "new_connection_replay[1]" in results
+        assert all(stats["min"] > 0 and stats["number"] >= 1 for stats in results.values())
+
+    def test_compare_reports_ratio_for_shared_benchmarks(self):
+        from benchmarks.collabBench import compare
+
+        base = {"a[1]": {"min": 2.0}, "b[1]": {"min": 1.0}}
+        head = {"a[1]": {"min": 3.0}, "c[1]": {"min": 1.0}}
+
+        assert compare(base, head) == [{"benchmark": "a[1]", "base": 2.0, "head": 3.0, "ratio": 1.5}]
+
+
 @pytest.mark.asyncio
 class TestCollaboration:
     @pytest.fixture
@@ -300,6 +2397,8 @@ class TestCollaboration:
 
         await basic_connection.send_to(text_data=json.dumps(sample_page_update))
         await basic_connection.send_to(text_data=json.dumps(sample_scene_update))
+        # Let the room apply both updates before the second client joins
+        await basic_connection.receive_nothing()
 
         await basic_collab_connection.connect()
 
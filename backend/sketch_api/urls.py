@@ -1,5 +1,5 @@
 from django.urls import path, re_path
-from .views import GenerateView, GenerateMultiView,api_test, GenerateVariationsView
+from .views import GenerateView, GenerateMultiView,api_test, GenerateVariationsView, GeneratePartialView, GenerateJobView, JobStatusView, ArtifactView, CollabRingView, CollabHandoffView, CollabGenerateView, CollabPageImageView
 from .consumers import SketchConsumer
 
 urlpatterns = [
@@ -10,6 +10,14 @@ urlpatterns = [
     #returns a function that Django's URL dispatcher can call.
     path('generate/', GenerateView.as_view(), name='generate_mockup'),
     path('generate-multi/', GenerateMultiView.as_view(), name='generate_multi'),
+    path('generate-partial/', GeneratePartialView.as_view(), name='generate_partial'),
     path('generate-variations/', GenerateVariationsView.as_view(), name='generate_variations'),
+    path('jobs/', GenerateJobView.as_view(), name='generate_job'),
+    path('jobs/<str:job_id>/', JobStatusView.as_view(), name='job_status'),
+    path('artifacts/<str:digest>/', ArtifactView.as_view(), name='artifact'),
+    path('collab/ring/', CollabRingView.as_view(), name='collab_ring'),
+    path('collab/<str:collab_id>/handoff/', CollabHandoffView.as_view(), name='collab_handoff'),
+    path('collab/<str:collab_id>/generate/', CollabGenerateView.as_view(), name='collab_generate'),
+    path('collab/<str:collab_id>/pages/<str:sketch_id>.png', CollabPageImageView.as_view(), name='collab_page_image'),
     re_path(r"ws/collab/(?P<collabID>\d+)/$", SketchConsumer.as_asgi())
 ]
@@ -1,4 +1,7 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import (Http404, HttpResponse, HttpResponseNotModified, HttpResponseRedirect, JsonResponse,
+                         StreamingHttpResponse)
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import render
 from django.utils.decorators import method_decorator
@@ -7,11 +10,78 @@ from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, JSONParser
 from rest_framework.response import Response
 from rest_framework import status
-from .services.claudeClient import image_to_html_css
-from .services.claudeClientVariations import generate_component_variations
+from .services.claudeClient import image_to_html_css, images_to_html_batch
+from .services.claudeClientVariations import generate_component_variations, stream_component_variations
+from .services.claudeRouting import batch_size
+from .services.imagePreprocess import preprocess_sketch
+from .services.partialRegen import regenerate_changed_regions
+from .services.uploadStream import upload_digest, upload_too_large
+from .services.generationJobs import Job, PageInput, get_job_runner, get_job_store
+from .services import metrics
+from .services.roomAffinity import TOKEN_HEADER, get_affinity
+from .services.sceneRaster import get_rasterizer
+from .services.sketchSimilarity import get_similarity_cache
+from .services.generatedArtifacts import DIGEST_PATTERN, etag_for, recall, remember
+from .CollabServer import CollabServer
 import asyncio
 
 MAX_BYTES = 10 * 1024 * 1024  # 10MB max upload
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+
+def run_async(coro):
+    """Run a coroutine to completion from a sync view on a private event loop."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def client_key(request) -> str:
+    """Fair-queuing key for the Claude scheduler: the collab room if given, else the caller's address."""
+    collab_id = request.POST.get("collab_id") or (request.data.get("collab_id") if isinstance(request.data, dict) else None)
+    if collab_id:
+        return f"collab:{collab_id}"
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR", "")
+    return f"addr:{forwarded.split(',')[0].strip() or request.META.get('REMOTE_ADDR', 'anonymous')}"
+
+
+def similarity_context(scope, prompt=None) -> tuple:
+    """
+    What, besides how the sketch looks, a cached page depends on. `scope` is the client key (caller
+    or collab room): a page is only ever reused for whoever it was generated for.
+    """
+    return scope, prompt, getattr(settings, "CLAUDE_MODEL", "claude-haiku-4-5-20251001")
+
+
+async def sketch_to_html(sketch, prompt=None, client_key="anonymous", priority=False) -> tuple[str, bool]:
+    """
+    HTML for a preprocessed sketch and whether it came from the near-duplicate cache: a sketch that
+    looks like one generated before (re-exported, nudged, re-cropped) gets that page back for free.
+    """
+    cache = get_similarity_cache()
+    context = similarity_context(client_key, prompt)
+    if cache is not None:
+        html = cache.get(sketch.fingerprint, *context)
+        if html is not None:
+            return html, True
+    html = await image_to_html_css(
+        sketch.data, media_type=sketch.media_type, prompt=prompt,
+        client_key=client_key, priority=priority,
+    )
+    if cache is not None:
+        cache.set(sketch.fingerprint, html, *context)
+    return html, False
+
+
+def wants_stream(request) -> bool:
+    """True if the client asked for per-page NDJSON streaming instead of one JSON body."""
+    flag = str(request.POST.get("stream") or request.query_params.get("stream") or "").lower()
+    if flag in ("1", "true", "ndjson"):
+        return True
+    return NDJSON_CONTENT_TYPE in request.headers.get("Accept", "")
 
 @csrf_exempt
 def api_test(request):
@@ -22,6 +92,12 @@ def api_test(request):
         'method': request.method
     })
 
+def metrics_view(request):
+    """Process metrics in the Prometheus text format, for scraping."""
+    if not getattr(settings, "METRICS_ENABLED", True):
+        raise Http404()
+    return HttpResponse(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @csrf_exempt  
 def generate_mockup(request):
     """Placeholder for sketch-to-mockup generation"""
@@ -43,6 +119,8 @@ class GenerateView(APIView):
     def post(self, request):
         # File field must be named "file" (matches your FormData)
         up = request.FILES.get("file")
+        if upload_too_large(request, "file"):
+            return Response({"detail": "File too large."}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
         if not up:
             return Response({"detail": "Missing file field 'file'."}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -57,20 +135,65 @@ class GenerateView(APIView):
         prompt = request.POST.get("prompt") or None
 
         try:
-            image_bytes = up.read()                  # raw PNG bytes from the upload
-            html = image_to_html_css(image_bytes, media_type=ctype, prompt=prompt)
-            return Response({"html": html}, status=status.HTTP_200_OK)
+            # Trim, downscale and re-encode before paying to upload it to Claude; Pillow reads the
+            # upload (in memory or spooled to disk) directly, so the raw bytes are never copied
+            sketch = preprocess_sketch(up, ctype)
+            # Single-page requests jump the queue ahead of multi-page batches
+            html, cached = run_async(sketch_to_html(
+                sketch, prompt=prompt, client_key=client_key(request), priority=True,
+            ))
+            return Response(
+                {"html": html, "preprocess": sketch.stats(), "sha256": upload_digest(request, "file"),
+                 "cached": cached, "artifact": remember(html)},
+                status=status.HTTP_200_OK,
+            )
         except Exception as e:
             # In production, log details to your logger/Sentry
             return Response({"detail": "Generation failed."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@method_decorator(csrf_exempt, name="dispatch")
+class GeneratePartialView(APIView):
+    """Regenerate only the part of a page whose sketch changed
+       POST /api/generate-partial/ with file (new sketch), previous_file (sketch the
+       previous_html was generated from) and previous_html"""
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        up = request.FILES.get("file")
+        previous_up = request.FILES.get("previous_file")
+        previous_html = request.POST.get("previous_html")
+        if upload_too_large(request, "file") or upload_too_large(request, "previous_file"):
+            return Response({"detail": "File too large."}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if not up or not previous_up or not previous_html:
+            return Response({"detail": "Missing 'file', 'previous_file' or 'previous_html'."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if up.size > MAX_BYTES or previous_up.size > MAX_BYTES:
+            return Response({"detail": "File too large."}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        ctype = str(getattr(up, "content_type", "") or "")
+        if not ctype.startswith("image/"):
+            return Response({"detail": "Only images are supported."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            result = run_async(regenerate_changed_regions(
+                previous_html, previous_up, up, media_type=ctype,
+                client_key=client_key(request), priority=True,
+            ))
+            return Response(result.to_dict(), status=status.HTTP_200_OK)
+        except Exception as e:
+            print(f"Partial regeneration failed: {e}")
+            return Response({"detail": "Generation failed."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @method_decorator(csrf_exempt, name = "dispatch")
 class GenerateMultiView(APIView):
     """API endpoint to generate multiple mockup pages from  uploaded sketch images"""
     parser_classes = [MultiPartParser]  # accept multipart/form-data (file upload)
 
-    async def one_page(self, i, request):
+    def read_page(self, i, request):
+        """(page id, page name, uploaded file, content type) for upload i, or an error result."""
         file_key = f"file_{i}"
         name_key = f"name_{i}"
         id_key = f"id_{i}"
@@ -79,13 +202,27 @@ class GenerateMultiView(APIView):
         page_name = request.POST.get(name_key, f"Page {i+1}")
         page_id = request.POST.get(id_key, f"page_{i}")
 
+        # Oversized uploads are dropped mid-stream by HashingUploadHandler, so they arrive missing
+        if upload_too_large(request, file_key):
+            return {
+                "id" : page_id,
+                "index": i,
+                "html": f"<p>Error: File too large.</p>",
+                "error": "File too large."
+            }
+
         if not up_file:
-            #Skip missing files
-            pass
+            return {
+                "id": page_id,
+                "index": i,
+                "html": f"<p>Error: Missing file for {page_name}.</p>",
+                "error": "Missing file."
+            }
 
         if up_file.size > MAX_BYTES:
             return {
                 "id" : page_id,
+                "index": i,
                 "html": f"<p>Error: File too large.</p>",
                 "error": "File too large."
             }
@@ -94,26 +231,136 @@ class GenerateMultiView(APIView):
         if not ctype.startswith("image/"):
             return {
                 "id" : page_id,
+                "index": i,
                 "html": f"<p>Error: Invalid file type</p>",
                 "error": "Invalid file type"
             }
 
+        return page_id, page_name, up_file, ctype
+
+    async def one_page(self, i, request):
+        page = self.read_page(i, request)
+        if isinstance(page, dict):
+            return page
+        page_id, page_name, up_file, ctype = page
+
         #Generate HTML for this page
         try:
-            image_bytes = up_file.read()
-            html = await image_to_html_css(image_bytes, media_type=ctype, prompt = None)
+            # Pillow work is CPU-bound; keep it off the event loop the other pages share
+            sketch = await asyncio.to_thread(preprocess_sketch, up_file, ctype)
+            html, cached = await sketch_to_html(
+                sketch, client_key=client_key(request), priority=self.single_page,
+            )
             return {
                 "id": page_id,
-                "html": html
+                "index": i,
+                "html": html,
+                "preprocess": sketch.stats(),
+                "sha256": upload_digest(request, f"file_{i}"),
+                "cached": cached,
+                "artifact": remember(html),
             }
 
         except Exception as e:
             return {
                 "id": page_id,
+                "index": i,
                 "html": f"<p>Error generating mockup for {page_name}: {str(e)}</p>",
                 "error": "Generation failed."
             }
 
+    async def batch_pages(self, indexes, request):
+        """Generate a group of pages in one Claude call; returns a list of page results."""
+        results = []
+        pages = []
+        for i in indexes:
+            page = self.read_page(i, request)
+            if isinstance(page, dict):
+                results.append(page)
+            else:
+                pages.append((i, page))
+        if not pages:
+            return results
+
+        sketches = await asyncio.gather(*(
+            asyncio.to_thread(preprocess_sketch, up_file, ctype)
+            for _, (_, _, up_file, ctype) in pages
+        ))
+
+        # Pages that look like ones generated before are answered from the cache and left out of the call
+        cache = get_similarity_cache()
+        if cache is not None:
+            remaining = []
+            for (i, page), sketch in zip(pages, sketches):
+                html = cache.get(sketch.fingerprint, *similarity_context(client_key(request)))
+                if html is None:
+                    remaining.append(((i, page), sketch))
+                else:
+                    results.append({"id": page[0], "index": i, "html": html, "preprocess": sketch.stats(),
+                                    "cached": True, "artifact": remember(html)})
+            pages = [page for page, _ in remaining]
+            sketches = [sketch for _, sketch in remaining]
+            if not pages:
+                return results
+
+        try:
+            htmls = await images_to_html_batch(
+                [(sketch.data, sketch.media_type) for sketch in sketches],
+                client_key=client_key(request), priority=self.single_page,
+            )
+        except Exception as e:
+            return results + [{
+                "id": page_id,
+                "index": i,
+                "html": f"<p>Error generating mockup for {page_name}: {str(e)}</p>",
+                "error": "Generation failed."
+            } for i, (page_id, page_name, _, _) in pages]
+
+        async def finish(i, page, sketch, html):
+            page_id, page_name = page[0], page[1]
+            if html is None:
+                # The model dropped this page from the batch; generate it on its own
+                try:
+                    html, _ = await sketch_to_html(sketch, client_key=client_key(request))
+                except Exception as e:
+                    return {
+                        "id": page_id,
+                        "index": i,
+                        "html": f"<p>Error generating mockup for {page_name}: {str(e)}</p>",
+                        "error": "Generation failed."
+                    }
+            if cache is not None:
+                cache.set(sketch.fingerprint, html, *similarity_context(client_key(request)))
+            return {"id": page_id, "index": i, "html": html, "preprocess": sketch.stats(), "batched": True,
+                    "artifact": remember(html)}
+
+        results += await asyncio.gather(*(
+            finish(i, page, sketch, html) for (i, page), sketch, html in zip(pages, sketches, htmls)
+        ))
+        return results
+
+    @staticmethod
+    def flatten(result):
+        """Per-page calls produce one result, batched calls a list of them."""
+        return result if isinstance(result, list) else [result]
+
+    async def gather_pages(self, pages):
+        """Wait for every page and return results in upload order."""
+        results = [item for result in await asyncio.gather(*pages) for item in self.flatten(result)]
+        return sorted(results, key=lambda r: r["index"])
+
+    async def stream_pages(self, pages):
+        """Yield one NDJSON line per page, in completion order rather than upload order."""
+        tasks = [asyncio.ensure_future(page) for page in pages]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                for result in self.flatten(await finished):
+                    yield json.dumps(result) + "\n"
+        finally:
+            # Client went away mid-stream: don't keep paying for pages nobody will read
+            for task in tasks:
+                task.cancel()
+
     def post(self, request):
         #Get count of files
         count_str = request.POST.get("count")
@@ -131,16 +378,26 @@ class GenerateMultiView(APIView):
             return Response ({"detail": "Count must be between 1 and 20"}, status=status.HTTP_400_BAD_REQUEST)
         
         futures = []
-
-        #Processing each file
-        for i in range(count):
-            futures.append(self.one_page(i, request))
-
-        loop = asyncio.new_event_loop()
-
-        asyncio.set_event_loop(loop)
-
-        results = loop.run_until_complete(asyncio.gather(*futures))
+        self.single_page = count == 1
+
+        if str(request.POST.get("batch") or "").lower() in ("1", "true"):
+            # Several pages per Claude call, sharing the instructions and one design system
+            size = batch_size()
+            for start in range(0, count, size):
+                futures.append(self.batch_pages(range(start, min(count, start + size)), request))
+        else:
+            #Processing each file
+            for i in range(count):
+                futures.append(self.one_page(i, request))
+
+        if wants_stream(request):
+            # Each page is flushed as soon as its own generation finishes, keyed by page id
+            response = StreamingHttpResponse(self.stream_pages(futures), content_type=NDJSON_CONTENT_TYPE)
+            response["Cache-Control"] = "no-cache"
+            response["X-Accel-Buffering"] = "no"
+            return response
+
+        results = run_async(self.gather_pages(futures))
 
         if not results:
             return Response({"detail": "No valid files provided."}, status=status.HTTP_400_BAD_REQUEST)
@@ -155,6 +412,17 @@ class GenerateVariationsView(APIView):
     
     parser_classes = [JSONParser]  # accept multipart/form-data (file upload)
 
+    async def stream_variations(self, **kwargs):
+        """Yield one NDJSON line per variation as soon as the model finishes writing it."""
+        index = 0
+        try:
+            async for html in stream_component_variations(**kwargs):
+                yield json.dumps({"index": index, "html": html, "artifact": remember(html)}) + "\n"
+                index += 1
+        except Exception as e:
+            print(f"Error generating variations: {e}")
+            yield json.dumps({"error": f"Failed to generate variations: {str(e)}"}) + "\n"
+
     def post(self, request):
 
         try:
@@ -190,24 +458,37 @@ class GenerateVariationsView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        if data.get("stream") or wants_stream(request):
+            response = StreamingHttpResponse(
+                self.stream_variations(
+                    element_html=element_html,
+                    element_type=element_type,
+                    custom_prompt=custom_prompt,
+                    count=count,
+                    client_key=client_key(request),
+                ),
+                content_type=NDJSON_CONTENT_TYPE,
+            )
+            response["Cache-Control"] = "no-cache"
+            response["X-Accel-Buffering"] = "no"
+            return response
+
         #Generate Variations
         try:
 
             # Run async function
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            variations = loop.run_until_complete(
+            variations = run_async(
                 generate_component_variations(
                     element_html=element_html,
                     element_type=element_type,
                     custom_prompt=custom_prompt,
-                    count=count
+                    count=count,
+                    client_key=client_key(request),
                 )
             )
-            loop.close()
             
             return Response(
-                {"variations": variations},
+                {"variations": variations, "artifacts": [remember(html) for html in variations]},
                 status=status.HTTP_200_OK
             )
 
@@ -219,3 +500,193 @@ class GenerateVariationsView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class GenerateJobView(APIView):
+    """Queue a multi-page generation as a background job (API-only; the editor streams generate-multi)
+       POST /api/jobs/ with the same multipart fields as /api/generate-multi/"""
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        try:
+            count = int(request.POST.get("count", ""))
+        except ValueError:
+            return Response({"detail": "Missing or invalid 'count' field."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if count <= 0 or count > 20:
+            return Response({"detail": "Count must be between 1 and 20"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Uploads are read now: the request (and its temp files) is gone by the time a worker runs
+        pages = []
+        for i in range(count):
+            up_file = request.FILES.get(f"file_{i}")
+            page_id = request.POST.get(f"id_{i}", f"page_{i}")
+            if not up_file:
+                return Response({"detail": f"Missing file field 'file_{i}'."}, status=status.HTTP_400_BAD_REQUEST)
+            if up_file.size > MAX_BYTES:
+                return Response({"detail": f"File too large for page {page_id}."}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            ctype = str(getattr(up_file, "content_type", "") or "")
+            if not ctype.startswith("image/"):
+                return Response({"detail": f"Only images are supported (page {page_id})."}, status=status.HTTP_400_BAD_REQUEST)
+            pages.append(PageInput(i, page_id, request.POST.get(f"name_{i}", f"Page {i+1}"), up_file.read(), ctype))
+
+        job = Job(len(pages), client_key=client_key(request), collab_id=request.POST.get("collab_id") or None)
+        get_job_runner().submit(job, pages)
+
+        body = job.to_dict(include_results=False)
+        body["status_url"] = f"/api/jobs/{job.id}/"
+        return Response(body, status=status.HTTP_202_ACCEPTED)
+
+
+class ArtifactView(APIView):
+    """A generated page or variation by the content hash its generation response gave it
+       GET /api/artifacts/<digest>/  (If-None-Match: "<digest>" answers 304 Not Modified)"""
+
+    def get(self, request, digest):
+        etag = etag_for(digest)
+        cache_control = f"private, max-age={getattr(settings, 'ARTIFACT_CACHE_TTL', 86400)}, immutable"
+        # Content-addressed, so a client holding this hash holds this page, even after it left the store.
+        # "*" names no page, so it only matches one that is still stored.
+        if DIGEST_PATTERN.match(digest):
+            held = {tag.removeprefix("W/") for tag in parse_etags(request.headers.get("If-None-Match", ""))}
+            if etag in held or ("*" in held and recall(digest) is not None):
+                response = HttpResponseNotModified()
+                response["ETag"] = etag
+                response["Cache-Control"] = cache_control
+                return response
+        html = recall(digest)
+        if html is None:
+            return Response({"detail": "Unknown or expired artifact."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"artifact": digest, "html": html}, status=status.HTTP_200_OK,
+                        headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+class JobStatusView(APIView):
+    """Poll a background generation job
+       GET /api/jobs/<job_id>/"""
+
+    def get(self, request, job_id):
+        job = get_job_store().get(job_id)
+        if job is None:
+            return Response({"detail": "Unknown or expired job."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job.to_dict(), status=status.HTTP_200_OK)
+
+
+def cluster_request_allowed(request) -> bool:
+    return get_affinity().allows(request.headers.get(TOKEN_HEADER))
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class CollabRingView(APIView):
+    """This worker's room-affinity ring
+       GET  /api/collab/ring/
+       POST /api/collab/ring/  {"workers": [...]}  - new membership; rooms now owned elsewhere are handed off"""
+    parser_classes = [JSONParser]
+
+    def get(self, request):
+        if not cluster_request_allowed(request):
+            raise Http404()
+        affinity = get_affinity()
+        return Response({"worker": affinity.worker, "workers": list(affinity.ring.workers)})
+
+    def post(self, request):
+        if not cluster_request_allowed(request):
+            raise Http404()
+        workers = request.data.get("workers") if isinstance(request.data, dict) else None
+        if not isinstance(workers, list) or not all(isinstance(worker, str) for worker in workers):
+            return Response({"detail": "workers must be a list of worker URLs."}, status=status.HTTP_400_BAD_REQUEST)
+        server = CollabServer()
+        moving = server.on_loop(server.rebalance, workers)
+        return Response({"workers": list(get_affinity().ring.workers), "moving": moving})
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class CollabHandoffView(APIView):
+    """Receive a room from its previous owner
+       POST /api/collab/<collab_id>/handoff/  (a CollabSession snapshot)"""
+    parser_classes = [JSONParser]
+
+    def post(self, request, collab_id):
+        if not cluster_request_allowed(request):
+            raise Http404()
+        if not isinstance(request.data, dict) or not isinstance(request.data.get("sketches"), list):
+            return Response({"detail": "Expected a room snapshot."}, status=status.HTTP_400_BAD_REQUEST)
+        server = CollabServer()
+        server.on_loop(server.install, collab_id, request.data)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def room_pages(request, collab_id):
+    """
+    A collab room's pages from this worker's memory, or a response to return instead: a redirect
+    to the worker owning the room (307 keeps the method and body), or 404.
+    """
+    server = CollabServer()
+    pages = server.on_loop(server.pages, collab_id)
+    if pages is not None:
+        return pages
+    owner = get_affinity().owner(collab_id)
+    if owner is not None:
+        response = HttpResponseRedirect(owner + request.get_full_path())
+        response.status_code = status.HTTP_307_TEMPORARY_REDIRECT
+        return response
+    return Response({"detail": "No active collab room with that id."}, status=status.HTTP_404_NOT_FOUND)
+
+
+class CollabPageImageView(APIView):
+    """A collab page rendered server-side, as Claude would see it
+       GET /api/collab/<collab_id>/pages/<sketch_id>.png"""
+
+    def get(self, request, collab_id, sketch_id):
+        pages = room_pages(request, collab_id)
+        if isinstance(pages, HttpResponse):
+            return pages
+        scene = next((scene for page_id, _, scene in pages if page_id == sketch_id), None)
+        png = get_rasterizer().render(scene) if scene is not None else None
+        if png is None:
+            return Response({"detail": "No such page, or nothing drawn on it."}, status=status.HTTP_404_NOT_FOUND)
+        return HttpResponse(png, content_type="image/png")
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class CollabGenerateView(APIView):
+    """Generate pages straight from a collab room's state, with no browser export or upload
+       POST /api/collab/<collab_id>/generate/  {"pages": [sketch ids]}  (default: every page)
+       Queued as a background job, like /api/jobs/, and its progress is pushed to the room.
+       API-only: the editor still exports and uploads its pages (/api/generate-multi/)."""
+    parser_classes = [JSONParser]
+
+    def post(self, request, collab_id):
+        pages = room_pages(request, collab_id)
+        if isinstance(pages, HttpResponse):
+            return pages
+        wanted = request.data.get("pages") if isinstance(request.data, dict) else None
+        if wanted is not None:
+            if not isinstance(wanted, list):
+                return Response({"detail": "pages must be a list of page ids."}, status=status.HTTP_400_BAD_REQUEST)
+            pages = [page for page in pages if page[0] in wanted]
+        # Checked before rendering: a large room would otherwise be rasterized just to be refused
+        if len(pages) > 20:
+            return Response({"detail": "At most 20 pages per generation."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Rasterized here, in the request's thread; unchanged pages come out of the render cache
+        inputs, skipped = [], []
+        rasterizer = get_rasterizer()
+        for page_id, name, scene in pages:
+            png = rasterizer.render(scene)
+            if png is None:
+                skipped.append(page_id)
+                continue
+            inputs.append(PageInput(len(inputs), page_id, name or f"Page {len(inputs) + 1}", png, "image/png"))
+        if not inputs:
+            return Response({"detail": "Nothing drawn on the requested pages.", "skipped": skipped},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        job = Job(len(inputs), client_key=client_key(request), collab_id=collab_id)
+        get_job_runner().submit(job, inputs)
+
+        body = job.to_dict(include_results=False)
+        body["status_url"] = f"/api/jobs/{job.id}/"
+        body["skipped"] = skipped
+        return Response(body, status=status.HTTP_202_ACCEPTED)
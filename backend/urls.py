@@ -18,11 +18,13 @@ from django.contrib import admin
 from django.urls import path, include, re_path
 from django.views.generic import TemplateView
 from backend.sketch_api import urls
+from backend.sketch_api.views import metrics_view
 from channels.routing import URLRouter
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/", include('backend.sketch_api.urls')),
+    path("metrics", metrics_view, name="metrics"),
     re_path(r"^(?:.*)?$", TemplateView.as_view(template_name="index.html")),  # SPA catch-all
         
 ]
@@ -60,6 +60,12 @@ function getCollabId(): string {
   return params.get('collab') || Date.now().toString();
 }
 
+/** Whether the URL joins the collab room read-only (?collab=<id>&role=spectator) */
+function isSpectatorLink(): boolean {
+  const params = new URLSearchParams(window.location.search);
+  return params.has('collab') && params.get('role') === 'spectator';
+}
+
 /**
  * Serializes a scene for comparison purposes
  * Only includes elements and files (the actual drawing content)
@@ -75,6 +81,7 @@ function serializeScene(scene: SceneData): string {
 export default function App() {
   // Compute a stable collab id up-front so we can also use it for the very first page id.
   const [initialCollabId] = useState(() => getCollabId());
+  const [spectator] = useState(() => isSpectatorLink());
   /** Current active view (Drawing or Mockup) */
   const [currentPage, setCurrentPage] = useState(Page.Drawing);
   
@@ -116,6 +123,9 @@ export default function App() {
   
   /** Track the scene state at the time each page was last generated */
   const [lastGeneratedScenes, setLastGeneratedScenes] = useState<Record<string, string>>({});
+
+  /** Sketch export each page's current mockup was generated from, for partial regeneration */
+  const lastGeneratedBlobs = useRef<Record<string, Blob>>({});
   
   /** Loading state during backend processing */
   const [loading, setLoading] = useState(false);
@@ -213,6 +223,7 @@ export default function App() {
     makeEmptyScene,
     canvasHostRef,
     drawingRef: drawingRefs,  // Pass the refs object
+    spectator,
   });
 
   // Check for collab URL parameter on mount - show dialog but do not auto-enable
@@ -221,6 +232,11 @@ export default function App() {
     const collabParam = params.get('collab');
     
     if (collabParam && !collabEnabled) {
+      if (spectator) {
+        // Spectators don't appear to the room, so there's no name to ask for
+        handleConfirmUsername('Spectator');
+        return;
+      }
       // Just show the dialog - username entry will enable collaboration
       handleShowCollaboration();
     }
@@ -489,61 +505,156 @@ export default function App() {
       }
 
       let newGeneratedMockups: MockupPage[] = [];
-      
-      // Only call backend if there are pages to regenerate
-      if (pageBlobs.length > 0) {
+
+      /** Builds the mockup list from what has landed so far, falling back to previous mockups */
+      const mergeMockups = (): MockupPage[] => pages
+        .filter(page => page.scene.elements && page.scene.elements.length > 0)
+        .map(page => newGeneratedMockups.find(m => m.id === page.id)
+          ?? mockups.find(m => m.id === page.id)
+          ?? null)
+        .filter((m): m is MockupPage => m !== null);
+
+      /** Records a finished page and renders it; the first one switches to the mockup view */
+      const addMockup = (mockup: MockupPage) => {
+        newGeneratedMockups = [...newGeneratedMockups.filter(m => m.id !== mockup.id), mockup];
+        setMockups(mergeMockups());
+        if (newGeneratedMockups.length === 1) {
+          setCurrentPage(Page.Mockup);
+          setLoading(false);
+        }
+      };
+
+      /** Pages that came back without an error; only these count as generated from their current sketch */
+      const succeeded = new Set<string>();
+      const failed = new Set<string>();
+
+      /** Generates pages from scratch, rendering each one as its NDJSON line lands */
+      const generateFull = async (items: Array<{ id: string; name: string; blob: Blob }>) => {
         // Create form data with all images
         const formData = new FormData();
-        pageBlobs.forEach((item, index) => {
+        items.forEach((item, index) => {
           formData.append(`file_${index}`, item.blob, `${item.name}.png`);
           formData.append(`name_${index}`, item.name);
           formData.append(`id_${index}`, item.id);
         });
-        formData.append('count', pageBlobs.length.toString());
+        formData.append('count', items.length.toString());
+        // Lets the backend queue this room's pages fairly against other users
+        if (collabEnabled) {
+          formData.append('collab_id', collabId);
+        }
+        // Ask for one NDJSON line per page so finished pages render without waiting on the slowest one
+        formData.append('stream', 'ndjson');
 
         const res = await fetch("/api/generate-multi/", {
           method: "POST",
           body: formData,
         });
 
-        if (!res.ok) {
+        if (!res.ok || !res.body) {
           alert("Failed to generate HTML from sketches");
           return;
         }
 
-        // Expect array of HTML strings
-        const data = (await res.json()) as { results: Array<{ id: string; html: string }> };
-        
-        if (!data.results || data.results.length === 0) {
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = "";
+
+        while (true) {
+          const { done, value } = await reader.read();
+          if (value) {
+            buffered += decoder.decode(value, { stream: !done });
+          }
+
+          let newline = buffered.indexOf("\n");
+          while (newline >= 0) {
+            const line = buffered.slice(0, newline).trim();
+            buffered = buffered.slice(newline + 1);
+            newline = buffered.indexOf("\n");
+            if (!line) continue;
+
+            const result = JSON.parse(line) as { id: string; index?: number; html: string; error?: string };
+
+            // Try to match by backend's returned ID first, then by the index we sent it under
+            let page = pages.find((p) => p.id === result.id);
+            if (!page && result.index !== undefined && result.index < items.length) {
+              const sentPageId = items[result.index].id;
+              page = pages.find((p) => p.id === sentPageId);
+            }
+
+            // Use the page ID we sent, not the backend's ID
+            const pageId = page?.id || result.id;
+            (result.error ? failed : succeeded).add(pageId);
+            // Render each page as it lands
+            addMockup({
+              id: pageId,
+              name: page?.name || `Sketch Generated ${newGeneratedMockups.length + 1}`,
+              html: result.html,
+            });
+          }
+
+          if (done) break;
+        }
+      };
+
+      // Edited pages that already have a mockup only send the changed region and get back a patch
+      const partialBlobs = forceRegenerate ? [] : pageBlobs.filter(item =>
+        lastGeneratedBlobs.current[item.id] && mockups.some(m => m.id === item.id));
+      const generatePartial = async () => {
+        const partialResults = await Promise.all(partialBlobs.map(async (item) => {
+          const formData = new FormData();
+          formData.append('file', item.blob, `${item.name}.png`);
+          formData.append('previous_file', lastGeneratedBlobs.current[item.id], `${item.name}-previous.png`);
+          formData.append('previous_html', mockups.find(m => m.id === item.id)!.html);
+          if (collabEnabled) {
+            formData.append('collab_id', collabId);
+          }
+          try {
+            const res = await fetch("/api/generate-partial/", { method: "POST", body: formData });
+            if (!res.ok) return null;
+            const result = await res.json() as { html: string; mode: string };
+            console.log(`Page "${item.name}" regenerated (${result.mode})`);
+            succeeded.add(item.id);
+            addMockup({ id: item.id, name: item.name, html: result.html });
+            return item.id;
+          } catch (error) {
+            console.error(`Partial regeneration failed for "${item.name}":`, error);
+            return null;
+          }
+        }));
+        // Anything the partial endpoint couldn't handle goes through the normal full generation
+        const fallbackBlobs = partialBlobs.filter(item => !partialResults.includes(item.id));
+        if (fallbackBlobs.length > 0) {
+          await generateFull(fallbackBlobs);
+        }
+      };
+
+      // The other pages don't wait for the patches: both requests run side by side
+      const fullBlobs = pageBlobs.filter(item => !partialBlobs.includes(item));
+      await Promise.all([
+        fullBlobs.length > 0 ? generateFull(fullBlobs) : Promise.resolve(),
+        generatePartial(),
+      ]);
+
+      if (pageBlobs.length > 0) {
+        if (newGeneratedMockups.length === 0) {
           alert("No HTML received from server");
           return;
         }
 
-        // Build mockup pages for newly generated content
-        // Match by index since backend might not preserve our IDs
-        newGeneratedMockups = data.results.map((result, index) => {
-          // Try to match by backend's returned ID first
-          let page = pages.find((p) => p.id === result.id);
-          
-          // If not found, match by index (order in which we sent pages)
-          if (!page && index < pageBlobs.length) {
-            const sentPageId = pageBlobs[index].id;
-            page = pages.find((p) => p.id === sentPageId);
+        // A page that failed keeps no sketch to diff against, so its next generation starts from scratch
+        // instead of patching the error message
+        pageBlobs.forEach(item => {
+          if (succeeded.has(item.id) && !failed.has(item.id)) {
+            lastGeneratedBlobs.current[item.id] = item.blob;
+          } else {
+            delete lastGeneratedBlobs.current[item.id];
           }
-          
-          // Use the page ID we sent, not the backend's ID
-          const pageId = page?.id || result.id;
-          
-          return {
-            id: pageId, // Use our page ID, not backend's
-            name: page?.name || `Sketch Generated ${index + 1}`,
-            html: result.html,
-          };
         });
+        const generatedPages = pagesToGenerate.filter(page => succeeded.has(page.id) && !failed.has(page.id));
 
         setMockupStyles(prev =>{
           const next = {...prev};
-          pagesToGenerate.forEach(page =>{
+          generatedPages.forEach(page =>{
             if (next[page.id]){
               delete next[page.id];
             }
@@ -554,7 +665,7 @@ export default function App() {
         // Update lastGeneratedScenes for newly generated pages
         setLastGeneratedScenes(prev => {
           const next = { ...prev };
-          for (const page of pagesToGenerate) {
+          for (const page of generatedPages) {
             next[page.id] = sceneSnapshots.get(page.id) ||serializeScene(page.scene);
           }
           return next;
@@ -701,6 +812,7 @@ export default function App() {
               },
             }}
             onSceneChange={handleSceneChange}
+            viewModeEnabled={spectator}
           />
         )}
         </div>
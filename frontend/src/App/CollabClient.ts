@@ -21,6 +21,9 @@ export default class CollabClient {
   /** Connection to server */
   connection: WebSocket;
 
+  /** Read-only viewer: gets periodic page snapshots and sends nothing (no join, pointer or edits) */
+  spectator: boolean;
+
   /** Current page this user is viewing */
   currentPage: string | null = null;
 
@@ -34,10 +37,12 @@ export default class CollabClient {
    * Creates a new collaboration client
    * @param collabID - Unique identifier for this collaboration session
    * @param username - This user's display name
+   * @param spectator - Join read-only, as one of a large audience
    */
-  constructor(collabID: number, username: string) {
+  constructor(collabID: number, username: string, spectator: boolean = false) {
     this.collabID = collabID
     this.username = username
+    this.spectator = spectator
     // Generate a unique user ID for this session
     this.userID = `user-${Date.now()}-${Math.random().toString(36).substr(2, 9)}`
 
@@ -47,7 +52,8 @@ export default class CollabClient {
       proto = "wss://"
     }
 
-    this.connection = new WebSocket(proto+window.location.hostname+":"+window.location.port+"/ws/collab/"+collabID+"/")
+    const query = spectator ? "?role=spectator" : ""
+    this.connection = new WebSocket(proto+window.location.hostname+":"+window.location.port+"/ws/collab/"+collabID+"/"+query)
    
     // Note: onopen handler is set by useCollaboration hook
    
@@ -62,7 +68,19 @@ export default class CollabClient {
     this.connection.onmessage = (event) => {
       let message = JSON.parse(event.data)
       let action = message.action
-      
+
+      // Server heartbeat: answer so the room doesn't drop us as a dead connection
+      if (action === "ping") {
+        this.connection.send(JSON.stringify({ action: "pong" }))
+        return
+      }
+
+      // Progress of background jobs (/api/jobs/, /api/collab/<id>/generate/) that API clients started
+      // for this room; the editor generates through /api/generate-multi/ and has nothing to update
+      if (action === "job_update") {
+        return
+      }
+
       // Filter: only accept messages where sketchID starts with our collabID
       // This prevents cross-contamination between different collab sessions
       if (action === "scene_update" || action === "page_update") {
@@ -125,6 +143,7 @@ export default class CollabClient {
    * @param sceneData - New scene data to send to collaborators
    */
   sendSceneUpdate(sketchID: string, sceneData: SceneData) {
+    if (this.spectator) return
     if (this.connection.readyState === WebSocket.OPEN) {
       try {
         // Create a clean, serializable copy of the scene data
@@ -169,6 +188,7 @@ export default class CollabClient {
    * @param pageName - New name for the page, or null if page is being deleted
    */
   sendPageUpdate(sketchID: string, pageName: string | null) {
+    if (this.spectator) return
     if (this.connection.readyState === WebSocket.OPEN) {
       this.connection.send(JSON.stringify({
         action: "page_update",
@@ -204,6 +224,8 @@ export default class CollabClient {
    * Sends join message to server with username
    */
   sendCollaboratorJoin() {
+    // Spectators stay out of the collaborator list
+    if (this.spectator) return
     if (this.connection.readyState === WebSocket.OPEN) {
       this.connection.send(JSON.stringify({
         action: "collaborator_join",
@@ -227,6 +249,7 @@ export default class CollabClient {
    * @param pointer - Current pointer coordinates, or null to hide pointer
    */
   sendPointerUpdate(pointer: { x: number; y: number } | null) {
+    if (this.spectator) return
     if (this.connection.readyState === WebSocket.OPEN) {
       this.connection.send(JSON.stringify({
         action: "collaborator_pointer",
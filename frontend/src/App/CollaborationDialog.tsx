@@ -281,6 +281,29 @@ export default function CollaborationDialog({
                 </button>
               </div>
 
+              {/* View-only link: spectators watch the room without a cursor or edits */}
+              <p style={{ fontSize: '13px', color: '#6b7280', margin: '0 0 8px' }}>
+                View-only link, for an audience:
+              </p>
+              <input
+                type="text"
+                value={`${collaborationUrl}&role=spectator`}
+                readOnly
+                style={{
+                  width: '100%',
+                  boxSizing: 'border-box',
+                  padding: '8px 12px',
+                  backgroundColor: '#f9fafb',
+                  border: '1px solid #e5e7eb',
+                  borderRadius: '8px',
+                  fontSize: '13px',
+                  color: '#374151',
+                  outline: 'none',
+                  marginBottom: '16px',
+                }}
+                onClick={(e) => (e.target as HTMLInputElement).select()}
+              />
+
               {/* Info */}
               <div style={{ 
                 display: 'flex', 
@@ -1,5 +1,6 @@
 // frontend/src/components/VariationPreview.tsx
 import { VARIATION_CONFIG } from '../config/variations';
+import { tailwindRuntimeFor } from '../../utils/tailwindRuntime';
 
 type VariationPreviewProps = {
   html: string;
@@ -25,7 +26,7 @@ export default function VariationPreview({
       <head>
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <script src="https://cdn.jsdelivr.net/npm/@tailwindcss/browser@4"></script>
+        ${tailwindRuntimeFor(html)}
         <style>
           html, body {
             margin: 0;
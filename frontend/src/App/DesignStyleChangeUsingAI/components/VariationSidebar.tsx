@@ -170,7 +170,9 @@ export default function VariationSidebar({
               }}
             />
             <p style={{ margin: 0, fontSize: '13px' }}>
-              Generating variations...
+              {variations && variations.length > 0
+                ? `Generating variations (${variations.length} ready)...`
+                : 'Generating variations...'}
             </p>
           </div>
         )}
@@ -192,8 +194,8 @@ export default function VariationSidebar({
           </div>
         )}
 
-        {/* Variations */}
-        {variations && variations.length > 0 && !loading && (
+        {/* Variations (shown as they stream in, while the rest are still generating) */}
+        {variations && variations.length > 0 && (
           <div>
             <label
               style={{
@@ -29,13 +29,24 @@ export function useVariations(): UseVariationsResult {
   
   const cacheRef = useRef<VariationCache>(createEmptyCache());
 
+  /**
+   * Reports a failed generation. Variations that streamed in before it stay on screen next to the error.
+   */
+  const reportFailure = useCallback((err: unknown, received: string[]) => {
+    const message = err instanceof Error ? err.message : 'Unknown error';
+    setError(received.length > 0
+      ? `${message} (${received.length} of ${VARIATION_CONFIG.COUNT} variations finished)`
+      : message);
+  }, []);
+
   /**
    * Calls the backend API to generate variations
    */
   const callAPI = useCallback(async (
   elementHtml: string,
   elementType: string,
-  customPrompt?: string
+  customPrompt?: string,
+  onPartial?: (variations: string[]) => void
 ): Promise<string[]> => {
   const response = await fetch(VARIATION_CONFIG.API_ENDPOINT, {
     method: 'POST',
@@ -47,6 +58,7 @@ export function useVariations(): UseVariationsResult {
       element_type: elementType,
       prompt: customPrompt || null,
       count: VARIATION_CONFIG.COUNT,
+      stream: true,
     }),
   });
 
@@ -55,30 +67,43 @@ export function useVariations(): UseVariationsResult {
     throw new Error(errorData.detail || 'Failed to generate variations');
   }
 
-  const data = await response.json();
-
-  console.log('📦 Raw API response:', {
-    variations: data.variations,
-    variationsCount: data.variations?.length,
-    fullData: data
-  });
+  // Remove ```html and ``` fences
+  const clean = (html: string) => html
+    .replace(/```html\n?/gi, '')
+    .replace(/```\n?/g, '')
+    .trim();
+
+  // The backend sends one NDJSON line per variation as soon as the model finishes it
+  const collected: string[] = [];
+  const handleLine = (line: string) => {
+    if (!line.trim()) return;
+    const item = JSON.parse(line);
+    if (item.error) {
+      throw new Error(item.error);
+    }
+    collected[item.index] = clean(item.html);
+    onPartial?.(collected.filter((v) => v !== undefined));
+  };
 
+  if (!response.body) {
+    (await response.text()).split('\n').forEach(handleLine);
+    return collected;
+  }
 
-  // Clean markdown fences from variations
-  const cleanedVariations = (data.variations || []).map((html: string) => {
-    console.log('Original variation:', html.substring(0, 100));
-    
-    // Remove ```html and ``` fences
-    let cleaned = html
-      .replace(/```html\n?/gi, '')
-      .replace(/```\n?/g, '')
-      .trim();
-    
-    console.log('Cleaned variation:', cleaned.substring(0, 100));
-    return cleaned;
-  });
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffered += decoder.decode(value, { stream: true });
+    const lines = buffered.split('\n');
+    buffered = lines.pop() ?? '';
+    lines.forEach(handleLine);
+  }
+  handleLine(buffered + decoder.decode());
 
-  return cleanedVariations;
+  return collected.filter((v) => v !== undefined);
 }, []);
 
   /**
@@ -90,6 +115,7 @@ export function useVariations(): UseVariationsResult {
   ) => {
     setLoading(true);
     setError(null);
+    let received: string[] = [];
 
     try {
       const cacheKey = generateCacheKey(elementHtml);
@@ -105,7 +131,11 @@ export function useVariations(): UseVariationsResult {
 
       // Call API
       console.log('Generating new auto variations');
-      const newVariations = await callAPI(elementHtml, elementType);
+      setVariations(null);
+      const newVariations = await callAPI(elementHtml, elementType, undefined, (partial) => {
+        received = partial;
+        setVariations(partial);
+      });
 
       // Update cache
       cacheRef.current.auto[cacheKey] = {
@@ -119,12 +149,11 @@ export function useVariations(): UseVariationsResult {
       setVariations(newVariations);
     } catch (err) {
       console.error('Error generating auto variations:', err);
-      setError(err instanceof Error ? err.message : 'Unknown error');
-      setVariations(null);
+      reportFailure(err, received);
     } finally {
       setLoading(false);
     }
-  }, [callAPI]);
+  }, [callAPI, reportFailure]);
 
   /**
    * Generates custom variations based on user prompt
@@ -141,6 +170,7 @@ export function useVariations(): UseVariationsResult {
 
     setLoading(true);
     setError(null);
+    let received: string[] = [];
 
     console.log('🔵 Starting custom generation:', {
       elementHtml: elementHtml.substring(0, 100),
@@ -175,7 +205,11 @@ export function useVariations(): UseVariationsResult {
 
       // Call API with prompt
       console.log('Generating new custom variations with prompt:', prompt);
-      const newVariations = await callAPI(elementHtml, elementType, prompt);
+      setVariations(null);
+      const newVariations = await callAPI(elementHtml, elementType, prompt, (partial) => {
+        received = partial;
+        setVariations(partial);
+      });
 
       // ADD THIS LOG RIGHT AFTER:
       console.log('🟢 Received custom variations:', {
@@ -196,12 +230,11 @@ export function useVariations(): UseVariationsResult {
       setVariations(newVariations);
     } catch (err) {
       console.error('Error generating custom variations:', err);
-      setError(err instanceof Error ? err.message : 'Unknown error');
-      setVariations(null);
+      reportFailure(err, received);
     } finally {
       setLoading(false);
     }
-  }, [callAPI]);
+  }, [callAPI, reportFailure]);
 
   /**
    * Clears all cached variations
@@ -36,6 +36,8 @@ export interface DrawingProps {
   visible?: boolean;
   initialScene?: SceneData;
   onSceneChange?: (scene: SceneData) => void;
+  /** Read-only canvas (collab spectators) */
+  viewModeEnabled?: boolean;
   ref: (ref: DrawingHandle | null) => void;
 }
 
@@ -52,7 +54,7 @@ type ExcalidrawAPI = NonNullable<
  * @param ref - Forwarded ref for accessing component methods
  */
 function Drawing(
-  { className, visible, initialScene, onSceneChange, ref }: DrawingProps
+  { className, visible, initialScene, onSceneChange, viewModeEnabled, ref }: DrawingProps
 ) {
   /** Reference to Excalidraw's API methods */
   const excaliRef = useRef<ExcalidrawAPI | null>(null);
@@ -131,6 +133,7 @@ function Drawing(
       }}
     >
       <Excalidraw
+        viewModeEnabled={viewModeEnabled}
         excalidrawAPI={(api) => {
           excaliRef.current = api;
 
@@ -1,5 +1,6 @@
 import React from 'react';
 import ReactDOMServer from 'react-dom/server';
+import { tailwindRuntimeFor } from '../utils/tailwindRuntime';
 
 interface EditableComponentsProps {
   htmlContent: string; // The HTML content from backend
@@ -79,6 +80,8 @@ export const EditableComponents: React.FC<EditableComponentsProps> = ({
     const script = `
       <script>
         let selectedElement = null;
+        // Stylesheets of applied variations already moved into <head>
+        const appliedStyles = new Set();
 
         // Detect element type for variations
         function detectElementType(element) {
@@ -235,7 +238,18 @@ export const EditableComponents: React.FC<EditableComponentsProps> = ({
             if (element && newHtml) {
               const temp = document.createElement('div');
               temp.innerHTML = newHtml;
-              const newElement = temp.firstElementChild;
+
+              // Compiled variations end with their Tailwind stylesheets: the utilities move into <head>,
+              // the preflight copy (only there for previews) is dropped since the page has its own
+              temp.querySelectorAll('style[data-tailwind-compiled]').forEach((style) => {
+                if (style.hasAttribute('data-tailwind-preflight') || appliedStyles.has(style.textContent)) {
+                  style.remove();
+                } else {
+                  appliedStyles.add(style.textContent);
+                  document.head.appendChild(style);
+                }
+              });
+              const newElement = Array.from(temp.children).find((child) => child.tagName !== 'STYLE');
 
               if (newElement) {
                 // Preserve the element ID
@@ -420,7 +434,7 @@ export const EditableComponents: React.FC<EditableComponentsProps> = ({
         <head>
           <meta charset="UTF-8">
           <meta name="viewport" content="width=device-width, initial-scale=1.0">
-          <script src="https://cdn.jsdelivr.net/npm/@tailwindcss/browser@4"></script>
+          ${tailwindRuntimeFor(htmlContent)}
           ${styles}
         </head>
         <body>
@@ -27,6 +27,8 @@ export interface UseCollaborationParams {
   canvasHostRef?: React.RefObject<HTMLDivElement | null>;
   /** Ref to the drawing components (one per page) for updating scenes */
   drawingRef?: React.MutableRefObject<Record<string, DrawingHandle | null>>;
+  /** Join read-only (?role=spectator): receive the room's pages, send nothing */
+  spectator?: boolean;
 }
 
 export interface UseCollaborationReturn {
@@ -81,6 +83,7 @@ export function useCollaboration({
   makeEmptyScene,
   canvasHostRef,
   drawingRef,
+  spectator = false,
 }: UseCollaborationParams): UseCollaborationReturn {
   // Collaboration state
   const [showCollabDialog, setShowCollabDialog] = useState(false);
@@ -173,7 +176,7 @@ export function useCollaboration({
     
     const onMove = (e: PointerEvent) => {
       // Send pointer updates to other collaborators
-      if (collabEnabled && collabClientRef.current) {
+      if (collabEnabled && collabClientRef.current && !spectator) {
         const now = Date.now();
         if (now - lastPointerSendTime.current > POINTER_THROTTLE_MS) {
           // Get canvas element to calculate relative coordinates
@@ -219,7 +222,7 @@ export function useCollaboration({
       host.removeEventListener('pointercancel', end as any, true);
       host.removeEventListener('pointerleave', end as any, true);
     };
-  }, [activePageId, collabEnabled, canvasHostRef]);
+  }, [activePageId, collabEnabled, canvasHostRef, spectator]);
 
   // === COLLABORATION WEBSOCKET SETUP ===
   useEffect(() => {
@@ -229,8 +232,8 @@ export function useCollaboration({
       return;
     }
 
-    console.log("Starting collaboration with ID:", collabId, "Username:", username);
-    const client = new CollabClient(Number(collabId), username);
+    console.log("Starting collaboration with ID:", collabId, "Username:", username, "Spectator:", spectator);
+    const client = new CollabClient(Number(collabId), username, spectator);
     collabClientRef.current = client;
 
     // Set the initial page
@@ -366,6 +369,11 @@ export function useCollaboration({
     // When WebSocket opens, send collaborator join and active page
     client.connection.onopen = () => {
       console.log("WebSocket connected");
+
+      // Spectators only watch: no collaborator_join, and no page of theirs pushed into the room
+      if (spectator) {
+        return;
+      }
       
       // Send collaborator join immediately
       client.sendCollaboratorJoin();
@@ -394,7 +402,7 @@ export function useCollaboration({
     };
   // We intentionally avoid depending on pages/activePageId to keep handlers stable
   // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, [collabEnabled, collabId, username]);
+  }, [collabEnabled, collabId, username, spectator]);
 
   // Update Excalidraw scene with collaborators whenever they change
   const updateSceneCollaborators = useCallback(() => {
@@ -472,7 +480,7 @@ export function useCollaboration({
    */
   const handleCollabSceneChange = (scene: SceneData) => {
     //if (scene.appState?.editingTextElement) { return; }
-    if (collabEnabled && collabClientRef.current) 
+    if (collabEnabled && collabClientRef.current && !spectator) 
     {
       const sceneToSend = generateDiff(lastSentScene.current, scene);
       if(sceneToSend === undefined) return;
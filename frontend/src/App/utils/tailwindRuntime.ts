@@ -0,0 +1,13 @@
+/**
+ * Generated pages and variations normally arrive with their Tailwind classes already compiled into an
+ * inline <style data-tailwind-compiled> block. Only HTML without one needs the in-browser Tailwind runtime.
+ *
+ * The runtime is pinned to Tailwind v3 (the Play CDN): the backend compiles against the v3 default theme
+ * (services/tailwindCompile.py) and the model writes v3 pages, so a page renders the same whether its
+ * classes were compiled or it fell back to the runtime.
+ */
+
+export const TAILWIND_RUNTIME_SCRIPT = '<script src="https://cdn.tailwindcss.com"></script>';
+
+export const tailwindRuntimeFor = (html: string): string =>
+  html.includes('data-tailwind-compiled') ? '' : TAILWIND_RUNTIME_SCRIPT;